@@ -0,0 +1,8 @@
+"""
+Benchmarks del sistema híbrido PostgreSQL + MongoDB
+
+Se ejecutan desde la raíz del proyecto, con las bases de datos de
+docker-compose levantadas:
+
+    python -m benchmarks.<nombre_benchmark>
+"""
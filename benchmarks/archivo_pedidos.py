@@ -0,0 +1,181 @@
+"""
+Benchmark del archivo de pedidos: tablas de pedidos antes y después de archivar
+
+Crea clientes y productos sintéticos con --antiguos pedidos entregados o
+cancelados de 1998 a 2002 y --recientes pedidos de los últimos 30 días, con
+--lineas líneas cada uno. Mide el tamaño de 'pedidos' y 'detalle_pedido' y
+la latencia de:
+
+1. obtener_pedidos_cliente de un cliente al azar
+2. obtener_pedido_completo de un pedido reciente
+3. El listado de pedidos del admin (COUNT y primera página)
+
+antes y después de archivar los pedidos anteriores a 2003 (solo los
+sintéticos, salvo que la base tenga pedidos de esas fechas), y la de
+obtener_pedido_completo de un pedido archivado. La lectura de MongoDB se
+simula: solo se mide PostgreSQL. Los datos sintéticos, archivados o no, se
+eliminan al terminar.
+
+Uso:
+    python -m benchmarks.archivo_pedidos [--antiguos 200000] [--recientes 20000] [--clientes 2000] [--lecturas 200]
+"""
+
+import argparse
+import random
+import time
+from datetime import date
+from unittest import mock
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+
+from ecommerce.archivo_pedidos import ArchivoPedidos  # noqa: E402
+from ecommerce.integration_service import PedidoIntegrationService  # noqa: E402
+from ecommerce.models import Pedido  # noqa: E402
+from ecommerce.mongodb_services import cliente_info_service  # noqa: E402
+from ecommerce.particiones import mes_actual  # noqa: E402
+
+PREFIJO = 'benchmark.archivo'
+PRODUCTOS = 500
+# Los pedidos antiguos son de 1998 a 2002: se archivan los anteriores a 2003
+ARCHIVAR_ANTES_DE = date(2003, 1, 1)
+
+
+def _crear_datos(cursor, antiguos, recientes, clientes, lineas):
+    cursor.execute(
+        "INSERT INTO clientes (nombre, email, telefono, fecha_registro, activo, num_pedidos, total_gastado) "
+        "SELECT 'Cliente ' || i, %s || i || '@example.com', '000', now(), true, 0, 0 "
+        "FROM generate_series(1, %s) i RETURNING id_cliente", [PREFIJO, clientes]
+    )
+    ids_clientes = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute(
+        "INSERT INTO productos (nombre, precio, descripcion, stock, activo, fecha_creacion, unidades_vendidas) "
+        "SELECT %s || ' ' || i, 1 + i %% 50, '', 1000000, true, now(), 0 "
+        "FROM generate_series(1, %s) i RETURNING id_producto", [PREFIJO, PRODUCTOS]
+    )
+    ids_productos = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute(
+        "INSERT INTO pedidos (id_cliente_id, fecha_pedido, total, estado, direccion_envio, metodo_pago) "
+        "SELECT %(primer_cliente)s + i %% %(clientes)s, "
+        "CASE WHEN i <= %(antiguos)s "
+        "     THEN timestamptz '1998-01-01 00:00:00+00' + (i %% 1826) * interval '1 day' "
+        "     ELSE now() - (i %% 30) * interval '1 day' END, "
+        "0, CASE WHEN i %% 10 = 0 THEN 'cancelado' ELSE 'entregado' END, "
+        "'Calle Benchmark ' || i, 'tarjeta' "
+        "FROM generate_series(1, %(total)s) i RETURNING id_pedido",
+        {"primer_cliente": min(ids_clientes), "clientes": clientes, "antiguos": antiguos,
+         "total": antiguos + recientes}
+    )
+    ids_pedidos = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute(
+        "INSERT INTO detalle_pedido "
+        "(id_pedido_id, id_producto_id, cantidad, precio_unitario, subtotal, fecha_pedido) "
+        "SELECT p.id_pedido, %(primer_producto)s + (p.id_pedido + j) %% %(productos)s, 1 + j, 2.50, 2.50 * (1 + j), "
+        "p.fecha_pedido "
+        "FROM pedidos p CROSS JOIN generate_series(0, %(lineas)s - 1) j "
+        "WHERE p.id_pedido BETWEEN %(desde)s AND %(hasta)s",
+        {"primer_producto": min(ids_productos), "productos": PRODUCTOS, "lineas": lineas,
+         "desde": min(ids_pedidos), "hasta": max(ids_pedidos)}
+    )
+    cursor.execute(
+        "UPDATE pedidos p SET total = d.total FROM ("
+        "  SELECT id_pedido_id, sum(subtotal) AS total FROM detalle_pedido "
+        "  WHERE id_pedido_id BETWEEN %s AND %s GROUP BY id_pedido_id"
+        ") d WHERE p.id_pedido = d.id_pedido_id",
+        [min(ids_pedidos), max(ids_pedidos)]
+    )
+    cursor.execute("ANALYZE pedidos, detalle_pedido")
+    return ids_clientes, ids_productos, ids_pedidos
+
+
+def _eliminar_datos(cursor, ids_clientes, ids_productos):
+    # Sin señales: los contadores de los datos sintéticos no importan
+    cursor.execute("DELETE FROM pedidos_archivo WHERE id_cliente_id = ANY(%s)", [ids_clientes])
+    cursor.execute("DELETE FROM unidades_archivadas WHERE id_producto_id = ANY(%s)", [ids_productos])
+    cursor.execute("DELETE FROM detalle_pedido WHERE id_producto_id = ANY(%s)", [ids_productos])
+    cursor.execute("DELETE FROM pedidos WHERE id_cliente_id = ANY(%s)", [ids_clientes])
+    cursor.execute("DELETE FROM productos WHERE id_producto = ANY(%s)", [ids_productos])
+    cursor.execute("DELETE FROM clientes WHERE id_cliente = ANY(%s)", [ids_clientes])
+
+
+def _listado_admin():
+    Pedido.objects.count()
+    list(Pedido.objects.select_related('id_cliente').order_by('-id_pedido')[:100])
+
+
+def _medir(titulo, lectura, lecturas):
+    latencias = []
+    for _ in range(lecturas):
+        with cronometro(latencias):
+            lectura()
+    imprimir_resumen(titulo, latencias)
+
+
+def _medir_lecturas(ids_clientes, recientes, lecturas):
+    _medir(
+        "obtener_pedidos_cliente",
+        lambda: PedidoIntegrationService.obtener_pedidos_cliente(random.choice(ids_clientes)), lecturas
+    )
+    _medir(
+        "obtener_pedido_completo (reciente)",
+        lambda: PedidoIntegrationService.obtener_pedido_completo(random.choice(recientes)), lecturas
+    )
+    _medir("listado del admin (COUNT + 100 filas)", _listado_admin, lecturas)
+
+
+def _imprimir_tamanos():
+    for tabla, tamano in ArchivoPedidos.tamanos().items():
+        print(f"  {tabla:<45} {tamano / 1024 / 1024:10.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--antiguos', type=int, default=200_000)
+    parser.add_argument('--recientes', type=int, default=20_000)
+    parser.add_argument('--clientes', type=int, default=2000)
+    parser.add_argument('--lineas', type=int, default=3)
+    parser.add_argument('--lecturas', type=int, default=200)
+    args = parser.parse_args()
+
+    mes = mes_actual()
+    meses = (mes.year - ARCHIVAR_ANTES_DE.year) * 12 + mes.month - ARCHIVAR_ANTES_DE.month
+
+    ids_clientes, ids_productos = [], []
+    try:
+        with connection.cursor() as cursor, \
+                mock.patch.object(cliente_info_service, 'obtener_info_completa', return_value={"preferencias": {}}):
+            imprimir_encabezado(f"Carga: {args.antiguos} pedidos antiguos y {args.recientes} recientes")
+            ids_clientes, ids_productos, ids_pedidos = _crear_datos(
+                cursor, args.antiguos, args.recientes, args.clientes, args.lineas
+            )
+            antiguos, recientes = ids_pedidos[:args.antiguos], ids_pedidos[args.antiguos:]
+
+            imprimir_encabezado("Antes de archivar")
+            _imprimir_tamanos()
+            _medir_lecturas(ids_clientes, recientes, args.lecturas)
+
+            ArchivoPedidos.preparar_tabla()
+            inicio = time.perf_counter()
+            archivados = ArchivoPedidos.archivar(meses=meses)
+            segundos = time.perf_counter() - inicio
+            # VACUUM FULL para medir lo que ocupan las tablas sin el espacio libre que deja el borrado
+            cursor.execute("VACUUM FULL pedidos, detalle_pedido")
+            cursor.execute("ANALYZE pedidos, detalle_pedido, pedidos_archivo")
+
+            imprimir_encabezado(f"Después de archivar {archivados} pedidos en {segundos:.1f}s")
+            _imprimir_tamanos()
+            _medir_lecturas(ids_clientes, recientes, args.lecturas)
+            _medir(
+                "obtener_pedido_completo (archivado)",
+                lambda: PedidoIntegrationService.obtener_pedido_completo(random.choice(antiguos)), args.lecturas
+            )
+    finally:
+        with connection.cursor() as cursor:
+            _eliminar_datos(cursor, ids_clientes, ids_productos)
+
+
+if __name__ == "__main__":
+    main()
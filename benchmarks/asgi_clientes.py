@@ -0,0 +1,173 @@
+"""
+Benchmark de latencia y concurrencia del servicio async frente al síncrono
+
+1. En proceso: N lecturas de obtener_cliente_completo con concurrencia C,
+   síncronas en un ThreadPoolExecutor contra async con asyncio.gather
+2. Bajo un servidor ASGI (uvicorn, opcional: `pip install uvicorn`): N
+   peticiones HTTP con concurrencia C a la vista async y a la síncrona
+
+Requiere clientes existentes (p. ej. `python manage.py init_database`).
+
+Uso:
+    python -m benchmarks.asgi_clientes [--peticiones 2000] [--concurrencia 50] [--puerto 8765]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import setup_django, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+
+from ecommerce.async_services import AsyncClienteIntegrationService  # noqa: E402
+from ecommerce.integration_service import ClienteIntegrationService  # noqa: E402
+from ecommerce.models import Cliente  # noqa: E402
+
+
+def _ids_clientes():
+    ids = list(Cliente.objects.values_list('id_cliente', flat=True)[:100])
+    if not ids:
+        sys.exit("No hay clientes: ejecute antes `python manage.py init_database`")
+    return ids
+
+
+def benchmark_sincrono(ids, peticiones, concurrencia):
+    def lectura(i):
+        inicio = time.perf_counter()
+        ClienteIntegrationService.obtener_cliente_completo(ids[i % len(ids)])
+        duracion = (time.perf_counter() - inicio) * 1000
+        return duracion
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        latencias = list(executor.map(lectura, range(peticiones)))
+    total = time.perf_counter() - inicio
+    imprimir_resumen(f"síncrono ({concurrencia} hilos)", latencias)
+    print(f"    {peticiones / total:,.0f} lecturas/s")
+
+
+async def benchmark_async(ids, peticiones, concurrencia):
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def lectura(i):
+        async with semaforo:
+            inicio = time.perf_counter()
+            await AsyncClienteIntegrationService.obtener_cliente_completo(ids[i % len(ids)])
+            return (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    latencias = await asyncio.gather(*(lectura(i) for i in range(peticiones)))
+    total = time.perf_counter() - inicio
+    imprimir_resumen(f"async ({concurrencia} tareas)", list(latencias))
+    print(f"    {peticiones / total:,.0f} lecturas/s")
+
+
+def _sesion_staff():
+    """Sesión de un usuario staff para las vistas protegidas"""
+    from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+    from django.contrib.sessions.backends.db import SessionStore
+
+    usuario, _ = get_user_model().objects.get_or_create(
+        username='benchmark_asgi', defaults={'is_staff': True}
+    )
+    sesion = SessionStore()
+    sesion[SESSION_KEY] = str(usuario.pk)
+    sesion[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+    sesion.create()
+    return sesion.session_key
+
+
+async def _get(puerto, ruta, sesion):
+    lector, escritor = await asyncio.open_connection('127.0.0.1', puerto)
+    escritor.write(
+        f"GET {ruta} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: sessionid={sesion}\r\n"
+        f"Connection: close\r\n\r\n".encode()
+    )
+    await escritor.drain()
+    respuesta = await lector.read()
+    escritor.close()
+    await escritor.wait_closed()
+    return int(respuesta.split(b" ", 2)[1])
+
+
+async def benchmark_http(ids, peticiones, concurrencia, puerto, sesion, sufijo, titulo):
+    semaforo = asyncio.Semaphore(concurrencia)
+    errores = 0
+
+    async def peticion(i):
+        nonlocal errores
+        async with semaforo:
+            inicio = time.perf_counter()
+            estado = await _get(puerto, f"/api/clientes/{ids[i % len(ids)]}/{sufijo}", sesion)
+            if estado != 200:
+                errores += 1
+            return (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    latencias = await asyncio.gather(*(peticion(i) for i in range(peticiones)))
+    total = time.perf_counter() - inicio
+    imprimir_resumen(titulo, list(latencias))
+    print(f"    {peticiones / total:,.0f} peticiones/s, {errores} respuestas distintas de 200")
+
+
+async def _esperar_servidor(puerto, segundos=15):
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        try:
+            _, escritor = await asyncio.open_connection('127.0.0.1', puerto)
+            escritor.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.2)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peticiones', type=int, default=2000)
+    parser.add_argument('--concurrencia', type=int, default=50)
+    parser.add_argument('--puerto', type=int, default=8765)
+    args = parser.parse_args()
+
+    ids = _ids_clientes()
+
+    imprimir_encabezado("EN PROCESO")
+    benchmark_sincrono(ids, args.peticiones, args.concurrencia)
+    asyncio.run(benchmark_async(ids, args.peticiones, args.concurrencia))
+
+    imprimir_encabezado("BAJO SERVIDOR ASGI (uvicorn)")
+    if importlib.util.find_spec('uvicorn') is None:
+        print("  uvicorn no está instalado (pip install uvicorn); se omite esta parte")
+        return
+
+    sesion = _sesion_staff()
+    connection.close()
+    servidor = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'client_sync.asgi:application',
+         '--port', str(args.puerto), '--log-level', 'warning'],
+    )
+    try:
+        if not asyncio.run(_esperar_servidor(args.puerto)):
+            print("  El servidor no arrancó")
+            return
+        asyncio.run(benchmark_http(
+            ids, args.peticiones, args.concurrencia, args.puerto, sesion, '', "vista async"
+        ))
+        asyncio.run(benchmark_http(
+            ids, args.peticiones, args.concurrencia, args.puerto, sesion, 'sync/', "vista síncrona"
+        ))
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+
+if __name__ == "__main__":
+    main()
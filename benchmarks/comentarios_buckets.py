@@ -0,0 +1,73 @@
+"""
+Benchmark de latencia de escritura de comentarios según su número previo
+
+Compara el arreglo embebido en 'clientes_info' con el almacenamiento en
+buckets de 'clientes_comentarios'. Usa clientes sintéticos con id negativo
+que se eliminan al terminar.
+
+Uso:
+    python -m benchmarks.comentarios_buckets [--conteos 0 1000 10000 50000] [--escrituras 200]
+"""
+
+import argparse
+from datetime import datetime, timedelta
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from ecommerce.mongodb_services import (  # noqa: E402
+    ClienteInfoService, MODO_COMENTARIOS_BUCKETS, MODO_COMENTARIOS_EMBEBIDO
+)
+
+
+def _comentarios_previos(cantidad: int):
+    inicio = datetime.utcnow() - timedelta(days=365)
+    return [
+        {"texto": f"Comentario histórico {i} " + "x" * 80, "fecha": inicio + timedelta(seconds=i)}
+        for i in range(cantidad)
+    ]
+
+
+def _precargar(service: ClienteInfoService, id_cliente: int, cantidad: int):
+    service.eliminar_cliente(id_cliente)
+    service.crear_documento_cliente(id_cliente)
+    comentarios = _comentarios_previos(cantidad)
+    if service.usa_buckets:
+        service.buckets.agregar_historicos(id_cliente, comentarios)
+        return
+    for inicio in range(0, len(comentarios), 5000):
+        service.collection.update_one(
+            {"id_cliente": id_cliente},
+            {"$push": {"comentarios": {"$each": comentarios[inicio:inicio + 5000]}}}
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conteos', type=int, nargs='+', default=[0, 1000, 10000, 50000])
+    parser.add_argument('--escrituras', type=int, default=200)
+    args = parser.parse_args()
+
+    for modo in (MODO_COMENTARIOS_EMBEBIDO, MODO_COMENTARIOS_BUCKETS):
+        service = ClienteInfoService(modo_comentarios=modo)
+        imprimir_encabezado(f"MODO {modo.upper()}")
+        for indice, cantidad in enumerate(args.conteos):
+            id_cliente = -1000 - indice
+            _precargar(service, id_cliente, cantidad)
+            latencias = []
+            for i in range(args.escrituras):
+                with cronometro(latencias):
+                    service.agregar_comentario(id_cliente, f"Comentario de benchmark {i}")
+            imprimir_resumen(f"{cantidad} comentarios previos", latencias)
+            lecturas = []
+            for _ in range(args.escrituras):
+                with cronometro(lecturas):
+                    service.obtener_comentarios(id_cliente, limit=5)
+            imprimir_resumen("  lectura de los últimos 5", lecturas)
+            service.eliminar_cliente(id_cliente)
+            service.buckets.eliminar(id_cliente)
+
+
+if __name__ == "__main__":
+    main()
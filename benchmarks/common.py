@@ -0,0 +1,62 @@
+"""
+Utilidades compartidas por los benchmarks
+"""
+
+import os
+import statistics
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+def setup_django():
+    """Configura Django igual que los scripts de prueba del proyecto"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'client_sync.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def cronometro(resultados: List[float]):
+    """Agrega a `resultados` la duración del bloque en milisegundos"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        resultados.append((time.perf_counter() - inicio) * 1000)
+
+
+def percentil(valores: List[float], p: float) -> float:
+    """Percentil p (0-100) por el método del rango más cercano"""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def resumen(valores: List[float]) -> Dict[str, float]:
+    """Resumen de latencias en milisegundos"""
+    return {
+        "n": len(valores),
+        "media": statistics.mean(valores) if valores else 0.0,
+        "p50": percentil(valores, 50),
+        "p99": percentil(valores, 99),
+        "max": max(valores) if valores else 0.0,
+    }
+
+
+def imprimir_resumen(titulo: str, valores: List[float]):
+    """Imprime una línea de resumen de latencias"""
+    r = resumen(valores)
+    print(
+        f"  {titulo:<45} n={r['n']:<6} media={r['media']:8.3f}ms "
+        f"p50={r['p50']:8.3f}ms p99={r['p99']:8.3f}ms max={r['max']:8.3f}ms"
+    )
+
+
+def imprimir_encabezado(titulo: str):
+    """Imprime un encabezado formateado"""
+    print("\n" + "=" * 60)
+    print(f"  {titulo}")
+    print("=" * 60)
@@ -0,0 +1,88 @@
+"""
+Benchmark de creación de pedidos según su número de líneas
+
+Compara, solo en PostgreSQL:
+1. El camino anterior: Producto.objects.get y DetallePedido.save() por línea,
+   cada uno recalculando el total del pedido, y un calcular_total final
+2. PedidoIntegrationService.crear_pedido: una consulta de productos,
+   bulk_create de los detalles y el total escrito una vez
+
+Usa un cliente y productos sintéticos que se eliminan al terminar.
+
+Uso:
+    python -m benchmarks.crear_pedidos [--lineas 1 10 50 200] [--pedidos 50]
+"""
+
+import argparse
+from decimal import Decimal
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from django.db import connection, transaction  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from ecommerce.integration_service import PedidoIntegrationService  # noqa: E402
+from ecommerce.models import Cliente, DetallePedido, Pedido, Producto  # noqa: E402
+
+
+def crear_pedido_por_linea(id_cliente, productos, direccion_envio, metodo_pago):
+    """Creación de pedidos tal como se hacía antes de crear_pedido"""
+    pedido = Pedido.objects.create(
+        id_cliente_id=id_cliente,
+        direccion_envio=direccion_envio,
+        metodo_pago=metodo_pago
+    )
+    for producto_data in productos:
+        producto = Producto.objects.get(id_producto=producto_data['id_producto'])
+        DetallePedido.objects.create(
+            id_pedido=pedido,
+            id_producto=producto,
+            cantidad=producto_data['cantidad']
+        )
+    pedido.calcular_total()
+    return pedido
+
+
+def _medir(titulo, funcion, cliente, lineas, pedidos):
+    latencias = []
+    # Con DEBUG=True el registro de consultas tiene un tope; se vacía para contar bien
+    connection.queries_log.clear()
+    with CaptureQueriesContext(connection) as consultas:
+        with transaction.atomic():
+            funcion(cliente.id_cliente, lineas, "Benchmark", "efectivo")
+    for _ in range(pedidos):
+        with cronometro(latencias):
+            with transaction.atomic():
+                funcion(cliente.id_cliente, lineas, "Benchmark", "efectivo")
+    imprimir_resumen(titulo, latencias)
+    print(f"    {len(consultas)} consultas por pedido")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lineas', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--pedidos', type=int, default=50)
+    args = parser.parse_args()
+
+    cliente = Cliente.objects.create(
+        nombre="Cliente benchmark", email="benchmark.pedidos@example.com", telefono="000"
+    )
+    productos = Producto.objects.bulk_create([
+        Producto(nombre=f"Producto benchmark {i}", precio=Decimal('9.99'), stock=1000000)
+        for i in range(max(args.lineas))
+    ])
+    try:
+        for cantidad in args.lineas:
+            lineas = [{"id_producto": p.id_producto, "cantidad": 2} for p in productos[:cantidad]]
+            imprimir_encabezado(f"PEDIDOS DE {cantidad} LÍNEAS")
+            _medir("por línea (anterior)", crear_pedido_por_linea, cliente, lineas, args.pedidos)
+            _medir("crear_pedido (bulk)", PedidoIntegrationService.crear_pedido, cliente, lineas, args.pedidos)
+    finally:
+        cliente.delete()
+        Producto.objects.filter(id_producto__in=[p.id_producto for p in productos]).delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark de importación de pedidos: uno a uno frente a crear_pedidos_bulk
+
+1. crear_pedido_completo por pedido (PostgreSQL + preferencias en MongoDB)
+2. crear_pedidos_bulk: COPY a tablas temporales, inserciones sobre conjuntos
+   y un bulk_write de preferencias
+
+Usa clientes y productos sintéticos que se eliminan al terminar.
+
+Uso:
+    python -m benchmarks.crear_pedidos_bulk [--pedidos 50000] [--uno-a-uno 1000] [--lineas 3]
+"""
+
+import argparse
+import time
+from decimal import Decimal
+
+from benchmarks.common import setup_django, imprimir_encabezado
+
+setup_django()
+
+from ecommerce.integration_service import PedidoIntegrationService  # noqa: E402
+from ecommerce.models import Cliente, Producto  # noqa: E402
+from ecommerce.mongodb_services import cliente_info_service  # noqa: E402
+
+
+def _generar(cantidad, clientes, productos, lineas):
+    """Pedidos sintéticos generados sobre la marcha"""
+    for i in range(cantidad):
+        inicio = i % len(productos)
+        yield {
+            "id_cliente": clientes[i % len(clientes)].id_cliente,
+            "productos": [
+                {"id_producto": productos[(inicio + j) % len(productos)].id_producto, "cantidad": 1 + j}
+                for j in range(lineas)
+            ],
+            "direccion_envio": f"Calle Benchmark {i}",
+            "metodo_pago": "tarjeta" if i % 2 else "efectivo",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pedidos', type=int, default=50000)
+    parser.add_argument('--uno-a-uno', type=int, default=1000)
+    parser.add_argument('--lineas', type=int, default=3)
+    parser.add_argument('--clientes', type=int, default=500)
+    args = parser.parse_args()
+
+    clientes = Cliente.objects.bulk_create([
+        Cliente(nombre=f"Cliente benchmark {i}", email=f"benchmark.bulk{i}@example.com", telefono="000")
+        for i in range(args.clientes)
+    ])
+    productos = Producto.objects.bulk_create([
+        Producto(nombre=f"Producto benchmark {i}", precio=Decimal('4.99'), stock=100_000_000)
+        for i in range(max(50, args.lineas))
+    ])
+    try:
+        imprimir_encabezado("UNO A UNO (crear_pedido_completo)")
+        inicio = time.perf_counter()
+        for pedido in _generar(args.uno_a_uno, clientes, productos, args.lineas):
+            PedidoIntegrationService.crear_pedido_completo(**pedido)
+        segundos = time.perf_counter() - inicio
+        print(f"  {args.uno_a_uno} pedidos en {segundos:.2f}s: {args.uno_a_uno / segundos:,.0f} pedidos/s")
+
+        imprimir_encabezado("LOTE (crear_pedidos_bulk)")
+        resultado = PedidoIntegrationService.crear_pedidos_bulk(
+            _generar(args.pedidos, clientes, productos, args.lineas)
+        )
+        if not resultado:
+            print("  La carga falló (ver el log)")
+            return
+        print(
+            f"  {resultado['creados']} pedidos en {resultado['segundos']:.2f}s: "
+            f"{resultado['pedidos_por_segundo']:,.0f} pedidos/s "
+            f"({len(resultado['rechazados'])} rechazados, "
+            f"{resultado['preferencias_actualizadas']} preferencias actualizadas)"
+        )
+    finally:
+        ids = [c.id_cliente for c in clientes]
+        try:
+            cliente_info_service.collection.delete_many({"id_cliente": {"$in": ids}})
+        except Exception as e:
+            print(f"  No se pudieron borrar los documentos de MongoDB: {e}")
+        Cliente.objects.filter(id_cliente__in=ids).delete()
+        Producto.objects.filter(id_producto__in=[p.id_producto for p in productos]).delete()
+
+
+if __name__ == "__main__":
+    main()
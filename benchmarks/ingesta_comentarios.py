@@ -0,0 +1,74 @@
+"""
+Benchmark de la ingesta de comentarios por lotes frente a una llamada por comentario
+
+Simula una ráfaga de comentarios repartidos entre varios clientes sintéticos
+(id negativo, eliminados al terminar) y compara:
+1. agregar_comentario síncrono, un viaje a MongoDB por comentario
+2. IngestaComentarios: encolar en memoria + bulk_write por lotes
+
+Uso:
+    python -m benchmarks.ingesta_comentarios [--comentarios 20000] [--clientes 200] [--lote 500]
+"""
+
+import argparse
+import time
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from ecommerce.ingesta_comentarios import IngestaComentarios  # noqa: E402
+from ecommerce.mongodb_services import cliente_info_service  # noqa: E402
+
+
+def _limpiar(clientes: int):
+    for i in range(clientes):
+        cliente_info_service.eliminar_cliente(-1 - i)
+        cliente_info_service.buckets.eliminar(-1 - i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comentarios', type=int, default=20000)
+    parser.add_argument('--clientes', type=int, default=200)
+    parser.add_argument('--lote', type=int, default=500)
+    parser.add_argument('--intervalo', type=float, default=0.5)
+    args = parser.parse_args()
+
+    _limpiar(args.clientes)
+
+    imprimir_encabezado("LLAMADA SÍNCRONA POR COMENTARIO")
+    latencias = []
+    inicio = time.perf_counter()
+    for i in range(args.comentarios):
+        with cronometro(latencias):
+            cliente_info_service.agregar_comentario(-1 - i % args.clientes, f"Comentario {i}")
+    total = time.perf_counter() - inicio
+    imprimir_resumen("agregar_comentario", latencias)
+    print(f"    {args.comentarios / total:,.0f} comentarios/s")
+
+    _limpiar(args.clientes)
+
+    imprimir_encabezado("INGESTA POR LOTES")
+    ingesta = IngestaComentarios(tamano_lote=args.lote, intervalo=args.intervalo)
+    latencias = []
+    profundidad_maxima = 0
+    inicio = time.perf_counter()
+    for i in range(args.comentarios):
+        with cronometro(latencias):
+            ingesta.encolar(-1 - i % args.clientes, f"Comentario {i}")
+        if i % 1000 == 0:
+            profundidad_maxima = max(profundidad_maxima, ingesta.estadisticas()["profundidad"])
+    ingesta.detener()
+    total = time.perf_counter() - inicio
+    imprimir_resumen("encolar", latencias)
+    estadisticas = ingesta.estadisticas()
+    print(f"    {estadisticas['escritos'] / total:,.0f} comentarios/s (hasta el último escrito)")
+    print(f"    lotes={estadisticas['lotes']} fallidos={estadisticas['fallidos']} "
+          f"rechazados={estadisticas['rechazados']} profundidad máxima={profundidad_maxima}")
+
+    _limpiar(args.clientes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark de lecturas completas: PostgreSQL y MongoDB en serie o en paralelo
+
+Lee N veces obtener_cliente_completo y obtener_pedido_completo (sin caché)
+con LECTURAS_PARALELAS desactivado y activado. Para que el resultado no
+dependa de dónde corran las bases de datos, se inyecta latencia en cada
+una: una espera fija más una cola exponencial (--jitter) en cada consulta
+SQL (con connection.execute_wrapper) y en cada lectura de MongoDB.
+
+Por defecto la lectura de MongoDB se simula; con --mongo-real se hace de
+verdad, además de la espera inyectada. El cliente, el producto y el pedido
+sintéticos se eliminan al terminar.
+
+Uso:
+    python -m benchmarks.lecturas_paralelas [--lecturas 300] [--latencia-pg 5] [--latencia-mongo 10] [--jitter 2]
+"""
+
+import argparse
+import random
+import time
+from decimal import Decimal
+from unittest import mock
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado, resumen
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from ecommerce.integration_service import ClienteIntegrationService, PedidoIntegrationService  # noqa: E402
+from ecommerce.models import Cliente, DetallePedido, Pedido, Producto  # noqa: E402
+from ecommerce.mongodb_services import cliente_info_service  # noqa: E402
+
+
+def _espera(base_ms, jitter_ms):
+    time.sleep((base_ms + (random.expovariate(1 / jitter_ms) if jitter_ms > 0 else 0)) / 1000)
+
+
+def _medir(titulo, lectura, lecturas):
+    latencias = []
+    for _ in range(lecturas):
+        with cronometro(latencias):
+            lectura()
+    imprimir_resumen(titulo, latencias)
+    return resumen(latencias)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lecturas', type=int, default=300)
+    parser.add_argument('--latencia-pg', type=float, default=5.0, help='ms por consulta SQL')
+    parser.add_argument('--latencia-mongo', type=float, default=10.0, help='ms por lectura de MongoDB')
+    parser.add_argument('--jitter', type=float, default=2.0, help='ms de media de la cola exponencial')
+    parser.add_argument('--mongo-real', action='store_true')
+    args = parser.parse_args()
+
+    obtener_real = cliente_info_service.obtener_info_completa
+
+    def obtener_info_completa(id_cliente, fields=None):
+        _espera(args.latencia_mongo, args.jitter)
+        if args.mongo_real:
+            return obtener_real(id_cliente, fields)
+        return {"preferencias": {"idioma": "ES"}, "comentarios": []}
+
+    def latencia_sql(execute, sql, params, many, context):
+        _espera(args.latencia_pg, args.jitter)
+        return execute(sql, params, many, context)
+
+    cliente = Cliente.objects.create(nombre="Cliente benchmark", email="benchmark.paralelas@example.com", telefono="000")
+    producto = Producto.objects.create(nombre="Producto benchmark", precio=Decimal('4.99'), stock=100)
+    pedido = Pedido.objects.create(id_cliente=cliente, direccion_envio="Benchmark", metodo_pago="efectivo")
+    DetallePedido.objects.create(id_pedido=pedido, id_producto=producto, cantidad=1)
+
+    lecturas = {
+        "obtener_cliente_completo": lambda: ClienteIntegrationService.obtener_cliente_completo(cliente.id_cliente),
+        "obtener_pedido_completo": lambda: PedidoIntegrationService.obtener_pedido_completo(pedido.id_pedido),
+    }
+    print(
+        f"Latencia inyectada: PostgreSQL {args.latencia_pg}ms/consulta, MongoDB {args.latencia_mongo}ms/lectura, "
+        f"cola exponencial de {args.jitter}ms"
+    )
+    try:
+        with mock.patch.object(cliente_info_service, 'obtener_info_completa', side_effect=obtener_info_completa), \
+                connection.execute_wrapper(latencia_sql), override_settings(CACHE_CLIENTES_TTL=0):
+            for nombre, lectura in lecturas.items():
+                imprimir_encabezado(nombre)
+                resultados = {}
+                for paralelo in (False, True):
+                    with override_settings(LECTURAS_PARALELAS=paralelo):
+                        lectura()  # calentamiento (pool de hilos, conexión)
+                        resultados[paralelo] = _medir(
+                            "en paralelo" if paralelo else "en serie", lectura, args.lecturas
+                        )
+                for p in ("p50", "p99"):
+                    mejora = 1 - resultados[True][p] / resultados[False][p] if resultados[False][p] else 0
+                    print(f"    {p}: {mejora:.0%} menos en paralelo")
+    finally:
+        pedido.delete()
+        producto.delete()
+        cliente.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark del cliente MongoDB perezoso y con pool por proceso
+
+Compara:
+1. Arranque: cliente creado + ping al importar (antes) contra cliente perezoso (ahora)
+2. Peticiones: cliente nuevo por petición contra el pool compartido del proceso,
+   contando las conexiones abiertas con un ConnectionPoolListener
+3. Fork: cada proceso hijo construye su propio cliente
+
+Uso:
+    python -m benchmarks.mongodb_pool [--peticiones 500] [--procesos 4]
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+from pymongo import MongoClient, monitoring
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from client_sync.mongodb import MongoDBConnection, mongodb  # noqa: E402
+
+
+class ContadorConexiones(monitoring.ConnectionPoolListener):
+    """Cuenta las conexiones TCP creadas por los clientes registrados"""
+
+    def __init__(self):
+        self.creadas = 0
+
+    def connection_created(self, event):
+        self.creadas += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+def _nuevo_cliente(**opciones):
+    """Cliente con la misma configuración que MongoDBConnection"""
+    return MongoClient(
+        MongoDBConnection.get_connection_string(),
+        **{**MongoDBConnection.get_pool_options(), **opciones}
+    )
+
+
+def benchmark_arranque(repeticiones: int):
+    imprimir_encabezado("ARRANQUE DEL PROCESO")
+    antes, ahora = [], []
+    for _ in range(repeticiones):
+        with cronometro(antes):
+            cliente = _nuevo_cliente()
+            cliente.admin.command('ping')
+        cliente.close()
+        with cronometro(ahora):
+            MongoDBConnection()
+    imprimir_resumen("antes: cliente + ping al importar", antes)
+    imprimir_resumen("ahora: cliente perezoso", ahora)
+
+
+def benchmark_peticiones(peticiones: int):
+    imprimir_encabezado("REUTILIZACIÓN DE CONEXIONES POR PETICIÓN")
+
+    contador = ContadorConexiones()
+    latencias = []
+    for i in range(peticiones):
+        with cronometro(latencias):
+            cliente = _nuevo_cliente(event_listeners=[contador])
+            cliente[MongoDBConnection.get_database_name()]['clientes_info'].find_one({"id_cliente": i % 100})
+            cliente.close()
+    imprimir_resumen("cliente nuevo por petición", latencias)
+    print(f"    conexiones creadas: {contador.creadas}")
+
+    contador = ContadorConexiones()
+    compartido = _nuevo_cliente(event_listeners=[contador])
+    coleccion = compartido[MongoDBConnection.get_database_name()]['clientes_info']
+    latencias = []
+    for i in range(peticiones):
+        with cronometro(latencias):
+            coleccion.find_one({"id_cliente": i % 100})
+    compartido.close()
+    imprimir_resumen("pool compartido del proceso", latencias)
+    print(f"    conexiones creadas: {contador.creadas}")
+
+
+def _trabajo_hijo(cola):
+    inicio = time.perf_counter()
+    mongodb.get_collection('clientes_info').find_one({})
+    cola.put((os.getpid(), mongodb._pid, (time.perf_counter() - inicio) * 1000))
+
+
+def benchmark_fork(procesos: int):
+    imprimir_encabezado("FORK DE WORKERS")
+    # El padre usa el cliente antes del fork, como un master de gunicorn con preload
+    mongodb.get_collection('clientes_info').find_one({})
+    contexto = multiprocessing.get_context('fork')
+    cola = contexto.Queue()
+    hijos = [contexto.Process(target=_trabajo_hijo, args=(cola,)) for _ in range(procesos)]
+    for hijo in hijos:
+        hijo.start()
+    for hijo in hijos:
+        hijo.join()
+    while not cola.empty():
+        pid, pid_cliente, ms = cola.get()
+        estado = "propio" if pid == pid_cliente else "HEREDADO"
+        print(f"  worker {pid}: cliente {estado}, primera consulta {ms:.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peticiones', type=int, default=500)
+    parser.add_argument('--procesos', type=int, default=4)
+    parser.add_argument('--arranques', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"Opciones de pool: {MongoDBConnection.get_pool_options()}")
+    benchmark_arranque(args.arranques)
+    benchmark_peticiones(args.peticiones)
+    benchmark_fork(args.procesos)
+
+
+if __name__ == "__main__":
+    main()
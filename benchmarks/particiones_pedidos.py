@@ -0,0 +1,165 @@
+"""
+Benchmark de particionado por meses: tabla de pedidos plana frente a particionada
+
+Crea en un esquema aparte ('benchmark_particiones') dos copias de una tabla
+de pedidos sintéticos repartidos en --meses meses, una plana y otra
+particionada por mes de fecha_pedido como `ecommerce.particiones`, con los
+mismos índices. Después compara:
+
+1. Consultas acotadas por fecha (pedidos de hoy, total del último mes,
+   estados del último trimestre, pedidos recientes de un cliente) y cuántas
+   particiones recorre cada una según EXPLAIN
+2. Retirar el mes más antiguo: DELETE en la tabla plana frente a desconectar
+   y eliminar su partición
+
+El esquema se elimina al terminar. Con el valor por defecto de --filas la
+carga tarda y ocupa varios GB; para una prueba rápida use --filas 5000000.
+
+Uso:
+    python -m benchmarks.particiones_pedidos [--filas 50000000] [--meses 60] [--clientes 100000] [--repeticiones 20]
+"""
+
+import argparse
+import re
+import time
+from datetime import timedelta
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from ecommerce.particiones import inicio_mes, mes_actual, sumar_meses  # noqa: E402
+
+ESQUEMA = 'benchmark_particiones'
+PLANA = f'{ESQUEMA}.pedidos_plana'
+PARTICIONADA = f'{ESQUEMA}.pedidos_particionada'
+
+COLUMNAS = (
+    "id_pedido bigint NOT NULL, id_cliente_id integer NOT NULL, fecha_pedido timestamptz NOT NULL, "
+    "total numeric(10, 2) NOT NULL, estado varchar(20) NOT NULL"
+)
+
+
+def _consultas():
+    """
+    Consultas con las fechas como parámetros, como las del ORM: así las
+    particiones se descartan al planificar
+    """
+    ahora = timezone.now()
+    hoy = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+    mes = inicio_mes(mes_actual())
+    return {
+        "pedidos de hoy": (
+            "SELECT count(*) FROM {tabla} WHERE fecha_pedido >= %s AND fecha_pedido < %s",
+            [hoy, hoy + timedelta(days=1)]
+        ),
+        "total del último mes": (
+            "SELECT sum(total) FROM {tabla} WHERE fecha_pedido >= %s AND fecha_pedido < %s",
+            [inicio_mes(sumar_meses(mes_actual(), -1)), mes]
+        ),
+        "estados del último trimestre": (
+            "SELECT estado, count(*) FROM {tabla} WHERE fecha_pedido >= %s GROUP BY estado",
+            [ahora - timedelta(days=90)]
+        ),
+        "pedidos recientes de un cliente": (
+            "SELECT id_pedido, total FROM {tabla} WHERE id_cliente_id = 42 AND fecha_pedido >= %s "
+            "ORDER BY fecha_pedido DESC",
+            [ahora - timedelta(days=30)]
+        ),
+    }
+
+
+def _ejecutar(cursor, sql, params=None):
+    inicio = time.perf_counter()
+    cursor.execute(sql, params)
+    return time.perf_counter() - inicio
+
+
+def _crear_tablas(cursor, meses, filas, clientes):
+    cursor.execute(f"CREATE SCHEMA {ESQUEMA}")
+    cursor.execute(f"CREATE TABLE {PLANA} ({COLUMNAS}, PRIMARY KEY (id_pedido))")
+    cursor.execute(
+        f"CREATE TABLE {PARTICIONADA} ({COLUMNAS}, PRIMARY KEY (id_pedido, fecha_pedido)) "
+        f"PARTITION BY RANGE (fecha_pedido)"
+    )
+    primero = sumar_meses(mes_actual(), -(meses - 1))
+    for i in range(meses + 1):
+        mes = sumar_meses(primero, i)
+        cursor.execute(
+            f"CREATE TABLE {PARTICIONADA}_p{mes:%Y_%m} PARTITION OF {PARTICIONADA} "
+            f"FOR VALUES FROM (%s) TO (%s)",
+            [inicio_mes(mes), inicio_mes(sumar_meses(mes, 1))]
+        )
+
+    # Fechas repartidas de forma uniforme desde el primer mes hasta ahora
+    generar = (
+        "SELECT i, 1 + (i * 7919) %% %s, "
+        "%s::timestamptz + (now() - %s::timestamptz) * (i::float / %s), "
+        "(i %% 500) + 0.99, CASE WHEN i %% 100 = 0 THEN 'pendiente' ELSE 'entregado' END "
+        "FROM generate_series(1, %s::bigint) i"
+    )
+    inicio = inicio_mes(primero)
+    params = [clientes, inicio, inicio, filas, filas]
+    for tabla in (PLANA, PARTICIONADA):
+        segundos = _ejecutar(cursor, f"INSERT INTO {tabla} {generar}", params)
+        cursor.execute(f"CREATE INDEX ON {tabla} (fecha_pedido)")
+        cursor.execute(f"CREATE INDEX ON {tabla} (id_cliente_id, fecha_pedido DESC) INCLUDE (total)")
+        cursor.execute(f"ANALYZE {tabla}")
+        print(f"  {tabla}: {filas} filas cargadas e indexadas en {segundos:.1f}s")
+    return primero
+
+
+def _particiones_recorridas(cursor, sql, params):
+    cursor.execute(f"EXPLAIN {sql}", params)
+    plan = "\n".join(fila[0] for fila in cursor.fetchall())
+    return len(set(re.findall(r'pedidos_particionada_p\d{4}_\d{2}', plan)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=50_000_000)
+    parser.add_argument('--meses', type=int, default=60)
+    parser.add_argument('--clientes', type=int, default=100_000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    try:
+        with connection.cursor() as cursor:
+            imprimir_encabezado(f"Carga: {args.filas} pedidos en {args.meses} meses")
+            primero = _crear_tablas(cursor, args.meses, args.filas, args.clientes)
+
+            for nombre, (plantilla, params) in _consultas().items():
+                imprimir_encabezado(nombre)
+                for tabla in (PLANA, PARTICIONADA):
+                    sql = plantilla.format(tabla=tabla)
+                    cursor.execute(sql, params)  # calentamiento de caché
+                    latencias = []
+                    for _ in range(args.repeticiones):
+                        with cronometro(latencias):
+                            cursor.execute(sql, params)
+                            cursor.fetchall()
+                    titulo = "plana"
+                    if tabla == PARTICIONADA:
+                        titulo = f"particionada ({_particiones_recorridas(cursor, sql, params)} particiones)"
+                    imprimir_resumen(titulo, latencias)
+
+            imprimir_encabezado("Retirar el mes más antiguo")
+            segundos = _ejecutar(
+                cursor, f"DELETE FROM {PLANA} WHERE fecha_pedido >= %s AND fecha_pedido < %s",
+                [inicio_mes(primero), inicio_mes(sumar_meses(primero, 1))]
+            )
+            print(f"  plana: DELETE de {cursor.rowcount} filas en {timedelta(seconds=segundos)}")
+            particion = f"{PARTICIONADA}_p{primero:%Y_%m}"
+            segundos = _ejecutar(cursor, f"ALTER TABLE {PARTICIONADA} DETACH PARTITION {particion}")
+            segundos += _ejecutar(cursor, f"DROP TABLE {particion}")
+            print(f"  particionada: DETACH + DROP de la partición en {timedelta(seconds=segundos)}")
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {ESQUEMA} CASCADE")
+
+
+if __name__ == "__main__":
+    main()
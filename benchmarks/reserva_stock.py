@@ -0,0 +1,129 @@
+"""
+Benchmark de contención: varios procesos comprando el mismo producto
+
+Cada proceso crea pedidos de una unidad de un producto "caliente" durante
+unos segundos, con:
+1. PedidoIntegrationService.crear_pedido (UPDATE condicional de stock)
+2. select_for_update sobre el producto antes de descontar (referencia)
+
+Muestra pedidos/s totales, latencias y que el stock final cuadra con los
+pedidos creados. Solo usa PostgreSQL; el cliente y el producto sintéticos
+se eliminan al terminar.
+
+Uso:
+    python -m benchmarks.reserva_stock [--procesos 1 4 8 16] [--segundos 5]
+"""
+
+import argparse
+import multiprocessing
+import time
+from decimal import Decimal
+
+from benchmarks.common import setup_django, cronometro, imprimir_resumen, imprimir_encabezado
+
+setup_django()
+
+from django.db import connection, transaction  # noqa: E402
+
+from ecommerce.integration_service import PedidoIntegrationService  # noqa: E402
+from ecommerce.inventario import StockInsuficienteError  # noqa: E402
+from ecommerce.models import Cliente, DetallePedido, Pedido, Producto  # noqa: E402
+
+STOCK_INICIAL = 10_000_000
+
+
+def crear_con_update_condicional(id_cliente, id_producto):
+    with transaction.atomic():
+        PedidoIntegrationService.crear_pedido(
+            id_cliente, [{"id_producto": id_producto, "cantidad": 1}], "Benchmark", "efectivo"
+        )
+
+
+def crear_con_select_for_update(id_cliente, id_producto):
+    with transaction.atomic():
+        producto = Producto.objects.select_for_update().get(id_producto=id_producto)
+        if producto.stock < 1:
+            raise StockInsuficienteError(id_producto, 1)
+        producto.stock -= 1
+        producto.save(update_fields=['stock'])
+        pedido = Pedido.objects.create(
+            id_cliente_id=id_cliente, direccion_envio="Benchmark", metodo_pago="efectivo", total=producto.precio
+        )
+        DetallePedido.objects.bulk_create([DetallePedido(
+            id_pedido=pedido, id_producto=producto, cantidad=1, fecha_pedido=pedido.fecha_pedido,
+            precio_unitario=producto.precio, subtotal=producto.precio
+        )])
+
+
+ESTRATEGIAS = {
+    "UPDATE condicional": crear_con_update_condicional,
+    "select_for_update": crear_con_select_for_update,
+}
+
+
+def _trabajador(estrategia, id_cliente, id_producto, segundos, resultados):
+    funcion = ESTRATEGIAS[estrategia]
+    latencias = []
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        with cronometro(latencias):
+            funcion(id_cliente, id_producto)
+    connection.close()
+    resultados.put(latencias)
+
+
+def _ejecutar(estrategia, procesos, segundos, cliente, producto):
+    Pedido.objects.filter(id_cliente=cliente).delete()
+    Producto.objects.filter(id_producto=producto.id_producto).update(stock=STOCK_INICIAL)
+    # Los hijos abren su propia conexión: no deben heredar la del padre
+    connection.close()
+
+    resultados = multiprocessing.Queue()
+    hijos = [
+        multiprocessing.Process(
+            target=_trabajador,
+            args=(estrategia, cliente.id_cliente, producto.id_producto, segundos, resultados)
+        )
+        for _ in range(procesos)
+    ]
+    inicio = time.perf_counter()
+    for hijo in hijos:
+        hijo.start()
+    latencias = []
+    for _ in hijos:
+        latencias.extend(resultados.get())
+    for hijo in hijos:
+        hijo.join()
+    total = time.perf_counter() - inicio
+
+    imprimir_resumen(f"{estrategia} ({procesos} procesos)", latencias)
+    stock = Producto.objects.get(id_producto=producto.id_producto).stock
+    pedidos = Pedido.objects.filter(id_cliente=cliente).count()
+    print(
+        f"    {len(latencias) / total:,.0f} pedidos/s; "
+        f"stock descontado {STOCK_INICIAL - stock}, pedidos creados {pedidos}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--procesos', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--segundos', type=float, default=5.0)
+    args = parser.parse_args()
+
+    cliente = Cliente.objects.create(
+        nombre="Cliente benchmark", email="benchmark.stock@example.com", telefono="000"
+    )
+    producto = Producto.objects.create(nombre="Producto caliente", precio=Decimal('9.99'), stock=STOCK_INICIAL)
+    try:
+        for estrategia in ESTRATEGIAS:
+            imprimir_encabezado(estrategia.upper())
+            for procesos in args.procesos:
+                _ejecutar(estrategia, procesos, args.segundos, cliente, producto)
+    finally:
+        cliente.delete()
+        producto.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'client_sync.settings')
 
 application = get_asgi_application()
+
+# En modo estricto (MONGO_STRICT_INDEXES) no arranca si faltan índices de MongoDB
+from ecommerce.checks import verificar_indices_al_arrancar  # noqa: E402
+
+verificar_indices_al_arrancar()
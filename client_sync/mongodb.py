@@ -1,69 +1,210 @@
 """
 MongoDB connection utility for Django project.
 Uses pymongo for direct MongoDB access.
+
+The MongoClient is created lazily on first use and once per process: a
+client inherited through ``fork()`` (gunicorn pre-fork workers, multiprocessing)
+is discarded and rebuilt in the child, since pymongo clients are not fork-safe.
+
+AsyncMongoDBConnection is the asyncio counterpart used under ASGI: one
+AsyncMongoClient per process and event loop.
 """
 
-from pymongo import MongoClient
+import asyncio
+import os
+import threading
+import weakref
+from pymongo import AsyncMongoClient, MongoClient
 from decouple import config
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _optional_int(value):
+    """Cast for optional integer settings (empty string means 'not set')"""
+    return int(value) if value not in (None, '') else None
+
+
 class MongoDBConnection:
     """MongoDB connection manager"""
-    
+
     def __init__(self):
-        self.client = None
-        self.db = None
-        self._connect()
-    
+        self._client = None
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_pool_options():
+        """Pool options for MongoClient, tunable from config.env"""
+        options = {
+            'maxPoolSize': config('MONGO_MAX_POOL_SIZE', default=100, cast=int),
+            'minPoolSize': config('MONGO_MIN_POOL_SIZE', default=0, cast=int),
+            'maxIdleTimeMS': config('MONGO_MAX_IDLE_TIME_MS', default='', cast=_optional_int),
+            'waitQueueTimeoutMS': config('MONGO_WAIT_QUEUE_TIMEOUT_MS', default='', cast=_optional_int),
+            'serverSelectionTimeoutMS': config('MONGO_SERVER_SELECTION_TIMEOUT_MS', default=30000, cast=int),
+        }
+        # pymongo rejects None for some options, so only pass the ones that are set
+        return {key: value for key, value in options.items() if value is not None}
+
+    @staticmethod
+    def get_connection_string():
+        """Connection string built from config.env"""
+        # Get MongoDB configuration from environment
+        mongo_user = config('MONGO_USER', default='client_sync_user')
+        mongo_password = config('MONGO_PASSWORD', default='client_sync_password')
+        mongo_host = config('MONGO_HOST', default='localhost')
+        mongo_port = config('MONGO_PORT', default='27017')
+        return f"mongodb://{mongo_user}:{mongo_password}@{mongo_host}:{mongo_port}/"
+
+    @staticmethod
+    def get_database_name():
+        """Database name from config.env"""
+        return config('MONGO_DB', default='client_sync_mongo')
+
     def _connect(self):
         """Establish connection to MongoDB"""
         try:
-            # Get MongoDB configuration from environment
-            mongo_user = config('MONGO_USER', default='client_sync_user')
-            mongo_password = config('MONGO_PASSWORD', default='client_sync_password')
-            mongo_host = config('MONGO_HOST', default='localhost')
-            mongo_port = config('MONGO_PORT', default='27017')
-            mongo_db = config('MONGO_DB', default='client_sync_mongo')
-            
-            # Create connection string
-            connection_string = f"mongodb://{mongo_user}:{mongo_password}@{mongo_host}:{mongo_port}/"
-            
-            # Connect to MongoDB
-            self.client = MongoClient(connection_string)
-            self.db = self.client[mongo_db]
-            
-            # Test connection
-            self.client.admin.command('ping')
-            logger.info("Successfully connected to MongoDB")
-            
+            # Connect to MongoDB (pymongo opens sockets in the background, on demand)
+            self._client = MongoClient(self.get_connection_string(), **self.get_pool_options())
+            self._db = self._client[self.get_database_name()]
+            self._pid = os.getpid()
+            logger.info(f"MongoDB client created for process {self._pid}")
+
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {e}")
             # Set db to None to indicate connection failure
-            self.db = None
-            self.client = None
+            self._db = None
+            self._client = None
+            self._pid = None
             raise
-    
+
+    def _reset_after_fork(self):
+        """Forget the client inherited from the parent process"""
+        # The parent still owns the inherited sockets; closing them here would
+        # tear down connections in use by the parent, so only drop the references.
+        self._client = None
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_connected(self):
+        """Create the client on first use in the current process"""
+        if self._db is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid is not None and self._pid != os.getpid():
+                self._reset_after_fork()
+            if self._db is None:
+                self._connect()
+
+    @property
+    def client(self):
+        """MongoClient of the current process"""
+        self._ensure_connected()
+        return self._client
+
+    @property
+    def db(self):
+        """Database of the current process"""
+        self._ensure_connected()
+        return self._db
+
+    def ping(self):
+        """Check the server is reachable"""
+        self.client.admin.command('ping')
+        logger.info("Successfully connected to MongoDB")
+        return True
+
     def get_collection(self, collection_name):
         """Get a MongoDB collection"""
-        if self.db is None:
-            self._connect()
         return self.db[collection_name]
-    
+
     def close(self):
         """Close MongoDB connection"""
-        if self.client:
-            self.client.close()
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
             logger.info("MongoDB connection closed")
+        self._client = None
+        self._db = None
+        self._pid = None
+
+class AsyncMongoDBConnection:
+    """Asyncio MongoDB connection manager"""
+
+    def __init__(self):
+        # An AsyncMongoClient is bound to the loop it first ran on, so each loop
+        # gets its own; entries go away with their loop
+        self._clients = weakref.WeakKeyDictionary()
+        self._pid = None
+        self._lock = threading.Lock()
+        # Closes of clients from finished loops still running on the current loop
+        self._closing = set()
+
+    def _ensure_connected(self):
+        """Return the client of the current process and event loop, creating it on first use"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._pid != os.getpid():
+                # Clients inherited from the parent process belong to its loops: only drop them
+                self._clients = weakref.WeakKeyDictionary()
+                self._pid = os.getpid()
+            client = self._clients.get(loop)
+            if client is not None:
+                return client
+            finished = [(old_loop, old) for old_loop, old in self._clients.items() if old_loop.is_closed()]
+            for old_loop, _ in finished:
+                del self._clients[old_loop]
+            client = AsyncMongoClient(
+                MongoDBConnection.get_connection_string(),
+                **MongoDBConnection.get_pool_options()
+            )
+            self._clients[loop] = client
+        for _, old in finished:
+            self._close_later(loop, old)
+        logger.info(f"Async MongoDB client created for process {self._pid}")
+        return client
 
-# Global MongoDB connection instance
+    def _close_later(self, loop, client):
+        """Close the client of a finished loop from the current one (pymongo ignores socket errors)"""
+        task = loop.create_task(client.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    @property
+    def client(self):
+        """AsyncMongoClient of the current process and event loop"""
+        return self._ensure_connected()
+
+    def get_collection(self, collection_name):
+        """Get an async MongoDB collection (must be called inside the event loop)"""
+        return self._ensure_connected()[MongoDBConnection.get_database_name()][collection_name]
+
+    async def close(self):
+        """Close the async MongoDB client of the current event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.pop(loop, None) if self._pid == os.getpid() else None
+        if client is not None:
+            await client.close()
+            logger.info("Async MongoDB connection closed")
+
+# Global MongoDB connection instances (no connection is opened until first use)
 mongodb = MongoDBConnection()
+async_mongodb = AsyncMongoDBConnection()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=mongodb._reset_after_fork)
 
 def get_mongodb_collection(collection_name):
     """Helper function to get a MongoDB collection"""
     return mongodb.get_collection(collection_name)
 
+def get_async_mongodb_collection(collection_name):
+    """Helper function to get an async MongoDB collection"""
+    return async_mongodb.get_collection(collection_name)
+
 def close_mongodb_connection():
     """Helper function to close MongoDB connection"""
-    mongodb.close() 
\ No newline at end of file
+    mongodb.close()
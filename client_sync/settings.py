@@ -86,6 +86,96 @@ DATABASES = {
     }
 }
 
+# Réplica de lectura opcional (ecommerce.replica): con POSTGRES_REPLICA_HOST se
+# añade el alias 'replica', con las mismas credenciales que el principal
+POSTGRES_REPLICA_HOST = config('POSTGRES_REPLICA_HOST', default='')
+if POSTGRES_REPLICA_HOST:
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': POSTGRES_REPLICA_HOST,
+        'PORT': config('POSTGRES_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'OPTIONS': {
+            'connect_timeout': config('POSTGRES_REPLICA_CONNECT_TIMEOUT', default=2, cast=int),
+        },
+        # En los tests lee la base de pruebas del principal (replicada)
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['ecommerce.replica.RouterReplica']
+
+# MongoDB
+# Con MONGO_STRICT_INDEXES=True el proyecto no arranca si faltan los índices
+# requeridos (ver `python manage.py ensure_mongo_indexes`)
+MONGO_STRICT_INDEXES = config('MONGO_STRICT_INDEXES', default=False, cast=bool)
+
+# Almacenamiento de comentarios: 'embebido' (arreglo en clientes_info) o
+# 'buckets' (documentos de tamaño fijo en clientes_comentarios, ver
+# `python manage.py migrar_comentarios_buckets`)
+MONGO_COMENTARIOS_MODO = config('MONGO_COMENTARIOS_MODO', default='embebido')
+MONGO_COMENTARIOS_POR_BUCKET = config('MONGO_COMENTARIOS_POR_BUCKET', default=200, cast=int)
+# En modo buckets, leer también los comentarios que sigan embebidos: dejarlo
+# activo hasta que `migrar_comentarios_buckets` termine
+MONGO_COMENTARIOS_LEER_EMBEBIDOS = config('MONGO_COMENTARIOS_LEER_EMBEBIDOS', default=True, cast=bool)
+
+# Ingesta asíncrona de comentarios (ecommerce.ingesta_comentarios): tamaño de
+# lote, segundos máximos en cola, capacidad de la cola y espera del productor
+# cuando está llena
+MONGO_INGESTA_TAMANO_LOTE = config('MONGO_INGESTA_TAMANO_LOTE', default=500, cast=int)
+MONGO_INGESTA_INTERVALO = config('MONGO_INGESTA_INTERVALO', default=1.0, cast=float)
+MONGO_INGESTA_CAPACIDAD = config('MONGO_INGESTA_CAPACIDAD', default=10000, cast=int)
+MONGO_INGESTA_ESPERA_MAXIMA = config('MONGO_INGESTA_ESPERA_MAXIMA', default=5.0, cast=float)
+
+# Outbox transaccional (ecommerce.outbox): con MONGO_OUTBOX=True las escrituras
+# en MongoDB de los servicios de integración se guardan en 'outbox_mongo' y
+# las aplica `python manage.py relay_outbox_mongo`. Un evento que falla se
+# reintenta tras MONGO_OUTBOX_ESPERA_REINTENTO segundos, el doble en cada
+# fallo, y tras MONGO_OUTBOX_MAX_INTENTOS fallos queda descartado
+MONGO_OUTBOX = config('MONGO_OUTBOX', default=False, cast=bool)
+MONGO_OUTBOX_TAMANO_LOTE = config('MONGO_OUTBOX_TAMANO_LOTE', default=500, cast=int)
+MONGO_OUTBOX_MAX_INTENTOS = config('MONGO_OUTBOX_MAX_INTENTOS', default=10, cast=int)
+MONGO_OUTBOX_ESPERA_REINTENTO = config('MONGO_OUTBOX_ESPERA_REINTENTO', default=5.0, cast=float)
+
+# Exportaciones del admin en streaming (ecommerce.exportacion): filas por
+# bloque (una lectura en MongoDB por bloque) y compresión gzip del fichero
+EXPORTACION_TAMANO_BLOQUE = config('EXPORTACION_TAMANO_BLOQUE', default=1000, cast=int)
+EXPORTACION_GZIP = config('EXPORTACION_GZIP', default=False, cast=bool)
+
+# Caché de clientes completos (ecommerce.cache_clientes): alias de CACHES,
+# segundos de vida (0 la desactiva) y entradas del LRU en memoria de cada
+# proceso (0 lo desactiva)
+CACHE_CLIENTES_ALIAS = config('CACHE_CLIENTES_ALIAS', default='default')
+CACHE_CLIENTES_TTL = config('CACHE_CLIENTES_TTL', default=300, cast=int)
+CACHE_CLIENTES_LRU_TAMANO = config('CACHE_CLIENTES_LRU_TAMANO', default=1000, cast=int)
+
+# Snapshot de estadísticas del panel (ecommerce.estadisticas): segundos de
+# antigüedad tras los que se recalcula al leerlo (ver también
+# `python manage.py refrescar_estadisticas --intervalo`)
+ESTADISTICAS_MAX_ANTIGUEDAD = config('ESTADISTICAS_MAX_ANTIGUEDAD', default=60, cast=float)
+
+# Lecturas en paralelo de PostgreSQL y MongoDB (ecommerce.lecturas_paralelas):
+# activación, hilos del pool de lecturas de MongoDB y segundos máximos de
+# espera por cada una
+LECTURAS_PARALELAS = config('LECTURAS_PARALELAS', default=False, cast=bool)
+LECTURAS_PARALELAS_HILOS = config('LECTURAS_PARALELAS_HILOS', default=16, cast=int)
+LECTURAS_PARALELAS_TIMEOUT = config('LECTURAS_PARALELAS_TIMEOUT', default=2.0, cast=float)
+
+# Particiones mensuales de pedidos (ecommerce.particiones): meses por delante
+# del actual con partición creada y meses conservados conectados (0 = todos)
+PEDIDOS_PARTICIONES_ADELANTE = config('PEDIDOS_PARTICIONES_ADELANTE', default=3, cast=int)
+PEDIDOS_PARTICIONES_RETENCION = config('PEDIDOS_PARTICIONES_RETENCION', default=0, cast=int)
+
+# Archivo de pedidos antiguos (ecommerce.archivo_pedidos): meses completos que
+# se conservan en las tablas de pedidos y pedidos archivados por transacción
+PEDIDOS_ARCHIVO_MESES = config('PEDIDOS_ARCHIVO_MESES', default=12, cast=int)
+PEDIDOS_ARCHIVO_LOTE = config('PEDIDOS_ARCHIVO_LOTE', default=1000, cast=int)
+
+# Lecturas de informes en la réplica (ecommerce.replica): segundos de retraso
+# máximo aceptado, segundos entre comprobaciones del retraso y segundos que
+# las lecturas de un hilo siguen en el principal tras escribir
+REPLICA_MAX_RETRASO = config('REPLICA_MAX_RETRASO', default=5.0, cast=float)
+REPLICA_COMPROBACION_INTERVALO = config('REPLICA_COMPROBACION_INTERVALO', default=5.0, cast=float)
+REPLICA_FIJAR_TRAS_ESCRITURA = config('REPLICA_FIJAR_TRAS_ESCRITURA', default=5.0, cast=float)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'client_sync.settings')
 
 application = get_wsgi_application()
+
+# En modo estricto (MONGO_STRICT_INDEXES) no arranca si faltan índices de MongoDB
+from ecommerce.checks import verificar_indices_al_arrancar  # noqa: E402
+
+verificar_indices_al_arrancar()
@@ -0,0 +1,5 @@
+#!/bin/bash
+# Allow streaming replication connections (used by the optional postgres-replica service).
+# Runs only when the postgres_data volume is initialized for the first time.
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
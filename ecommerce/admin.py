@@ -2,20 +2,23 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from django.http import JsonResponse
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.urls import path
 from django.template.response import TemplateResponse
-from django.db.models import Sum, Count, Avg
-from django.utils import timezone
+from django.db.models import Avg
 from datetime import datetime, timedelta
 from decimal import Decimal
 import json
 
 from .models import Cliente, Producto, Pedido, DetallePedido
 from .mongodb_services import ClienteInfoService
-from .integration_service import ClienteIntegrationService, PedidoIntegrationService, EstadisticasService
+from .integration_service import PedidoIntegrationService
+from .estadisticas import snapshot_estadisticas
+from .exportacion import (
+    COLUMNAS_CLIENTES, COLUMNAS_PEDIDOS, FORMATO_CSV, FORMATO_JSON, FORMATO_NDJSON,
+    bloques_clientes, bloques_pedidos, respuesta_exportacion
+)
 
 
 class ComentarioInline(admin.TabularInline):
@@ -45,7 +48,10 @@ class ClienteAdmin(admin.ModelAdmin):
         'comentarios_display', 'preferencias_display'
     ]
     ordering = ['id_cliente']
-    actions = ['sincronizar_mongodb', 'exportar_datos_completos', 'limpiar_comentarios']
+    actions = [
+        'sincronizar_mongodb', 'exportar_datos_completos', 'exportar_datos_completos_ndjson',
+        'exportar_datos_completos_csv', 'limpiar_comentarios'
+    ]
     
     fieldsets = (
         ('Información Básica', {
@@ -81,10 +87,28 @@ class ClienteAdmin(admin.ModelAdmin):
         ]
         return custom_urls + urls
     
+    def get_changelist_instance(self, request):
+        """Carga el estado en MongoDB de toda la página con una sola consulta"""
+        cl = super().get_changelist_instance(request)
+        try:
+            infos = ClienteInfoService().obtener_info_bulk(
+                (cliente.id_cliente for cliente in cl.result_list),
+                fields=['id_cliente']
+            )
+        except Exception:
+            return cl
+        # result_list queda evaluado, así que la plantilla recorre estos mismos objetos
+        for cliente in cl.result_list:
+            cliente._info_mongo = infos.get(cliente.id_cliente)
+        return cl
+    
     def estado_mongo(self, obj):
         """Indica si el cliente tiene datos en MongoDB"""
         try:
-            info = ClienteInfoService().obtener_info_completa(obj.id_cliente)
+            if hasattr(obj, '_info_mongo'):
+                info = obj._info_mongo
+            else:
+                info = ClienteInfoService().obtener_info_completa(obj.id_cliente, fields=['id_cliente'])
             if info:
                 return format_html(
                     '<span style="color: green;">✓ Sincronizado</span>'
@@ -112,10 +136,10 @@ class ClienteAdmin(admin.ModelAdmin):
     def comentarios_display(self, obj):
         """Muestra comentarios de MongoDB"""
         try:
-            info = ClienteInfoService().obtener_info_completa(obj.id_cliente)
-            if info and info.get('comentarios'):
+            comentarios = ClienteInfoService().obtener_comentarios(obj.id_cliente, limit=5)
+            if comentarios:
                 comentarios_html = []
-                for comentario in info['comentarios'][-5:]:  # Últimos 5 comentarios
+                for comentario in comentarios:  # Últimos 5 comentarios
                     fecha = comentario.get('fecha', 'Sin fecha')
                     if isinstance(fecha, datetime):
                         fecha = fecha.strftime('%d/%m/%Y %H:%M')
@@ -134,9 +158,8 @@ class ClienteAdmin(admin.ModelAdmin):
     def preferencias_display(self, obj):
         """Muestra preferencias de MongoDB"""
         try:
-            info = ClienteInfoService().obtener_info_completa(obj.id_cliente)
-            if info and info.get('preferencias'):
-                prefs = info['preferencias']
+            prefs = ClienteInfoService().obtener_preferencias(obj.id_cliente)
+            if prefs:
                 return format_html(
                     '<strong>Idioma:</strong> {}<br>'
                     '<strong>Método de pago:</strong> {}<br>'
@@ -152,12 +175,14 @@ class ClienteAdmin(admin.ModelAdmin):
     preferencias_display.short_description = 'Preferencias'
     
     def total_pedidos(self, obj):
-        return obj.total_pedidos
+        return obj.num_pedidos
     total_pedidos.short_description = 'Total Pedidos'
+    total_pedidos.admin_order_field = 'num_pedidos'
     
     def total_gastado(self, obj):
         return f"${obj.total_gastado:,.2f}"
     total_gastado.short_description = 'Total Gastado'
+    total_gastado.admin_order_field = 'total_gastado'
     
     def agregar_comentario_view(self, request, cliente_id):
         """Vista para agregar comentarios"""
@@ -196,8 +221,7 @@ class ClienteAdmin(admin.ModelAdmin):
         
         cliente = Cliente.objects.get(id_cliente=cliente_id)
         service = ClienteInfoService()
-        info = service.obtener_info_completa(cliente_id)
-        preferencias = info.get('preferencias', {}) if info else {}
+        preferencias = service.obtener_preferencias(cliente_id)
         
         context = {
             'title': f'Actualizar Preferencias - {cliente.nombre}',
@@ -223,17 +247,21 @@ class ClienteAdmin(admin.ModelAdmin):
     
     def exportar_datos_completos(self, request, queryset):
         """Acción para exportar datos completos"""
-        datos_completos = []
-        for cliente in queryset:
-            datos = ClienteIntegrationService.obtener_cliente_completo(cliente.id_cliente)
-            if datos:
-                datos_completos.append(datos)
-        
-        response = JsonResponse(datos_completos, safe=False)
-        response['Content-Disposition'] = f'attachment; filename="clientes_completos_{timezone.now().strftime("%Y%m%d_%H%M%S")}.json"'
-        return response
+        return respuesta_exportacion(bloques_clientes(queryset), 'clientes_completos', FORMATO_JSON)
     exportar_datos_completos.short_description = "Exportar datos completos"
     
+    def exportar_datos_completos_ndjson(self, request, queryset):
+        """Acción para exportar datos completos, un cliente por línea"""
+        return respuesta_exportacion(bloques_clientes(queryset), 'clientes_completos', FORMATO_NDJSON)
+    exportar_datos_completos_ndjson.short_description = "Exportar datos completos (NDJSON)"
+    
+    def exportar_datos_completos_csv(self, request, queryset):
+        """Acción para exportar datos completos en CSV"""
+        return respuesta_exportacion(
+            bloques_clientes(queryset), 'clientes_completos', FORMATO_CSV, columnas=COLUMNAS_CLIENTES
+        )
+    exportar_datos_completos_csv.short_description = "Exportar datos completos (CSV)"
+    
     def limpiar_comentarios(self, request, queryset):
         """Acción para limpiar comentarios antiguos"""
         service = ClienteInfoService()
@@ -270,7 +298,10 @@ class PedidoAdmin(admin.ModelAdmin):
     readonly_fields = ['id_pedido', 'fecha_pedido', 'total']
     ordering = ['id_pedido']
     inlines = [DetallePedidoInline]
-    actions = ['marcar_entregado', 'marcar_enviado', 'exportar_pedido_completo']
+    actions = [
+        'marcar_entregado', 'marcar_enviado', 'cancelar_pedidos', 'exportar_pedido_completo',
+        'exportar_pedido_completo_ndjson', 'exportar_pedido_completo_csv'
+    ]
     
     fieldsets = (
         ('Información del Cliente', {
@@ -301,30 +332,61 @@ class PedidoAdmin(admin.ModelAdmin):
         return f"${obj.total:,.2f}"
     total.short_description = 'Total'
     
+    def get_readonly_fields(self, request, obj=None):
+        # Un pedido cancelado ya devolvió su stock: no puede volver a otro estado
+        if obj is not None and obj.estado == 'cancelado':
+            return self.readonly_fields + ['estado']
+        return self.readonly_fields
+    
+    def save_model(self, request, obj, form, change):
+        """La cancelación desde el formulario pasa por el servicio para devolver el stock"""
+        cancelar = change and 'estado' in form.changed_data and obj.estado == 'cancelado'
+        if cancelar:
+            obj.estado = form.initial['estado']
+        super().save_model(request, obj, form, change)
+        if cancelar:
+            if PedidoIntegrationService.cancelar_pedido(obj.id_pedido):
+                obj.estado = 'cancelado'
+            else:
+                messages.error(request, f'No se pudo cancelar el pedido #{obj.id_pedido}.')
+    
     def marcar_entregado(self, request, queryset):
         """Acción para marcar pedidos como entregados"""
-        actualizados = queryset.update(estado='entregado')
+        actualizados = queryset.exclude(estado='cancelado').update(estado='entregado')
         messages.success(request, f'{actualizados} pedidos marcados como entregados.')
     marcar_entregado.short_description = "Marcar como entregado"
     
     def marcar_enviado(self, request, queryset):
         """Acción para marcar pedidos como enviados"""
-        actualizados = queryset.update(estado='enviado')
+        actualizados = queryset.exclude(estado='cancelado').update(estado='enviado')
         messages.success(request, f'{actualizados} pedidos marcados como enviados.')
     marcar_enviado.short_description = "Marcar como enviado"
     
+    def cancelar_pedidos(self, request, queryset):
+        """Acción para cancelar pedidos y devolver su stock"""
+        cancelados = sum(
+            PedidoIntegrationService.cancelar_pedido(id_pedido)
+            for id_pedido in queryset.values_list('id_pedido', flat=True)
+        )
+        messages.success(request, f'{cancelados} pedidos cancelados y su stock devuelto.')
+    cancelar_pedidos.short_description = "Cancelar y devolver stock"
+    
     def exportar_pedido_completo(self, request, queryset):
         """Acción para exportar pedidos completos"""
-        datos_completos = []
-        for pedido in queryset:
-            datos = PedidoIntegrationService.obtener_pedido_completo(pedido.id_pedido)
-            if datos:
-                datos_completos.append(datos)
-        
-        response = JsonResponse(datos_completos, safe=False)
-        response['Content-Disposition'] = f'attachment; filename="pedidos_completos_{timezone.now().strftime("%Y%m%d_%H%M%S")}.json"'
-        return response
+        return respuesta_exportacion(bloques_pedidos(queryset), 'pedidos_completos', FORMATO_JSON)
     exportar_pedido_completo.short_description = "Exportar pedidos completos"
+    
+    def exportar_pedido_completo_ndjson(self, request, queryset):
+        """Acción para exportar pedidos completos, un pedido por línea"""
+        return respuesta_exportacion(bloques_pedidos(queryset), 'pedidos_completos', FORMATO_NDJSON)
+    exportar_pedido_completo_ndjson.short_description = "Exportar pedidos completos (NDJSON)"
+    
+    def exportar_pedido_completo_csv(self, request, queryset):
+        """Acción para exportar pedidos completos en CSV"""
+        return respuesta_exportacion(
+            bloques_pedidos(queryset), 'pedidos_completos', FORMATO_CSV, columnas=COLUMNAS_PEDIDOS
+        )
+    exportar_pedido_completo_csv.short_description = "Exportar pedidos completos (CSV)"
 
 
 class ProductoAdmin(admin.ModelAdmin):
@@ -437,37 +499,20 @@ class CustomAdminSite(admin.AdminSite):
         """Vista personalizada del índice con estadísticas"""
         extra_context = extra_context or {}
         
-        # Estadísticas generales
-        stats = EstadisticasService.obtener_estadisticas_generales()
-        
-        # Estadísticas adicionales
-        total_clientes = Cliente.objects.count()
-        total_productos = Producto.objects.count()
-        total_pedidos = Pedido.objects.count()
-        pedidos_hoy = Pedido.objects.filter(
-            fecha_pedido__date=timezone.now().date()
-        ).count()
-        
-        # Productos más vendidos
-        productos_mas_vendidos = DetallePedido.objects.values(
-            'id_producto__nombre'
-        ).annotate(
-            total_vendido=Sum('cantidad')
-        ).order_by('-total_vendido')[:5]
-        
-        # Clientes más activos
-        clientes_mas_activos = Cliente.objects.annotate(
-            num_pedidos=Count('pedidos')
-        ).order_by('-num_pedidos')[:5]
+        # Estadísticas ya calculadas: una sola consulta mientras estén vigentes
+        snapshot = snapshot_estadisticas.obtener()
+        datos = snapshot.datos
         
         extra_context.update({
-            'total_clientes': total_clientes,
-            'total_productos': total_productos,
-            'total_pedidos': total_pedidos,
-            'pedidos_hoy': pedidos_hoy,
-            'productos_mas_vendidos': productos_mas_vendidos,
-            'clientes_mas_activos': clientes_mas_activos,
-            'stats': stats,
+            'total_clientes': datos['postgresql']['total_clientes'],
+            'total_productos': datos['postgresql']['total_productos'],
+            'total_pedidos': datos['postgresql']['total_pedidos'],
+            'pedidos_hoy': datos['pedidos_hoy'],
+            'productos_mas_vendidos': datos['productos_mas_vendidos'],
+            'clientes_mas_activos': datos['clientes_mas_activos'],
+            'stats': datos,
+            'estadisticas_fecha': snapshot.fecha_calculo,
+            'estadisticas_fecha_mongo': snapshot.fecha_mongo,
         })
         
         return super().index(request, extra_context)
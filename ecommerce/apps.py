@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class EcommerceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ecommerce'
+
+    def ready(self):
+        from . import checks  # noqa: F401  (registra los chequeos del sistema)
+        from . import signals  # noqa: F401  (mantiene los totales de los clientes)
@@ -0,0 +1,189 @@
+"""
+Archivo de pedidos antiguos
+
+Los pedidos entregados o cancelados hace más de PEDIDOS_ARCHIVO_MESES meses
+casi no se leen, pero ocupan 'pedidos' y 'detalle_pedido' (y sus índices y
+los listados del admin). `python manage.py archivar_pedidos` los mueve por
+lotes a 'pedidos_archivo' (`PedidoArchivado`): una fila por pedido con sus
+líneas desnormalizadas (nombre y precio del producto incluidos) en una lista
+JSONB, sin las filas, cabeceras e índices de cada línea en 'detalle_pedido'.
+
+Cada lote es una sola sentencia en su propia transacción: copia los pedidos
+al archivo y borra sus líneas y sus filas sin pasar por las señales de
+borrado, así que los pedidos archivados siguen contando en los totales de
+sus clientes y en las unidades vendidas de sus productos
+(`UnidadesArchivadas` guarda la parte archivada de estas últimas para los
+recálculos). `obtener_pedido_completo` y `obtener_pedidos_cliente` buscan
+también en el archivo.
+
+El mismo proceso vacía las particiones desconectadas por
+`python manage.py particiones_pedidos` (`ecommerce.particiones`) y después
+las elimina.
+"""
+
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.utils import NotSupportedError
+
+from .models import PedidoArchivado
+from .particiones import ParticionesPedidos, TABLA_DETALLES, TABLA_PEDIDOS, inicio_mes, mes_actual, sumar_meses
+import logging
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_ARCHIVABLES = ['entregado', 'cancelado']
+
+TABLA_ARCHIVO = PedidoArchivado._meta.db_table
+
+# Copia un lote de pedidos de {pedidos} al archivo y borra sus líneas y sus
+# filas; las unidades de las líneas se suman a unidades_archivadas
+SQL_ARCHIVAR_LOTE = """
+    WITH lote AS (
+        SELECT id_pedido FROM {pedidos}
+        WHERE {filtro}
+        ORDER BY id_pedido
+        LIMIT %(lote)s
+        FOR UPDATE SKIP LOCKED
+    ), archivados AS (
+        INSERT INTO pedidos_archivo (
+            id_pedido, id_cliente_id, fecha_pedido, total, estado, direccion_envio, metodo_pago,
+            detalles, fecha_archivado
+        )
+        SELECT p.id_pedido, p.id_cliente_id, p.fecha_pedido, p.total, p.estado, p.direccion_envio, p.metodo_pago,
+               COALESCE(l.detalles, '[]'::jsonb), now()
+        FROM {pedidos} p
+        JOIN lote USING (id_pedido)
+        LEFT JOIN LATERAL (
+            -- En el orden de PedidoArchivado.COLUMNAS_DETALLE
+            SELECT jsonb_agg(jsonb_build_array(
+                d.id_detalle, d.id_producto_id, pr.nombre, pr.precio, d.cantidad, d.precio_unitario, d.subtotal
+            ) ORDER BY d.id_detalle) AS detalles
+            FROM {detalles} d
+            JOIN productos pr ON pr.id_producto = d.id_producto_id
+            WHERE d.id_pedido_id = p.id_pedido
+        ) l ON true
+        RETURNING id_pedido
+    ), lineas AS (
+        DELETE FROM {detalles} d USING archivados a
+        WHERE d.id_pedido_id = a.id_pedido
+        RETURNING d.id_producto_id, d.cantidad
+    ), unidades AS (
+        INSERT INTO unidades_archivadas (id_producto_id, unidades)
+        SELECT id_producto_id, sum(cantidad) FROM lineas GROUP BY id_producto_id
+        ON CONFLICT (id_producto_id) DO UPDATE SET unidades = unidades_archivadas.unidades + EXCLUDED.unidades
+    )
+    DELETE FROM {pedidos} p USING archivados a
+    WHERE p.id_pedido = a.id_pedido
+"""
+
+
+class ArchivoPedidos:
+    """
+    Archivado por lotes de pedidos antiguos
+    """
+
+    @staticmethod
+    def preparar_tabla():
+        """
+        Comprime con lz4, si el servidor lo admite, las líneas de los pedidos
+        archivados
+
+        PostgreSQL solo comprime los valores de filas de más de ~2 kB (pedidos
+        con muchas líneas); por defecto usa pglz, más lento y que descarta
+        más valores por no ganar lo suficiente.
+        """
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {TABLA_ARCHIVO} ALTER COLUMN detalles SET COMPRESSION lz4")
+        except NotSupportedError:
+            logger.info("El servidor no admite lz4; las líneas archivadas se comprimen con pglz")
+
+    @staticmethod
+    def tamanos() -> Dict[str, int]:
+        """
+        Tamaño en bytes, con índices y TOAST, de las tablas de pedidos y del
+        archivo (si están particionadas, la suma de sus particiones)
+        """
+        tamanos = {}
+        with connection.cursor() as cursor:
+            for tabla in (TABLA_PEDIDOS, TABLA_DETALLES, TABLA_ARCHIVO):
+                # pg_partition_tree no devuelve filas para una tabla sin particionar
+                cursor.execute(
+                    "SELECT COALESCE(sum(pg_total_relation_size(relid)), pg_total_relation_size(%s)) "
+                    "FROM pg_partition_tree(%s)",
+                    [tabla, tabla]
+                )
+                tamanos[tabla] = int(cursor.fetchone()[0])
+        return tamanos
+
+    @staticmethod
+    def _archivar(pedidos: str, detalles: str, filtro: str, params: Dict[str, Any],
+                  tamano_lote: int, limite: Optional[int]) -> int:
+        """Archiva lotes de {pedidos} que cumplen el filtro hasta agotarlos o llegar al límite"""
+        sql = SQL_ARCHIVAR_LOTE.format(
+            pedidos=connection.ops.quote_name(pedidos), detalles=connection.ops.quote_name(detalles), filtro=filtro
+        )
+        archivados = 0
+        while limite is None or archivados < limite:
+            lote = tamano_lote if limite is None else min(tamano_lote, limite - archivados)
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, {**params, "lote": lote})
+                archivados_lote = cursor.rowcount
+            archivados += archivados_lote
+            if archivados_lote < lote:
+                break
+        return archivados
+
+    @staticmethod
+    def archivar(meses: Optional[int] = None, tamano_lote: Optional[int] = None,
+                 limite: Optional[int] = None) -> int:
+        """
+        Archiva los pedidos entregados o cancelados antes del mes de hace
+        `meses` meses (con 12, en octubre: los anteriores a octubre del año
+        pasado)
+
+        Args:
+            meses: Meses completos que se conservan (por defecto PEDIDOS_ARCHIVO_MESES)
+            tamano_lote: Pedidos por transacción (por defecto PEDIDOS_ARCHIVO_LOTE)
+            limite: Máximo de pedidos archivados en esta llamada (None = todos)
+
+        Returns:
+            int: Pedidos archivados
+        """
+        meses = settings.PEDIDOS_ARCHIVO_MESES if meses is None else meses
+        antes_de = inicio_mes(sumar_meses(mes_actual(), -meses))
+        return ArchivoPedidos._archivar(
+            TABLA_PEDIDOS, TABLA_DETALLES,
+            "estado = ANY(%(estados)s) AND fecha_pedido < %(antes_de)s",
+            {"estados": ESTADOS_ARCHIVABLES, "antes_de": antes_de},
+            tamano_lote or settings.PEDIDOS_ARCHIVO_LOTE, limite
+        )
+
+    @staticmethod
+    def archivar_desconectadas(tamano_lote: Optional[int] = None) -> List[str]:
+        """
+        Archiva todos los pedidos de las particiones desconectadas, sea cual
+        sea su estado, y elimina las particiones
+
+        Returns:
+            List[str]: Tablas eliminadas
+        """
+        eliminadas = []
+        for nombre, mes in ParticionesPedidos.desconectadas(TABLA_PEDIDOS):
+            detalles = ParticionesPedidos.nombre_particion(TABLA_DETALLES, mes)
+            ArchivoPedidos._archivar(
+                nombre, detalles, "true", {}, tamano_lote or settings.PEDIDOS_ARCHIVO_LOTE, None
+            )
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Líneas sin pedido en la misma partición: no se archivan y la tabla se conserva
+                cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {connection.ops.quote_name(detalles)})")
+                if cursor.fetchone()[0]:
+                    logger.error(f"Quedan líneas sin pedido en {detalles}; no se elimina")
+                    continue
+                cursor.execute(
+                    f"DROP TABLE {connection.ops.quote_name(detalles)}, {connection.ops.quote_name(nombre)}"
+                )
+            eliminadas.extend([detalles, nombre])
+        return eliminadas
@@ -0,0 +1,420 @@
+"""
+Servicios asíncronos (asyncio) para las vistas async servidas por ASGI
+
+Misma interfaz que ClienteInfoService, pero sobre AsyncMongoClient: las
+vistas async los esperan con `await` sin ocupar un hilo por consulta.
+Las consultas y actualizaciones se construyen con los mismos métodos que
+el servicio síncrono, así que ambos escriben documentos idénticos.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from client_sync.mongodb import get_async_mongodb_collection
+from .cache_clientes import Degradado, cache_clientes
+from .integration_service import ClienteIntegrationService
+from .lecturas_paralelas import SIN_RESPUESTA_MONGO
+from .models import Cliente
+from .mongodb_services import ClienteInfoService, ComentariosBucketService
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def bulk_write_con_reintento_async(collection, operaciones: List[UpdateOne]) -> List[int]:
+    """Versión async de mongodb_services.bulk_write_con_reintento"""
+    if not operaciones:
+        return []
+    try:
+        await collection.bulk_write(operaciones, ordered=False)
+        return []
+    except BulkWriteError as e:
+        errores = e.details.get("writeErrors", [])
+
+    fallidas = [error["index"] for error in errores if error.get("code") != 11000]
+    reintentos = [error["index"] for error in errores if error.get("code") == 11000]
+    if reintentos:
+        try:
+            await collection.bulk_write([operaciones[i] for i in reintentos], ordered=False)
+        except BulkWriteError as e:
+            fallidas.extend(reintentos[error["index"]] for error in e.details.get("writeErrors", []))
+    return sorted(fallidas)
+
+
+class AsyncComentariosBucketService(ComentariosBucketService):
+    """
+    Versión async de ComentariosBucketService
+    """
+
+    @property
+    def collection(self):
+        """Colección async; el cliente se crea en el primer uso dentro de cada event loop"""
+        return get_async_mongodb_collection(self.collection_name)
+
+    async def agregar(self, id_cliente: int, comentario: Dict[str, Any]):
+        filtro, update = self._filtro_y_update(id_cliente, comentario)
+        return await self.collection.update_one(filtro, update, upsert=True)
+
+    async def agregar_historicos(self, id_cliente: int, comentarios: List[Dict[str, Any]]) -> int:
+        operaciones = self.operaciones_historicos(id_cliente, comentarios)
+        if operaciones:
+            await self.collection.bulk_write(operaciones, ordered=True)
+        return len(operaciones)
+
+    async def obtener(
+        self,
+        id_cliente: int,
+        limit: Optional[int] = None,
+        before: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        comentarios = []
+        cursor = self._cursor_buckets(id_cliente, before)
+        async for bucket in cursor:
+            comentarios.extend(self._comentarios_del_bucket(bucket, before))
+            if limit is not None and len(comentarios) >= limit:
+                break
+        await cursor.close()
+        return self._ordenar_y_recortar(comentarios, limit)
+
+    async def obtener_bulk(self, ids_cliente: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        resultado: Dict[int, List[Dict[str, Any]]] = {}
+        for inicio in range(0, len(ids_cliente), self.bulk_chunk_size):
+            bloque = ids_cliente[inicio:inicio + self.bulk_chunk_size]
+            async for bucket in self.collection.find(
+                {"id_cliente": {"$in": bloque}},
+                {"_id": 0, "id_cliente": 1, "comentarios": 1}
+            ):
+                resultado.setdefault(bucket["id_cliente"], []).extend(bucket.get("comentarios", []))
+        for comentarios in resultado.values():
+            self._ordenar_y_recortar(comentarios, None)
+        return resultado
+
+    async def eliminar(self, id_cliente: int) -> int:
+        return (await self.collection.delete_many({"id_cliente": id_cliente})).deleted_count
+
+    async def contar_por_cliente(self):
+        return await self.collection.aggregate([
+            {"$group": {"_id": "$id_cliente", "total": {"$sum": {"$size": "$comentarios"}}}}
+        ], allowDiskUse=True)
+
+
+class AsyncClienteInfoService(ClienteInfoService):
+    """
+    Versión async de ClienteInfoService, con los mismos métodos
+    """
+
+    def __init__(self, modo_comentarios: Optional[str] = None):
+        super().__init__(modo_comentarios)
+        self.buckets = AsyncComentariosBucketService()
+
+    @property
+    def collection(self):
+        """Colección async; el cliente se crea en el primer uso dentro de cada event loop"""
+        return get_async_mongodb_collection(self.collection_name)
+
+    async def _upsert(self, id_cliente: int, update: Dict[str, Any]):
+        try:
+            return await self.collection.update_one({"id_cliente": id_cliente}, update, upsert=True)
+        except DuplicateKeyError:
+            return await self.collection.update_one({"id_cliente": id_cliente}, update, upsert=True)
+
+    async def crear_documento_cliente(self, id_cliente: int) -> bool:
+        try:
+            valores = self._valores_iniciales()
+            valores["ultima_actualizacion"] = valores["fecha_creacion"]
+            result = await self._upsert(id_cliente, {"$setOnInsert": valores})
+            if result.upserted_id is not None:
+                await cache_clientes.ainvalidar([id_cliente])
+                logger.info(f"Documento creado para cliente {id_cliente} con ID: {result.upserted_id}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al crear documento para cliente {id_cliente}: {e}")
+            return False
+
+    async def agregar_comentario(self, id_cliente: int, texto: str) -> bool:
+        try:
+            comentario = {
+                "texto": texto,
+                "fecha": datetime.utcnow()
+            }
+            if self.usa_buckets:
+                await self.buckets.agregar(id_cliente, comentario)
+            await self._upsert(id_cliente, self._update_comentarios([comentario]))
+            await cache_clientes.ainvalidar([id_cliente])
+
+            logger.info(f"Comentario agregado para cliente {id_cliente}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al agregar comentario para cliente {id_cliente}: {e}")
+            return False
+
+    async def agregar_comentarios_bulk(self, comentarios_por_cliente: Dict[int, List[Dict[str, Any]]]) -> int:
+        ids = [id_cliente for id_cliente, comentarios in comentarios_por_cliente.items() if comentarios]
+        total = sum(len(comentarios_por_cliente[id_cliente]) for id_cliente in ids)
+        try:
+            operaciones = [
+                UpdateOne({"id_cliente": id_cliente}, self._update_comentarios(comentarios_por_cliente[id_cliente]), upsert=True)
+                for id_cliente in ids
+            ]
+
+            if self.usa_buckets:
+                operaciones_buckets = [
+                    self.buckets.operacion_agregar(id_cliente, comentario)
+                    for id_cliente in ids
+                    for comentario in comentarios_por_cliente[id_cliente]
+                ]
+                fallidas = await bulk_write_con_reintento_async(self.buckets.collection, operaciones_buckets)
+                await bulk_write_con_reintento_async(self.collection, operaciones)
+                perdidos = len(fallidas)
+            else:
+                fallidas = await bulk_write_con_reintento_async(self.collection, operaciones)
+                perdidos = sum(len(comentarios_por_cliente[ids[i]]) for i in fallidas)
+            await cache_clientes.ainvalidar(ids)
+
+            if perdidos:
+                logger.error(f"No se pudieron guardar {perdidos} de {total} comentarios")
+            return total - perdidos
+
+        except Exception as e:
+            logger.error(f"Error al agregar {total} comentarios por lotes: {e}")
+            return 0
+
+    async def _comentarios_embebidos(
+        self,
+        id_cliente: int,
+        limit: Optional[int],
+        before: Optional[datetime]
+    ) -> List[Dict[str, Any]]:
+        if before is None:
+            documento = await self.collection.find_one(
+                {"id_cliente": id_cliente},
+                self._proyeccion_comentarios(limit)
+            )
+        else:
+            cursor = await self.collection.aggregate(
+                self._pipeline_comentarios_anteriores(id_cliente, limit, before)
+            )
+            documentos = await cursor.to_list(length=1)
+            documento = documentos[0] if documentos else None
+        if documento:
+            return documento.get("comentarios", [])
+        return []
+
+    async def obtener_comentarios(
+        self,
+        id_cliente: int,
+        limit: Optional[int] = None,
+        before: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        try:
+            if self.usa_buckets:
+                comentarios = await self.buckets.obtener(id_cliente, limit=limit, before=before)
+                if not self.lee_embebidos:
+                    return comentarios
+                return self._combinar_comentarios(
+                    await self._comentarios_embebidos(id_cliente, limit, before), comentarios, limit
+                )
+            return await self._comentarios_embebidos(id_cliente, limit, before)
+
+        except Exception as e:
+            logger.error(f"Error al obtener comentarios para cliente {id_cliente}: {e}")
+            return []
+
+    async def actualizar_preferencias(self, id_cliente: int, preferencias: Dict[str, Any]) -> bool:
+        try:
+            await self._upsert(id_cliente, self._update_preferencias(preferencias))
+            await cache_clientes.ainvalidar([id_cliente])
+            logger.info(f"Preferencias actualizadas para cliente {id_cliente}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error al actualizar preferencias para cliente {id_cliente}: {e}")
+            return False
+
+    async def actualizar_preferencias_bulk(self, preferencias_por_cliente: Dict[int, Dict[str, Any]]) -> int:
+        total = len(preferencias_por_cliente)
+        try:
+            operaciones = [
+                UpdateOne({"id_cliente": id_cliente}, self._update_preferencias(preferencias), upsert=True)
+                for id_cliente, preferencias in preferencias_por_cliente.items()
+            ]
+            fallidas = await bulk_write_con_reintento_async(self.collection, operaciones)
+            await cache_clientes.ainvalidar(preferencias_por_cliente)
+            if fallidas:
+                logger.error(f"No se pudieron actualizar las preferencias de {len(fallidas)} de {total} clientes")
+            return total - len(fallidas)
+
+        except Exception as e:
+            logger.error(f"Error al actualizar preferencias de {total} clientes por lotes: {e}")
+            return 0
+
+    async def obtener_preferencias(self, id_cliente: int) -> Dict[str, Any]:
+        try:
+            documento = await self.collection.find_one(
+                {"id_cliente": id_cliente},
+                {"_id": 0, "preferencias": 1}
+            )
+            if documento:
+                return documento.get("preferencias", {})
+            return {}
+
+        except Exception as e:
+            logger.error(f"Error al obtener preferencias para cliente {id_cliente}: {e}")
+            return {}
+
+    async def obtener_info_completa(
+        self,
+        id_cliente: int,
+        fields: Optional[List[str]] = None,
+        en_error: Any = None
+    ) -> Optional[Dict[str, Any]]:
+        try:
+            documento = await self.collection.find_one(
+                {"id_cliente": id_cliente},
+                self._proyeccion(fields)
+            )
+            if documento and self.usa_buckets and (fields is None or "comentarios" in fields):
+                documento["comentarios"] = self._comentarios_documento(
+                    documento, await self.buckets.obtener(id_cliente)
+                )
+            return documento
+
+        except Exception as e:
+            logger.error(f"Error al obtener información completa para cliente {id_cliente}: {e}")
+            return en_error
+
+    async def obtener_info_bulk(
+        self,
+        ids_cliente: Iterable[int],
+        fields: Optional[List[str]] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        ids = list(dict.fromkeys(ids_cliente))
+        if not ids:
+            return {}
+
+        projection = self._proyeccion(fields)
+
+        try:
+            documentos = {}
+            for inicio in range(0, len(ids), self.bulk_chunk_size):
+                bloque = ids[inicio:inicio + self.bulk_chunk_size]
+                async for documento in self.collection.find({"id_cliente": {"$in": bloque}}, projection):
+                    documentos[documento["id_cliente"]] = documento
+
+            if documentos and self.usa_buckets and (fields is None or "comentarios" in fields):
+                comentarios = await self.buckets.obtener_bulk(list(documentos))
+                for id_cliente, documento in documentos.items():
+                    documento["comentarios"] = self._comentarios_documento(
+                        documento, comentarios.get(id_cliente, [])
+                    )
+            return documentos
+
+        except Exception as e:
+            logger.error(f"Error al obtener información de {len(ids)} clientes: {e}")
+            return {}
+
+    async def eliminar_cliente(self, id_cliente: int) -> bool:
+        try:
+            result = await self.collection.delete_one({"id_cliente": id_cliente})
+            if self.usa_buckets:
+                await self.buckets.eliminar(id_cliente)
+            await cache_clientes.ainvalidar([id_cliente])
+            if result.deleted_count > 0:
+                logger.info(f"Información eliminada para cliente {id_cliente}")
+                return True
+            return False
+
+        except Exception as e:
+            logger.error(f"Error al eliminar información para cliente {id_cliente}: {e}")
+            return False
+
+    async def obtener_estadisticas(self) -> Dict[str, Any]:
+        try:
+            cursor = await self.collection.aggregate(self.pipeline_estadisticas)
+            resultados = await cursor.to_list(length=1)
+            return self._formatear_estadisticas(resultados[0] if resultados else None)
+
+        except Exception as e:
+            logger.error(f"Error al obtener estadísticas: {e}")
+            return self._formatear_estadisticas(None)
+
+    async def recalcular_contadores(self) -> Dict[str, int]:
+        embebidos = await self.collection.update_many(
+            {},
+            [{"$set": {"num_comentarios": {"$size": {"$ifNull": ["$comentarios", []]}}}}]
+        )
+
+        actualizados_buckets = 0
+        operaciones = []
+        async for conteo in await self.buckets.contar_por_cliente():
+            operaciones.append(UpdateOne(
+                {"id_cliente": conteo["_id"]},
+                [{"$set": {"num_comentarios": {"$add": [
+                    {"$size": {"$ifNull": ["$comentarios", []]}},
+                    conteo["total"]
+                ]}}}]
+            ))
+            if len(operaciones) >= self.bulk_chunk_size:
+                actualizados_buckets += (await self.collection.bulk_write(operaciones, ordered=False)).modified_count
+                operaciones = []
+        if operaciones:
+            actualizados_buckets += (await self.collection.bulk_write(operaciones, ordered=False)).modified_count
+
+        return {
+            "embebidos": embebidos.modified_count,
+            "buckets": actualizados_buckets
+        }
+
+
+class AsyncClienteIntegrationService:
+    """
+    Versión async de las lecturas de ClienteIntegrationService
+    """
+
+    @staticmethod
+    async def obtener_cliente_completo(id_cliente: int) -> Optional[Dict[str, Any]]:
+        """
+        Obtiene información completa de un cliente desde la misma caché que
+        `ClienteIntegrationService.obtener_cliente_completo`
+
+        Args:
+            id_cliente: ID del cliente
+
+        Returns:
+            Dict: Información completa del cliente o None si no existe
+        """
+        try:
+            return await cache_clientes.aobtener(
+                id_cliente, lambda: AsyncClienteIntegrationService._cargar_cliente_completo(id_cliente)
+            )
+
+        except Exception as e:
+            logger.error(f"Error al obtener cliente completo {id_cliente}: {e}")
+            return None
+
+    @staticmethod
+    async def _cargar_cliente_completo(id_cliente: int) -> Optional[Dict[str, Any]]:
+        """
+        Lee a la vez el cliente de PostgreSQL y su documento de MongoDB, sin
+        caché; si MongoDB falla, la vista no se guarda (`Degradado`)
+        """
+        cliente, info_mongo = await asyncio.gather(
+            Cliente.objects.filter(id_cliente=id_cliente).afirst(),
+            async_cliente_info_service.obtener_info_completa(id_cliente, en_error=SIN_RESPUESTA_MONGO)
+        )
+        if not cliente:
+            return None
+
+        if info_mongo is SIN_RESPUESTA_MONGO:
+            return Degradado(ClienteIntegrationService.combinar_cliente(cliente, None))
+        return ClienteIntegrationService.combinar_cliente(cliente, info_mongo)
+
+
+# Instancia global del servicio async
+async_cliente_info_service = AsyncClienteInfoService()
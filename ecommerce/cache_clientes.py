@@ -0,0 +1,306 @@
+"""
+Caché de lectura de clientes completos (PostgreSQL + MongoDB)
+
+`ClienteIntegrationService.obtener_cliente_completo` se lee mucho más de lo
+que cambia. Cada cliente tiene una versión en la caché compartida de Django
+(CACHE_CLIENTES_ALIAS) y su vista completa se guarda bajo una clave que
+incluye esa versión. Las escrituras no borran datos: cambian la versión, con
+lo que las copias anteriores dejan de ser alcanzables en todos los procesos,
+incluidas las que un lector concurrente guarde tarde con la versión vieja.
+
+Delante de la caché compartida hay un LRU acotado en memoria del proceso
+(CACHE_CLIENTES_LRU_TAMANO) que se valida con la misma versión, así que un
+acierto del LRU se ahorra la transferencia y deserialización del documento,
+no la lectura de la versión.
+
+Una vista incompleta (por ejemplo, sin los datos de MongoDB porque su lectura
+venció el límite o falló) se devuelve envuelta en `Degradado`: se entrega al
+llamador pero no se guarda, para no servirla durante todo CACHE_CLIENTES_TTL.
+"""
+
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Se incrementa si cambia la forma del diccionario guardado
+VERSION_FORMATO = 1
+PREFIJO = f'cliente_completo:{VERSION_FORMATO}'
+
+
+class Degradado:
+    """Resultado de `cargar` que se devuelve sin guardarlo en la caché"""
+
+    __slots__ = ('valor',)
+
+    def __init__(self, valor: Dict[str, Any]):
+        self.valor = valor
+
+
+class CacheClientes:
+    """
+    Caché de dos niveles (LRU del proceso y caché de Django) con claves versionadas
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[int, tuple]" = OrderedDict()
+        self._contadores = {
+            "aciertos_lru": 0,
+            "aciertos_compartida": 0,
+            "fallos": 0,
+            "desalojos": 0,
+            "invalidaciones": 0,
+            "errores": 0,
+            "degradados": 0,
+        }
+
+    @property
+    def ttl(self) -> int:
+        """Segundos de vida de cada entrada; 0 desactiva la caché"""
+        return settings.CACHE_CLIENTES_TTL
+
+    @property
+    def tamano_lru(self) -> int:
+        return settings.CACHE_CLIENTES_LRU_TAMANO
+
+    @property
+    def cache(self):
+        return caches[settings.CACHE_CLIENTES_ALIAS]
+
+    @staticmethod
+    def _clave_version(id_cliente: int) -> str:
+        return f'{PREFIJO}:version:{id_cliente}'
+
+    @staticmethod
+    def _clave_datos(id_cliente: int, version: str) -> str:
+        return f'{PREFIJO}:datos:{id_cliente}:{version}'
+
+    @staticmethod
+    def _nueva_version() -> str:
+        # Distinta de cualquier versión anterior aunque la clave se haya desalojado
+        return uuid.uuid4().hex
+
+    def _contar(self, contador: str, cantidad: int = 1):
+        with self._lock:
+            self._contadores[contador] += cantidad
+
+    def _version(self, id_cliente: int) -> str:
+        clave = self._clave_version(id_cliente)
+        version = self.cache.get(clave)
+        if version is None:
+            nueva = self._nueva_version()
+            # Las versiones no caducan; si otro proceso se adelanta, gana la suya
+            version = nueva if self.cache.add(clave, nueva, timeout=None) else self.cache.get(clave, nueva)
+        return version
+
+    async def _aversion(self, id_cliente: int) -> str:
+        clave = self._clave_version(id_cliente)
+        version = await self.cache.aget(clave)
+        if version is None:
+            nueva = self._nueva_version()
+            version = nueva if await self.cache.aadd(clave, nueva, timeout=None) else await self.cache.aget(clave, nueva)
+        return version
+
+    def _leer_lru(self, id_cliente: int, version: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entrada = self._lru.get(id_cliente)
+            if entrada is None:
+                return None
+            version_lru, expira, valor = entrada
+            if version_lru != version or expira <= time.monotonic():
+                del self._lru[id_cliente]
+                return None
+            self._lru.move_to_end(id_cliente)
+            self._contadores["aciertos_lru"] += 1
+        return copy.deepcopy(valor)
+
+    def _guardar_lru(self, id_cliente: int, version: str, valor: Dict[str, Any]):
+        if self.tamano_lru <= 0:
+            return
+        entrada = (version, time.monotonic() + self.ttl, copy.deepcopy(valor))
+        with self._lock:
+            self._lru[id_cliente] = entrada
+            self._lru.move_to_end(id_cliente)
+            while len(self._lru) > self.tamano_lru:
+                self._lru.popitem(last=False)
+                self._contadores["desalojos"] += 1
+
+    def _sin_envolver(self, valor):
+        if isinstance(valor, Degradado):
+            self._contar("degradados")
+            return valor.valor
+        return valor
+
+    def obtener(
+        self,
+        id_cliente: int,
+        cargar: Callable[[], Optional[Dict[str, Any]]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Devuelve el cliente completo desde la caché o, si no está, lo carga y lo guarda
+
+        La versión se lee antes de cargar: si una escritura la cambia mientras
+        tanto, lo cargado queda guardado bajo la versión vieja y nadie lo lee.
+
+        Args:
+            id_cliente: ID del cliente
+            cargar: Función que obtiene el cliente de las bases de datos
+                (None si no existe; ni None ni un `Degradado` se guardan)
+
+        Returns:
+            Dict: Información completa del cliente o None si no existe
+        """
+        if self.ttl <= 0:
+            return self._sin_envolver(cargar())
+
+        try:
+            version = self._version(id_cliente)
+            valor = self._leer_lru(id_cliente, version)
+            if valor is not None:
+                return valor
+            valor = self.cache.get(self._clave_datos(id_cliente, version))
+        except Exception as e:
+            logger.error(f"Error al leer la caché del cliente {id_cliente}: {e}")
+            self._contar("errores")
+            return self._sin_envolver(cargar())
+
+        if valor is not None:
+            self._contar("aciertos_compartida")
+            self._guardar_lru(id_cliente, version, valor)
+            return valor
+
+        self._contar("fallos")
+        valor = cargar()
+        if valor is None or isinstance(valor, Degradado):
+            return self._sin_envolver(valor)
+        try:
+            self.cache.set(self._clave_datos(id_cliente, version), valor, timeout=self.ttl)
+            self._guardar_lru(id_cliente, version, valor)
+        except Exception as e:
+            logger.error(f"Error al guardar en caché el cliente {id_cliente}: {e}")
+            self._contar("errores")
+        return valor
+
+    async def aobtener(
+        self,
+        id_cliente: int,
+        cargar: Callable[[], Awaitable[Optional[Dict[str, Any]]]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Versión async de `obtener` para los servicios async: mismas claves,
+        versiones y LRU, así que ASGI y WSGI comparten las entradas
+
+        Args:
+            id_cliente: ID del cliente
+            cargar: Corrutina que obtiene el cliente de las bases de datos
+        """
+        if self.ttl <= 0:
+            return self._sin_envolver(await cargar())
+
+        try:
+            version = await self._aversion(id_cliente)
+            valor = self._leer_lru(id_cliente, version)
+            if valor is not None:
+                return valor
+            valor = await self.cache.aget(self._clave_datos(id_cliente, version))
+        except Exception as e:
+            logger.error(f"Error al leer la caché del cliente {id_cliente}: {e}")
+            self._contar("errores")
+            return self._sin_envolver(await cargar())
+
+        if valor is not None:
+            self._contar("aciertos_compartida")
+            self._guardar_lru(id_cliente, version, valor)
+            return valor
+
+        self._contar("fallos")
+        valor = await cargar()
+        if valor is None or isinstance(valor, Degradado):
+            return self._sin_envolver(valor)
+        try:
+            await self.cache.aset(self._clave_datos(id_cliente, version), valor, timeout=self.ttl)
+            self._guardar_lru(id_cliente, version, valor)
+        except Exception as e:
+            logger.error(f"Error al guardar en caché el cliente {id_cliente}: {e}")
+            self._contar("errores")
+        return valor
+
+    def _renovar_versiones(self, ids_cliente: list):
+        try:
+            self.cache.set_many(
+                {self._clave_version(id_cliente): self._nueva_version() for id_cliente in ids_cliente},
+                timeout=None
+            )
+            self._contar("invalidaciones", len(ids_cliente))
+        except Exception as e:
+            logger.error(f"Error al invalidar la caché de {len(ids_cliente)} clientes: {e}")
+            self._contar("errores")
+
+    def invalidar(self, ids_cliente: Iterable[int]):
+        """
+        Cambia la versión de los clientes dados, ahora y, dentro de una
+        transacción, otra vez tras el commit
+
+        La primera renovación cubre las escrituras en MongoDB, que no esperan
+        al commit; la segunda descarta lo que un lector haya guardado con datos
+        de PostgreSQL aún sin confirmar.
+        """
+        ids = list(dict.fromkeys(ids_cliente))
+        if not ids or self.ttl <= 0:
+            return
+        self._renovar_versiones(ids)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self._renovar_versiones(ids))
+
+    async def ainvalidar(self, ids_cliente: Iterable[int]):
+        """Versión async de `invalidar` para los servicios async (sin transacciones de PostgreSQL)"""
+        ids = list(dict.fromkeys(ids_cliente))
+        if not ids or self.ttl <= 0:
+            return
+        try:
+            await self.cache.aset_many(
+                {self._clave_version(id_cliente): self._nueva_version() for id_cliente in ids},
+                timeout=None
+            )
+            self._contar("invalidaciones", len(ids))
+        except Exception as e:
+            logger.error(f"Error al invalidar la caché de {len(ids)} clientes: {e}")
+            self._contar("errores")
+
+    def limpiar_lru(self):
+        """Vacía el LRU del proceso (la caché compartida no se toca)"""
+        with self._lock:
+            self._lru.clear()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """
+        Contadores de la caché en este proceso
+
+        Returns:
+            Dict: aciertos (LRU y compartida), fallos, desalojos del LRU,
+            invalidaciones, errores, vistas degradadas no guardadas,
+            ocupación del LRU y tasa de aciertos
+        """
+        with self._lock:
+            datos = dict(self._contadores)
+            datos["tamano_lru"] = len(self._lru)
+        lecturas = datos["aciertos_lru"] + datos["aciertos_compartida"] + datos["fallos"]
+        datos.update({
+            "capacidad_lru": self.tamano_lru,
+            "tasa_aciertos": (lecturas - datos["fallos"]) / lecturas if lecturas else 0.0,
+        })
+        return datos
+
+
+# Instancia global usada por los servicios
+cache_clientes = CacheClientes()
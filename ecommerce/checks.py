@@ -0,0 +1,55 @@
+"""
+Chequeos de arranque del sistema híbrido
+"""
+
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+
+
+def _indices_faltantes():
+    """Índices de MongoDB requeridos que no existen, como 'coleccion.indice'"""
+    from .mongodb_services import indices_mongo_service
+
+    reporte = indices_mongo_service.verificar_indices()
+    return [
+        f"{nombre_coleccion}.{nombre}"
+        for nombre_coleccion, estado in reporte.items()
+        for nombre in estado["faltantes"]
+    ]
+
+
+@checks.register()
+def check_indices_mongo(app_configs, **kwargs):
+    """En modo estricto (MONGO_STRICT_INDEXES) falla si falta algún índice de MongoDB"""
+    if not getattr(settings, 'MONGO_STRICT_INDEXES', False):
+        return []
+    try:
+        faltantes = _indices_faltantes()
+    except Exception as e:
+        return [checks.Error(
+            f"No se pudieron verificar los índices de MongoDB: {e}",
+            id='ecommerce.E001',
+        )]
+    if faltantes:
+        return [checks.Error(
+            f"Faltan índices en MongoDB: {', '.join(faltantes)}",
+            hint="Ejecute 'python manage.py ensure_mongo_indexes'.",
+            id='ecommerce.E002',
+        )]
+    return []
+
+
+def verificar_indices_al_arrancar():
+    """
+    Verificación para los servidores WSGI/ASGI, que no ejecutan los chequeos
+    del sistema. Solo actúa en modo estricto.
+    """
+    if not getattr(settings, 'MONGO_STRICT_INDEXES', False):
+        return
+    faltantes = _indices_faltantes()
+    if faltantes:
+        raise ImproperlyConfigured(
+            f"Faltan índices en MongoDB: {', '.join(faltantes)}. "
+            f"Ejecute 'python manage.py ensure_mongo_indexes'."
+        )
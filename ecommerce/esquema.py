@@ -0,0 +1,142 @@
+"""
+Cambios de esquema para bases creadas antes de algunas columnas o índices
+
+El proyecto crea las tablas sin migraciones, así que las columnas nuevas de
+tablas existentes las agrega `migrate` (ver `ecommerce.signals`): las de
+COLUMNAS_POSTERIORES con `crear_columnas_posteriores`, y las que hay que
+calcular, como CAMPOS_TOTALES o `productos.unidades_vendidas`, creándolas y
+rellenándolas a continuación. Los
+índices de `Meta.indexes` los crea `python manage.py ensure_postgres_indexes`.
+"""
+
+from typing import Dict, Iterable, List
+
+from django.apps import apps
+from django.db import connection
+
+# Columnas agregadas después de crear las tablas cuyo valor por defecto ya es
+# el correcto para las filas existentes: (modelo, campos)
+COLUMNAS_POSTERIORES = [
+    ('ecommerce.DetallePedido', ['cantidad_reservada']),
+    ('ecommerce.EventoOutbox', ['proximo_intento']),
+]
+
+# Totales de 'clientes' calculados desde sus pedidos
+CAMPOS_TOTALES = ('num_pedidos', 'total_gastado')
+
+
+def columnas_faltantes(modelo, campos: Iterable[str]) -> List[str]:
+    """
+    Campos de `campos` sin columna en la tabla del modelo (ninguno si la
+    tabla no existe: se creará completa)
+    """
+    tabla = modelo._meta.db_table
+    with connection.cursor() as cursor:
+        if tabla not in connection.introspection.table_names(cursor):
+            return []
+        columnas = {columna.name for columna in connection.introspection.get_table_description(cursor, tabla)}
+    return [campo for campo in campos if modelo._meta.get_field(campo).column not in columnas]
+
+
+def crear_columnas_faltantes(modelo, campos: Iterable[str]) -> List[str]:
+    """
+    Agrega a la tabla del modelo las columnas de `campos` que no existan
+
+    Returns:
+        List[str]: Campos agregados
+    """
+    faltantes = columnas_faltantes(modelo, campos)
+    if faltantes:
+        with connection.schema_editor() as schema_editor:
+            for campo in faltantes:
+                schema_editor.add_field(modelo, modelo._meta.get_field(campo))
+    return faltantes
+
+
+def crear_columnas_posteriores() -> List[str]:
+    """
+    Agrega las columnas de COLUMNAS_POSTERIORES que falten en tablas que ya
+    existen (las tablas nuevas se crean completas)
+
+    Returns:
+        List[str]: Columnas agregadas, como 'tabla.columna'
+    """
+    agregadas = []
+    for etiqueta, campos in COLUMNAS_POSTERIORES:
+        modelo = apps.get_model(etiqueta)
+        agregadas += [f'{modelo._meta.db_table}.{campo}' for campo in crear_columnas_faltantes(modelo, campos)]
+    return agregadas
+
+
+def es_particionada(tabla: str) -> bool:
+    """Indica si la tabla existe y está particionada (PARTITION BY)"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [tabla])
+        fila = cursor.fetchone()
+    return bool(fila and fila[0])
+
+
+def _indices_existentes(modelo) -> Dict[str, Dict]:
+    with connection.cursor() as cursor:
+        restricciones = connection.introspection.get_constraints(cursor, modelo._meta.db_table)
+    return {nombre: datos for nombre, datos in restricciones.items() if datos['index'] or datos['unique']}
+
+
+def indices_faltantes(modelo) -> List[str]:
+    """Índices de `Meta.indexes` del modelo que no existen en su tabla"""
+    existentes = _indices_existentes(modelo)
+    return [indice.name for indice in modelo._meta.indexes if indice.name not in existentes]
+
+
+def crear_indices_faltantes(modelo) -> List[str]:
+    """
+    Crea los índices de `Meta.indexes` que falten, con CREATE INDEX
+    CONCURRENTLY para no bloquear las escrituras en tablas con datos
+    (PostgreSQL no lo admite en tablas particionadas: en ellas se crean
+    sin CONCURRENTLY)
+
+    Returns:
+        List[str]: Índices creados
+    """
+    faltantes = set(indices_faltantes(modelo))
+    concurrentemente = not es_particionada(modelo._meta.db_table)
+    creados = []
+    # CONCURRENTLY no puede ejecutarse dentro de una transacción
+    with connection.schema_editor(atomic=False) as schema_editor:
+        for indice in modelo._meta.indexes:
+            if indice.name in faltantes:
+                schema_editor.add_index(modelo, indice, concurrently=concurrentemente)
+                creados.append(indice.name)
+    return creados
+
+
+def indices_redundantes(modelo) -> List[str]:
+    """
+    Índices no únicos de la tabla cuyas columnas son el comienzo de un índice
+    declarado y completo (no parcial): los de las claves foráneas creados
+    antes de que el modelo declarara su índice compuesto
+
+    Returns:
+        List[str]: Nombres de los índices redundantes
+    """
+    def columnas(campos):
+        return [modelo._meta.get_field(campo.lstrip('-')).column for campo in campos]
+
+    declarados = [columnas(indice.fields) for indice in modelo._meta.indexes if indice.condition is None]
+    declarados += [columnas(campos) for campos in modelo._meta.unique_together]
+    nombres_declarados = {indice.name for indice in modelo._meta.indexes}
+
+    redundantes = []
+    for nombre, datos in _indices_existentes(modelo).items():
+        if datos['unique'] or datos['primary_key'] or nombre in nombres_declarados:
+            continue
+        if any(cols[:len(datos['columns'])] == datos['columns'] for cols in declarados):
+            redundantes.append(nombre)
+    return redundantes
+
+
+def eliminar_indices(modelo, nombres: Iterable[str]):
+    """Elimina índices de la tabla del modelo con DROP INDEX CONCURRENTLY"""
+    with connection.cursor() as cursor:
+        for nombre in nombres:
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {connection.ops.quote_name(nombre)}')
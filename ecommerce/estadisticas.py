@@ -0,0 +1,207 @@
+"""
+Snapshot de las estadísticas del panel de administración
+
+Las estadísticas se guardan ya calculadas en una sola fila de
+'estadisticas_snapshot'; el panel la lee con una consulta. Calcularlas no
+recorre 'pedidos' ni 'detalle_pedido': parte de los contadores que se
+mantienen al escribir (`Cliente.num_pedidos`, `Cliente.total_gastado` y
+`Producto.unidades_vendidas`), así que su coste depende del número de
+clientes y productos, no del de pedidos.
+
+La fila se recalcula al leerla si tiene más de ESTADISTICAS_MAX_ANTIGUEDAD
+segundos, o periódicamente con `python manage.py refrescar_estadisticas`.
+
+Con una réplica de lectura (`ecommerce.replica`), el cálculo lee de ella; la
+fila y el bloqueo siguen en el principal.
+"""
+
+from datetime import datetime, time as hora, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Cliente, DetallePedido, EstadisticasSnapshot, Pedido, Producto, UnidadesArchivadas
+from .mongodb_services import ClienteInfoService, cliente_info_service
+from .replica import replica_lecturas
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Clave del advisory lock de PostgreSQL: un solo recálculo a la vez
+CLAVE_BLOQUEO_ESTADISTICAS = 7_301_466_118
+
+TOP_PANEL = 5
+
+
+class SnapshotEstadisticas:
+    """
+    Cálculo y lectura del snapshot de estadísticas
+    """
+
+    def __init__(self, service: Optional[ClienteInfoService] = None):
+        self.service = service or cliente_info_service
+
+    @staticmethod
+    def inicio_del_dia() -> datetime:
+        """Medianoche de hoy en la zona horaria del proyecto"""
+        return timezone.make_aware(datetime.combine(timezone.localdate(), hora.min))
+
+    def pedidos_hoy(self):
+        """
+        Pedidos de hoy como rango sobre fecha_pedido, que resuelve
+        pedidos_fecha_idx (`fecha_pedido__date=hoy` convertiría cada fila a
+        fecha y no podría usar el índice)
+        """
+        inicio = self.inicio_del_dia()
+        return Pedido.objects.filter(fecha_pedido__gte=inicio, fecha_pedido__lt=inicio + timedelta(days=1))
+
+    def _estadisticas_mongo(self) -> Dict[str, Any]:
+        """Estadísticas de MongoDB; a diferencia del servicio, propaga los errores"""
+        resultados = list(self.service.collection.aggregate(self.service.pipeline_estadisticas))
+        return self.service._formatear_estadisticas(resultados[0] if resultados else None)
+
+    def calcular(self, anterior: Optional[EstadisticasSnapshot] = None) -> Tuple[Dict[str, Any], Optional[datetime]]:
+        """
+        Calcula las estadísticas del panel
+
+        Si MongoDB no responde se conservan sus estadísticas anteriores y su fecha.
+
+        Returns:
+            Tuple: Estadísticas y fecha de las de MongoDB
+        """
+        totales_clientes = Cliente.objects.aggregate(
+            total_clientes=models.Count('pk'),
+            total_pedidos=Coalesce(models.Sum('num_pedidos'), 0),
+            total_ventas=Coalesce(models.Sum('total_gastado'), Decimal('0.00'))
+        )
+        total_clientes = totales_clientes["total_clientes"]
+        total_pedidos = totales_clientes["total_pedidos"]
+        total_ventas = totales_clientes["total_ventas"]
+
+        try:
+            stats_mongo = self._estadisticas_mongo()
+            fecha_mongo = timezone.now()
+        except Exception as e:
+            logger.error(f"Error al calcular las estadísticas de MongoDB: {e}")
+            stats_mongo = (anterior.datos.get("mongodb") if anterior else None) or \
+                ClienteInfoService._formatear_estadisticas(None)
+            fecha_mongo = anterior.fecha_mongo if anterior else None
+
+        return {
+            "postgresql": {
+                "total_clientes": total_clientes,
+                "total_pedidos": total_pedidos,
+                "total_productos": Producto.objects.count(),
+                "total_ventas": float(total_ventas),
+                "promedio_venta": float(total_ventas / total_pedidos) if total_pedidos > 0 else 0
+            },
+            "mongodb": stats_mongo,
+            "integracion": {
+                "clientes_con_info_completa": stats_mongo["total_clientes"],
+                "porcentaje_cobertura": (stats_mongo["total_clientes"] / total_clientes * 100) if total_clientes > 0 else 0
+            },
+            "pedidos_hoy": self.pedidos_hoy().count(),
+            "productos_mas_vendidos": list(
+                Producto.objects.filter(unidades_vendidas__gt=0)
+                .order_by('-unidades_vendidas', 'id_producto')
+                .values('id_producto', 'nombre', 'unidades_vendidas')[:TOP_PANEL]
+            ),
+            "clientes_mas_activos": list(
+                Cliente.objects.filter(num_pedidos__gt=0)
+                .order_by('-num_pedidos', 'id_cliente')
+                .values('id_cliente', 'nombre', 'num_pedidos')[:TOP_PANEL]
+            ),
+        }, fecha_mongo
+
+    def refrescar(self, esperar: bool = True) -> Optional[EstadisticasSnapshot]:
+        """
+        Recalcula y guarda el snapshot
+
+        Args:
+            esperar: Si otro proceso está recalculando, esperar a que termine
+                (True) o no hacer nada (False)
+
+        Returns:
+            EstadisticasSnapshot: El snapshot guardado, o None si no se esperó
+        """
+        solicitado = timezone.now()
+        # Dentro de la transacción del bloqueo la réplica ya no se elegiría
+        alias = replica_lecturas.alias()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if esperar:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [CLAVE_BLOQUEO_ESTADISTICAS])
+                else:
+                    cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [CLAVE_BLOQUEO_ESTADISTICAS])
+                    if not cursor.fetchone()[0]:
+                        return None
+
+            anterior = EstadisticasSnapshot.objects.filter(pk=1).first()
+            # Otro proceso lo recalculó mientras se esperaba el bloqueo
+            if anterior and anterior.fecha_calculo >= solicitado:
+                return anterior
+
+            with replica_lecturas.lecturas(alias):
+                datos, fecha_mongo = self.calcular(anterior)
+            snapshot, _ = EstadisticasSnapshot.objects.update_or_create(
+                pk=1,
+                defaults={"datos": datos, "fecha_calculo": timezone.now(), "fecha_mongo": fecha_mongo}
+            )
+            return snapshot
+
+    def obtener(self, max_antiguedad: Optional[float] = None) -> EstadisticasSnapshot:
+        """
+        Devuelve el snapshot, recalculándolo antes si es más antiguo que el límite
+
+        Mientras otro proceso lo recalcula se devuelve el anterior, para que
+        varias lecturas a la vez no lo recalculen todas.
+
+        Args:
+            max_antiguedad: Segundos de antigüedad aceptados (por defecto
+                ESTADISTICAS_MAX_ANTIGUEDAD)
+        """
+        if max_antiguedad is None:
+            max_antiguedad = settings.ESTADISTICAS_MAX_ANTIGUEDAD
+        snapshot = EstadisticasSnapshot.objects.filter(pk=1).first()
+        if snapshot and (timezone.now() - snapshot.fecha_calculo).total_seconds() <= max_antiguedad:
+            return snapshot
+        return self.refrescar(esperar=snapshot is None) or snapshot
+
+    @staticmethod
+    def recalcular_unidades_vendidas() -> int:
+        """
+        Recalcula `Producto.unidades_vendidas` desde 'detalle_pedido' (más las
+        unidades de los pedidos archivados) y corrige los productos desviados
+
+        Returns:
+            int: Productos corregidos
+        """
+        reales = Coalesce(
+            models.Subquery(
+                DetallePedido.objects.filter(id_producto=models.OuterRef('pk')).order_by()
+                .values('id_producto').annotate(u=models.Sum('cantidad')).values('u')
+            ),
+            0
+        ) + Coalesce(
+            models.Subquery(UnidadesArchivadas.objects.filter(id_producto=models.OuterRef('pk')).values('unidades')),
+            0
+        )
+        with transaction.atomic():
+            desviados = list(
+                Producto.objects.annotate(reales=reales)
+                .exclude(unidades_vendidas=models.F('reales'))
+                .select_for_update(of=('self',))
+                .order_by('id_producto')
+                .values_list('id_producto', flat=True)
+            )
+            if desviados:
+                Producto.objects.filter(id_producto__in=desviados).update(unidades_vendidas=reales)
+        return len(desviados)
+
+
+# Instancia global usada por EstadisticasService y el panel
+snapshot_estadisticas = SnapshotEstadisticas()
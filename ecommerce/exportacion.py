@@ -0,0 +1,200 @@
+"""
+Exportaciones en streaming de clientes y pedidos
+
+Las filas se leen de PostgreSQL con un cursor del lado del servidor
+(QuerySet.iterator) y se completan con MongoDB una vez por bloque, de modo
+que la memoria no depende del número de filas exportadas y los primeros
+bytes salen en cuanto se procesa el primer bloque.
+
+Con una réplica de lectura (`ecommerce.replica`), las filas se leen de ella.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .integration_service import ClienteIntegrationService, PedidoIntegrationService
+from .replica import replica_lecturas
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATO_JSON = 'json'
+FORMATO_NDJSON = 'ndjson'
+FORMATO_CSV = 'csv'
+
+TIPOS_CONTENIDO = {
+    FORMATO_JSON: 'application/json',
+    FORMATO_NDJSON: 'application/x-ndjson',
+    FORMATO_CSV: 'text/csv; charset=utf-8',
+}
+
+COLUMNAS_CLIENTES = [
+    'id_cliente', 'nombre', 'email', 'telefono', 'fecha_registro', 'total_pedidos',
+    'total_gastado', 'comentarios', 'preferencias', 'ultima_actualizacion_mongo',
+]
+
+COLUMNAS_PEDIDOS = [
+    'id_pedido', 'cliente', 'fecha_pedido', 'total', 'estado',
+    'direccion_envio', 'metodo_pago', 'detalles',
+]
+
+
+def iterar_bloques(queryset, tamano_bloque: int) -> Iterator[List[Any]]:
+    """
+    Recorre un QuerySet con un cursor del lado del servidor, en listas de
+    `tamano_bloque` objetos
+    """
+    iterador = queryset.iterator(chunk_size=tamano_bloque)
+    while True:
+        bloque = list(islice(iterador, tamano_bloque))
+        if not bloque:
+            return
+        yield bloque
+
+
+def bloques_clientes(queryset, tamano_bloque: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Clientes completos por bloques: una consulta $in a MongoDB por bloque"""
+    tamano_bloque = tamano_bloque or settings.EXPORTACION_TAMANO_BLOQUE
+    queryset = queryset.using(replica_lecturas.alias())
+    for bloque in iterar_bloques(queryset, tamano_bloque):
+        yield ClienteIntegrationService.combinar_clientes(bloque)
+
+
+def bloques_pedidos(queryset, tamano_bloque: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+    """Pedidos completos por bloques, con detalles precargados por bloque"""
+    tamano_bloque = tamano_bloque or settings.EXPORTACION_TAMANO_BLOQUE
+    # Los detalles precargados se leen de la misma base que los pedidos
+    queryset = (
+        queryset.using(replica_lecturas.alias())
+        .select_related('id_cliente').prefetch_related('detalles__id_producto')
+    )
+    for bloque in iterar_bloques(queryset, tamano_bloque):
+        yield PedidoIntegrationService.combinar_pedidos(bloque)
+
+
+def _json(valor: Any) -> str:
+    return json.dumps(valor, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def _celda_csv(valor: Any) -> Any:
+    """Los valores anidados (listas, diccionarios) van como JSON dentro de la celda"""
+    if valor is None:
+        return ''
+    if isinstance(valor, (dict, list)):
+        return _json(valor)
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return valor
+
+
+def serializar_json(bloques: Iterable[List[Dict[str, Any]]]) -> Iterator[str]:
+    """Un arreglo JSON, emitido bloque a bloque"""
+    yield '['
+    separador = ''
+    for bloque in bloques:
+        if bloque:
+            yield separador + ','.join(_json(fila) for fila in bloque)
+            separador = ','
+    yield ']'
+
+
+def serializar_ndjson(bloques: Iterable[List[Dict[str, Any]]]) -> Iterator[str]:
+    """Un objeto JSON por línea"""
+    for bloque in bloques:
+        yield ''.join(_json(fila) + '\n' for fila in bloque)
+
+
+def serializar_csv(bloques: Iterable[List[Dict[str, Any]]], columnas: List[str]) -> Iterator[str]:
+    """CSV con cabecera fija, reutilizando un único buffer"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(columnas)
+    yield buffer.getvalue()
+    for bloque in bloques:
+        buffer.seek(0)
+        buffer.truncate()
+        for fila in bloque:
+            escritor.writerow([_celda_csv(fila.get(columna)) for columna in columnas])
+        yield buffer.getvalue()
+
+
+def comprimir_gzip(partes: Iterable[str]) -> Iterator[bytes]:
+    """
+    Comprime el flujo en gzip, vaciando el compresor tras cada parte para que
+    el cliente reciba datos bloque a bloque
+    """
+    compresor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for parte in partes:
+        datos = compresor.compress(parte.encode('utf-8')) + compresor.flush(zlib.Z_SYNC_FLUSH)
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+
+def _registrar_errores(partes: Iterable[Any], nombre: str) -> Iterator[Any]:
+    """
+    Los errores a mitad de la exportación ya no pueden cambiar el código de
+    estado: se registran y se corta la conexión para que el fichero no
+    parezca completo
+    """
+    try:
+        yield from partes
+    except Exception as e:
+        logger.error(f"Error en la exportación {nombre}: {e}")
+        raise
+
+
+def respuesta_exportacion(
+    bloques: Iterable[List[Dict[str, Any]]],
+    nombre: str,
+    formato: str = FORMATO_JSON,
+    columnas: Optional[List[str]] = None,
+    comprimir: Optional[bool] = None
+) -> StreamingHttpResponse:
+    """
+    Construye la descarga en streaming de una exportación
+
+    Args:
+        bloques: Iterable de listas de filas (ver `bloques_clientes` y `bloques_pedidos`)
+        nombre: Prefijo del nombre del fichero
+        formato: 'json', 'ndjson' o 'csv'
+        columnas: Columnas del CSV (obligatorias con formato 'csv')
+        comprimir: Comprime en gzip (por defecto EXPORTACION_GZIP)
+
+    Returns:
+        StreamingHttpResponse: Respuesta con el fichero como adjunto
+    """
+    if formato not in TIPOS_CONTENIDO:
+        raise ValueError(f"Formato de exportación no soportado: {formato}")
+    if comprimir is None:
+        comprimir = settings.EXPORTACION_GZIP
+
+    if formato == FORMATO_CSV:
+        partes = serializar_csv(bloques, columnas)
+    elif formato == FORMATO_NDJSON:
+        partes = serializar_ndjson(bloques)
+    else:
+        partes = serializar_json(bloques)
+
+    nombre_fichero = f"{nombre}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    if comprimir:
+        response = StreamingHttpResponse(
+            _registrar_errores(comprimir_gzip(partes), nombre), content_type='application/gzip'
+        )
+        nombre_fichero += '.gz'
+    else:
+        response = StreamingHttpResponse(
+            _registrar_errores(partes, nombre), content_type=TIPOS_CONTENIDO[formato]
+        )
+    response['Content-Disposition'] = f'attachment; filename="{nombre_fichero}"'
+    return response
@@ -0,0 +1,229 @@
+"""
+Ingesta asíncrona de comentarios por lotes
+
+Los comentarios se encolan en memoria y un hilo en segundo plano los escribe
+en MongoDB con bulk_write de upserts no ordenados, cuando el lote alcanza
+su tamaño o cuando vence el intervalo de vaciado. Pensado para ráfagas
+(p. ej. importaciones tras una campaña), donde un viaje a MongoDB por
+comentario en el hilo de la petición es el cuello de botella.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from .mongodb_services import ClienteInfoService, cliente_info_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ColaLlenaError(Exception):
+    """La cola de ingesta siguió llena durante todo el tiempo de espera"""
+
+
+class IngestaComentarios:
+    """
+    Cola de comentarios con vaciado por tamaño o por tiempo hacia MongoDB
+    """
+
+    def __init__(
+        self,
+        service: Optional[ClienteInfoService] = None,
+        tamano_lote: Optional[int] = None,
+        intervalo: Optional[float] = None,
+        capacidad: Optional[int] = None,
+        espera_maxima: Optional[float] = None
+    ):
+        """
+        Args:
+            service: Servicio usado para escribir (por defecto el global)
+            tamano_lote: Comentarios por bulk_write (MONGO_INGESTA_TAMANO_LOTE)
+            intervalo: Segundos máximos que un comentario espera en la cola (MONGO_INGESTA_INTERVALO)
+            capacidad: Tamaño máximo de la cola (MONGO_INGESTA_CAPACIDAD)
+            espera_maxima: Segundos que `encolar` espera si la cola está llena (MONGO_INGESTA_ESPERA_MAXIMA)
+        """
+        self.service = service or cliente_info_service
+        self.tamano_lote = tamano_lote or getattr(settings, 'MONGO_INGESTA_TAMANO_LOTE', 500)
+        self.intervalo = intervalo or getattr(settings, 'MONGO_INGESTA_INTERVALO', 1.0)
+        self.capacidad = capacidad or getattr(settings, 'MONGO_INGESTA_CAPACIDAD', 10000)
+        self.espera_maxima = espera_maxima if espera_maxima is not None else getattr(
+            settings, 'MONGO_INGESTA_ESPERA_MAXIMA', 5.0
+        )
+
+        self._lock = threading.Lock()
+        self._iniciar_estado()
+
+    def _iniciar_estado(self):
+        """Cola, hilo y contadores propios del proceso actual"""
+        self._cola: queue.Queue = queue.Queue(maxsize=self.capacidad)
+        self._hilo: Optional[threading.Thread] = None
+        self._detener = threading.Event()
+        self._pid = os.getpid()
+        self._contadores = {
+            "encolados": 0,
+            "escritos": 0,
+            "fallidos": 0,
+            "rechazados": 0,
+            "lotes": 0,
+        }
+        self._inicio: Optional[float] = None
+        self._segundos_escribiendo = 0.0
+
+    def _asegurar_hilo(self):
+        """Arranca el hilo de vaciado en el primer uso dentro de cada proceso"""
+        if self._hilo is not None and self._hilo.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Un proceso hijo hereda la cola pero no el hilo que la vacía
+                self._iniciar_estado()
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._inicio = time.monotonic()
+                self._hilo = threading.Thread(
+                    target=self._bucle, name='ingesta-comentarios', daemon=True
+                )
+                self._hilo.start()
+
+    def encolar(self, id_cliente: int, texto: str, bloquear: bool = True) -> bool:
+        """
+        Encola un comentario para escribirlo en el siguiente lote
+
+        Si la cola está llena, espera hasta `espera_maxima` segundos a que el
+        hilo de vaciado libere espacio (contrapresión sobre el productor).
+
+        Args:
+            id_cliente: ID del cliente en PostgreSQL
+            texto: Texto del comentario
+            bloquear: Si es False, no espera cuando la cola está llena
+
+        Returns:
+            bool: True si se encoló, False si la cola siguió llena
+        """
+        self._asegurar_hilo()
+        comentario = {"texto": texto, "fecha": datetime.utcnow()}
+        try:
+            self._cola.put((id_cliente, comentario), block=bloquear, timeout=self.espera_maxima)
+        except queue.Full:
+            with self._lock:
+                self._contadores["rechazados"] += 1
+            logger.warning(f"Cola de ingesta llena; comentario rechazado para cliente {id_cliente}")
+            return False
+        with self._lock:
+            self._contadores["encolados"] += 1
+        return True
+
+    def encolar_o_fallar(self, id_cliente: int, texto: str):
+        """Como `encolar`, pero lanza ColaLlenaError si la cola sigue llena"""
+        if not self.encolar(id_cliente, texto):
+            raise ColaLlenaError(f"Cola de ingesta llena ({self.capacidad} comentarios)")
+
+    def _bucle(self):
+        """Hilo de vaciado: junta lotes por tamaño o por tiempo y los escribe"""
+        lote: List = []
+        limite = time.monotonic() + self.intervalo
+        while True:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self._cola.get(timeout=max(restante, 0.01)))
+            except queue.Empty:
+                pass
+
+            if len(lote) >= self.tamano_lote or time.monotonic() >= limite:
+                if lote:
+                    self._escribir(lote)
+                    lote = []
+                limite = time.monotonic() + self.intervalo
+
+            if self._detener.is_set() and self._cola.empty():
+                if lote:
+                    self._escribir(lote)
+                return
+
+    def _escribir(self, lote: List):
+        """Escribe un lote agrupando los comentarios por cliente"""
+        comentarios_por_cliente: Dict[int, List[Dict[str, Any]]] = {}
+        for id_cliente, comentario in lote:
+            comentarios_por_cliente.setdefault(id_cliente, []).append(comentario)
+
+        inicio = time.monotonic()
+        escritos = self.service.agregar_comentarios_bulk(comentarios_por_cliente)
+        duracion = time.monotonic() - inicio
+
+        with self._lock:
+            self._contadores["lotes"] += 1
+            self._contadores["escritos"] += escritos
+            self._contadores["fallidos"] += len(lote) - escritos
+            self._segundos_escribiendo += duracion
+        for _ in lote:
+            self._cola.task_done()
+
+    def vaciar(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a que se escriban todos los comentarios encolados hasta ahora
+
+        Returns:
+            bool: True si la cola quedó vacía dentro del tiempo indicado
+        """
+        if self._hilo is None or self._pid != os.getpid():
+            return True
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self._cola.unfinished_tasks:
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def detener(self, timeout: Optional[float] = 30.0) -> bool:
+        """
+        Detiene el hilo de vaciado después de escribir lo pendiente
+
+        Returns:
+            bool: True si todo lo encolado quedó escrito
+        """
+        if self._hilo is None or self._pid != os.getpid():
+            return True
+        self._detener.set()
+        self._hilo.join(timeout)
+        terminado = not self._hilo.is_alive()
+        if not terminado:
+            logger.error(f"La ingesta de comentarios no terminó en {timeout}s; quedan {self._cola.qsize()} en cola")
+        return terminado
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """
+        Contadores de la ingesta
+
+        Returns:
+            Dict: encolados, escritos, fallidos, rechazados, lotes, profundidad
+            de la cola y rendimiento (comentarios escritos por segundo, total
+            desde el arranque y durante la escritura)
+        """
+        with self._lock:
+            datos = dict(self._contadores)
+            segundos_escribiendo = self._segundos_escribiendo
+            inicio = self._inicio
+        transcurrido = time.monotonic() - inicio if inicio is not None else 0.0
+        datos.update({
+            "profundidad": self._cola.qsize(),
+            "capacidad": self.capacidad,
+            "comentarios_por_segundo": datos["escritos"] / transcurrido if transcurrido > 0 else 0.0,
+            "comentarios_por_segundo_escribiendo": (
+                datos["escritos"] / segundos_escribiendo if segundos_escribiendo > 0 else 0.0
+            ),
+        })
+        return datos
+
+
+# Instancia global de la ingesta (el hilo arranca con el primer comentario)
+ingesta_comentarios = IngestaComentarios()
+
+# Escribe lo pendiente al terminar el proceso
+atexit.register(ingesta_comentarios.detener)
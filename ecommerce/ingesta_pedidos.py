@@ -0,0 +1,355 @@
+"""
+Ingesta masiva de pedidos con COPY de PostgreSQL
+
+Los pedidos se vuelcan en streaming a una tabla temporal con COPY (una fila
+por línea de pedido) y desde ahí se validan, se calculan sus totales y se
+insertan en 'pedidos' y 'detalle_pedido' (y se suman a los totales de
+'clientes') con sentencias sobre conjuntos, sin ida y vuelta por pedido.
+Las preferencias de método de pago pasan por `escrituras_mongo`: con el
+outbox se registran en la misma transacción y, sin él, se actualizan después
+en MongoDB con un solo bulk_write.
+"""
+
+import csv
+import io
+import time
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache_clientes import cache_clientes
+from .outbox import escrituras_mongo
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Una fila por línea de pedido; los pedidos sin productos llevan una fila sin producto
+SQL_CREAR_LINEAS = """
+    CREATE TEMP TABLE ingesta_lineas (
+        seq integer NOT NULL,
+        id_cliente integer,
+        direccion_envio text,
+        metodo_pago text,
+        id_producto integer,
+        cantidad integer,
+        precio_unitario numeric(10, 2)
+    ) ON COMMIT DROP
+"""
+
+SQL_COPY_LINEAS = """
+    COPY ingesta_lineas (seq, id_cliente, direccion_envio, metodo_pago, id_producto, cantidad, precio_unitario)
+    FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (direccion_envio, metodo_pago))
+"""
+
+# Pedidos rechazados y el primer motivo encontrado
+SQL_RECHAZOS = """
+    CREATE TEMP TABLE ingesta_rechazos ON COMMIT DROP AS
+    SELECT seq, min(motivo) AS motivo FROM (
+        SELECT l.seq, 'cliente inexistente' AS motivo
+        FROM ingesta_lineas l LEFT JOIN clientes c ON c.id_cliente = l.id_cliente
+        WHERE c.id_cliente IS NULL
+        UNION ALL
+        SELECT l.seq, 'producto inexistente'
+        FROM ingesta_lineas l LEFT JOIN productos p ON p.id_producto = l.id_producto
+        WHERE l.id_producto IS NOT NULL AND p.id_producto IS NULL
+        UNION ALL
+        SELECT l.seq, 'cantidad inválida'
+        FROM ingesta_lineas l
+        WHERE l.id_producto IS NOT NULL AND (l.cantidad IS NULL OR l.cantidad < 1)
+        UNION ALL
+        SELECT l.seq, 'precio distinto del catálogo'
+        FROM ingesta_lineas l JOIN productos p ON p.id_producto = l.id_producto
+        WHERE l.precio_unitario IS NOT NULL AND l.precio_unitario <> p.precio
+        UNION ALL
+        SELECT seq, 'producto repetido'
+        FROM ingesta_lineas
+        WHERE id_producto IS NOT NULL
+        GROUP BY seq, id_producto HAVING count(*) > 1
+    ) motivos
+    GROUP BY seq
+"""
+
+# Pedidos válidos con su total y su id ya reservado en la secuencia
+SQL_PEDIDOS = """
+    CREATE TEMP TABLE ingesta_pedidos ON COMMIT DROP AS
+    SELECT nextval(pg_get_serial_sequence('pedidos', 'id_pedido')) AS id_pedido, validos.*
+    FROM (
+        SELECT l.seq, min(l.id_cliente) AS id_cliente,
+               min(l.direccion_envio) AS direccion_envio, min(l.metodo_pago) AS metodo_pago,
+               coalesce(sum(p.precio * l.cantidad), 0) AS total
+        FROM ingesta_lineas l LEFT JOIN productos p ON p.id_producto = l.id_producto
+        WHERE NOT EXISTS (SELECT 1 FROM ingesta_rechazos r WHERE r.seq = l.seq)
+        GROUP BY l.seq
+        ORDER BY l.seq
+    ) validos
+"""
+
+SQL_INSERTAR_PEDIDOS = """
+    INSERT INTO pedidos (id_pedido, id_cliente_id, fecha_pedido, total, estado, direccion_envio, metodo_pago)
+    SELECT id_pedido, id_cliente, %s, total, 'pendiente', direccion_envio, metodo_pago
+    FROM ingesta_pedidos
+    ORDER BY id_pedido
+"""
+
+SQL_INSERTAR_DETALLES = """
+    INSERT INTO detalle_pedido (
+        id_pedido_id, id_producto_id, cantidad, precio_unitario, subtotal, fecha_pedido, cantidad_reservada
+    )
+    SELECT i.id_pedido, l.id_producto, l.cantidad, p.precio, p.precio * l.cantidad, %s, l.cantidad
+    FROM ingesta_lineas l
+    JOIN ingesta_pedidos i ON i.seq = l.seq
+    JOIN productos p ON p.id_producto = l.id_producto
+    ORDER BY i.id_pedido, l.id_producto
+"""
+
+# Mismas diferencias que aplica Pedido.save, una vez por cliente del lote y en orden de id
+SQL_TOTALES_CLIENTES = """
+    UPDATE clientes c
+    SET num_pedidos = c.num_pedidos + t.pedidos, total_gastado = c.total_gastado + t.total
+    FROM (
+        SELECT c.id_cliente, t.pedidos, t.total
+        FROM clientes c
+        JOIN (
+            SELECT id_cliente, count(*) AS pedidos, sum(total) AS total
+            FROM ingesta_pedidos GROUP BY id_cliente
+        ) t ON t.id_cliente = c.id_cliente
+        ORDER BY c.id_cliente
+        FOR UPDATE OF c
+    ) t
+    WHERE c.id_cliente = t.id_cliente
+"""
+
+# Clientes y productos del lote que pueden recibir pedidos, bloqueados en el
+# mismo orden que crear_pedido (el cliente y después los productos por id)
+# para no interbloquear con él; desde aquí el stock leído no cambia hasta el commit
+SQL_BLOQUEAR_CLIENTES = """
+    SELECT c.id_cliente FROM clientes c
+    WHERE c.id_cliente IN (
+        SELECT l.id_cliente FROM ingesta_lineas l
+        WHERE NOT EXISTS (SELECT 1 FROM ingesta_rechazos r WHERE r.seq = l.seq)
+    )
+    ORDER BY c.id_cliente
+    FOR UPDATE OF c
+"""
+
+SQL_BLOQUEAR_PRODUCTOS = """
+    SELECT p.id_producto FROM productos p
+    WHERE p.id_producto IN (
+        SELECT l.id_producto FROM ingesta_lineas l
+        WHERE NOT EXISTS (SELECT 1 FROM ingesta_rechazos r WHERE r.seq = l.seq)
+    )
+    ORDER BY p.id_producto
+    FOR UPDATE OF p
+"""
+
+# Líneas de los productos cuya demanda en el lote pasa de su stock, con ese
+# stock, en el orden de entrada; los demás productos alcanzan para todos sus
+# pedidos y no hace falta repartirlos (ver `IngestaPedidos._asignar_stock`)
+SQL_LINEAS_ESCASAS = """
+    WITH candidatas AS (
+        SELECT l.seq, l.id_producto, l.cantidad FROM ingesta_lineas l
+        WHERE l.id_producto IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM ingesta_rechazos r WHERE r.seq = l.seq)
+    ), escasos AS (
+        SELECT c.id_producto, p.stock
+        FROM candidatas c JOIN productos p ON p.id_producto = c.id_producto
+        GROUP BY c.id_producto, p.stock
+        HAVING sum(c.cantidad) > p.stock
+    )
+    SELECT c.seq, c.id_producto, c.cantidad, e.stock
+    FROM candidatas c JOIN escasos e ON e.id_producto = c.id_producto
+    ORDER BY c.seq, c.id_producto
+"""
+
+SQL_RECHAZOS_STOCK = """
+    INSERT INTO ingesta_rechazos (seq, motivo)
+    SELECT unnest(%s::integer[]), 'stock insuficiente'
+"""
+
+# Descuenta el stock de los pedidos creados (ya comprobado con los productos
+# bloqueados) y suma las unidades vendidas
+SQL_RESERVAR_STOCK = """
+    UPDATE productos p SET stock = p.stock - d.cantidad, unidades_vendidas = p.unidades_vendidas + d.cantidad
+    FROM (
+        SELECT l.id_producto, sum(l.cantidad) AS cantidad
+        FROM ingesta_lineas l JOIN ingesta_pedidos i ON i.seq = l.seq
+        WHERE l.id_producto IS NOT NULL
+        GROUP BY l.id_producto
+    ) d
+    WHERE p.id_producto = d.id_producto
+"""
+
+# Último método de pago de cada cliente, en el orden de entrada
+SQL_METODOS_PAGO = """
+    SELECT DISTINCT ON (id_cliente) id_cliente, metodo_pago
+    FROM ingesta_pedidos
+    ORDER BY id_cliente, seq DESC
+"""
+
+
+class LectorCSV(io.RawIOBase):
+    """
+    Archivo de solo lectura que genera el CSV a medida que COPY lo consume,
+    para no tener el lote entero en memoria
+    """
+
+    def __init__(self, partes: Iterator[str]):
+        self._partes = partes
+        self._pendiente = b''
+        self._posicion = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        disponibles = len(self._pendiente) - self._posicion
+        if disponibles <= 0:
+            parte = next(self._partes, None)
+            if parte is None:
+                return b''
+            self._pendiente, self._posicion = parte.encode('utf-8'), 0
+            disponibles = len(self._pendiente)
+        if size < 0 or size > disponibles:
+            size = disponibles
+        datos = self._pendiente[self._posicion:self._posicion + size]
+        self._posicion += size
+        return datos
+
+
+class IngestaPedidos:
+    """
+    Carga de un lote de pedidos en una sola transacción
+    """
+
+    def __init__(self, filas_por_parte: int = 1000):
+        """
+        Args:
+            filas_por_parte: Filas de CSV generadas de una vez para COPY
+        """
+        self.filas_por_parte = filas_por_parte
+
+    def _partes_csv(self, pedidos: Iterable[Dict[str, Any]], contador: Dict[str, int]) -> Iterator[str]:
+        """Convierte los pedidos en CSV para la tabla ingesta_lineas"""
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        filas = 0
+        for seq, pedido in enumerate(pedidos):
+            contador["recibidos"] = seq + 1
+            cabecera = [seq, pedido['id_cliente'], pedido['direccion_envio'], pedido['metodo_pago']]
+            productos = pedido.get('productos') or [{}]
+            for linea in productos:
+                escritor.writerow(cabecera + [
+                    linea.get('id_producto'), linea.get('cantidad'), linea.get('precio_unitario')
+                ])
+                filas += 1
+            if filas >= self.filas_por_parte:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                filas = 0
+        yield buffer.getvalue()
+
+    @staticmethod
+    def _asignar_stock(lineas: Iterable[Tuple[int, int, int, int]]) -> List[int]:
+        """
+        Reparte el stock de los productos escasos en el orden de entrada: un
+        pedido se acepta si todas sus líneas caben en lo que queda, y solo
+        entonces descuenta sus cantidades
+
+        Args:
+            lineas: (seq, id_producto, cantidad, stock) ordenadas por seq
+
+        Returns:
+            List[int]: seq de los pedidos rechazados por falta de stock
+        """
+        restante: Dict[int, int] = {}
+        rechazados = []
+        for seq, grupo in groupby(lineas, key=itemgetter(0)):
+            grupo = list(grupo)
+            if all(restante.setdefault(id_producto, stock) >= cantidad for _, id_producto, cantidad, stock in grupo):
+                for _, id_producto, cantidad, _ in grupo:
+                    restante[id_producto] -= cantidad
+            else:
+                rechazados.append(seq)
+        return rechazados
+
+    def cargar(self, pedidos: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Crea todos los pedidos válidos del lote
+
+        Los pedidos con cliente o producto inexistente, cantidad menor que 1,
+        precio distinto del de catálogo, un producto repetido o sin stock
+        para ellos (ver `_asignar_stock`) se rechazan y el resto se crea.
+
+        Args:
+            pedidos: Iterable de pedidos con 'id_cliente', 'productos'
+                (id_producto, cantidad y opcionalmente precio_unitario),
+                'direccion_envio' y 'metodo_pago'
+
+        Returns:
+            Dict: recibidos, creados, rechazados (índice en la entrada y
+            motivo), preferencias actualizadas, segundos y pedidos por segundo;
+            vacío si el lote entero falló
+        """
+        inicio = time.perf_counter()
+        contador = {"recibidos": 0}
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(SQL_CREAR_LINEAS)
+                    cursor.copy_expert(SQL_COPY_LINEAS, LectorCSV(self._partes_csv(pedidos, contador)))
+                    cursor.execute("ANALYZE ingesta_lineas")
+
+                    cursor.execute(SQL_RECHAZOS)
+                    cursor.execute(SQL_BLOQUEAR_CLIENTES)
+                    cursor.execute(SQL_BLOQUEAR_PRODUCTOS)
+                    cursor.execute(SQL_LINEAS_ESCASAS)
+                    sin_stock = self._asignar_stock(cursor.fetchall())
+                    if sin_stock:
+                        cursor.execute(SQL_RECHAZOS_STOCK, [sin_stock])
+                    cursor.execute("SELECT seq, motivo FROM ingesta_rechazos ORDER BY seq")
+                    rechazados = [{"indice": seq, "motivo": motivo} for seq, motivo in cursor.fetchall()]
+
+                    cursor.execute(SQL_PEDIDOS)
+                    fecha_pedido = timezone.now()
+                    cursor.execute(SQL_INSERTAR_PEDIDOS, [fecha_pedido])
+                    creados = cursor.rowcount
+                    cursor.execute(SQL_INSERTAR_DETALLES, [fecha_pedido])
+                    cursor.execute(SQL_TOTALES_CLIENTES)
+                    cursor.execute(SQL_RESERVAR_STOCK)
+
+                    cursor.execute(SQL_METODOS_PAGO)
+                    preferencias = {
+                        id_cliente: {"metodo_pago": metodo_pago} for id_cliente, metodo_pago in cursor.fetchall()
+                    }
+
+                    # ON COMMIT DROP no basta si el lote corre dentro de una transacción más amplia
+                    cursor.execute("DROP TABLE ingesta_lineas, ingesta_rechazos, ingesta_pedidos")
+
+                if escrituras_mongo.usa_outbox:
+                    # Eventos del outbox en la misma transacción que los pedidos
+                    preferencias_actualizadas = escrituras_mongo.actualizar_preferencias_bulk(preferencias)
+
+        except Exception as e:
+            logger.error(f"Error al cargar lote de {contador['recibidos']} pedidos: {e}")
+            return {}
+
+        # Los totales de los clientes cambiaron por SQL, sin pasar por Pedido.save
+        cache_clientes.invalidar(preferencias)
+
+        if not escrituras_mongo.usa_outbox:
+            # Tras el commit, para no guardar preferencias de pedidos revertidos
+            preferencias_actualizadas = escrituras_mongo.actualizar_preferencias_bulk(preferencias)
+
+        segundos = time.perf_counter() - inicio
+        return {
+            "recibidos": contador["recibidos"],
+            "creados": creados,
+            "rechazados": rechazados,
+            "preferencias_actualizadas": preferencias_actualizadas,
+            "segundos": segundos,
+            "pedidos_por_segundo": creados / segundos if segundos > 0 else 0.0,
+        }
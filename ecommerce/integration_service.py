@@ -3,10 +3,19 @@ Servicio de integración entre PostgreSQL y MongoDB
 Combina datos estructurados y no estructurados para ofrecer una vista completa
 """
 
-from typing import Dict, List, Optional, Any
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Any
 from django.db import transaction, models
-from .models import Cliente, Pedido, Producto, DetallePedido
+from django.db.models.functions import Coalesce
+from .cache_clientes import Degradado, cache_clientes
+from .estadisticas import snapshot_estadisticas
+from .models import Cliente, Pedido, PedidoArchivado, Producto, DetallePedido
+from .ingesta_pedidos import IngestaPedidos
+from .inventario import InventarioService, StockInsuficienteError
+from .lecturas_paralelas import SIN_RESPUESTA_MONGO, lecturas_paralelas
 from .mongodb_services import cliente_info_service
+from .outbox import escrituras_mongo
+from .replica import replica_lecturas
 import logging
 
 logger = logging.getLogger(__name__)
@@ -45,17 +54,17 @@ class ClienteIntegrationService:
                     telefono=telefono
                 )
                 
-                # Crear documento en MongoDB
+                # Crear documento en MongoDB (o registrarlo en el outbox)
                 if preferencias:
-                    cliente_info_service.actualizar_preferencias(
+                    escrituras_mongo.actualizar_preferencias(
                         cliente.id_cliente, 
                         preferencias
                     )
                 else:
-                    cliente_info_service.crear_documento_cliente(cliente.id_cliente)
-                
-                # Obtener información completa
-                return ClienteIntegrationService.obtener_cliente_completo(cliente.id_cliente)
+                    escrituras_mongo.crear_documento_cliente(cliente.id_cliente)
+            
+            # Obtener información completa, ya fuera de la transacción
+            return ClienteIntegrationService.obtener_cliente_completo(cliente.id_cliente)
                 
         except Exception as e:
             logger.error(f"Error al crear cliente completo: {e}")
@@ -64,7 +73,8 @@ class ClienteIntegrationService:
     @staticmethod
     def obtener_cliente_completo(id_cliente: int) -> Optional[Dict[str, Any]]:
         """
-        Obtiene información completa de un cliente desde ambas bases de datos
+        Obtiene información completa de un cliente desde ambas bases de datos,
+        pasando por la caché de clientes (`ecommerce.cache_clientes`)
         
         Args:
             id_cliente: ID del cliente
@@ -73,52 +83,135 @@ class ClienteIntegrationService:
             Dict: Información completa del cliente o None si no existe
         """
         try:
-            # Obtener datos de PostgreSQL
-            cliente = Cliente.objects.filter(id_cliente=id_cliente).first()
-            if not cliente:
-                return None
-            
-            # Obtener datos de MongoDB
-            info_mongo = cliente_info_service.obtener_info_completa(id_cliente)
-            
-            # Combinar información
-            cliente_data = {
-                "id_cliente": cliente.id_cliente,
-                "nombre": cliente.nombre,
-                "email": cliente.email,
-                "telefono": cliente.telefono,
-                "fecha_registro": cliente.fecha_registro,
-                "total_pedidos": cliente.total_pedidos,
-                "total_gastado": float(cliente.total_gastado),
-                "comentarios": info_mongo.get("comentarios", []) if info_mongo else [],
-                "preferencias": info_mongo.get("preferencias", {}) if info_mongo else {},
-                "ultima_actualizacion_mongo": info_mongo.get("ultima_actualizacion") if info_mongo else None
-            }
-            
-            return cliente_data
+            return cache_clientes.obtener(
+                id_cliente, lambda: ClienteIntegrationService._cargar_cliente_completo(id_cliente)
+            )
             
         except Exception as e:
             logger.error(f"Error al obtener cliente completo {id_cliente}: {e}")
             return None
     
+    @staticmethod
+    def _cargar_cliente_completo(id_cliente: int) -> Optional[Dict[str, Any]]:
+        """
+        Lee el cliente de PostgreSQL y su documento de MongoDB, sin caché
+        (a la vez si LECTURAS_PARALELAS está activo)
+        
+        Si MongoDB no responde a tiempo o falla, la vista se devuelve sin sus
+        datos y envuelta en `Degradado`, para que la caché no la guarde.
+        """
+        cliente, info_mongo = lecturas_paralelas.ejecutar(
+            lambda: Cliente.objects.filter(id_cliente=id_cliente).first(),
+            lambda: cliente_info_service.obtener_info_completa(id_cliente, en_error=SIN_RESPUESTA_MONGO),
+            defecto_mongo=SIN_RESPUESTA_MONGO
+        )
+        if not cliente:
+            return None
+        
+        if info_mongo is SIN_RESPUESTA_MONGO:
+            return Degradado(ClienteIntegrationService.combinar_cliente(cliente, None))
+        
+        # Combinar información
+        return ClienteIntegrationService.combinar_cliente(cliente, info_mongo)
+    
+    @staticmethod
+    def combinar_cliente(cliente: Cliente, info_mongo: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Combina un cliente de PostgreSQL con su documento de MongoDB
+        
+        Args:
+            cliente: Cliente de PostgreSQL (con sus totales guardados)
+            info_mongo: Documento de MongoDB del cliente (o None si no existe)
+            
+        Returns:
+            Dict: Información completa del cliente
+        """
+        return {
+            "id_cliente": cliente.id_cliente,
+            "nombre": cliente.nombre,
+            "email": cliente.email,
+            "telefono": cliente.telefono,
+            "fecha_registro": cliente.fecha_registro,
+            "total_pedidos": cliente.num_pedidos,
+            "total_gastado": float(cliente.total_gastado),
+            "comentarios": info_mongo.get("comentarios", []) if info_mongo else [],
+            "preferencias": info_mongo.get("preferencias", {}) if info_mongo else {},
+            "ultima_actualizacion_mongo": info_mongo.get("ultima_actualizacion") if info_mongo else None
+        }
+    
+    @staticmethod
+    def combinar_clientes(clientes) -> List[Dict[str, Any]]:
+        """Combina varios clientes con una sola lectura por lotes en MongoDB"""
+        infos_mongo = cliente_info_service.obtener_info_bulk(
+            cliente.id_cliente for cliente in clientes
+        )
+        return [
+            ClienteIntegrationService.combinar_cliente(cliente, infos_mongo.get(cliente.id_cliente))
+            for cliente in clientes
+        ]
+    
+    @staticmethod
+    def obtener_clientes_completos(clientes) -> List[Dict[str, Any]]:
+        """
+        Obtiene información completa de varios clientes con una sola lectura
+        por lotes en MongoDB
+        
+        Args:
+            clientes: Iterable (o QuerySet) de clientes de PostgreSQL
+            
+        Returns:
+            List[Dict]: Lista con información completa de los clientes
+        """
+        return ClienteIntegrationService.combinar_clientes(list(clientes))
+    
+    @staticmethod
+    def iterar_clientes_completos(
+        queryset: Optional[models.QuerySet] = None,
+        tamano_bloque: int = 500
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Recorre clientes completos por bloques ordenados por id_cliente
+        
+        Cada bloque cuesta una consulta SQL y una lectura `$in` en MongoDB, y solo un bloque vive en
+        memoria a la vez. La paginación por clave (id_cliente > último visto)
+        evita el coste creciente de OFFSET. Con una réplica de lectura
+        (`ecommerce.replica`), los bloques se leen de ella.
+        
+        Args:
+            queryset: Clientes a recorrer (por defecto todos)
+            tamano_bloque: Clientes por bloque
+            
+        Yields:
+            Dict: Información completa de cada cliente
+        """
+        if queryset is None:
+            queryset = Cliente.objects.all()
+        queryset = queryset.using(replica_lecturas.alias()).order_by('id_cliente')
+        
+        ultimo_id = None
+        while True:
+            bloque_qs = queryset if ultimo_id is None else queryset.filter(id_cliente__gt=ultimo_id)
+            bloque = list(bloque_qs[:tamano_bloque])
+            if not bloque:
+                return
+            yield from ClienteIntegrationService.combinar_clientes(bloque)
+            if len(bloque) < tamano_bloque:
+                return
+            ultimo_id = bloque[-1].id_cliente
+    
     @staticmethod
     def obtener_todos_clientes_completos() -> List[Dict[str, Any]]:
         """
         Obtiene información completa de todos los clientes
         
+        Para recorrer muchos clientes sin cargarlos todos en memoria, use
+        `iterar_clientes_completos`.
+        
         Returns:
             List[Dict]: Lista con información completa de todos los clientes
         """
         try:
-            clientes = Cliente.objects.all()
-            clientes_completos = []
-            
-            for cliente in clientes:
-                cliente_completo = ClienteIntegrationService.obtener_cliente_completo(cliente.id_cliente)
-                if cliente_completo:
-                    clientes_completos.append(cliente_completo)
-            
-            return clientes_completos
+            return list(ClienteIntegrationService.iterar_clientes_completos())
             
         except Exception as e:
             logger.error(f"Error al obtener todos los clientes completos: {e}")
@@ -148,13 +241,14 @@ class ClienteIntegrationService:
                 # Actualizar datos en PostgreSQL
                 if datos_postgres:
                     Cliente.objects.filter(id_cliente=id_cliente).update(**datos_postgres)
+                    cache_clientes.invalidar([id_cliente])
                 
-                # Actualizar datos en MongoDB
+                # Actualizar datos en MongoDB (o registrarlos en el outbox)
                 if comentario:
-                    cliente_info_service.agregar_comentario(id_cliente, comentario)
+                    escrituras_mongo.agregar_comentario(id_cliente, comentario)
                 
                 if preferencias:
-                    cliente_info_service.actualizar_preferencias(id_cliente, preferencias)
+                    escrituras_mongo.actualizar_preferencias(id_cliente, preferencias)
                 
                 return True
                 
@@ -175,8 +269,9 @@ class ClienteIntegrationService:
         """
         try:
             with transaction.atomic():
-                # Eliminar de MongoDB primero
-                cliente_info_service.eliminar_cliente(id_cliente)
+                # Eliminar de MongoDB primero, junto con las escrituras del
+                # outbox que aún no se han aplicado y lo volverían a crear
+                escrituras_mongo.eliminar_cliente(id_cliente)
                 
                 # Eliminar de PostgreSQL
                 cliente = Cliente.objects.filter(id_cliente=id_cliente).first()
@@ -188,6 +283,67 @@ class ClienteIntegrationService:
         except Exception as e:
             logger.error(f"Error al eliminar cliente completo {id_cliente}: {e}")
             return False
+    
+    @staticmethod
+    def totales_reales() -> Dict[str, Any]:
+        """
+        Expresiones con el número de pedidos y el total gastado calculados
+        desde 'pedidos' y 'pedidos_archivo'
+        """
+        num_pedidos = []
+        total_gastado = []
+        for modelo in (Pedido, PedidoArchivado):
+            pedidos = modelo.objects.filter(id_cliente=models.OuterRef('pk')).order_by().values('id_cliente')
+            num_pedidos.append(Coalesce(models.Subquery(pedidos.annotate(n=models.Count('pk')).values('n')), 0))
+            total_gastado.append(Coalesce(
+                models.Subquery(pedidos.annotate(t=models.Sum('total')).values('t')),
+                Decimal('0.00'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2)
+            ))
+        return {
+            "num_pedidos": num_pedidos[0] + num_pedidos[1],
+            "total_gastado": total_gastado[0] + total_gastado[1],
+        }
+    
+    @staticmethod
+    def recalcular_totales(reparar: bool = True, tamano_bloque: int = 1000) -> Dict[str, Any]:
+        """
+        Compara num_pedidos y total_gastado de cada cliente con sus pedidos
+        y, si se pide, corrige los que se hayan desviado
+        
+        La corrección bloquea antes las filas de los clientes: un pedido
+        concurrente espera y suma su diferencia sobre el valor ya corregido.
+        
+        Args:
+            reparar: Si es False solo informa de los desvíos
+            tamano_bloque: Clientes corregidos por transacción
+            
+        Returns:
+            Dict: clientes revisados, ids desviados y clientes reparados
+        """
+        reales = ClienteIntegrationService.totales_reales()
+        desviados = list(
+            Cliente.objects.annotate(pedidos_reales=reales["num_pedidos"], gastado_real=reales["total_gastado"])
+            .exclude(num_pedidos=models.F('pedidos_reales'), total_gastado=models.F('gastado_real'))
+            .order_by('id_cliente')
+            .values_list('id_cliente', flat=True)
+        )
+        
+        reparados = 0
+        if reparar:
+            for inicio in range(0, len(desviados), tamano_bloque):
+                ids = desviados[inicio:inicio + tamano_bloque]
+                with transaction.atomic():
+                    list(Cliente.objects.select_for_update().filter(id_cliente__in=ids)
+                         .order_by('id_cliente').values_list('id_cliente', flat=True))
+                    reparados += Cliente.objects.filter(id_cliente__in=ids).update(**reales)
+                    cache_clientes.invalidar(ids)
+        
+        return {
+            "revisados": Cliente.objects.count(),
+            "desviados": desviados,
+            "reparados": reparados
+        }
 
 
 class PedidoIntegrationService:
@@ -195,6 +351,75 @@ class PedidoIntegrationService:
     Servicio para integrar datos de pedidos con información de clientes
     """
     
+    @staticmethod
+    def crear_pedido(
+        id_cliente: int,
+        productos: List[Dict[str, Any]],
+        direccion_envio: str,
+        metodo_pago: str
+    ) -> Pedido:
+        """
+        Crea un pedido y sus detalles en PostgreSQL con un número fijo de consultas
+        
+        Los productos se leen en una sola consulta, los subtotales y el total se
+        calculan en memoria y los detalles se insertan con bulk_create, de modo
+        que el total se escribe una vez (en el INSERT del pedido) en lugar de
+        recalcularse tras cada detalle. El stock se reserva con
+        `InventarioService.reservar`. Debe llamarse dentro de una transacción.
+        
+        Args:
+            id_cliente: ID del cliente
+            productos: Lista de productos con cantidad
+            direccion_envio: Dirección de envío
+            metodo_pago: Método de pago
+            
+        Returns:
+            Pedido: Pedido creado
+            
+        Raises:
+            Producto.DoesNotExist: Si algún producto no existe
+            StockInsuficienteError: Si algún producto no tiene stock suficiente
+        """
+        ids_producto = {int(producto_data['id_producto']) for producto_data in productos}
+        productos_por_id = Producto.objects.in_bulk(ids_producto)
+        faltantes = ids_producto - productos_por_id.keys()
+        if faltantes:
+            raise Producto.DoesNotExist(f"Productos inexistentes: {sorted(faltantes)}")
+        
+        detalles = []
+        total = Decimal('0.00')
+        for producto_data in productos:
+            producto = productos_por_id[int(producto_data['id_producto'])]
+            subtotal = producto.precio * producto_data['cantidad']
+            detalles.append(DetallePedido(
+                id_producto=producto,
+                cantidad=producto_data['cantidad'],
+                precio_unitario=producto.precio,
+                subtotal=subtotal,
+                cantidad_reservada=producto_data['cantidad']
+            ))
+            total += subtotal
+        
+        pedido = Pedido.objects.create(
+            id_cliente_id=id_cliente,
+            direccion_envio=direccion_envio,
+            metodo_pago=metodo_pago,
+            total=total
+        )
+        for detalle in detalles:
+            detalle.id_pedido = pedido
+            detalle.fecha_pedido = pedido.fecha_pedido
+        # bulk_create no llama a DetallePedido.save(), que sumaría al total la diferencia de cada detalle
+        DetallePedido.objects.bulk_create(detalles)
+        
+        # La reserva va al final: las filas de producto quedan bloqueadas solo
+        # desde su UPDATE hasta el commit, no durante los INSERT del pedido
+        InventarioService.reservar(InventarioService.agrupar_cantidades(
+            (int(producto_data['id_producto']), producto_data['cantidad']) for producto_data in productos
+        ))
+        
+        return pedido
+    
     @staticmethod
     def crear_pedido_completo(
         id_cliente: int,
@@ -216,41 +441,260 @@ class PedidoIntegrationService:
         """
         try:
             with transaction.atomic():
-                # Crear pedido
-                pedido = Pedido.objects.create(
-                    id_cliente_id=id_cliente,
-                    direccion_envio=direccion_envio,
-                    metodo_pago=metodo_pago
+                pedido = PedidoIntegrationService.crear_pedido(
+                    id_cliente, productos, direccion_envio, metodo_pago
                 )
                 
-                # Crear detalles del pedido
-                for producto_data in productos:
-                    producto = Producto.objects.get(id_producto=producto_data['id_producto'])
-                    DetallePedido.objects.create(
-                        id_pedido=pedido,
-                        id_producto=producto,
-                        cantidad=producto_data['cantidad']
-                    )
-                
-                # Recalcular total
-                pedido.calcular_total()
-                
-                # Actualizar preferencias de método de pago en MongoDB
-                cliente_info_service.actualizar_preferencias(
+                # Actualizar preferencias de método de pago en MongoDB (o registrarlas en el outbox)
+                escrituras_mongo.actualizar_preferencias(
                     id_cliente,
                     {"metodo_pago": metodo_pago}
                 )
+            
+            return PedidoIntegrationService.obtener_pedido_completo(pedido.id_pedido)
                 
-                return PedidoIntegrationService.obtener_pedido_completo(pedido.id_pedido)
-                
+        except StockInsuficienteError as e:
+            logger.warning(f"Pedido rechazado para cliente {id_cliente}: {e}")
+            return None
         except Exception as e:
             logger.error(f"Error al crear pedido completo: {e}")
             return None
     
+    @staticmethod
+    def crear_pedidos_bulk(pedidos: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Crea un lote grande de pedidos con COPY y sentencias sobre conjuntos
+        
+        Pensado para importaciones (decenas de miles de pedidos): los pedidos
+        se leen del iterable a medida que PostgreSQL los consume, y las
+        preferencias de método de pago se actualizan con un solo bulk_write.
+        Ver `IngestaPedidos.cargar` para la validación y el resultado.
+        
+        Args:
+            pedidos: Iterable de pedidos con el mismo formato que crear_pedido_completo
+                ('id_cliente', 'productos', 'direccion_envio', 'metodo_pago')
+            
+        Returns:
+            Dict: Resumen del lote (creados, rechazados, pedidos por segundo...)
+        """
+        return IngestaPedidos().cargar(pedidos)
+    
+    @staticmethod
+    def cancelar_pedido(id_pedido: int) -> bool:
+        """
+        Cancela un pedido y devuelve su stock
+        
+        Solo se devuelve lo que cada línea reservó (`cantidad_reservada`): las
+        líneas agregadas desde el admin y los pedidos anteriores a la reserva
+        de stock no descontaron nada. El pedido se bloquea mientras cambia de
+        estado para que dos cancelaciones simultáneas no devuelvan el stock
+        dos veces.
+        
+        Args:
+            id_pedido: ID del pedido
+            
+        Returns:
+            bool: True si se canceló, False si no existe, ya estaba cancelado o hubo un error
+        """
+        try:
+            with transaction.atomic():
+                pedido = Pedido.objects.select_for_update().filter(id_pedido=id_pedido).first()
+                if pedido is None or pedido.estado == 'cancelado':
+                    return False
+                
+                reservadas = pedido.detalles.filter(cantidad_reservada__gt=0)
+                InventarioService.liberar(InventarioService.agrupar_cantidades(
+                    reservadas.values_list('id_producto_id', 'cantidad_reservada')
+                ))
+                reservadas.update(cantidad_reservada=0)
+                pedido.estado = 'cancelado'
+                pedido.save(update_fields=['estado'])
+                return True
+                
+        except Exception as e:
+            logger.error(f"Error al cancelar pedido {id_pedido}: {e}")
+            return False
+    
+    @staticmethod
+    def total_real():
+        """Expresión con el total de cada pedido calculado desde 'detalle_pedido'"""
+        return Coalesce(
+            models.Subquery(
+                DetallePedido.objects.filter(id_pedido=models.OuterRef('pk')).order_by()
+                .values('id_pedido').annotate(t=models.Sum('subtotal')).values('t')
+            ),
+            Decimal('0.00'),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2)
+        )
+    
+    @staticmethod
+    def recalcular_totales(reparar: bool = True, tamano_bloque: int = 1000) -> Dict[str, Any]:
+        """
+        Compara el total de cada pedido con la suma de sus detalles y, si se
+        pide, corrige los desviados y el total gastado de sus clientes
+        
+        La corrección bloquea antes las filas de los pedidos y vuelve a
+        calcular sus totales: una línea concurrente espera y suma su
+        diferencia sobre el total ya corregido.
+        
+        Args:
+            reparar: Si es False solo informa de los desvíos
+            tamano_bloque: Pedidos corregidos por transacción
+            
+        Returns:
+            Dict: pedidos revisados, ids desviados y pedidos reparados
+        """
+        total_real = PedidoIntegrationService.total_real()
+        desviados = list(
+            Pedido.objects.annotate(total_real=total_real)
+            .exclude(total=models.F('total_real'))
+            .order_by('id_pedido')
+            .values_list('id_pedido', flat=True)
+        )
+        
+        reparados = 0
+        if reparar:
+            for inicio in range(0, len(desviados), tamano_bloque):
+                ids = desviados[inicio:inicio + tamano_bloque]
+                with transaction.atomic():
+                    filas = list(
+                        Pedido.objects.select_for_update().filter(id_pedido__in=ids)
+                        .annotate(total_real=total_real)
+                        .exclude(total=models.F('total_real'))
+                        .order_by('id_pedido')
+                        .values_list('id_pedido', 'id_cliente_id', 'total', 'total_real')
+                    )
+                    diferencias = {}
+                    for _, id_cliente, total, real in filas:
+                        acumulado = diferencias.get(id_cliente, (0, Decimal('0.00')))[1]
+                        diferencias[id_cliente] = (0, acumulado + real - total)
+                    reparados += Pedido.objects.filter(id_pedido__in=[fila[0] for fila in filas]).update(total=total_real)
+                    Cliente.aplicar_diferencias(diferencias)
+        
+        return {
+            "revisados": Pedido.objects.count(),
+            "desviados": desviados,
+            "reparados": reparados
+        }
+    
+    @staticmethod
+    def formatear_pedido(pedido: Pedido, info_cliente: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Construye la vista completa de un pedido
+        
+        Args:
+            pedido: Pedido con su cliente y sus detalles (idealmente precargados)
+            info_cliente: Documento de MongoDB del cliente (o None si no existe)
+            
+        Returns:
+            Dict: Información completa del pedido
+        """
+        return {
+            "id_pedido": pedido.id_pedido,
+            "cliente": {
+                "id_cliente": pedido.id_cliente.id_cliente,
+                "nombre": pedido.id_cliente.nombre,
+                "email": pedido.id_cliente.email,
+                "preferencias": info_cliente.get("preferencias", {}) if info_cliente else {}
+            },
+            "fecha_pedido": pedido.fecha_pedido,
+            "total": float(pedido.total),
+            "estado": pedido.estado,
+            "direccion_envio": pedido.direccion_envio,
+            "metodo_pago": pedido.metodo_pago,
+            "detalles": [
+                {
+                    "id_detalle": detalle.id_detalle,
+                    "producto": {
+                        "id_producto": detalle.id_producto.id_producto,
+                        "nombre": detalle.id_producto.nombre,
+                        "precio": float(detalle.id_producto.precio)
+                    },
+                    "cantidad": detalle.cantidad,
+                    "precio_unitario": float(detalle.precio_unitario),
+                    "subtotal": float(detalle.subtotal)
+                }
+                for detalle in pedido.detalles.all()
+            ],
+            "archivado": False
+        }
+    
+    @staticmethod
+    def formatear_pedido_archivado(
+        archivado: PedidoArchivado,
+        info_cliente: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Construye la vista completa de un pedido archivado, con las mismas
+        claves que `formatear_pedido`; el nombre y el precio de cada producto
+        son los que tenía al archivarse
+        
+        Args:
+            archivado: Pedido archivado con su cliente (idealmente precargado)
+            info_cliente: Documento de MongoDB del cliente (o None si no existe)
+            
+        Returns:
+            Dict: Información completa del pedido
+        """
+        return {
+            "id_pedido": archivado.id_pedido,
+            "cliente": {
+                "id_cliente": archivado.id_cliente.id_cliente,
+                "nombre": archivado.id_cliente.nombre,
+                "email": archivado.id_cliente.email,
+                "preferencias": info_cliente.get("preferencias", {}) if info_cliente else {}
+            },
+            "fecha_pedido": archivado.fecha_pedido,
+            "total": float(archivado.total),
+            "estado": archivado.estado,
+            "direccion_envio": archivado.direccion_envio,
+            "metodo_pago": archivado.metodo_pago,
+            "detalles": [
+                {
+                    "id_detalle": linea["id_detalle"],
+                    "producto": {
+                        "id_producto": linea["id_producto"],
+                        "nombre": linea["nombre"],
+                        "precio": float(linea["precio"])
+                    },
+                    "cantidad": linea["cantidad"],
+                    "precio_unitario": float(linea["precio_unitario"]),
+                    "subtotal": float(linea["subtotal"])
+                }
+                for linea in archivado.lineas()
+            ],
+            "archivado": True
+        }
+    
+    @staticmethod
+    def combinar_pedidos(pedidos) -> List[Dict[str, Any]]:
+        """
+        Construye la vista completa de varios pedidos con una sola lectura
+        por lotes de las preferencias de sus clientes en MongoDB
+        
+        Args:
+            pedidos: Pedidos con su cliente y sus detalles precargados
+            
+        Returns:
+            List[Dict]: Lista con información completa de los pedidos
+        """
+        infos_mongo = cliente_info_service.obtener_info_bulk(
+            (pedido.id_cliente_id for pedido in pedidos), fields=["preferencias"]
+        )
+        return [
+            PedidoIntegrationService.formatear_pedido(pedido, infos_mongo.get(pedido.id_cliente_id))
+            for pedido in pedidos
+        ]
+    
     @staticmethod
     def obtener_pedido_completo(id_pedido: int) -> Optional[Dict[str, Any]]:
         """
-        Obtiene información completa de un pedido
+        Obtiene información completa de un pedido, buscándolo en el archivo
+        (`ecommerce.archivo_pedidos`) si ya no está en 'pedidos'
+        
+        Con LECTURAS_PARALELAS, el documento del cliente se lee en MongoDB
+        mientras se cargan los detalles (la lectura de MongoDB necesita el
+        cliente, que viene en la fila del pedido).
         
         Args:
             id_pedido: ID del pedido
@@ -259,52 +703,53 @@ class PedidoIntegrationService:
             Dict: Información completa del pedido o None si no existe
         """
         try:
-            pedido = Pedido.objects.select_related('id_cliente').prefetch_related('detalles__id_producto').get(id_pedido=id_pedido)
-            
-            # Obtener información del cliente desde MongoDB
-            info_cliente = cliente_info_service.obtener_info_completa(pedido.id_cliente.id_cliente)
-            
-            pedido_data = {
-                "id_pedido": pedido.id_pedido,
-                "cliente": {
-                    "id_cliente": pedido.id_cliente.id_cliente,
-                    "nombre": pedido.id_cliente.nombre,
-                    "email": pedido.id_cliente.email,
-                    "preferencias": info_cliente.get("preferencias", {}) if info_cliente else {}
-                },
-                "fecha_pedido": pedido.fecha_pedido,
-                "total": float(pedido.total),
-                "estado": pedido.estado,
-                "direccion_envio": pedido.direccion_envio,
-                "metodo_pago": pedido.metodo_pago,
-                "detalles": [
-                    {
-                        "id_detalle": detalle.id_detalle,
-                        "producto": {
-                            "id_producto": detalle.id_producto.id_producto,
-                            "nombre": detalle.id_producto.nombre,
-                            "precio": float(detalle.id_producto.precio)
-                        },
-                        "cantidad": detalle.cantidad,
-                        "precio_unitario": float(detalle.precio_unitario),
-                        "subtotal": float(detalle.subtotal)
-                    }
-                    for detalle in pedido.detalles.all()
-                ]
-            }
+            pedido = Pedido.objects.select_related('id_cliente').get(id_pedido=id_pedido)
+            
+            def cargar_detalles():
+                models.prefetch_related_objects([pedido], 'detalles__id_producto')
+                return pedido
             
-            return pedido_data
+            # Detalles desde PostgreSQL e información del cliente desde MongoDB
+            _, info_cliente = lecturas_paralelas.ejecutar(
+                cargar_detalles,
+                lambda: cliente_info_service.obtener_info_completa(pedido.id_cliente_id, fields=["preferencias"])
+            )
+            
+            return PedidoIntegrationService.formatear_pedido(pedido, info_cliente)
             
         except Pedido.DoesNotExist:
-            return None
+            return PedidoIntegrationService.obtener_pedido_archivado(id_pedido)
         except Exception as e:
             logger.error(f"Error al obtener pedido completo {id_pedido}: {e}")
             return None
     
+    @staticmethod
+    def obtener_pedido_archivado(id_pedido: int) -> Optional[Dict[str, Any]]:
+        """
+        Obtiene información completa de un pedido archivado
+        
+        Args:
+            id_pedido: ID del pedido
+            
+        Returns:
+            Dict: Información completa del pedido o None si no está archivado
+        """
+        try:
+            archivado = PedidoArchivado.objects.select_related('id_cliente').filter(id_pedido=id_pedido).first()
+            if archivado is None:
+                return None
+            info_cliente = cliente_info_service.obtener_info_completa(archivado.id_cliente_id, fields=["preferencias"])
+            return PedidoIntegrationService.formatear_pedido_archivado(archivado, info_cliente)
+            
+        except Exception as e:
+            logger.error(f"Error al obtener pedido archivado {id_pedido}: {e}")
+            return None
+    
     @staticmethod
     def obtener_pedidos_cliente(id_cliente: int) -> List[Dict[str, Any]]:
         """
-        Obtiene todos los pedidos de un cliente con información completa
+        Obtiene todos los pedidos de un cliente con información completa,
+        los archivados incluidos, del más reciente al más antiguo
         
         Args:
             id_cliente: ID del cliente
@@ -313,15 +758,34 @@ class PedidoIntegrationService:
             List[Dict]: Lista de pedidos completos del cliente
         """
         try:
-            pedidos = Pedido.objects.filter(id_cliente_id=id_cliente).order_by('-fecha_pedido')
-            pedidos_completos = []
-            
-            for pedido in pedidos:
-                pedido_completo = PedidoIntegrationService.obtener_pedido_completo(pedido.id_pedido)
-                if pedido_completo:
-                    pedidos_completos.append(pedido_completo)
+            # Una consulta para los pedidos y una por nivel de detalles, sea cual sea su número
+            pedidos = list(
+                Pedido.objects.filter(id_cliente_id=id_cliente)
+                .select_related('id_cliente')
+                .prefetch_related('detalles__id_producto')
+                .order_by('-fecha_pedido')
+            )
+            archivados = list(
+                PedidoArchivado.objects.filter(id_cliente_id=id_cliente)
+                .select_related('id_cliente')
+                .order_by('-fecha_pedido')
+            )
+            if not pedidos and not archivados:
+                return []
             
-            return pedidos_completos
+            # Todos los pedidos son del mismo cliente: sus preferencias se leen una vez
+            info_cliente = cliente_info_service.obtener_info_completa(id_cliente, fields=["preferencias"])
+            resultado = [
+                PedidoIntegrationService.formatear_pedido(pedido, info_cliente)
+                for pedido in pedidos
+            ] + [
+                PedidoIntegrationService.formatear_pedido_archivado(archivado, info_cliente)
+                for archivado in archivados
+            ]
+            # Los pedidos sin cerrar siguen en 'pedidos' aunque sean anteriores a los archivados
+            if pedidos and archivados:
+                resultado.sort(key=lambda pedido: pedido["fecha_pedido"], reverse=True)
+            return resultado
             
         except Exception as e:
             logger.error(f"Error al obtener pedidos del cliente {id_cliente}: {e}")
@@ -334,40 +798,29 @@ class EstadisticasService:
     """
     
     @staticmethod
-    def obtener_estadisticas_generales() -> Dict[str, Any]:
+    def obtener_estadisticas_generales(max_antiguedad: Optional[float] = None) -> Dict[str, Any]:
         """
-        Obtiene estadísticas generales del sistema
+        Obtiene estadísticas generales del sistema desde el snapshot de
+        estadísticas (`ecommerce.estadisticas`)
+        
+        Args:
+            max_antiguedad: Segundos de antigüedad aceptados (por defecto
+                ESTADISTICAS_MAX_ANTIGUEDAD); 0 fuerza el recálculo
         
         Returns:
-            Dict: Estadísticas generales
+            Dict: Estadísticas generales, con la fecha de cálculo de las de
+            PostgreSQL y de las de MongoDB
         """
         try:
-            # Estadísticas de PostgreSQL
-            total_clientes = Cliente.objects.count()
-            total_pedidos = Pedido.objects.count()
-            total_productos = Producto.objects.count()
-            total_ventas = Pedido.objects.aggregate(
-                total=models.Sum('total')
-            )['total'] or 0
-            
-            # Estadísticas de MongoDB
-            stats_mongo = cliente_info_service.obtener_estadisticas()
-            
+            snapshot = snapshot_estadisticas.obtener(max_antiguedad)
             return {
-                "postgresql": {
-                    "total_clientes": total_clientes,
-                    "total_pedidos": total_pedidos,
-                    "total_productos": total_productos,
-                    "total_ventas": float(total_ventas),
-                    "promedio_venta": float(total_ventas / total_pedidos) if total_pedidos > 0 else 0
-                },
-                "mongodb": stats_mongo,
-                "integracion": {
-                    "clientes_con_info_completa": stats_mongo["total_clientes"],
-                    "porcentaje_cobertura": (stats_mongo["total_clientes"] / total_clientes * 100) if total_clientes > 0 else 0
-                }
+                "postgresql": snapshot.datos["postgresql"],
+                "mongodb": snapshot.datos["mongodb"],
+                "integracion": snapshot.datos["integracion"],
+                "fecha_calculo": snapshot.fecha_calculo,
+                "fecha_mongo": snapshot.fecha_mongo
             }
             
         except Exception as e:
             logger.error(f"Error al obtener estadísticas generales: {e}")
-            return {} 
\ No newline at end of file
+            return {}
@@ -0,0 +1,85 @@
+"""
+Reserva de stock para pedidos sin bloqueos explícitos
+
+El stock se descuenta con UPDATE condicionales
+(`stock = stock - n WHERE stock >= n`): la comprobación y el descuento son
+una sola sentencia, así que no hace falta `select_for_update` y dos pedidos
+del mismo producto solo esperan el uno al otro lo que dura su transacción.
+"""
+
+from typing import Dict, Iterable, Tuple
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import Producto
+
+
+class StockInsuficienteError(Exception):
+    """Algún producto no tiene stock para la cantidad pedida"""
+
+    def __init__(self, id_producto: int, cantidad: int):
+        self.id_producto = id_producto
+        self.cantidad = cantidad
+        super().__init__(f"Stock insuficiente del producto {id_producto} para {cantidad} unidades")
+
+
+class InventarioService:
+    """
+    Servicio de reserva y liberación de stock
+    """
+
+    @staticmethod
+    def agrupar_cantidades(lineas: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+        """
+        Suma las cantidades por producto
+
+        Args:
+            lineas: Pares (id_producto, cantidad)
+
+        Returns:
+            Dict: Cantidad total por id_producto
+        """
+        cantidades: Dict[int, int] = {}
+        for id_producto, cantidad in lineas:
+            cantidades[id_producto] = cantidades.get(id_producto, 0) + cantidad
+        return cantidades
+
+    @staticmethod
+    def reservar(cantidades: Dict[int, int]):
+        """
+        Descuenta el stock de varios productos, todo o nada, y suma la
+        cantidad a sus unidades vendidas en la misma sentencia
+
+        Los productos se actualizan en orden de id para que dos pedidos con
+        productos en común bloqueen las filas en el mismo orden y no se
+        interbloqueen. Si a algún producto le falta stock se revierte la
+        transacción que contiene la reserva (sin savepoint propio: dentro de
+        un pedido, el fallo debe deshacer el pedido entero).
+
+        Args:
+            cantidades: Cantidad a reservar por id_producto
+
+        Raises:
+            StockInsuficienteError: Si algún producto no tiene stock suficiente
+        """
+        with transaction.atomic(savepoint=False):
+            for id_producto, cantidad in sorted(cantidades.items()):
+                actualizados = Producto.objects.filter(
+                    id_producto=id_producto, stock__gte=cantidad
+                ).update(stock=F('stock') - cantidad, unidades_vendidas=F('unidades_vendidas') + cantidad)
+                if not actualizados:
+                    raise StockInsuficienteError(id_producto, cantidad)
+
+    @staticmethod
+    def liberar(cantidades: Dict[int, int]):
+        """
+        Devuelve al stock las cantidades reservadas (las líneas del pedido
+        siguen existiendo, así que las unidades vendidas no cambian)
+
+        Args:
+            cantidades: Cantidad a devolver por id_producto
+        """
+        with transaction.atomic(savepoint=False):
+            for id_producto, cantidad in sorted(cantidades.items()):
+                Producto.objects.filter(id_producto=id_producto).update(stock=F('stock') + cantidad)
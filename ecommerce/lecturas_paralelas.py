@@ -0,0 +1,149 @@
+"""
+Lecturas en paralelo de PostgreSQL y MongoDB
+
+Las vistas completas de clientes y pedidos leen PostgreSQL y después
+MongoDB, así que su latencia es la suma de ambas. Con LECTURAS_PARALELAS=True
+la lectura de MongoDB se lanza en un pool acotado de hilos
+(LECTURAS_PARALELAS_HILOS) mientras el hilo de la petición hace la consulta
+del ORM, y la latencia se acerca a la mayor de las dos.
+
+La consulta del ORM sigue en el hilo de la petición (y en su transacción);
+los hilos del pool solo hablan con MongoDB. Cada lectura de MongoDB tiene un
+límite de LECTURAS_PARALELAS_TIMEOUT segundos: al vencer, la vista se
+construye sin los datos de MongoDB, como cuando MongoDB no responde.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+import pymongo
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+M = TypeVar('M')
+
+# Resultado de una lectura de MongoDB que no respondió (límite vencido o
+# error), distinto de None (el documento no existe)
+SIN_RESPUESTA_MONGO = object()
+
+
+class LecturasParalelas:
+    """
+    Ejecuta a la vez una consulta de PostgreSQL y una de MongoDB
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._contadores = {
+            "paralelas": 0,
+            "secuenciales": 0,
+            "timeouts": 0,
+        }
+
+    @property
+    def activo(self) -> bool:
+        return settings.LECTURAS_PARALELAS
+
+    @property
+    def hilos(self) -> int:
+        return settings.LECTURAS_PARALELAS_HILOS
+
+    @property
+    def timeout(self) -> float:
+        """Segundos máximos de espera por la lectura de MongoDB"""
+        return settings.LECTURAS_PARALELAS_TIMEOUT
+
+    def _contar(self, contador: str):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """Pool del proceso actual; se crea en el primer uso y de nuevo tras un fork"""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.hilos, thread_name_prefix='lecturas_mongo'
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _con_timeout(self, consulta_mongo: Callable[[], M]) -> Callable[[], M]:
+        # pymongo.timeout limita también la operación en el servidor, así que
+        # una lectura abandonada no sigue ocupando el hilo del pool
+        def ejecutar():
+            with pymongo.timeout(self.timeout):
+                return consulta_mongo()
+        return ejecutar
+
+    def ejecutar(
+        self,
+        consulta_pg: Callable[[], T],
+        consulta_mongo: Callable[[], M],
+        defecto_mongo: Optional[M] = None
+    ) -> Tuple[T, Optional[M]]:
+        """
+        Ejecuta ambas consultas, en paralelo si LECTURAS_PARALELAS está activo
+
+        Si la consulta de PostgreSQL devuelve None, el resultado de MongoDB no
+        se usa (en modo secuencial ni siquiera se consulta).
+
+        Args:
+            consulta_pg: Consulta del ORM, siempre en el hilo actual
+            consulta_mongo: Lectura de MongoDB
+            defecto_mongo: Valor de MongoDB si su lectura vence el límite
+
+        Returns:
+            Tuple: Resultado de PostgreSQL y resultado de MongoDB
+        """
+        if not self.activo:
+            self._contar("secuenciales")
+            resultado_pg = consulta_pg()
+            if resultado_pg is None:
+                return None, None
+            return resultado_pg, consulta_mongo()
+
+        self._contar("paralelas")
+        inicio = time.monotonic()
+        futuro = self._pool().submit(self._con_timeout(consulta_mongo))
+        try:
+            resultado_pg = consulta_pg()
+        except BaseException:
+            futuro.cancel()
+            raise
+        if resultado_pg is None:
+            futuro.cancel()
+            return None, None
+
+        try:
+            restante = max(0.0, self.timeout - (time.monotonic() - inicio))
+            return resultado_pg, futuro.result(timeout=restante)
+        except FuturesTimeoutError:
+            # Si el pool estaba lleno y la lectura no empezó, no llega a ejecutarse
+            futuro.cancel()
+            self._contar("timeouts")
+            logger.error(f"La lectura de MongoDB superó {self.timeout}s; se responde sin sus datos")
+            return resultado_pg, defecto_mongo
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """
+        Contadores de este proceso
+
+        Returns:
+            Dict: lecturas paralelas, secuenciales y las que vencieron el límite
+        """
+        with self._lock:
+            datos = dict(self._contadores)
+        datos["hilos"] = self.hilos
+        return datos
+
+
+# Instancia global usada por los servicios de integración
+lecturas_paralelas = LecturasParalelas()
@@ -0,0 +1,62 @@
+"""
+Comando de Django para archivar los pedidos antiguos ya cerrados
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.archivo_pedidos import ArchivoPedidos
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _legible(tamano: float) -> str:
+    for unidad in ('B', 'kB', 'MB'):
+        if tamano < 1024:
+            return f'{tamano:.1f} {unidad}'
+        tamano /= 1024
+    return f'{tamano:.1f} GB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Mueve por lotes los pedidos entregados o cancelados antiguos (y las particiones '
+        'desconectadas) a pedidos_archivo'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--meses',
+            type=int,
+            default=settings.PEDIDOS_ARCHIVO_MESES,
+            help='Meses completos que se conservan en las tablas de pedidos',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=settings.PEDIDOS_ARCHIVO_LOTE,
+            help='Pedidos archivados por transacción',
+        )
+        parser.add_argument(
+            '--limite',
+            type=int,
+            default=None,
+            help='Máximo de pedidos archivados en esta ejecución (por defecto, todos)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            ArchivoPedidos.preparar_tabla()
+            antes = ArchivoPedidos.tamanos()
+            archivados = ArchivoPedidos.archivar(options['meses'], options['lote'], options['limite'])
+            eliminadas = ArchivoPedidos.archivar_desconectadas(options['lote'])
+            despues = ArchivoPedidos.tamanos()
+        except Exception as e:
+            logger.error(f'Error en archivar_pedidos: {e}')
+            raise CommandError(f'Error al archivar pedidos: {e}')
+
+        for tabla in antes:
+            self.stdout.write(f'  - {tabla}: {_legible(antes[tabla])} -> {_legible(despues[tabla])}')
+        for nombre in eliminadas:
+            self.stdout.write(f'  - Partición archivada y eliminada: {nombre}')
+        self.stdout.write(self.style.SUCCESS(f'Pedidos archivados: {archivados}.'))
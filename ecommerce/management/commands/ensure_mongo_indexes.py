@@ -0,0 +1,73 @@
+"""
+Comando de Django para crear y verificar los índices de MongoDB
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.mongodb_services import indices_mongo_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Crea los índices de MongoDB que necesitan los servicios y reporta índices faltantes o sin uso'
+
+    # El chequeo estricto de índices no debe impedir ejecutar el comando que los crea
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo reporta el estado de los índices, sin crearlos (falla si falta alguno)',
+        )
+
+    def handle(self, *args, **options):
+        if not options['verificar']:
+            self._crear_indices()
+
+        reporte = indices_mongo_service.verificar_indices()
+        faltantes = self._imprimir_reporte(reporte)
+
+        if faltantes:
+            raise CommandError(f'Faltan índices en MongoDB: {", ".join(faltantes)}')
+        self.stdout.write(self.style.SUCCESS('Todos los índices requeridos existen.'))
+
+    def _crear_indices(self):
+        """Crea los índices requeridos, comprobando antes los duplicados de los índices únicos"""
+        for nombre_coleccion, indices in indices_mongo_service.indices_requeridos.items():
+            for indice in indices:
+                documento = indice.document
+                if not documento.get('unique'):
+                    continue
+                for campo in documento['key']:
+                    duplicados = indices_mongo_service.buscar_duplicados(nombre_coleccion, campo)
+                    if duplicados:
+                        raise CommandError(
+                            f'No se puede crear el índice único {documento["name"]} en {nombre_coleccion}: '
+                            f'hay documentos repetidos para {campo} (por ejemplo {duplicados}). '
+                            f'Fusiónelos o elimínelos y vuelva a ejecutar el comando.'
+                        )
+
+        try:
+            creados = indices_mongo_service.asegurar_indices()
+        except Exception as e:
+            logger.error(f'Error en ensure_mongo_indexes: {e}')
+            raise CommandError(f'Error al crear los índices: {e}')
+
+        for nombre_coleccion, nombres in creados.items():
+            self.stdout.write(f'  - {nombre_coleccion}: {", ".join(nombres)}')
+
+    def _imprimir_reporte(self, reporte):
+        """Imprime el reporte de índices y devuelve los faltantes"""
+        faltantes = []
+        for nombre_coleccion, estado in reporte.items():
+            self.stdout.write(f'Colección {nombre_coleccion}:')
+            for nombre in estado['faltantes']:
+                faltantes.append(f'{nombre_coleccion}.{nombre}')
+                self.stdout.write(self.style.ERROR(f'  - Falta el índice {nombre}'))
+            for nombre in estado['no_declarados']:
+                self.stdout.write(self.style.WARNING(f'  - Índice no declarado por ningún servicio: {nombre}'))
+            for nombre in estado['sin_uso']:
+                self.stdout.write(self.style.WARNING(f'  - Índice sin uso desde el último reinicio: {nombre}'))
+        return faltantes
@@ -0,0 +1,62 @@
+"""
+Comando de Django para crear y verificar los índices de PostgreSQL
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.esquema import (
+    crear_indices_faltantes, eliminar_indices, indices_faltantes, indices_redundantes
+)
+from ecommerce.models import DetallePedido, Pedido, Producto
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODELOS = [Pedido, DetallePedido, Producto]
+
+
+class Command(BaseCommand):
+    help = 'Crea los índices de PostgreSQL declarados en los modelos y reporta los faltantes o redundantes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo reporta el estado de los índices, sin crearlos (falla si falta alguno)',
+        )
+        parser.add_argument(
+            '--eliminar-redundantes',
+            action='store_true',
+            help='Elimina los índices que cubre otro índice declarado (DROP INDEX CONCURRENTLY)',
+        )
+
+    def handle(self, *args, **options):
+        faltantes = []
+        try:
+            for modelo in MODELOS:
+                tabla = modelo._meta.db_table
+                self.stdout.write(f'Tabla {tabla}:')
+                if not options['verificar']:
+                    for nombre in crear_indices_faltantes(modelo):
+                        self.stdout.write(f'  - Creado el índice {nombre}')
+
+                redundantes = indices_redundantes(modelo)
+                if redundantes and options['eliminar_redundantes'] and not options['verificar']:
+                    eliminar_indices(modelo, redundantes)
+                    for nombre in redundantes:
+                        self.stdout.write(f'  - Eliminado el índice redundante {nombre}')
+                    redundantes = []
+
+                for nombre in indices_faltantes(modelo):
+                    faltantes.append(f'{tabla}.{nombre}')
+                    self.stdout.write(self.style.ERROR(f'  - Falta el índice {nombre}'))
+                for nombre in redundantes:
+                    self.stdout.write(self.style.WARNING(
+                        f'  - Índice redundante (lo cubre otro declarado): {nombre}'
+                    ))
+        except Exception as e:
+            logger.error(f'Error en ensure_postgres_indexes: {e}')
+            raise CommandError(f'Error al crear los índices: {e}')
+
+        if faltantes:
+            raise CommandError(f'Faltan índices en PostgreSQL: {", ".join(faltantes)}')
+        self.stdout.write(self.style.SUCCESS('Todos los índices declarados existen.'))
@@ -0,0 +1,95 @@
+"""
+Comando de Django para mover los comentarios embebidos de 'clientes_info'
+a buckets de tamaño fijo en 'clientes_comentarios'
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.mongodb_services import ClienteInfoService, MODO_COMENTARIOS_BUCKETS
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Migra los comentarios embebidos de clientes_info al almacenamiento en buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=100,
+            help='Número de documentos de cliente leídos por lote (por defecto 100)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Solo muestra cuántos comentarios se migrarían',
+        )
+
+    def handle(self, *args, **options):
+        if settings.MONGO_COMENTARIOS_MODO != MODO_COMENTARIOS_BUCKETS and not options['dry_run']:
+            # Con el modo embebido activo, los comentarios nuevos seguirían llegando al arreglo
+            raise CommandError(
+                "Configure MONGO_COMENTARIOS_MODO=buckets antes de migrar, "
+                "para que los comentarios nuevos no vuelvan al arreglo embebido."
+            )
+
+        service = ClienteInfoService(modo_comentarios=MODO_COMENTARIOS_BUCKETS)
+        filtro = {"comentarios.0": {"$exists": True}}
+        total_clientes = 0
+        total_comentarios = 0
+        total_buckets = 0
+
+        try:
+            # Se procesa por id_cliente creciente para poder retomar tras un fallo:
+            # los buckets históricos tienen _id deterministas, así que repetir un
+            # cliente que se cortó antes del $pullAll reescribe los mismos buckets
+            ultimo_id = None
+            while True:
+                filtro_lote = dict(filtro)
+                if ultimo_id is not None:
+                    filtro_lote["id_cliente"] = {"$gt": ultimo_id}
+                documentos = list(service.collection.find(
+                    filtro_lote,
+                    {"_id": 0, "id_cliente": 1, "comentarios": 1}
+                ).sort("id_cliente", 1).limit(options['lote']))
+                if not documentos:
+                    break
+
+                for documento in documentos:
+                    comentarios = documento["comentarios"]
+                    total_clientes += 1
+                    total_comentarios += len(comentarios)
+                    if options['dry_run']:
+                        continue
+
+                    total_buckets += service.buckets.agregar_historicos(documento["id_cliente"], comentarios)
+                    # $pullAll quita solo los comentarios migrados: si llegó alguno
+                    # nuevo entre la lectura y este punto, queda para la siguiente ejecución
+                    service.collection.update_one(
+                        {"id_cliente": documento["id_cliente"]},
+                        {"$pullAll": {"comentarios": comentarios}}
+                    )
+
+                ultimo_id = documentos[-1]["id_cliente"]
+                self.stdout.write(f'  - Procesados {total_clientes} clientes ({total_comentarios} comentarios)')
+
+        except Exception as e:
+            logger.error(f'Error en migrar_comentarios_buckets: {e}')
+            raise CommandError(f'Error al migrar comentarios: {e}')
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'Se migrarían {total_comentarios} comentarios de {total_clientes} clientes.'
+            )
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Migrados {total_comentarios} comentarios de {total_clientes} clientes '
+            f'a {total_buckets} buckets.'
+        ))
+        if not service.collection.find_one(filtro, {"_id": 1}):
+            self.stdout.write(
+                'No quedan comentarios embebidos: ya puede configurar MONGO_COMENTARIOS_LEER_EMBEBIDOS=False.'
+            )
@@ -0,0 +1,77 @@
+"""
+Comando de Django para particionar por meses las tablas de pedidos y mantener sus particiones
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.esquema import es_particionada
+from ecommerce.particiones import ParticionesPedidos, TABLA_PEDIDOS
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Crea las particiones mensuales de los próximos meses en pedidos y detalle_pedido '
+        'y desconecta las anteriores a la retención (--convertir particiona las tablas)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--preparar',
+            action='store_true',
+            help='Solo crea y rellena detalle_pedido.fecha_pedido (bases anteriores a la columna)',
+        )
+        parser.add_argument(
+            '--convertir',
+            action='store_true',
+            help='Convierte las tablas en particionadas; las bloquea mientras copia las filas',
+        )
+        parser.add_argument(
+            '--adelante',
+            type=int,
+            default=settings.PEDIDOS_PARTICIONES_ADELANTE,
+            help='Meses por delante del actual con partición creada',
+        )
+        parser.add_argument(
+            '--retencion',
+            type=int,
+            default=settings.PEDIDOS_PARTICIONES_RETENCION,
+            help='Meses conservados conectados, contando el actual (0 = no desconectar)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options['preparar']:
+                rellenadas = ParticionesPedidos.preparar_detalles()
+                self.stdout.write(self.style.SUCCESS(f'Líneas con fecha de pedido rellenada: {rellenadas}'))
+                return
+
+            if options['convertir']:
+                resultado = ParticionesPedidos.convertir(options['adelante'])
+                self.stdout.write(
+                    f'Copiados {resultado["pedidos"]} pedidos y {resultado["detalles"]} líneas '
+                    f'en {resultado["particiones"]} particiones'
+                )
+                self.stdout.write(self.style.SUCCESS('Tablas de pedidos particionadas por mes.'))
+                return
+
+            if not es_particionada(TABLA_PEDIDOS):
+                raise CommandError('Las tablas de pedidos no están particionadas; ejecute el comando con --convertir')
+
+            creadas = ParticionesPedidos.crear_particiones_futuras(options['adelante'])
+            desconectadas = ParticionesPedidos.desconectar_anteriores(options['retencion'])
+        except CommandError:
+            raise
+        except Exception as e:
+            logger.error(f'Error en particiones_pedidos: {e}')
+            raise CommandError(f'Error al mantener las particiones: {e}')
+
+        for nombre in creadas:
+            self.stdout.write(f'  - Creada: {nombre}')
+        for nombre in desconectadas:
+            self.stdout.write(f'  - Desconectada: {nombre}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Particiones creadas: {len(creadas)}, desconectadas: {len(desconectadas)}.'
+        ))
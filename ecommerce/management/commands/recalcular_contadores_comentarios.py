@@ -0,0 +1,33 @@
+"""
+Comando de Django para calcular el contador num_comentarios de cada cliente
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.mongodb_services import cliente_info_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula num_comentarios en clientes_info a partir de los comentarios guardados '
+        '(necesario una vez para los documentos anteriores al contador)'
+    )
+
+    def handle(self, *args, **options):
+        sin_contador = cliente_info_service.collection.count_documents(
+            {"num_comentarios": {"$exists": False}}
+        )
+        self.stdout.write(f'Documentos sin contador: {sin_contador}')
+
+        try:
+            resultado = cliente_info_service.recalcular_contadores()
+        except Exception as e:
+            logger.error(f'Error en recalcular_contadores_comentarios: {e}')
+            raise CommandError(f'Error al recalcular contadores: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Contadores recalculados: {resultado["embebidos"]} documentos por el arreglo embebido, '
+            f'{resultado["buckets"]} por los buckets.'
+        ))
@@ -0,0 +1,50 @@
+"""
+Comando de Django para calcular num_pedidos y total_gastado de cada cliente
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.esquema import CAMPOS_TOTALES, crear_columnas_faltantes
+from ecommerce.integration_service import ClienteIntegrationService
+from ecommerce.models import Cliente
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula num_pedidos y total_gastado en clientes a partir de sus pedidos y corrige los desvíos '
+        '(crea las columnas si la tabla es anterior a ellas)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo informa de los clientes desviados, sin corregirlos',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if not options['verificar']:
+                creadas = crear_columnas_faltantes(Cliente, CAMPOS_TOTALES)
+                if creadas:
+                    self.stdout.write(f'Columnas creadas: {", ".join(creadas)}')
+            resultado = ClienteIntegrationService.recalcular_totales(reparar=not options['verificar'])
+        except Exception as e:
+            logger.error(f'Error en recalcular_totales_clientes: {e}')
+            raise CommandError(f'Error al recalcular totales: {e}')
+
+        desviados = resultado["desviados"]
+        self.stdout.write(f'Clientes revisados: {resultado["revisados"]}, desviados: {len(desviados)}')
+        if desviados:
+            muestra = ", ".join(str(id_cliente) for id_cliente in desviados[:20])
+            self.stdout.write(f'  - Clientes desviados: {muestra}{"..." if len(desviados) > 20 else ""}')
+
+        if options['verificar']:
+            if desviados:
+                self.stdout.write(self.style.WARNING('Hay totales desviados; ejecute el comando sin --verificar.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Todos los totales cuadran con los pedidos.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Totales corregidos: {resultado["reparados"]} clientes.'))
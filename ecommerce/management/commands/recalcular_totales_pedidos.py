@@ -0,0 +1,44 @@
+"""
+Comando de Django para comprobar el total de cada pedido contra sus detalles
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.integration_service import PedidoIntegrationService
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula el total de cada pedido a partir de sus detalles y corrige los desvíos '
+        '(y el total gastado de sus clientes)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo informa de los pedidos desviados, sin corregirlos',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            resultado = PedidoIntegrationService.recalcular_totales(reparar=not options['verificar'])
+        except Exception as e:
+            logger.error(f'Error en recalcular_totales_pedidos: {e}')
+            raise CommandError(f'Error al recalcular totales: {e}')
+
+        desviados = resultado["desviados"]
+        self.stdout.write(f'Pedidos revisados: {resultado["revisados"]}, desviados: {len(desviados)}')
+        if desviados:
+            muestra = ", ".join(str(id_pedido) for id_pedido in desviados[:20])
+            self.stdout.write(f'  - Pedidos desviados: {muestra}{"..." if len(desviados) > 20 else ""}')
+
+        if options['verificar']:
+            if desviados:
+                self.stdout.write(self.style.WARNING('Hay totales desviados; ejecute el comando sin --verificar.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Todos los totales cuadran con los detalles.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Totales corregidos: {resultado["reparados"]} pedidos.'))
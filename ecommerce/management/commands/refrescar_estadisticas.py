@@ -0,0 +1,57 @@
+"""
+Comando de Django que recalcula el snapshot de estadísticas del panel
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.esquema import crear_columnas_faltantes
+from ecommerce.estadisticas import snapshot_estadisticas
+from ecommerce.models import Producto
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Recalcula la fila de estadisticas_snapshot que lee el panel de administración'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--completo',
+            action='store_true',
+            help='Corrige antes unidades_vendidas de los productos desde detalle_pedido (crea la columna si falta)',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=None,
+            help='Repite el recálculo cada tantos segundos en lugar de terminar',
+        )
+
+    def _refrescar(self):
+        snapshot = snapshot_estadisticas.refrescar()
+        mongo = snapshot.fecha_mongo.isoformat() if snapshot.fecha_mongo else 'no disponible'
+        self.stdout.write(self.style.SUCCESS(
+            f'Estadísticas al {snapshot.fecha_calculo.isoformat()} (MongoDB: {mongo}).'
+        ))
+
+    def handle(self, *args, **options):
+        try:
+            if options['completo']:
+                creadas = crear_columnas_faltantes(Producto, ['unidades_vendidas'])
+                if creadas:
+                    self.stdout.write(f'Columnas creadas: {", ".join(creadas)}')
+                corregidos = snapshot_estadisticas.recalcular_unidades_vendidas()
+                self.stdout.write(f'Productos con unidades vendidas corregidas: {corregidos}')
+
+            self._refrescar()
+            while options['intervalo']:
+                time.sleep(options['intervalo'])
+                self._refrescar()
+
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            logger.error(f'Error en refrescar_estadisticas: {e}')
+            raise CommandError(f'Error al recalcular las estadísticas: {e}')
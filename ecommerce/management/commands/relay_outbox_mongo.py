@@ -0,0 +1,92 @@
+"""
+Comando de Django que aplica en MongoDB los eventos del outbox transaccional
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from ecommerce.models import EventoOutbox
+from ecommerce.outbox import RelayOutbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Aplica en MongoDB, por lotes, las escrituras pendientes de la tabla outbox_mongo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=None,
+            help='Eventos por lote (por defecto MONGO_OUTBOX_TAMANO_LOTE)',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=1.0,
+            help='Segundos de espera cuando el outbox queda vacío (por defecto 1.0)',
+        )
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Aplica los eventos pendientes y termina (los que fallan quedan para más tarde)',
+        )
+        parser.add_argument(
+            '--reintentar-descartados',
+            action='store_true',
+            help='Devuelve a la cola los eventos que agotaron MONGO_OUTBOX_MAX_INTENTOS antes de empezar',
+        )
+
+    def handle(self, *args, **options):
+        relay = RelayOutbox(tamano_lote=options['lote'])
+        if not relay.adquirir_bloqueo():
+            raise CommandError('Ya hay otro relay del outbox en ejecución.')
+
+        aplicados = 0
+        fallidos = 0
+        try:
+            if options['reintentar_descartados']:
+                self.stdout.write(f'Eventos descartados devueltos a la cola: {relay.reintentar_descartados()}')
+            self.stdout.write(f'Eventos pendientes: {EventoOutbox.objects.count()}')
+
+            while True:
+                resultado = relay.procesar_lote()
+                aplicados += resultado["aplicados"]
+                fallidos += resultado["fallidos"]
+                if resultado["eventos"]:
+                    self.stdout.write(
+                        f'  - Lote: {resultado["aplicados"]} aplicados, {resultado["fallidos"]} fallidos'
+                    )
+
+                # Los eventos fallidos esperan su reintento fuera de los lotes
+                # siguientes, así que un lote incompleto significa que no
+                # queda nada aplicable por ahora
+                if resultado["eventos"] < relay.tamano_lote:
+                    if options['una_vez']:
+                        break
+                    time.sleep(options['intervalo'])
+                elif resultado["fallidos"]:
+                    # Con fallos se espera antes de seguir, para no martillear MongoDB
+                    time.sleep(options['intervalo'])
+
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            logger.error(f'Error en relay_outbox_mongo: {e}')
+            raise CommandError(f'Error en el relay del outbox: {e}')
+        finally:
+            relay.liberar_bloqueo()
+
+        mensaje = f'Eventos aplicados: {aplicados}, fallidos: {fallidos}.'
+        descartados = relay.descartados().count()
+        if descartados:
+            mensaje += (
+                f' {descartados} eventos descartados esperan revisión '
+                f'(--reintentar-descartados para volver a aplicarlos).'
+            )
+        if fallidos or descartados:
+            self.stdout.write(self.style.WARNING(mensaje))
+        else:
+            self.stdout.write(self.style.SUCCESS(mensaje))
@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
+from .cache_clientes import cache_clientes
+
 
 class Cliente(models.Model):
     """
@@ -14,6 +16,15 @@ class Cliente(models.Model):
     telefono = models.CharField(max_length=20, verbose_name="Teléfono")
     fecha_registro = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de registro")
     activo = models.BooleanField(default=True, verbose_name="Cliente activo")
+    # Totales mantenidos por Pedido.save y la señal post_delete de Pedido;
+    # `python manage.py recalcular_totales_clientes` corrige cualquier desvío
+    num_pedidos = models.PositiveIntegerField(default=0, verbose_name="Número de pedidos")
+    total_gastado = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name="Total gastado"
+    )
     
     class Meta:
         db_table = 'clientes'
@@ -27,14 +38,26 @@ class Cliente(models.Model):
     @property
     def total_pedidos(self):
         """Retorna el total de pedidos del cliente"""
-        return self.pedidos.count()
+        return self.num_pedidos
     
-    @property
-    def total_gastado(self):
-        """Retorna el total gastado por el cliente"""
-        return self.pedidos.aggregate(
-            total=models.Sum('total')
-        )['total'] or Decimal('0.00')
+    @staticmethod
+    def aplicar_diferencias(diferencias):
+        """
+        Suma a cada cliente su diferencia de pedidos y de total gastado con F(),
+        en orden de id_cliente para no interbloquear con otras transacciones
+        
+        Args:
+            diferencias: Dict {id_cliente: (pedidos, total)}
+        """
+        cambiados = []
+        for id_cliente, (pedidos, total) in sorted(diferencias.items()):
+            if pedidos or total:
+                Cliente.objects.filter(id_cliente=id_cliente).update(
+                    num_pedidos=models.F('num_pedidos') + pedidos,
+                    total_gastado=models.F('total_gastado') + total
+                )
+                cambiados.append(id_cliente)
+        cache_clientes.invalidar(cambiados)
 
 
 class Producto(models.Model):
@@ -56,14 +79,46 @@ class Producto(models.Model):
     activo = models.BooleanField(default=True, verbose_name="Producto activo")
     fecha_creacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
     # ======================
+    # Suma de las cantidades en 'detalle_pedido', mantenida al reservar stock y
+    # por DetallePedido.save y su señal post_delete; la corrige
+    # `python manage.py refrescar_estadisticas --completo`
+    unidades_vendidas = models.PositiveIntegerField(default=0, verbose_name="Unidades vendidas")
+    
     class Meta:
         db_table = 'productos'
         verbose_name = "Producto"
         verbose_name_plural = "Productos"
         ordering = ['id_producto']
+        indexes = [
+            # Productos más vendidos del snapshot de estadísticas; los que no
+            # se han vendido nunca quedan fuera del índice
+            models.Index(
+                fields=['-unidades_vendidas', 'id_producto'], name='productos_mas_vendidos_idx',
+                condition=models.Q(unidades_vendidas__gt=0)
+            ),
+        ]
     
     def __str__(self):
         return f"{self.nombre} - ${self.precio}"
+    
+    @staticmethod
+    def aplicar_unidades(diferencias):
+        """
+        Suma a cada producto su diferencia de unidades vendidas con F(), en
+        orden de id_producto
+        
+        Args:
+            diferencias: Dict {id_producto: unidades}
+        """
+        for id_producto, unidades in sorted(diferencias.items()):
+            if unidades:
+                Producto.objects.filter(id_producto=id_producto).update(
+                    unidades_vendidas=models.F('unidades_vendidas') + unidades
+                )
+
+
+# Estados de pedido salvo 'entregado', donde acaba la gran mayoría
+ESTADOS_MINORITARIOS = ['pendiente', 'confirmado', 'en_proceso', 'enviado', 'cancelado']
 
 
 class Pedido(models.Model):
@@ -81,10 +136,12 @@ class Pedido(models.Model):
     ]
     
     id_pedido = models.AutoField(primary_key=True)
+    # Sin índice propio: lo cubre pedidos_cliente_fecha_idx
     id_cliente = models.ForeignKey(
         Cliente, 
         on_delete=models.CASCADE, 
         related_name='pedidos',
+        db_index=False,
         verbose_name="Cliente"
     )
     fecha_pedido = models.DateTimeField(auto_now_add=True, verbose_name="Fecha del pedido")
@@ -110,12 +167,84 @@ class Pedido(models.Model):
         verbose_name = "Pedido"
         verbose_name_plural = "Pedidos"
         ordering = ['id_pedido']
+        indexes = [
+            # Pedidos de un cliente del más reciente al más antiguo; 'total'
+            # incluido para sumar los totales del cliente sin leer la tabla
+            models.Index(
+                fields=['id_cliente', '-fecha_pedido'], name='pedidos_cliente_fecha_idx', include=['total']
+            ),
+            # Pedidos de hoy (rango sobre fecha_pedido) y filtro por fecha del admin
+            models.Index(fields=['fecha_pedido'], name='pedidos_fecha_idx'),
+            # Filtro por estado del admin, ordenado por id; 'entregado' cubre casi
+            # toda la tabla y se resuelve mejor recorriéndola
+            models.Index(
+                fields=['estado', 'id_pedido'], name='pedidos_estado_idx',
+                condition=models.Q(estado__in=ESTADOS_MINORITARIOS)
+            ),
+        ]
     
     def __str__(self):
         return f"Pedido #{self.id_pedido} - {self.id_cliente.nombre}"
     
+    def save(self, *args, **kwargs):
+        """Guarda el pedido y suma al cliente la diferencia de pedidos y total"""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not {'total', 'id_cliente'} & set(update_fields):
+            super().save(*args, **kwargs)
+            return
+        
+        with transaction.atomic(savepoint=False):
+            anterior = None
+            if not self._state.adding:
+                # Bloquea la fila para que dos guardados a la vez no cuenten la misma diferencia
+                anterior = Pedido.objects.select_for_update().filter(
+                    id_pedido=self.id_pedido
+                ).values_list('id_cliente_id', 'total').first()
+            super().save(*args, **kwargs)
+            
+            total = Decimal(str(self.total))
+            diferencias = {}
+            if anterior is None:
+                diferencias[self.id_cliente_id] = (1, total)
+            elif anterior[0] != self.id_cliente_id:
+                diferencias[anterior[0]] = (-1, -anterior[1])
+                diferencias[self.id_cliente_id] = (1, total)
+            else:
+                diferencias[self.id_cliente_id] = (0, total - anterior[1])
+            Cliente.aplicar_diferencias(diferencias)
+    
+    @staticmethod
+    def aplicar_subtotales(diferencias):
+        """
+        Suma a cada pedido su diferencia de total, en orden de id_pedido, y
+        la misma diferencia al total gastado de su cliente
+        
+        Args:
+            diferencias: Dict {id_pedido: importe}
+        """
+        clientes = {}
+        with connection.cursor() as cursor:
+            for id_pedido, importe in sorted(diferencias.items()):
+                if not importe:
+                    continue
+                # RETURNING da el cliente actual del pedido sin otra consulta
+                cursor.execute(
+                    "UPDATE pedidos SET total = total + %s WHERE id_pedido = %s RETURNING id_cliente_id",
+                    [importe, id_pedido]
+                )
+                fila = cursor.fetchone()
+                if fila is not None:
+                    clientes[fila[0]] = (0, clientes.get(fila[0], (0, Decimal('0.00')))[1] + importe)
+        Cliente.aplicar_diferencias(clientes)
+    
     def calcular_total(self):
-        """Calcula el total del pedido basado en los detalles"""
+        """
+        Recalcula el total del pedido desde sus detalles y lo guarda
+        
+        Los detalles mantienen el total con diferencias al guardarse o
+        borrarse; esto solo repara un pedido desviado (para todos, ver
+        `python manage.py recalcular_totales_pedidos`).
+        """
         total = self.detalles.aggregate(
             total=models.Sum('subtotal')
         )['total'] or Decimal('0.00')
@@ -130,15 +259,19 @@ class DetallePedido(models.Model):
     Almacena los detalles de cada pedido
     """
     id_detalle = models.AutoField(primary_key=True)
+    # Sin índice propio: lo cubre el índice único (id_pedido, id_producto)
     id_pedido = models.ForeignKey(
         Pedido, 
         on_delete=models.CASCADE, 
         related_name='detalles',
+        db_index=False,
         verbose_name="Pedido"
     )
+    # Sin índice propio: lo cubre detalle_producto_cantidad_idx
     id_producto = models.ForeignKey(
         Producto, 
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name="Producto"
     )
     cantidad = models.PositiveIntegerField(
@@ -157,22 +290,210 @@ class DetallePedido(models.Model):
         verbose_name="Precio unitario"
     )
     # ======================
+    # Copia de la fecha del pedido: con las tablas particionadas
+    # (`ecommerce.particiones`) es la clave que deja cada línea en la
+    # partición de su pedido
+    fecha_pedido = models.DateTimeField(editable=False, verbose_name="Fecha del pedido")
+    # Unidades de la línea descontadas del stock al crear el pedido
+    # (`InventarioService.reservar`): la cancelación devuelve solo estas. Las
+    # líneas agregadas desde el admin y los pedidos anteriores a la reserva
+    # de stock no reservaron nada y quedan en 0 (también en la base, para los
+    # INSERT en SQL que no la nombran)
+    cantidad_reservada = models.PositiveIntegerField(
+        default=0, db_default=0, editable=False, verbose_name="Cantidad reservada"
+    )
     
     class Meta:
         db_table = 'detalle_pedido'
         verbose_name = "Detalle de Pedido"
         verbose_name_plural = "Detalles de Pedidos"
         unique_together = ['id_pedido', 'id_producto']
+        indexes = [
+            # Unidades vendidas por producto (SUM(cantidad) agrupado por
+            # id_producto) sin leer la tabla
+            models.Index(fields=['id_producto'], name='detalle_producto_cantidad_idx', include=['cantidad']),
+        ]
     
     def __str__(self):
         return f"{self.cantidad}x {self.id_producto.nombre} - ${self.subtotal}"
     
     def save(self, *args, **kwargs):
-        """Calcula automáticamente el subtotal antes de guardar"""
+        """
+        Calcula el subtotal y suma la diferencia de la línea a las unidades
+        vendidas del producto y al total del pedido (y de su cliente), sin
+        volver a sumar las demás líneas
+        """
         if not self.precio_unitario:
             self.precio_unitario = self.id_producto.precio
-        self.subtotal = self.precio_unitario * self.cantidad
-        super().save(*args, **kwargs)
+        self.subtotal = Decimal(str(self.precio_unitario)) * self.cantidad
+        
+        with transaction.atomic(savepoint=False):
+            anterior = None
+            if not self._state.adding:
+                anterior = DetallePedido.objects.select_for_update().filter(
+                    id_detalle=self.id_detalle
+                ).values_list('id_pedido_id', 'id_producto_id', 'cantidad', 'subtotal').first()
+            if self.fecha_pedido is None or (anterior is not None and anterior[0] != self.id_pedido_id):
+                self.fecha_pedido = self.id_pedido.fecha_pedido
+            super().save(*args, **kwargs)
+            
+            unidades = {self.id_producto_id: self.cantidad}
+            subtotales = {self.id_pedido_id: self.subtotal}
+            if anterior is not None:
+                unidades[anterior[1]] = unidades.get(anterior[1], 0) - anterior[2]
+                subtotales[anterior[0]] = subtotales.get(anterior[0], Decimal('0.00')) - anterior[3]
+            Producto.aplicar_unidades(unidades)
+            Pedido.aplicar_subtotales(subtotales)
         
-        # Recalcula el total del pedido
-        self.id_pedido.calcular_total()
+        # El pedido en memoria, si se cargó, queda con el total guardado
+        if DetallePedido.id_pedido.is_cached(self):
+            self.id_pedido.total += subtotales[self.id_pedido_id]
+
+
+class PedidoArchivado(models.Model):
+    """
+    Modelo para la tabla 'pedidos_archivo' en PostgreSQL
+    Pedidos antiguos ya cerrados, sacados de 'pedidos' y 'detalle_pedido'
+    (ver `ecommerce.archivo_pedidos`): una fila por pedido con sus líneas
+    en una lista JSON de valores en el orden de COLUMNAS_DETALLE
+    """
+    COLUMNAS_DETALLE = [
+        'id_detalle', 'id_producto', 'nombre', 'precio', 'cantidad', 'precio_unitario', 'subtotal'
+    ]
+    
+    id_pedido = models.IntegerField(primary_key=True, verbose_name="ID del pedido")
+    # Sin índice propio: lo cubre archivo_cliente_fecha_idx
+    id_cliente = models.ForeignKey(
+        Cliente,
+        on_delete=models.CASCADE,
+        related_name='pedidos_archivados',
+        db_index=False,
+        verbose_name="Cliente"
+    )
+    fecha_pedido = models.DateTimeField(verbose_name="Fecha del pedido")
+    total = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Total del pedido")
+    estado = models.CharField(max_length=20, choices=Pedido.ESTADOS_PEDIDO, verbose_name="Estado del pedido")
+    direccion_envio = models.TextField(verbose_name="Dirección de envío")
+    metodo_pago = models.CharField(max_length=50, verbose_name="Método de pago")
+    # Sin claves repetidas en cada línea: ocupa menos que una lista de objetos
+    detalles = models.JSONField(default=list, verbose_name="Líneas del pedido")
+    fecha_archivado = models.DateTimeField(verbose_name="Archivado el")
+    
+    class Meta:
+        db_table = 'pedidos_archivo'
+        verbose_name = "Pedido archivado"
+        verbose_name_plural = "Pedidos archivados"
+        ordering = ['id_pedido']
+        indexes = [
+            # Pedidos archivados de un cliente y su suma al recalcular sus totales
+            models.Index(
+                fields=['id_cliente', '-fecha_pedido'], name='archivo_cliente_fecha_idx', include=['total']
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Pedido archivado #{self.id_pedido}"
+    
+    def lineas(self):
+        """Líneas del pedido como diccionarios con las claves de COLUMNAS_DETALLE"""
+        return [dict(zip(self.COLUMNAS_DETALLE, linea)) for linea in self.detalles]
+    
+    def unidades(self):
+        """Unidades de cada producto en las líneas del pedido: Dict {id_producto: unidades}"""
+        unidades = {}
+        for linea in self.lineas():
+            unidades[linea["id_producto"]] = unidades.get(linea["id_producto"], 0) + linea["cantidad"]
+        return unidades
+
+
+class UnidadesArchivadas(models.Model):
+    """
+    Modelo para la tabla 'unidades_archivadas' en PostgreSQL
+    Unidades vendidas de cada producto en pedidos archivados, que siguen
+    contando en `Producto.unidades_vendidas`
+    """
+    id_producto = models.OneToOneField(
+        Producto,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='unidades_archivadas',
+        verbose_name="Producto"
+    )
+    unidades = models.PositiveBigIntegerField(default=0, verbose_name="Unidades archivadas")
+    
+    class Meta:
+        db_table = 'unidades_archivadas'
+        verbose_name = "Unidades archivadas"
+        verbose_name_plural = "Unidades archivadas"
+    
+    def __str__(self):
+        return f"{self.unidades} uds. archivadas - producto {self.id_producto_id}"
+    
+    @staticmethod
+    def aplicar_unidades(diferencias):
+        """
+        Suma a cada producto su diferencia de unidades archivadas con F(), en
+        orden de id_producto
+        
+        Args:
+            diferencias: Dict {id_producto: unidades}
+        """
+        for id_producto, unidades in sorted(diferencias.items()):
+            if unidades:
+                UnidadesArchivadas.objects.filter(id_producto=id_producto).update(
+                    unidades=models.F('unidades') + unidades
+                )
+
+
+class EstadisticasSnapshot(models.Model):
+    """
+    Modelo para la tabla 'estadisticas_snapshot' en PostgreSQL
+    Una sola fila con las estadísticas del panel ya calculadas
+    (ver `ecommerce.estadisticas`)
+    """
+    id_snapshot = models.PositiveSmallIntegerField(primary_key=True, default=1)
+    datos = models.JSONField(default=dict, verbose_name="Estadísticas")
+    fecha_calculo = models.DateTimeField(verbose_name="Calculadas el")
+    fecha_mongo = models.DateTimeField(null=True, blank=True, verbose_name="Estadísticas de MongoDB del")
+    
+    class Meta:
+        db_table = 'estadisticas_snapshot'
+        verbose_name = "Estadísticas del panel"
+        verbose_name_plural = "Estadísticas del panel"
+    
+    def __str__(self):
+        return f"Estadísticas al {self.fecha_calculo:%Y-%m-%d %H:%M:%S}"
+
+
+class EventoOutbox(models.Model):
+    """
+    Modelo para la tabla 'outbox_mongo' en PostgreSQL
+    Escrituras pendientes hacia MongoDB, guardadas en la misma transacción
+    que los datos de PostgreSQL y aplicadas después por el relay
+    (`python manage.py relay_outbox_mongo`)
+    """
+    TIPOS_EVENTO = [
+        ('crear_documento', 'Crear documento'),
+        ('agregar_comentario', 'Agregar comentario'),
+        ('actualizar_preferencias', 'Actualizar preferencias'),
+    ]
+    
+    id_evento = models.BigAutoField(primary_key=True)
+    id_cliente = models.IntegerField(verbose_name="ID del cliente")
+    tipo = models.CharField(max_length=30, choices=TIPOS_EVENTO, verbose_name="Tipo de evento")
+    datos = models.JSONField(default=dict, verbose_name="Datos")
+    fecha_creacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de creación")
+    intentos = models.PositiveIntegerField(default=0, verbose_name="Intentos fallidos")
+    ultimo_error = models.TextField(blank=True, verbose_name="Último error")
+    # Tras un fallo, el relay no reintenta el evento (ni los posteriores de su
+    # cliente) antes de esta fecha
+    proximo_intento = models.DateTimeField(null=True, blank=True, verbose_name="Próximo intento")
+    
+    class Meta:
+        db_table = 'outbox_mongo'
+        verbose_name = "Evento pendiente de MongoDB"
+        verbose_name_plural = "Eventos pendientes de MongoDB"
+        ordering = ['id_evento']
+    
+    def __str__(self):
+        return f"Evento #{self.id_evento} - {self.tipo} cliente {self.id_cliente}"
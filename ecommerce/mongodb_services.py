@@ -3,47 +3,396 @@ Servicios para manejar datos no estructurados en MongoDB
 Incluye operaciones para comentarios y preferencias de clientes
 """
 
+import hashlib
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, List, Optional, Any
+import bson
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from client_sync.mongodb import get_mongodb_collection
+from .cache_clientes import cache_clientes
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+PREFERENCIAS_POR_DEFECTO = {
+    "idioma": "ES",
+    "metodo_pago": "Tarjeta de crédito",
+    "notificaciones": True
+}
+
+MODO_COMENTARIOS_EMBEBIDO = 'embebido'
+MODO_COMENTARIOS_BUCKETS = 'buckets'
+
+
+def bulk_write_con_reintento(collection, operaciones: List[UpdateOne]) -> List[int]:
+    """
+    Ejecuta un bulk_write no ordenado de upserts, reintentando una vez las
+    operaciones rechazadas por clave duplicada (dos upserts concurrentes que
+    intentaron insertar el mismo documento)
+    
+    Args:
+        collection: Colección de MongoDB
+        operaciones: Operaciones a ejecutar
+        
+    Returns:
+        List[int]: Índices (en `operaciones`) de las operaciones que fallaron
+    """
+    if not operaciones:
+        return []
+    try:
+        collection.bulk_write(operaciones, ordered=False)
+        return []
+    except BulkWriteError as e:
+        errores = e.details.get("writeErrors", [])
+    
+    fallidas = [error["index"] for error in errores if error.get("code") != 11000]
+    reintentos = [error["index"] for error in errores if error.get("code") == 11000]
+    if reintentos:
+        try:
+            collection.bulk_write([operaciones[i] for i in reintentos], ordered=False)
+        except BulkWriteError as e:
+            fallidas.extend(reintentos[error["index"]] for error in e.details.get("writeErrors", []))
+    return sorted(fallidas)
+
+
+class ComentariosBucketService:
+    """
+    Servicio para guardar comentarios con el patrón bucket: cada cliente tiene
+    varios documentos de tamaño fijo en su propia colección, en lugar de un
+    único arreglo que crece sin límite dentro de 'clientes_info'
+    """
+    
+    collection_name = 'clientes_comentarios'
+    
+    # Máximo de ids por consulta $in en las lecturas por lotes
+    bulk_chunk_size = 1000
+    
+    @property
+    def collection(self):
+        """Colección de MongoDB; la conexión se abre en el primer uso dentro de cada proceso"""
+        return get_mongodb_collection(self.collection_name)
+    
+    @property
+    def comentarios_por_bucket(self) -> int:
+        """Capacidad de cada bucket (MONGO_COMENTARIOS_POR_BUCKET)"""
+        return getattr(settings, 'MONGO_COMENTARIOS_POR_BUCKET', 200)
+    
+    def _filtro_y_update(self, id_cliente: int, comentario: Dict[str, Any]):
+        """Upsert que agrega un comentario al bucket abierto del cliente o abre uno nuevo"""
+        filtro = {"id_cliente": id_cliente, "total": {"$lt": self.comentarios_por_bucket}}
+        update = {
+            "$push": {"comentarios": comentario},
+            "$inc": {"total": 1},
+            "$min": {"fecha_inicio": comentario["fecha"]},
+            "$max": {"fecha_fin": comentario["fecha"]}
+        }
+        return filtro, update
+    
+    def operacion_agregar(self, id_cliente: int, comentario: Dict[str, Any]) -> UpdateOne:
+        """Operación de bulk_write equivalente a `agregar`"""
+        filtro, update = self._filtro_y_update(id_cliente, comentario)
+        return UpdateOne(filtro, update, upsert=True)
+    
+    def eventos_guardados(self, ids_cliente: List[int], ids_evento: List[int]) -> set:
+        """
+        Ids de evento del outbox (`id_evento` de cada comentario) que ya están
+        en algún bucket de los clientes dados, para no repetirlos al reintentar
+        
+        Returns:
+            set: ids_evento ya guardados
+        """
+        if not ids_evento:
+            return set()
+        buscados = set(ids_evento)
+        guardados = set()
+        cursor = self.collection.find(
+            {"id_cliente": {"$in": ids_cliente}, "comentarios.id_evento": {"$in": list(buscados)}},
+            {"_id": 0, "comentarios.id_evento": 1}
+        )
+        for bucket in cursor:
+            guardados.update(
+                c["id_evento"] for c in bucket.get("comentarios", []) if c.get("id_evento") in buscados
+            )
+        return guardados
+    
+    def agregar(self, id_cliente: int, comentario: Dict[str, Any]):
+        """
+        Agrega un comentario al bucket abierto del cliente; si no hay ninguno
+        con espacio, el upsert crea uno nuevo
+        
+        Args:
+            id_cliente: ID del cliente en PostgreSQL
+            comentario: Comentario con 'texto' y 'fecha'
+        """
+        filtro, update = self._filtro_y_update(id_cliente, comentario)
+        return self.collection.update_one(filtro, update, upsert=True)
+    
+    def agregar_historicos(self, id_cliente: int, comentarios: List[Dict[str, Any]]) -> int:
+        """
+        Guarda en buckets llenos una lista de comentarios ya existentes
+        (usado por la migración desde el arreglo embebido)
+        
+        Es idempotente: repetirlo con los mismos comentarios reescribe los
+        mismos buckets en lugar de duplicarlos.
+        
+        Args:
+            id_cliente: ID del cliente en PostgreSQL
+            comentarios: Comentarios en orden cronológico
+            
+        Returns:
+            int: Número de buckets escritos
+        """
+        operaciones = self.operaciones_historicos(id_cliente, comentarios)
+        if operaciones:
+            self.collection.bulk_write(operaciones, ordered=True)
+        return len(operaciones)
+    
+    def operaciones_historicos(self, id_cliente: int, comentarios: List[Dict[str, Any]]) -> List[ReplaceOne]:
+        """Upserts de bulk_write equivalentes a `agregar_historicos`"""
+        return [
+            ReplaceOne({"_id": bucket["_id"]}, bucket, upsert=True)
+            for bucket in self._construir_historicos(id_cliente, comentarios)
+        ]
+    
+    @staticmethod
+    def _id_historico(id_cliente: int, bloque: List[Dict[str, Any]]) -> str:
+        """_id determinista de un bucket histórico: el mismo bloque de comentarios da el mismo _id"""
+        resumen = hashlib.sha1(bson.encode({"comentarios": bloque})).hexdigest()
+        return f"historico-{id_cliente}-{resumen}"
+    
+    def _construir_historicos(self, id_cliente: int, comentarios: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Buckets llenos con los comentarios dados, en orden cronológico"""
+        capacidad = self.comentarios_por_bucket
+        buckets = []
+        for inicio in range(0, len(comentarios), capacidad):
+            bloque = comentarios[inicio:inicio + capacidad]
+            fechas = [comentario.get("fecha") for comentario in bloque if comentario.get("fecha")]
+            buckets.append({
+                "_id": self._id_historico(id_cliente, bloque),
+                "id_cliente": id_cliente,
+                "comentarios": bloque,
+                # Se marcan como llenos para que los nuevos comentarios abran otro bucket
+                "total": capacidad,
+                "fecha_inicio": min(fechas) if fechas else None,
+                "fecha_fin": max(fechas) if fechas else None,
+            })
+        return buckets
+    
+    def obtener(
+        self,
+        id_cliente: int,
+        limit: Optional[int] = None,
+        before: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Obtiene los comentarios de un cliente en orden cronológico, leyendo
+        solo los buckets más recientes necesarios para completar `limit`
+        
+        Args:
+            id_cliente: ID del cliente en PostgreSQL
+            limit: Número máximo de comentarios (los más recientes); None devuelve todos
+            before: Si se indica, solo comentarios con fecha anterior
+            
+        Returns:
+            List[Dict]: Lista de comentarios
+        """
+        comentarios = []
+        cursor = self._cursor_buckets(id_cliente, before)
+        for bucket in cursor:
+            comentarios.extend(self._comentarios_del_bucket(bucket, before))
+            if limit is not None and len(comentarios) >= limit:
+                break
+        cursor.close()
+        return self._ordenar_y_recortar(comentarios, limit)
+    
+    def _cursor_buckets(self, id_cliente: int, before: Optional[datetime]):
+        """Buckets del cliente, del más reciente al más antiguo"""
+        filtro = {"id_cliente": id_cliente}
+        if before is not None:
+            filtro["fecha_inicio"] = {"$lt": before}
+        return self.collection.find(
+            filtro,
+            {"_id": 0, "comentarios": 1}
+        ).sort("fecha_fin", DESCENDING)
+    
+    @staticmethod
+    def _comentarios_del_bucket(bucket: Dict[str, Any], before: Optional[datetime]) -> List[Dict[str, Any]]:
+        bloque = bucket.get("comentarios", [])
+        if before is not None:
+            bloque = [c for c in bloque if c.get("fecha") and c["fecha"] < before]
+        return bloque
+    
+    @staticmethod
+    def _ordenar_y_recortar(comentarios: List[Dict[str, Any]], limit: Optional[int]) -> List[Dict[str, Any]]:
+        """Ordena cronológicamente y deja los últimos `limit`"""
+        comentarios.sort(key=lambda c: c.get("fecha") or datetime.min)
+        if limit is not None:
+            comentarios = comentarios[-limit:] if limit > 0 else []
+        return comentarios
+    
+    def obtener_bulk(self, ids_cliente: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Obtiene todos los comentarios de varios clientes con una consulta $in por bloque
+        
+        Args:
+            ids_cliente: IDs de los clientes en PostgreSQL
+            
+        Returns:
+            Dict: Comentarios en orden cronológico indexados por id_cliente
+        """
+        resultado: Dict[int, List[Dict[str, Any]]] = {}
+        for inicio in range(0, len(ids_cliente), self.bulk_chunk_size):
+            bloque = ids_cliente[inicio:inicio + self.bulk_chunk_size]
+            cursor = self.collection.find(
+                {"id_cliente": {"$in": bloque}},
+                {"_id": 0, "id_cliente": 1, "comentarios": 1}
+            )
+            for bucket in cursor:
+                resultado.setdefault(bucket["id_cliente"], []).extend(bucket.get("comentarios", []))
+        for comentarios in resultado.values():
+            comentarios.sort(key=lambda c: c.get("fecha") or datetime.min)
+        return resultado
+    
+    def eliminar(self, id_cliente: int) -> int:
+        """
+        Elimina todos los buckets de un cliente
+        
+        Returns:
+            int: Número de buckets eliminados
+        """
+        return self.collection.delete_many({"id_cliente": id_cliente}).deleted_count
+    
+    def contar_por_cliente(self):
+        """
+        Cursor con el total de comentarios en buckets de cada cliente
+        
+        Returns:
+            Cursor de documentos {"_id": id_cliente, "total": n}
+        """
+        return self.collection.aggregate([
+            {"$group": {"_id": "$id_cliente", "total": {"$sum": {"$size": "$comentarios"}}}}
+        ], allowDiskUse=True)
+
+
 class ClienteInfoService:
     """
     Servicio para manejar información no estructurada de clientes en MongoDB
+    
+    Los comentarios se guardan embebidos en 'clientes_info' o en buckets
+    ('clientes_comentarios') según MONGO_COMENTARIOS_MODO; la interfaz es la misma.
     """
     
-    def __init__(self):
-        self.collection = get_mongodb_collection('clientes_info')
+    collection_name = 'clientes_info'
+    
+    # Máximo de ids por consulta $in en las lecturas por lotes
+    bulk_chunk_size = 1000
+    
+    def __init__(self, modo_comentarios: Optional[str] = None):
+        self._modo_comentarios = modo_comentarios
+        self.buckets = ComentariosBucketService()
+    
+    @property
+    def collection(self):
+        """Colección de MongoDB; la conexión se abre en el primer uso dentro de cada proceso"""
+        return get_mongodb_collection(self.collection_name)
+    
+    @property
+    def modo_comentarios(self) -> str:
+        """Modo de almacenamiento de comentarios: 'embebido' o 'buckets'"""
+        return self._modo_comentarios or getattr(
+            settings, 'MONGO_COMENTARIOS_MODO', MODO_COMENTARIOS_EMBEBIDO
+        )
+    
+    @property
+    def usa_buckets(self) -> bool:
+        return self.modo_comentarios == MODO_COMENTARIOS_BUCKETS
+    
+    @property
+    def lee_embebidos(self) -> bool:
+        """
+        En modo buckets, si se leen también los comentarios que siguen en el
+        arreglo embebido (MONGO_COMENTARIOS_LEER_EMBEBIDOS, hasta terminar
+        `migrar_comentarios_buckets`)
+        """
+        return self.usa_buckets and getattr(settings, 'MONGO_COMENTARIOS_LEER_EMBEBIDOS', True)
+    
+    @staticmethod
+    def _combinar_comentarios(
+        embebidos: List[Dict[str, Any]],
+        de_buckets: List[Dict[str, Any]],
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Une los comentarios aún embebidos con los de buckets; los que ya se
+        copiaron a un bucket pero no se quitaron del arreglo aparecen una vez
+        """
+        en_buckets = {(c.get("fecha"), c.get("texto")) for c in de_buckets}
+        comentarios = de_buckets + [c for c in embebidos if (c.get("fecha"), c.get("texto")) not in en_buckets]
+        return ComentariosBucketService._ordenar_y_recortar(comentarios, limit)
+    
+    @staticmethod
+    def _proyeccion(fields: Optional[List[str]]) -> Optional[Dict[str, int]]:
+        """Proyección de MongoDB para los campos pedidos (siempre incluye id_cliente)"""
+        if fields is None:
+            return None
+        projection = {campo: 1 for campo in fields}
+        projection["id_cliente"] = 1
+        if "_id" not in fields:
+            projection["_id"] = 0
+        return projection
+    
+    def _valores_iniciales(self, *excluir: str) -> Dict[str, Any]:
+        """
+        Campos de un documento nuevo, para el $setOnInsert de los upserts
+        
+        Args:
+            excluir: Campos que la misma operación ya modifica ($set/$push) y
+                que por tanto no pueden repetirse en $setOnInsert
+        """
+        valores = {
+            "comentarios": [],
+            "num_comentarios": 0,
+            "preferencias": dict(PREFERENCIAS_POR_DEFECTO),
+            "fecha_creacion": datetime.utcnow()
+        }
+        for campo in excluir:
+            valores.pop(campo, None)
+        return valores
+    
+    def _upsert(self, id_cliente: int, update: Dict[str, Any]):
+        """
+        update_one con upsert sobre el documento del cliente, en un solo viaje
+        
+        Si dos primeras escrituras concurrentes intentan insertar a la vez, el
+        índice único de id_cliente rechaza una de ellas; el reintento encuentra
+        ya el documento y aplica la actualización sobre él.
+        """
+        try:
+            return self.collection.update_one({"id_cliente": id_cliente}, update, upsert=True)
+        except DuplicateKeyError:
+            return self.collection.update_one({"id_cliente": id_cliente}, update, upsert=True)
     
     def crear_documento_cliente(self, id_cliente: int) -> bool:
         """
-        Crea un documento inicial para un cliente en MongoDB
+        Crea un documento inicial para un cliente en MongoDB (no hace nada si ya existe)
         
         Args:
             id_cliente: ID del cliente en PostgreSQL
             
         Returns:
-            bool: True si se creó exitosamente, False en caso contrario
+            bool: True si el documento existe al terminar, False en caso de error
         """
         try:
-            documento = {
-                "id_cliente": id_cliente,
-                "comentarios": [],
-                "preferencias": {
-                    "idioma": "ES",
-                    "metodo_pago": "Tarjeta de crédito",
-                    "notificaciones": True
-                },
-                "fecha_creacion": datetime.utcnow(),
-                "ultima_actualizacion": datetime.utcnow()
-            }
+            valores = self._valores_iniciales()
+            valores["ultima_actualizacion"] = valores["fecha_creacion"]
             
-            result = self.collection.insert_one(documento)
-            logger.info(f"Documento creado para cliente {id_cliente} con ID: {result.inserted_id}")
+            result = self._upsert(id_cliente, {"$setOnInsert": valores})
+            if result.upserted_id is not None:
+                cache_clientes.invalidar([id_cliente])
+                logger.info(f"Documento creado para cliente {id_cliente} con ID: {result.upserted_id}")
             return True
             
         except Exception as e:
@@ -52,7 +401,8 @@ class ClienteInfoService:
     
     def agregar_comentario(self, id_cliente: int, texto: str) -> bool:
         """
-        Agrega un comentario al cliente
+        Agrega un comentario al cliente; si aún no tiene documento, se crea
+        con los valores por defecto en la misma operación
         
         Args:
             id_cliente: ID del cliente en PostgreSQL
@@ -67,17 +417,10 @@ class ClienteInfoService:
                 "fecha": datetime.utcnow()
             }
             
-            result = self.collection.update_one(
-                {"id_cliente": id_cliente},
-                {
-                    "$push": {"comentarios": comentario},
-                    "$set": {"ultima_actualizacion": datetime.utcnow()}
-                }
-            )
-            
-            if result.matched_count == 0:
-                # Si no existe el documento, lo creamos
-                return self.crear_documento_cliente(id_cliente)
+            if self.usa_buckets:
+                self.buckets.agregar(id_cliente, comentario)
+            self._upsert(id_cliente, self._update_comentarios([comentario]))
+            cache_clientes.invalidar([id_cliente])
             
             logger.info(f"Comentario agregado para cliente {id_cliente}")
             return True
@@ -86,29 +429,230 @@ class ClienteInfoService:
             logger.error(f"Error al agregar comentario para cliente {id_cliente}: {e}")
             return False
     
-    def obtener_comentarios(self, id_cliente: int) -> List[Dict[str, Any]]:
+    def _update_comentarios(self, comentarios: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Actualización del documento del cliente al agregar comentarios: mantiene
+        el contador num_comentarios y, en modo embebido, agrega los comentarios
+        al arreglo (en modo buckets van en su propia colección)
+        """
+        if self.usa_buckets:
+            return {
+                "$inc": {"num_comentarios": len(comentarios)},
+                "$set": {"ultima_actualizacion": datetime.utcnow()},
+                "$setOnInsert": self._valores_iniciales("num_comentarios")
+            }
+        return {
+            "$push": {"comentarios": {"$each": comentarios}},
+            "$inc": {"num_comentarios": len(comentarios)},
+            "$set": {"ultima_actualizacion": datetime.utcnow()},
+            "$setOnInsert": self._valores_iniciales("comentarios", "num_comentarios")
+        }
+    
+    def agregar_comentarios_bulk(self, comentarios_por_cliente: Dict[int, List[Dict[str, Any]]]) -> int:
+        """
+        Agrega comentarios de varios clientes con un bulk_write no ordenado de upserts
+        
+        Args:
+            comentarios_por_cliente: Comentarios ('texto' y 'fecha') en orden
+                cronológico, indexados por id_cliente
+            
+        Returns:
+            int: Número de comentarios guardados
+        """
+        ids = [id_cliente for id_cliente, comentarios in comentarios_por_cliente.items() if comentarios]
+        total = sum(len(comentarios_por_cliente[id_cliente]) for id_cliente in ids)
+        try:
+            operaciones = [
+                UpdateOne({"id_cliente": id_cliente}, self._update_comentarios(comentarios_por_cliente[id_cliente]), upsert=True)
+                for id_cliente in ids
+            ]
+            
+            if self.usa_buckets:
+                operaciones_buckets = []
+                for id_cliente in ids:
+                    for comentario in comentarios_por_cliente[id_cliente]:
+                        operaciones_buckets.append(self.buckets.operacion_agregar(id_cliente, comentario))
+                fallidas = bulk_write_con_reintento(self.buckets.collection, operaciones_buckets)
+                # El documento principal solo guarda la fecha de actualización
+                bulk_write_con_reintento(self.collection, operaciones)
+                perdidos = len(fallidas)
+            else:
+                fallidas = bulk_write_con_reintento(self.collection, operaciones)
+                perdidos = sum(len(comentarios_por_cliente[ids[i]]) for i in fallidas)
+            cache_clientes.invalidar(ids)
+            
+            if perdidos:
+                logger.error(f"No se pudieron guardar {perdidos} de {total} comentarios")
+            return total - perdidos
+            
+        except Exception as e:
+            logger.error(f"Error al agregar {total} comentarios por lotes: {e}")
+            return 0
+    
+    def operacion_outbox(
+        self,
+        id_cliente: int,
+        id_evento: int,
+        comentarios: List[Dict[str, Any]],
+        preferencias: Optional[Dict[str, Any]]
+    ) -> UpdateOne:
         """
-        Obtiene todos los comentarios de un cliente
+        Operación de bulk_write que aplica de una vez varios eventos del outbox
+        de un cliente (comentarios en orden y las últimas preferencias)
+        
+        El documento guarda en `ultimo_evento` el mayor evento aplicado y el
+        filtro excluye los documentos que ya lo tienen, de modo que reintentar
+        la operación no duplica comentarios.
         
         Args:
             id_cliente: ID del cliente en PostgreSQL
+            id_evento: Mayor id_evento incluido en la operación
+            comentarios: Comentarios a agregar ('texto' y 'fecha')
+            preferencias: Nuevas preferencias, o None si no cambian
+        """
+        update: Dict[str, Any] = {
+            "$set": {"ultima_actualizacion": datetime.utcnow(), "ultimo_evento": id_evento}
+        }
+        excluir = []
+        if comentarios:
+            update_comentarios = self._update_comentarios(comentarios)
+            update["$inc"] = update_comentarios["$inc"]
+            excluir.append("num_comentarios")
+            if "$push" in update_comentarios:
+                update["$push"] = update_comentarios["$push"]
+                excluir.append("comentarios")
+        if preferencias is not None:
+            update["$set"]["preferencias"] = self._update_preferencias(preferencias)["$set"]["preferencias"]
+            excluir.append("preferencias")
+        update["$setOnInsert"] = self._valores_iniciales(*excluir)
+        
+        filtro = {"id_cliente": id_cliente, "ultimo_evento": {"$not": {"$gte": id_evento}}}
+        return UpdateOne(filtro, update, upsert=True)
+    
+    def obtener_ultimos_eventos(self, ids_cliente: Iterable[int]) -> Dict[int, int]:
+        """
+        Mayor evento del outbox ya aplicado a cada cliente (ver `operacion_outbox`)
+        
+        A diferencia de las lecturas del servicio, los errores se propagan:
+        el relay no debe suponer que un evento está pendiente si no pudo
+        comprobarlo.
+        
+        Returns:
+            Dict: ultimo_evento por id_cliente; los clientes sin documento o
+            sin eventos aplicados no aparecen
+        """
+        ids = list(dict.fromkeys(ids_cliente))
+        ultimos = {}
+        for inicio in range(0, len(ids), self.bulk_chunk_size):
+            cursor = self.collection.find(
+                {"id_cliente": {"$in": ids[inicio:inicio + self.bulk_chunk_size]}, "ultimo_evento": {"$exists": True}},
+                {"_id": 0, "id_cliente": 1, "ultimo_evento": 1}
+            )
+            for documento in cursor:
+                ultimos[documento["id_cliente"]] = documento["ultimo_evento"]
+        return ultimos
+    
+    @staticmethod
+    def _proyeccion_comentarios(limit: Optional[int]) -> Dict[str, Any]:
+        """Proyección con los últimos `limit` comentarios ($slice)"""
+        comentarios = {"$slice": -limit} if limit is not None else 1
+        return {"_id": 0, "id_cliente": 1, "comentarios": comentarios}
+    
+    @staticmethod
+    def _pipeline_comentarios_anteriores(
+        id_cliente: int,
+        limit: Optional[int],
+        before: datetime
+    ) -> List[Dict[str, Any]]:
+        """Agregación con los últimos `limit` comentarios anteriores a `before`"""
+        anteriores = {
+            "$filter": {
+                "input": {"$ifNull": ["$comentarios", []]},
+                "as": "comentario",
+                "cond": {"$lt": ["$$comentario.fecha", before]}
+            }
+        }
+        if limit is not None:
+            anteriores = {"$slice": [anteriores, -limit]}
+        return [
+            {"$match": {"id_cliente": id_cliente}},
+            {"$limit": 1},
+            {"$project": {"_id": 0, "comentarios": anteriores}}
+        ]
+    
+    def _comentarios_embebidos(
+        self,
+        id_cliente: int,
+        limit: Optional[int],
+        before: Optional[datetime]
+    ) -> List[Dict[str, Any]]:
+        """Comentarios del arreglo embebido, recortados en el servidor"""
+        if before is None:
+            documento = self.collection.find_one(
+                {"id_cliente": id_cliente},
+                self._proyeccion_comentarios(limit)
+            )
+        else:
+            documento = next(self.collection.aggregate(
+                self._pipeline_comentarios_anteriores(id_cliente, limit, before)
+            ), None)
+        if documento:
+            return documento.get("comentarios", [])
+        return []
+    
+    def obtener_comentarios(
+        self,
+        id_cliente: int,
+        limit: Optional[int] = None,
+        before: Optional[datetime] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Obtiene los comentarios de un cliente, en orden cronológico
+        
+        El recorte se hace en el servidor ($slice), de modo que solo viajan
+        por la red los comentarios pedidos y no el documento completo.
+        
+        Args:
+            id_cliente: ID del cliente en PostgreSQL
+            limit: Número máximo de comentarios (los más recientes); None devuelve todos
+            before: Si se indica, solo comentarios con fecha anterior (para paginar hacia atrás)
             
         Returns:
             List[Dict]: Lista de comentarios
         """
         try:
-            documento = self.collection.find_one({"id_cliente": id_cliente})
-            if documento:
-                return documento.get("comentarios", [])
-            return []
+            if self.usa_buckets:
+                comentarios = self.buckets.obtener(id_cliente, limit=limit, before=before)
+                if not self.lee_embebidos:
+                    return comentarios
+                return self._combinar_comentarios(
+                    self._comentarios_embebidos(id_cliente, limit, before), comentarios, limit
+                )
+            return self._comentarios_embebidos(id_cliente, limit, before)
             
         except Exception as e:
             logger.error(f"Error al obtener comentarios para cliente {id_cliente}: {e}")
             return []
     
+    def _update_preferencias(self, preferencias: Dict[str, Any]) -> Dict[str, Any]:
+        """Actualización del documento del cliente al cambiar sus preferencias"""
+        # Validar estructura de preferencias
+        preferencias_validas = {
+            campo: preferencias.get(campo, valor)
+            for campo, valor in PREFERENCIAS_POR_DEFECTO.items()
+        }
+        return {
+            "$set": {
+                "preferencias": preferencias_validas,
+                "ultima_actualizacion": datetime.utcnow()
+            },
+            "$setOnInsert": self._valores_iniciales("preferencias")
+        }
+    
     def actualizar_preferencias(self, id_cliente: int, preferencias: Dict[str, Any]) -> bool:
         """
-        Actualiza las preferencias de un cliente
+        Actualiza las preferencias de un cliente; si aún no tiene documento,
+        se crea en la misma operación
         
         Args:
             id_cliente: ID del cliente en PostgreSQL
@@ -118,26 +662,8 @@ class ClienteInfoService:
             bool: True si se actualizó exitosamente, False en caso contrario
         """
         try:
-            # Validar estructura de preferencias
-            preferencias_validas = {
-                "idioma": preferencias.get("idioma", "ES"),
-                "metodo_pago": preferencias.get("metodo_pago", "Tarjeta de crédito"),
-                "notificaciones": preferencias.get("notificaciones", True)
-            }
-            
-            result = self.collection.update_one(
-                {"id_cliente": id_cliente},
-                {
-                    "$set": {
-                        "preferencias": preferencias_validas,
-                        "ultima_actualizacion": datetime.utcnow()
-                    }
-                }
-            )
-            
-            if result.matched_count == 0:
-                # Si no existe el documento, lo creamos
-                return self.crear_documento_cliente(id_cliente)
+            self._upsert(id_cliente, self._update_preferencias(preferencias))
+            cache_clientes.invalidar([id_cliente])
             
             logger.info(f"Preferencias actualizadas para cliente {id_cliente}")
             return True
@@ -146,6 +672,32 @@ class ClienteInfoService:
             logger.error(f"Error al actualizar preferencias para cliente {id_cliente}: {e}")
             return False
     
+    def actualizar_preferencias_bulk(self, preferencias_por_cliente: Dict[int, Dict[str, Any]]) -> int:
+        """
+        Actualiza las preferencias de varios clientes con un bulk_write no ordenado de upserts
+        
+        Args:
+            preferencias_por_cliente: Nuevas preferencias indexadas por id_cliente
+            
+        Returns:
+            int: Número de clientes actualizados
+        """
+        total = len(preferencias_por_cliente)
+        try:
+            operaciones = [
+                UpdateOne({"id_cliente": id_cliente}, self._update_preferencias(preferencias), upsert=True)
+                for id_cliente, preferencias in preferencias_por_cliente.items()
+            ]
+            fallidas = bulk_write_con_reintento(self.collection, operaciones)
+            cache_clientes.invalidar(preferencias_por_cliente)
+            if fallidas:
+                logger.error(f"No se pudieron actualizar las preferencias de {len(fallidas)} de {total} clientes")
+            return total - len(fallidas)
+            
+        except Exception as e:
+            logger.error(f"Error al actualizar preferencias de {total} clientes por lotes: {e}")
+            return 0
+    
     def obtener_preferencias(self, id_cliente: int) -> Dict[str, Any]:
         """
         Obtiene las preferencias de un cliente
@@ -157,7 +709,10 @@ class ClienteInfoService:
             Dict: Preferencias del cliente
         """
         try:
-            documento = self.collection.find_one({"id_cliente": id_cliente})
+            documento = self.collection.find_one(
+                {"id_cliente": id_cliente},
+                {"_id": 0, "preferencias": 1}
+            )
             if documento:
                 return documento.get("preferencias", {})
             return {}
@@ -166,23 +721,91 @@ class ClienteInfoService:
             logger.error(f"Error al obtener preferencias para cliente {id_cliente}: {e}")
             return {}
     
-    def obtener_info_completa(self, id_cliente: int) -> Optional[Dict[str, Any]]:
+    def _comentarios_documento(
+        self,
+        documento: Dict[str, Any],
+        de_buckets: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """En modo buckets, los comentarios del cliente a partir de su documento y sus buckets"""
+        if not self.lee_embebidos:
+            return de_buckets
+        return self._combinar_comentarios(documento.get("comentarios") or [], de_buckets)
+    
+    def obtener_info_completa(
+        self,
+        id_cliente: int,
+        fields: Optional[List[str]] = None,
+        en_error: Any = None
+    ) -> Optional[Dict[str, Any]]:
         """
         Obtiene toda la información no estructurada de un cliente
         
         Args:
             id_cliente: ID del cliente en PostgreSQL
+            fields: Campos a devolver (proyección); None devuelve el documento completo
+            en_error: Valor devuelto si la lectura falla
             
         Returns:
-            Dict: Información completa del cliente o None si no existe
+            Dict: Información completa del cliente, None si no existe o
+            `en_error` si la lectura falló
         """
         try:
-            documento = self.collection.find_one({"id_cliente": id_cliente})
+            documento = self.collection.find_one(
+                {"id_cliente": id_cliente},
+                self._proyeccion(fields)
+            )
+            if documento and self.usa_buckets and (fields is None or "comentarios" in fields):
+                documento["comentarios"] = self._comentarios_documento(
+                    documento, self.buckets.obtener(id_cliente)
+                )
             return documento
             
         except Exception as e:
             logger.error(f"Error al obtener información completa para cliente {id_cliente}: {e}")
-            return None
+            return en_error
+    
+    def obtener_info_bulk(
+        self,
+        ids_cliente: Iterable[int],
+        fields: Optional[List[str]] = None
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Obtiene la información no estructurada de varios clientes a la vez
+        
+        Hace una consulta $in por cada bloque de `bulk_chunk_size` ids, en lugar
+        de un find_one por cliente.
+        
+        Args:
+            ids_cliente: IDs de los clientes en PostgreSQL
+            fields: Campos a devolver (proyección); None devuelve el documento completo
+            
+        Returns:
+            Dict: Documentos indexados por id_cliente; los clientes sin documento no aparecen
+        """
+        ids = list(dict.fromkeys(ids_cliente))
+        if not ids:
+            return {}
+        
+        projection = self._proyeccion(fields)
+        
+        try:
+            documentos = {}
+            for inicio in range(0, len(ids), self.bulk_chunk_size):
+                bloque = ids[inicio:inicio + self.bulk_chunk_size]
+                for documento in self.collection.find({"id_cliente": {"$in": bloque}}, projection):
+                    documentos[documento["id_cliente"]] = documento
+            
+            if documentos and self.usa_buckets and (fields is None or "comentarios" in fields):
+                comentarios = self.buckets.obtener_bulk(list(documentos))
+                for id_cliente, documento in documentos.items():
+                    documento["comentarios"] = self._comentarios_documento(
+                        documento, comentarios.get(id_cliente, [])
+                    )
+            return documentos
+            
+        except Exception as e:
+            logger.error(f"Error al obtener información de {len(ids)} clientes: {e}")
+            return {}
     
     def eliminar_cliente(self, id_cliente: int) -> bool:
         """
@@ -196,6 +819,9 @@ class ClienteInfoService:
         """
         try:
             result = self.collection.delete_one({"id_cliente": id_cliente})
+            if self.usa_buckets:
+                self.buckets.eliminar(id_cliente)
+            cache_clientes.invalidar([id_cliente])
             if result.deleted_count > 0:
                 logger.info(f"Información eliminada para cliente {id_cliente}")
                 return True
@@ -205,25 +831,39 @@ class ClienteInfoService:
             logger.error(f"Error al eliminar información para cliente {id_cliente}: {e}")
             return False
     
+    pipeline_estadisticas = [
+        {"$group": {
+            "_id": None,
+            "total_clientes": {"$sum": 1},
+            "total_comentarios": {"$sum": "$num_comentarios"}
+        }}
+    ]
+    
+    @staticmethod
+    def _formatear_estadisticas(resultado: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Estadísticas a partir del resultado de `pipeline_estadisticas`"""
+        resultado = resultado or {}
+        total_clientes = resultado.get("total_clientes", 0)
+        total_comentarios = resultado.get("total_comentarios", 0)
+        return {
+            "total_clientes": total_clientes,
+            "total_comentarios": total_comentarios,
+            "promedio_comentarios": total_comentarios / total_clientes if total_clientes > 0 else 0
+        }
+    
     def obtener_estadisticas(self) -> Dict[str, Any]:
         """
         Obtiene estadísticas generales de la colección
         
+        Suma el contador num_comentarios de cada documento, sin recorrer los
+        comentarios (ver `python manage.py recalcular_contadores_comentarios`)
+        
         Returns:
             Dict: Estadísticas de la colección
         """
         try:
-            total_clientes = self.collection.count_documents({})
-            total_comentarios = self.collection.aggregate([
-                {"$unwind": "$comentarios"},
-                {"$count": "total"}
-            ]).next().get("total", 0) if total_clientes > 0 else 0
-            
-            return {
-                "total_clientes": total_clientes,
-                "total_comentarios": total_comentarios,
-                "promedio_comentarios": total_comentarios / total_clientes if total_clientes > 0 else 0
-            }
+            resultado = next(self.collection.aggregate(self.pipeline_estadisticas), None)
+            return self._formatear_estadisticas(resultado)
             
         except Exception as e:
             logger.error(f"Error al obtener estadísticas: {e}")
@@ -232,7 +872,146 @@ class ClienteInfoService:
                 "total_comentarios": 0,
                 "promedio_comentarios": 0
             }
+    
+    def recalcular_contadores(self) -> Dict[str, int]:
+        """
+        Recalcula num_comentarios de todos los clientes a partir de los
+        comentarios guardados (arreglo embebido más buckets)
+        
+        Returns:
+            Dict: Documentos actualizados por el recálculo embebido y por los buckets
+        """
+        # Un solo comando en el servidor: num_comentarios = tamaño del arreglo embebido
+        embebidos = self.collection.update_many(
+            {},
+            [{"$set": {"num_comentarios": {"$size": {"$ifNull": ["$comentarios", []]}}}}]
+        )
+        
+        # Se suman los comentarios en buckets de los clientes que los tengan
+        actualizados_buckets = 0
+        operaciones = []
+        for conteo in self.buckets.contar_por_cliente():
+            operaciones.append(UpdateOne(
+                {"id_cliente": conteo["_id"]},
+                [{"$set": {"num_comentarios": {"$add": [
+                    {"$size": {"$ifNull": ["$comentarios", []]}},
+                    conteo["total"]
+                ]}}}]
+            ))
+            if len(operaciones) >= self.bulk_chunk_size:
+                actualizados_buckets += self.collection.bulk_write(operaciones, ordered=False).modified_count
+                operaciones = []
+        if operaciones:
+            actualizados_buckets += self.collection.bulk_write(operaciones, ordered=False).modified_count
+        
+        return {
+            "embebidos": embebidos.modified_count,
+            "buckets": actualizados_buckets
+        }
+
+
+class IndicesMongoService:
+    """
+    Servicio para crear y verificar los índices que necesitan los servicios de MongoDB
+    """
+    
+    # Índices requeridos por colección
+    indices_requeridos = {
+        ClienteInfoService.collection_name: [
+            IndexModel([("id_cliente", ASCENDING)], name="id_cliente_unico", unique=True),
+        ],
+        ComentariosBucketService.collection_name: [
+            IndexModel(
+                [("id_cliente", ASCENDING), ("fecha_fin", DESCENDING)],
+                name="id_cliente_fecha_fin"
+            ),
+        ],
+    }
+    
+    def asegurar_indices(self) -> Dict[str, List[str]]:
+        """
+        Crea los índices requeridos que falten (create_indexes es idempotente)
+        
+        Returns:
+            Dict: Nombres de los índices asegurados por colección
+        """
+        creados = {}
+        for nombre_coleccion, indices in self.indices_requeridos.items():
+            creados[nombre_coleccion] = get_mongodb_collection(nombre_coleccion).create_indexes(indices)
+            logger.info(f"Índices asegurados en {nombre_coleccion}: {creados[nombre_coleccion]}")
+        return creados
+    
+    def buscar_duplicados(self, nombre_coleccion: str, campo: str, limite: int = 10) -> List[Any]:
+        """
+        Busca valores repetidos de un campo que impedirían crear un índice único
+        
+        Args:
+            nombre_coleccion: Colección a revisar
+            campo: Campo que debe ser único
+            limite: Máximo de valores a devolver
+            
+        Returns:
+            List: Valores repetidos
+        """
+        duplicados = get_mongodb_collection(nombre_coleccion).aggregate([
+            {"$group": {"_id": f"${campo}", "total": {"$sum": 1}}},
+            {"$match": {"total": {"$gt": 1}}},
+            {"$limit": limite},
+        ], allowDiskUse=True)
+        return [documento["_id"] for documento in duplicados]
+    
+    def verificar_indices(self) -> Dict[str, Dict[str, List[str]]]:
+        """
+        Compara los índices existentes con los requeridos
+        
+        Returns:
+            Dict: Por colección, los índices 'faltantes', 'no_declarados'
+            (existen pero ningún servicio los necesita) y 'sin_uso'
+            (sin accesos según $indexStats desde el último reinicio del servidor)
+        """
+        reporte = {}
+        for nombre_coleccion, indices in self.indices_requeridos.items():
+            coleccion = get_mongodb_collection(nombre_coleccion)
+            existentes = coleccion.index_information()
+            requeridos = {}
+            for indice in indices:
+                documento = indice.document
+                requeridos[documento["name"]] = documento
+            
+            faltantes = []
+            for nombre, documento in requeridos.items():
+                existente = existentes.get(nombre)
+                if (
+                    existente is None
+                    or list(existente["key"]) != list(documento["key"].items())
+                    or existente.get("unique", False) != documento.get("unique", False)
+                ):
+                    faltantes.append(nombre)
+            
+            no_declarados = [
+                nombre for nombre in existentes
+                if nombre != "_id_" and nombre not in requeridos
+            ]
+            
+            try:
+                sin_uso = [
+                    estadistica["name"]
+                    for estadistica in coleccion.aggregate([{"$indexStats": {}}])
+                    if estadistica["name"] != "_id_" and estadistica["accesses"]["ops"] == 0
+                ]
+            except Exception as e:
+                # $indexStats requiere permisos de clusterMonitor
+                logger.warning(f"No se pudo leer $indexStats de {nombre_coleccion}: {e}")
+                sin_uso = []
+            
+            reporte[nombre_coleccion] = {
+                "faltantes": faltantes,
+                "no_declarados": no_declarados,
+                "sin_uso": sin_uso,
+            }
+        return reporte
 
 
 # Instancia global del servicio
-cliente_info_service = ClienteInfoService() 
\ No newline at end of file
+cliente_info_service = ClienteInfoService()
+indices_mongo_service = IndicesMongoService() 
\ No newline at end of file
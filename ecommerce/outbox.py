@@ -0,0 +1,275 @@
+"""
+Outbox transaccional para las escrituras en MongoDB
+
+Con MONGO_OUTBOX=True, las escrituras en MongoDB de los servicios de
+integración se guardan como filas de 'outbox_mongo' dentro de la misma
+transacción de PostgreSQL: la petición paga un INSERT local en lugar de un
+viaje a MongoDB, y un rollback descarta también la escritura pendiente.
+El relay (`python manage.py relay_outbox_mongo`) las aplica después por
+lotes con bulk_write.
+
+Un evento que falla espera antes de reintentarse (MONGO_OUTBOX_ESPERA_REINTENTO
+segundos, el doble tras cada fallo) y, tras MONGO_OUTBOX_MAX_INTENTOS fallos,
+queda descartado en la tabla hasta que se reintente a mano. Mientras tanto
+los eventos posteriores de su cliente también esperan, para no aplicarlos
+fuera de orden; los de los demás clientes siguen su curso.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q, QuerySet
+from django.utils import timezone
+
+from .cache_clientes import cache_clientes
+from .models import EventoOutbox
+from .mongodb_services import ClienteInfoService, bulk_write_con_reintento, cliente_info_service
+import logging
+
+logger = logging.getLogger(__name__)
+
+TIPO_CREAR_DOCUMENTO = 'crear_documento'
+TIPO_COMENTARIO = 'agregar_comentario'
+TIPO_PREFERENCIAS = 'actualizar_preferencias'
+
+# Clave del advisory lock de PostgreSQL que garantiza un único relay activo
+CLAVE_BLOQUEO_RELAY = 7_301_466_117
+
+# Espera máxima entre dos intentos de un evento, en segundos
+ESPERA_MAXIMA_REINTENTO = 24 * 3600
+
+
+class EscriturasMongo:
+    """
+    Escrituras en MongoDB de los servicios de integración: directas, o como
+    eventos del outbox si MONGO_OUTBOX está activo
+    """
+
+    def __init__(self, service: Optional[ClienteInfoService] = None):
+        self.service = service or cliente_info_service
+
+    @property
+    def usa_outbox(self) -> bool:
+        return settings.MONGO_OUTBOX
+
+    @staticmethod
+    def _registrar(id_cliente: int, tipo: str, datos: Optional[Dict[str, Any]] = None) -> bool:
+        EventoOutbox.objects.create(id_cliente=id_cliente, tipo=tipo, datos=datos or {})
+        return True
+
+    def crear_documento_cliente(self, id_cliente: int) -> bool:
+        if self.usa_outbox:
+            return self._registrar(id_cliente, TIPO_CREAR_DOCUMENTO)
+        return self.service.crear_documento_cliente(id_cliente)
+
+    def agregar_comentario(self, id_cliente: int, texto: str) -> bool:
+        if self.usa_outbox:
+            # La fecha es la de la petición, no la de aplicación en MongoDB
+            return self._registrar(id_cliente, TIPO_COMENTARIO, {
+                "texto": texto,
+                "fecha": datetime.utcnow().isoformat()
+            })
+        return self.service.agregar_comentario(id_cliente, texto)
+
+    def actualizar_preferencias(self, id_cliente: int, preferencias: Dict[str, Any]) -> bool:
+        if self.usa_outbox:
+            return self._registrar(id_cliente, TIPO_PREFERENCIAS, {"preferencias": preferencias})
+        return self.service.actualizar_preferencias(id_cliente, preferencias)
+
+    def actualizar_preferencias_bulk(self, preferencias_por_cliente: Dict[int, Dict[str, Any]]) -> int:
+        if self.usa_outbox:
+            EventoOutbox.objects.bulk_create([
+                EventoOutbox(id_cliente=id_cliente, tipo=TIPO_PREFERENCIAS, datos={"preferencias": preferencias})
+                for id_cliente, preferencias in preferencias_por_cliente.items()
+            ])
+            return len(preferencias_por_cliente)
+        return self.service.actualizar_preferencias_bulk(preferencias_por_cliente)
+
+    def eliminar_cliente(self, id_cliente: int) -> bool:
+        """
+        Elimina el documento del cliente y sus eventos pendientes, que al
+        aplicarse lo volverían a crear
+
+        Debe llamarse dentro de una transacción: el borrado de los eventos
+        espera a que el relay termine el lote que los tenga bloqueados, así
+        que el documento se elimina después de su última escritura.
+        """
+        EventoOutbox.objects.filter(id_cliente=id_cliente).delete()
+        return self.service.eliminar_cliente(id_cliente)
+
+
+class RelayOutbox:
+    """
+    Aplica los eventos del outbox en MongoDB por lotes
+
+    Cada lote agrupa los eventos por cliente en una sola operación
+    (`ClienteInfoService.operacion_outbox`) y los borra del outbox en la misma
+    transacción que los bloqueó. Si el proceso cae entre el bulk_write y el
+    commit, los eventos se reintentan y `ultimo_evento` evita aplicarlos dos
+    veces. En modo buckets, los comentarios van antes a otra colección: cada
+    uno lleva el id de su evento y al reintentar se omiten los que ya están
+    en algún bucket (el relay es único, así que leerlos antes basta).
+    """
+
+    def __init__(self, service: Optional[ClienteInfoService] = None, tamano_lote: Optional[int] = None):
+        self.service = service or cliente_info_service
+        self.tamano_lote = tamano_lote or settings.MONGO_OUTBOX_TAMANO_LOTE
+
+    @staticmethod
+    def adquirir_bloqueo() -> bool:
+        """
+        Toma el advisory lock del relay para esta conexión; varios relays a la
+        vez podrían aplicar los eventos de un cliente fuera de orden
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [CLAVE_BLOQUEO_RELAY])
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def liberar_bloqueo():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [CLAVE_BLOQUEO_RELAY])
+
+    @staticmethod
+    def pendientes(ahora: Optional[datetime] = None) -> QuerySet:
+        """
+        Eventos que pueden aplicarse ahora: ni descartados ni esperando un
+        reintento, y sin eventos anteriores de su cliente en esa situación
+        """
+        ahora = ahora or timezone.now()
+        en_espera = Q(intentos__gte=settings.MONGO_OUTBOX_MAX_INTENTOS) | Q(proximo_intento__gt=ahora)
+        anteriores_en_espera = EventoOutbox.objects.filter(
+            en_espera, id_cliente=OuterRef('id_cliente'), id_evento__lt=OuterRef('id_evento')
+        )
+        return EventoOutbox.objects.exclude(en_espera).exclude(Exists(anteriores_en_espera))
+
+    @staticmethod
+    def descartados() -> QuerySet:
+        """Eventos que agotaron MONGO_OUTBOX_MAX_INTENTOS"""
+        return EventoOutbox.objects.filter(intentos__gte=settings.MONGO_OUTBOX_MAX_INTENTOS)
+
+    @staticmethod
+    def reintentar_descartados() -> int:
+        """Devuelve los eventos descartados a la cola; retorna cuántos"""
+        return RelayOutbox.descartados().update(intentos=0, proximo_intento=None)
+
+    @staticmethod
+    def _comentario(evento: EventoOutbox) -> Dict[str, Any]:
+        return {
+            "texto": evento.datos["texto"],
+            "fecha": datetime.fromisoformat(evento.datos["fecha"]),
+            "id_evento": evento.id_evento,
+        }
+
+    def _aplicar(self, por_cliente: Dict[int, List[EventoOutbox]]) -> set:
+        """
+        Escribe en MongoDB los eventos pendientes
+
+        Returns:
+            set: Clientes cuyos eventos no se pudieron aplicar
+        """
+        ultimos = self.service.obtener_ultimos_eventos(por_cliente)
+        en_buckets = set()
+        if self.service.usa_buckets:
+            en_buckets = self.service.buckets.eventos_guardados(list(por_cliente), [
+                evento.id_evento for eventos in por_cliente.values() for evento in eventos
+                if evento.tipo == TIPO_COMENTARIO
+            ])
+
+        clientes: List[int] = []
+        operaciones = []
+        operaciones_buckets = []
+        clientes_buckets: List[int] = []
+        for id_cliente, eventos in por_cliente.items():
+            pendientes = [evento for evento in eventos if evento.id_evento > ultimos.get(id_cliente, 0)]
+            if not pendientes:
+                continue
+            comentarios = [self._comentario(evento) for evento in pendientes if evento.tipo == TIPO_COMENTARIO]
+            preferencias = None
+            for evento in pendientes:
+                if evento.tipo == TIPO_PREFERENCIAS:
+                    preferencias = evento.datos["preferencias"]
+            clientes.append(id_cliente)
+            operaciones.append(self.service.operacion_outbox(
+                id_cliente, pendientes[-1].id_evento, comentarios, preferencias
+            ))
+            if self.service.usa_buckets:
+                for comentario in comentarios:
+                    if comentario["id_evento"] in en_buckets:
+                        continue
+                    operaciones_buckets.append(self.service.buckets.operacion_agregar(id_cliente, comentario))
+                    clientes_buckets.append(id_cliente)
+
+        fallidos = {clientes_buckets[i] for i in bulk_write_con_reintento(
+            self.service.buckets.collection, operaciones_buckets
+        )}
+        # Sin sus comentarios en los buckets, el documento principal no debe marcar los eventos como aplicados
+        restantes = [(id_cliente, operacion) for id_cliente, operacion in zip(clientes, operaciones)
+                     if id_cliente not in fallidos]
+        fallidos.update(restantes[i][0] for i in bulk_write_con_reintento(
+            self.service.collection, [operacion for _, operacion in restantes]
+        ))
+        return fallidos
+
+    def procesar_lote(self) -> Dict[str, int]:
+        """
+        Aplica el siguiente lote de eventos pendientes, del más antiguo al más
+        reciente; los que fallan se reintentan más tarde (ver `pendientes`)
+
+        Returns:
+            Dict: eventos leídos, aplicados (y borrados del outbox), fallidos
+            y descartados (fallidos que agotaron sus intentos)
+        """
+        ahora = timezone.now()
+        with transaction.atomic():
+            eventos = list(
+                self.pendientes(ahora).select_for_update(skip_locked=True).order_by('id_evento')[:self.tamano_lote]
+            )
+            if not eventos:
+                return {"eventos": 0, "aplicados": 0, "fallidos": 0, "descartados": 0}
+
+            por_cliente: Dict[int, List[EventoOutbox]] = {}
+            for evento in eventos:
+                por_cliente.setdefault(evento.id_cliente, []).append(evento)
+
+            try:
+                clientes_fallidos = self._aplicar(por_cliente)
+                error = "bulk_write rechazó la operación"
+            except Exception as e:
+                logger.error(f"Error al aplicar {len(eventos)} eventos del outbox: {e}")
+                clientes_fallidos = set(por_cliente)
+                error = str(e)
+
+            cache_clientes.invalidar(id_cliente for id_cliente in por_cliente if id_cliente not in clientes_fallidos)
+            aplicados = [evento.id_evento for evento in eventos if evento.id_cliente not in clientes_fallidos]
+            fallidos = [evento for evento in eventos if evento.id_cliente in clientes_fallidos]
+            EventoOutbox.objects.filter(id_evento__in=aplicados).delete()
+
+            # Una actualización por número de intentos, que fija la espera
+            por_intentos: Dict[int, List[int]] = {}
+            for evento in fallidos:
+                por_intentos.setdefault(evento.intentos, []).append(evento.id_evento)
+            for intentos, ids in por_intentos.items():
+                espera = min(settings.MONGO_OUTBOX_ESPERA_REINTENTO * 2 ** intentos, ESPERA_MAXIMA_REINTENTO)
+                EventoOutbox.objects.filter(id_evento__in=ids).update(
+                    intentos=intentos + 1, ultimo_error=error, proximo_intento=ahora + timedelta(seconds=espera)
+                )
+            descartados = sum(
+                len(ids) for intentos, ids in por_intentos.items()
+                if intentos + 1 >= settings.MONGO_OUTBOX_MAX_INTENTOS
+            )
+            if descartados:
+                logger.error(
+                    f"{descartados} eventos del outbox descartados tras "
+                    f"{settings.MONGO_OUTBOX_MAX_INTENTOS} intentos: {error}"
+                )
+
+        return {
+            "eventos": len(eventos), "aplicados": len(aplicados), "fallidos": len(fallidos), "descartados": descartados
+        }
+
+
+# Instancia global usada por los servicios de integración
+escrituras_mongo = EscriturasMongo()
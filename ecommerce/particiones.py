@@ -0,0 +1,320 @@
+"""
+Particionado por meses de 'pedidos' y 'detalle_pedido'
+
+Opcional: `python manage.py particiones_pedidos --convertir` convierte ambas
+tablas en tablas particionadas por rango de `fecha_pedido`, con una
+partición por mes. Las líneas se particionan por la copia de la fecha de su
+pedido (`DetallePedido.fecha_pedido`), así que cada línea queda en la
+partición del mismo mes que su pedido, y las consultas acotadas por fecha
+(pedidos de hoy, informes de los últimos meses) solo recorren las
+particiones de ese rango.
+
+Los modelos no cambian: el ORM sigue leyendo y escribiendo 'pedidos' y
+'detalle_pedido'. Lo que cambia en la base:
+- La clave primaria incluye la fecha: (id_pedido, fecha_pedido) e
+  (id_detalle, fecha_pedido). Los ids siguen saliendo de una secuencia.
+- 'detalle_pedido' referencia a 'pedidos' por (id_pedido, fecha_pedido),
+  con ON UPDATE CASCADE.
+
+`python manage.py particiones_pedidos` (periódicamente) crea las
+particiones de los próximos PEDIDOS_PARTICIONES_ADELANTE meses y, con
+PEDIDOS_PARTICIONES_RETENCION, desconecta las de meses anteriores: quedan
+como tablas sueltas con sus filas, fuera de las consultas del ORM.
+"""
+
+import re
+from datetime import date, datetime, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .esquema import es_particionada
+from .models import DetallePedido, Pedido
+import logging
+
+logger = logging.getLogger(__name__)
+
+TABLA_PEDIDOS = 'pedidos'
+TABLA_DETALLES = 'detalle_pedido'
+# Orden de creación; se desconectan en el orden inverso (primero las que referencian)
+TABLAS = (TABLA_PEDIDOS, TABLA_DETALLES)
+
+PATRON_PARTICION = re.compile(r'_p(\d{4})_(\d{2})$')
+
+
+def sumar_meses(mes: date, meses: int) -> date:
+    """Primer día del mes `meses` después (o antes, si es negativo) de `mes`"""
+    indice = mes.year * 12 + mes.month - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def mes_actual() -> date:
+    """Primer día del mes en curso, en UTC como los límites de las particiones"""
+    hoy = timezone.now().astimezone(dt_timezone.utc).date()
+    return hoy.replace(day=1)
+
+
+def inicio_mes(mes: date) -> datetime:
+    """Instante UTC en que empieza el mes: límite de las particiones"""
+    return datetime(mes.year, mes.month, 1, tzinfo=dt_timezone.utc)
+
+
+class ParticionesPedidos:
+    """
+    Conversión y mantenimiento de las particiones mensuales de pedidos
+    """
+
+    @staticmethod
+    def nombre_particion(tabla: str, mes: date) -> str:
+        return f'{tabla}_p{mes:%Y_%m}'
+
+    @staticmethod
+    def particiones(tabla: str) -> List[Tuple[str, date]]:
+        """
+        Particiones conectadas a la tabla con el mes que contienen, en orden
+
+        Returns:
+            List[Tuple]: (nombre, primer día del mes)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s)",
+                [tabla]
+            )
+            nombres = [fila[0] for fila in cursor.fetchall()]
+        return ParticionesPedidos._por_mes(nombres)
+
+    @staticmethod
+    def desconectadas(tabla: str) -> List[Tuple[str, date]]:
+        """
+        Particiones ya desconectadas de la tabla (tablas sueltas con nombre
+        de partición) con el mes que contienen, en orden
+
+        Returns:
+            List[Tuple]: (nombre, primer día del mes)
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+                "AND relname LIKE %s AND pg_table_is_visible(oid)",
+                [f'{tabla}\\_p%']
+            )
+            nombres = [fila[0] for fila in cursor.fetchall()]
+        return ParticionesPedidos._por_mes(nombres)
+
+    @staticmethod
+    def _por_mes(nombres: List[str]) -> List[Tuple[str, date]]:
+        resultado = []
+        for nombre in nombres:
+            coincidencia = PATRON_PARTICION.search(nombre)
+            if coincidencia:
+                resultado.append((nombre, date(int(coincidencia[1]), int(coincidencia[2]), 1)))
+        return sorted(resultado, key=lambda particion: particion[1])
+
+    @staticmethod
+    def crear_particion(tabla: str, mes: date) -> Optional[str]:
+        """
+        Crea la partición del mes si no existe
+
+        Returns:
+            str: Nombre de la partición creada, o None si ya existía
+        """
+        nombre = ParticionesPedidos.nombre_particion(tabla, mes)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [nombre])
+            if cursor.fetchone()[0]:
+                return None
+            cursor.execute(
+                f"CREATE TABLE {connection.ops.quote_name(nombre)} PARTITION OF {connection.ops.quote_name(tabla)} "
+                f"FOR VALUES FROM (%s) TO (%s)",
+                [inicio_mes(mes), inicio_mes(sumar_meses(mes, 1))]
+            )
+        return nombre
+
+    @staticmethod
+    def crear_particiones_futuras(meses_adelante: int, desde: Optional[date] = None) -> List[str]:
+        """
+        Crea, en ambas tablas, las particiones desde `desde` (por defecto el
+        mes en curso) hasta `meses_adelante` meses después del actual
+
+        Returns:
+            List[str]: Particiones creadas
+        """
+        mes = desde or mes_actual()
+        ultimo = sumar_meses(mes_actual(), meses_adelante)
+        creadas = []
+        with transaction.atomic():
+            while mes <= ultimo:
+                for tabla in TABLAS:
+                    nombre = ParticionesPedidos.crear_particion(tabla, mes)
+                    if nombre:
+                        creadas.append(nombre)
+                mes = sumar_meses(mes, 1)
+        return creadas
+
+    @staticmethod
+    def _eliminar_claves_foraneas(tabla: str):
+        """Quita las claves foráneas de una partición desconectada, que ya no sigue a las tablas del ORM"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'", [tabla]
+            )
+            for (nombre,) in cursor.fetchall():
+                cursor.execute(
+                    f"ALTER TABLE {connection.ops.quote_name(tabla)} DROP CONSTRAINT {connection.ops.quote_name(nombre)}"
+                )
+
+    @staticmethod
+    def desconectar_anteriores(meses_retencion: int) -> List[str]:
+        """
+        Desconecta las particiones de meses anteriores a los últimos
+        `meses_retencion` (contando el actual)
+
+        Cada mes se desconecta en su propia transacción, primero las líneas y
+        después los pedidos. Las tablas desconectadas conservan sus filas.
+
+        Returns:
+            List[str]: Particiones desconectadas
+        """
+        if meses_retencion <= 0:
+            return []
+        limite = sumar_meses(mes_actual(), -(meses_retencion - 1))
+        meses = sorted({mes for tabla in TABLAS for _, mes in ParticionesPedidos.particiones(tabla) if mes < limite})
+
+        desconectadas = []
+        for mes in meses:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for tabla in reversed(TABLAS):
+                    nombre = ParticionesPedidos.nombre_particion(tabla, mes)
+                    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [nombre])
+                    if not cursor.fetchone()[0]:
+                        continue
+                    cursor.execute(
+                        f"ALTER TABLE {connection.ops.quote_name(tabla)} "
+                        f"DETACH PARTITION {connection.ops.quote_name(nombre)}"
+                    )
+                    ParticionesPedidos._eliminar_claves_foraneas(nombre)
+                    desconectadas.append(nombre)
+        return desconectadas
+
+    @staticmethod
+    def preparar_detalles() -> int:
+        """
+        Crea y rellena `detalle_pedido.fecha_pedido` en bases anteriores a la
+        columna (particionadas o no)
+
+        Returns:
+            int: Líneas rellenadas
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE detalle_pedido ADD COLUMN IF NOT EXISTS fecha_pedido timestamp with time zone")
+            cursor.execute(
+                "UPDATE detalle_pedido d SET fecha_pedido = p.fecha_pedido FROM pedidos p "
+                "WHERE p.id_pedido = d.id_pedido_id AND d.fecha_pedido IS DISTINCT FROM p.fecha_pedido"
+            )
+            rellenadas = cursor.rowcount
+            cursor.execute("ALTER TABLE detalle_pedido ALTER COLUMN fecha_pedido SET NOT NULL")
+        return rellenadas
+
+    @staticmethod
+    def _secuencia(cursor, tabla: str, columna: str) -> Tuple[int, bool]:
+        """Último valor de la secuencia de la columna (identity o serial)"""
+        cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [tabla, columna])
+        secuencia = cursor.fetchone()[0]
+        cursor.execute(f"SELECT last_value, is_called FROM {secuencia}")
+        return cursor.fetchone()
+
+    @staticmethod
+    def _crear_secuencia(cursor, tabla: str, columna: str, ultimo: Tuple[int, bool]):
+        """Secuencia propia de la columna que continúa donde quedó la anterior"""
+        secuencia = f'{tabla}_{columna}_seq'
+        cursor.execute(f"CREATE SEQUENCE {secuencia} OWNED BY {tabla}.{columna}")
+        cursor.execute("SELECT setval(%s, %s, %s)", [secuencia, ultimo[0], ultimo[1]])
+        cursor.execute(f"ALTER TABLE {tabla} ALTER COLUMN {columna} SET DEFAULT nextval('{secuencia}')")
+
+    @staticmethod
+    def convertir(meses_adelante: int) -> Dict[str, int]:
+        """
+        Convierte 'pedidos' y 'detalle_pedido' en tablas particionadas por mes
+
+        Todo ocurre en una transacción con ambas tablas bloqueadas: las filas
+        se copian a las tablas nuevas y las originales se eliminan. Pensado
+        para una ventana de mantenimiento.
+
+        Returns:
+            Dict: particiones creadas, pedidos y líneas copiados
+        """
+        if es_particionada(TABLA_PEDIDOS):
+            raise ValueError("Las tablas de pedidos ya están particionadas")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # ALTER TABLE no admite comprobaciones diferidas de claves
+            # foráneas pendientes en la transacción: se hacen ahora
+            connection.check_constraints()
+            ParticionesPedidos.preparar_detalles()
+            cursor.execute("LOCK TABLE pedidos, detalle_pedido IN ACCESS EXCLUSIVE MODE")
+            cursor.execute("SELECT min(fecha_pedido) FROM pedidos")
+            primera = cursor.fetchone()[0]
+            secuencias = {
+                TABLA_PEDIDOS: ('id_pedido', ParticionesPedidos._secuencia(cursor, 'pedidos', 'id_pedido')),
+                TABLA_DETALLES: ('id_detalle', ParticionesPedidos._secuencia(cursor, 'detalle_pedido', 'id_detalle')),
+            }
+
+            cursor.execute("ALTER TABLE detalle_pedido RENAME TO detalle_pedido_sin_particionar")
+            cursor.execute("ALTER TABLE pedidos RENAME TO pedidos_sin_particionar")
+
+            # LIKE copia columnas, valores por defecto y CHECK, no la identidad
+            # ni claves o índices: se crean tras eliminar las tablas originales,
+            # que aún tienen los mismos nombres
+            for tabla in TABLAS:
+                cursor.execute(
+                    f"CREATE TABLE {tabla} (LIKE {tabla}_sin_particionar INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+                    f"PARTITION BY RANGE (fecha_pedido)"
+                )
+            desde = primera.astimezone(dt_timezone.utc).date().replace(day=1) if primera else None
+            creadas = ParticionesPedidos.crear_particiones_futuras(meses_adelante, desde=desde)
+
+            cursor.execute("INSERT INTO pedidos SELECT * FROM pedidos_sin_particionar")
+            pedidos = cursor.rowcount
+            cursor.execute("INSERT INTO detalle_pedido SELECT * FROM detalle_pedido_sin_particionar")
+            detalles = cursor.rowcount
+            cursor.execute("DROP TABLE detalle_pedido_sin_particionar, pedidos_sin_particionar")
+
+            # Las claves únicas de una tabla particionada deben incluir la fecha
+            cursor.execute("ALTER TABLE pedidos ADD CONSTRAINT pedidos_pkey PRIMARY KEY (id_pedido, fecha_pedido)")
+            cursor.execute(
+                "ALTER TABLE detalle_pedido ADD CONSTRAINT detalle_pedido_pkey PRIMARY KEY (id_detalle, fecha_pedido)"
+            )
+            cursor.execute(
+                "ALTER TABLE detalle_pedido ADD CONSTRAINT detalle_pedido_pedido_producto_uniq "
+                "UNIQUE (id_pedido_id, id_producto_id, fecha_pedido)"
+            )
+            cursor.execute(
+                "ALTER TABLE pedidos ADD CONSTRAINT pedidos_cliente_fk FOREIGN KEY (id_cliente_id) "
+                "REFERENCES clientes (id_cliente) DEFERRABLE INITIALLY DEFERRED"
+            )
+            cursor.execute(
+                "ALTER TABLE detalle_pedido ADD CONSTRAINT detalle_pedido_producto_fk FOREIGN KEY (id_producto_id) "
+                "REFERENCES productos (id_producto) DEFERRABLE INITIALLY DEFERRED"
+            )
+            # ON UPDATE CASCADE: si cambia la fecha de un pedido, sus líneas la siguen
+            cursor.execute(
+                "ALTER TABLE detalle_pedido ADD CONSTRAINT detalle_pedido_pedido_fk "
+                "FOREIGN KEY (id_pedido_id, fecha_pedido) REFERENCES pedidos (id_pedido, fecha_pedido) "
+                "ON UPDATE CASCADE DEFERRABLE INITIALLY DEFERRED"
+            )
+
+            # Los índices de la tabla particionada se crean en cada partición
+            with connection.schema_editor(atomic=False) as schema_editor:
+                for modelo in (Pedido, DetallePedido):
+                    for indice in modelo._meta.indexes:
+                        schema_editor.add_index(modelo, indice)
+
+            # Las tablas particionadas no admiten columnas identity (PostgreSQL < 17)
+            for tabla, (columna, ultimo) in secuencias.items():
+                ParticionesPedidos._crear_secuencia(cursor, tabla, columna, ultimo)
+            cursor.execute("ANALYZE pedidos, detalle_pedido")
+
+        return {"particiones": len(creadas), "pedidos": pedidos, "detalles": detalles}
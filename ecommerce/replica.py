@@ -0,0 +1,208 @@
+"""
+Réplica de lectura de PostgreSQL
+
+Con POSTGRES_REPLICA_HOST, settings añade el alias 'replica' (una réplica en
+streaming del principal) y `RouterReplica` envía a él las lecturas de los
+informes: el cálculo de las estadísticas del panel (`ecommerce.estadisticas`),
+las exportaciones del admin (`ecommerce.exportacion`) y los recorridos de
+clientes completos (`iterar_clientes_completos`). El resto de lecturas y
+todas las escrituras van al principal, así que quien escribe y vuelve a leer
+ve siempre lo que escribió.
+
+Una lectura de informes va al principal en lugar de la réplica si:
+
+- No hay réplica configurada
+- Se está dentro de una transacción del principal (debe ver sus cambios)
+- El mismo hilo o tarea escribió hace menos de REPLICA_FIJAR_TRAS_ESCRITURA
+  segundos
+- La réplica no responde o lleva más de REPLICA_MAX_RETRASO segundos de
+  retraso; se comprueba como mucho cada REPLICA_COMPROBACION_INTERVALO
+  segundos, así que lo leído nunca tiene más de la suma de ambos
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+import logging
+
+logger = logging.getLogger(__name__)
+
+ALIAS_PRINCIPAL = DEFAULT_DB_ALIAS
+ALIAS_REPLICA = 'replica'
+
+# Segundos de retraso de la réplica: 0 si no está en recuperación o si
+# recibe WAL en streaming y ya aplicó todo lo recibido (con el principal sin
+# escrituras, pg_last_xact_replay_timestamp envejece sin que falte nada). Sin
+# receptor en streaming no sabe qué le falta: la edad de la última transacción
+# aplicada acota lo que puede estar desfasada, y NULL (nada aplicado) cuenta
+# como retraso infinito. Ver el estado del receptor requiere pg_read_all_stats;
+# sin ese rol se trata como desconectado
+SQL_RETRASO = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+             AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+# Alias de las lecturas dentro de `ReplicaLecturas.lecturas` (None = el del router por defecto)
+_alias_lecturas: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('alias_lecturas', default=None)
+# Instante (time.monotonic) de la última escritura del hilo o tarea actual
+_ultima_escritura: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('ultima_escritura', default=None)
+
+
+class ReplicaLecturas:
+    """
+    Elige la base de datos de las lecturas de informes
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (instante de la comprobación, réplica utilizable)
+        self._comprobacion: Optional[tuple] = None
+        self._contadores = {
+            "replica": 0,
+            "principal": 0,
+            "retrasada": 0,
+            "no_disponible": 0,
+        }
+
+    @property
+    def configurada(self) -> bool:
+        return ALIAS_REPLICA in settings.DATABASES
+
+    def _contar(self, contador: str):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def retraso(self) -> float:
+        """Segundos de retraso de la réplica; propaga los errores de conexión"""
+        with connections[ALIAS_REPLICA].cursor() as cursor:
+            cursor.execute(SQL_RETRASO)
+            retraso = cursor.fetchone()[0]
+        return float('inf') if retraso is None else float(retraso)
+
+    def disponible(self) -> bool:
+        """
+        Indica si la réplica responde y su retraso no pasa de
+        REPLICA_MAX_RETRASO; el resultado se reutiliza durante
+        REPLICA_COMPROBACION_INTERVALO segundos
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            comprobacion = self._comprobacion
+        if comprobacion and ahora - comprobacion[0] < settings.REPLICA_COMPROBACION_INTERVALO:
+            return comprobacion[1]
+
+        try:
+            retraso = self.retraso()
+            utilizable = retraso <= settings.REPLICA_MAX_RETRASO
+            if not utilizable:
+                self._contar("retrasada")
+                logger.error(f"La réplica lleva {retraso:.1f}s de retraso; los informes leen del principal")
+        except Exception as e:
+            utilizable = False
+            self._contar("no_disponible")
+            logger.error(f"La réplica no responde; los informes leen del principal: {e}")
+            try:
+                connections[ALIAS_REPLICA].close()
+            except Exception:
+                pass
+
+        with self._lock:
+            self._comprobacion = (ahora, utilizable)
+        return utilizable
+
+    def alias(self) -> str:
+        """
+        Alias en el que deben ejecutarse las lecturas de informes que empiezan ahora
+
+        Returns:
+            str: 'replica' o 'default'
+        """
+        if not self.configurada:
+            return ALIAS_PRINCIPAL
+        if connections[ALIAS_PRINCIPAL].in_atomic_block:
+            self._contar("principal")
+            return ALIAS_PRINCIPAL
+        ultima = _ultima_escritura.get()
+        if ultima is not None and time.monotonic() - ultima < settings.REPLICA_FIJAR_TRAS_ESCRITURA:
+            self._contar("principal")
+            return ALIAS_PRINCIPAL
+        if not self.disponible():
+            self._contar("principal")
+            return ALIAS_PRINCIPAL
+        self._contar("replica")
+        return ALIAS_REPLICA
+
+    @contextmanager
+    def lecturas(self, alias: Optional[str] = None) -> Iterator[str]:
+        """
+        Envía a `alias` (por defecto `self.alias()`) las lecturas del ORM del
+        bloque; las escrituras siguen yendo al principal
+
+        Para generadores, que pueden reanudarse fuera del bloque, use
+        `QuerySet.using(replica_lecturas.alias())`.
+        """
+        alias = alias or self.alias()
+        token = _alias_lecturas.set(alias)
+        try:
+            yield alias
+        finally:
+            _alias_lecturas.reset(token)
+
+    @staticmethod
+    def registrar_escritura():
+        """Las lecturas de informes del hilo o tarea actual irán al principal durante un tiempo"""
+        _ultima_escritura.set(time.monotonic())
+
+    def reiniciar(self):
+        """Olvida la última comprobación de la réplica y la última escritura del contexto actual"""
+        with self._lock:
+            self._comprobacion = None
+        _ultima_escritura.set(None)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """
+        Contadores de este proceso
+
+        Returns:
+            Dict: lecturas de informes enviadas a la réplica y al principal, y
+            comprobaciones con la réplica retrasada o sin responder
+        """
+        with self._lock:
+            datos = dict(self._contadores)
+        datos["configurada"] = self.configurada
+        return datos
+
+
+# Instancia global usada por el router, las estadísticas y las exportaciones
+replica_lecturas = ReplicaLecturas()
+
+
+class RouterReplica:
+    """
+    Router de DATABASE_ROUTERS: lecturas de `ReplicaLecturas.lecturas` a su
+    alias y todas las escrituras al principal
+    """
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        return _alias_lecturas.get()
+
+    def db_for_write(self, model, **hints) -> str:
+        replica_lecturas.registrar_escritura()
+        return ALIAS_PRINCIPAL
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # La réplica tiene los mismos datos que el principal
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> bool:
+        # La réplica recibe el esquema por replicación
+        return db == ALIAS_PRINCIPAL
@@ -0,0 +1,87 @@
+"""
+Señales de los modelos de PostgreSQL
+"""
+
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .cache_clientes import cache_clientes
+from .esquema import CAMPOS_TOTALES, columnas_faltantes, crear_columnas_faltantes, crear_columnas_posteriores
+from .models import Cliente, DetallePedido, Pedido, PedidoArchivado, Producto, UnidadesArchivadas
+from .estadisticas import snapshot_estadisticas
+from .integration_service import ClienteIntegrationService
+from .particiones import ParticionesPedidos
+
+
+def _borrado_desde(origin, *modelos) -> bool:
+    """Indica si el borrado en cascada empezó en una instancia o QuerySet de `modelos`"""
+    if isinstance(origin, models.QuerySet):
+        return origin.model in modelos
+    return isinstance(origin, modelos)
+
+
+@receiver(post_delete, sender=Pedido)
+def descontar_pedido_eliminado(sender, instance, origin=None, **kwargs):
+    """
+    Resta el pedido eliminado de los totales de su cliente
+
+    Cubre también los borrados por QuerySet y en cascada; si el borrado
+    empieza en el propio cliente no hay totales que mantener.
+    """
+    if _borrado_desde(origin, Cliente):
+        return
+    Cliente.aplicar_diferencias({instance.id_cliente_id: (-1, -instance.total)})
+
+
+@receiver(post_delete, sender=DetallePedido)
+def descontar_detalle_eliminado(sender, instance, origin=None, **kwargs):
+    """
+    Resta la línea eliminada de las unidades vendidas de su producto y del
+    total de su pedido
+
+    Si el borrado empieza en el producto no hay unidades que mantener, y si
+    empieza en el pedido (o su cliente) tampoco hay total.
+    """
+    if not _borrado_desde(origin, Producto):
+        Producto.aplicar_unidades({instance.id_producto_id: -instance.cantidad})
+    if not _borrado_desde(origin, Pedido, Cliente):
+        Pedido.aplicar_subtotales({instance.id_pedido_id: -instance.subtotal})
+
+
+@receiver(post_delete, sender=PedidoArchivado)
+def descontar_pedido_archivado_eliminado(sender, instance, origin=None, **kwargs):
+    """
+    Resta el pedido archivado eliminado de los totales de su cliente y sus
+    líneas de las unidades vendidas, como un pedido de 'pedidos'
+    """
+    if not _borrado_desde(origin, Cliente):
+        Cliente.aplicar_diferencias({instance.id_cliente_id: (-1, -instance.total)})
+    unidades = {id_producto: -cantidad for id_producto, cantidad in instance.unidades().items()}
+    Producto.aplicar_unidades(unidades)
+    UnidadesArchivadas.aplicar_unidades(unidades)
+
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_delete, sender=Cliente)
+def invalidar_cliente(sender, instance, **kwargs):
+    """Descarta la vista completa en caché del cliente guardado o eliminado"""
+    cache_clientes.invalidar([instance.id_cliente])
+
+
+@receiver(post_migrate)
+def agregar_columnas_posteriores(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """Tras `migrate`, agrega a las tablas existentes las columnas posteriores a su creación"""
+    if sender.name != 'ecommerce' or using != DEFAULT_DB_ALIAS:
+        return
+    # La fecha de cada línea no tiene valor por defecto: se rellena con la de
+    # su pedido antes de exigirla
+    if columnas_faltantes(DetallePedido, ['fecha_pedido']):
+        ParticionesPedidos.preparar_detalles()
+    crear_columnas_posteriores()
+    # Los totales de los clientes y las unidades vendidas de los productos se
+    # crean a 0 y se calculan desde los pedidos
+    if crear_columnas_faltantes(Cliente, CAMPOS_TOTALES):
+        ClienteIntegrationService.recalcular_totales()
+    if crear_columnas_faltantes(Producto, ['unidades_vendidas']):
+        snapshot_estadisticas.recalcular_unidades_vendidas()
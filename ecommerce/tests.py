@@ -1,3 +1,1923 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import subprocess
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, router, transaction
+from django.db.models import F, Sum
+from django.db.utils import OperationalError
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect, ServerSelectionTimeoutError
+
+from client_sync.mongodb import AsyncMongoDBConnection, MongoDBConnection
+from .admin import custom_admin_site
+from .archivo_pedidos import ArchivoPedidos
+from .async_services import AsyncClienteInfoService, AsyncClienteIntegrationService, AsyncComentariosBucketService
+from .cache_clientes import cache_clientes
+from .checks import check_indices_mongo
+from .esquema import columnas_faltantes, crear_columnas_posteriores, es_particionada
+from .estadisticas import snapshot_estadisticas
+from .exportacion import (
+    COLUMNAS_CLIENTES, FORMATO_CSV, FORMATO_JSON, FORMATO_NDJSON,
+    bloques_clientes, bloques_pedidos, respuesta_exportacion
+)
+from .ingesta_comentarios import IngestaComentarios
+from .inventario import StockInsuficienteError
+from .lecturas_paralelas import lecturas_paralelas
+from .outbox import TIPO_COMENTARIO, TIPO_CREAR_DOCUMENTO, TIPO_PREFERENCIAS, RelayOutbox
+from .particiones import ParticionesPedidos, mes_actual, sumar_meses
+from .replica import ALIAS_PRINCIPAL, ALIAS_REPLICA, ReplicaLecturas, replica_lecturas
+from .signals import agregar_columnas_posteriores
+from .integration_service import ClienteIntegrationService, EstadisticasService, PedidoIntegrationService
+from .models import (
+    Cliente, DetallePedido, EstadisticasSnapshot, EventoOutbox, Pedido, PedidoArchivado, Producto, UnidadesArchivadas
+)
+from .mongodb_services import (
+    ClienteInfoService, ComentariosBucketService, IndicesMongoService,
+    MODO_COMENTARIOS_BUCKETS, MODO_COMENTARIOS_EMBEBIDO, PREFERENCIAS_POR_DEFECTO, bulk_write_con_reintento,
+    cliente_info_service, indices_mongo_service
+)
+
+
+def mongodb_disponible():
+    """Indica si hay un servidor MongoDB accesible con la configuración del proyecto"""
+    cliente = MongoClient(MongoDBConnection.get_connection_string(), serverSelectionTimeoutMS=2000)
+    try:
+        cliente.admin.command('ping')
+        return True
+    except Exception:
+        return False
+    finally:
+        cliente.close()
+
+
+class ClienteInfoServicePruebas(ClienteInfoService):
+    """ClienteInfoService sobre colecciones exclusivas de las pruebas"""
+    collection_name = 'test_clientes_info'
+
+    def __init__(self, modo_comentarios=None):
+        super().__init__(modo_comentarios)
+        self.buckets = ComentariosBucketPruebas()
+
+
+class ComentariosBucketPruebas(ComentariosBucketService):
+    collection_name = 'test_clientes_comentarios'
+
+
+class AsyncClienteInfoServicePruebas(AsyncClienteInfoService):
+    collection_name = ClienteInfoServicePruebas.collection_name
+
+    def __init__(self, modo_comentarios=None):
+        super().__init__(modo_comentarios)
+        self.buckets = AsyncComentariosBucketPruebas()
+
+
+class AsyncComentariosBucketPruebas(AsyncComentariosBucketService):
+    collection_name = ComentariosBucketPruebas.collection_name
+
+
+@unittest.skipUnless(mongodb_disponible(), "MongoDB no disponible")
+class MongoTestCase(SimpleTestCase):
+    """Prepara colecciones de prueba vacías, con los índices de producción"""
+
+    def setUp(self):
+        self.service = ClienteInfoServicePruebas()
+        self._limpiar()
+        indices = IndicesMongoService.indices_requeridos
+        self.service.collection.create_indexes(indices[ClienteInfoService.collection_name])
+        self.service.buckets.collection.create_indexes(indices[ComentariosBucketService.collection_name])
+
+    def tearDown(self):
+        self._limpiar()
+
+    def _limpiar(self):
+        self.service.collection.drop()
+        self.service.buckets.collection.drop()
+
+
+class UpsertConcurrenteTests(MongoTestCase):
+    """Primeras escrituras concurrentes sobre un cliente sin documento"""
+
+    HILOS = 32
+    COMENTARIOS_POR_HILO = 5
+
+    def _escribir_en_paralelo(self, service, id_cliente, con_preferencias=False):
+        barrera = threading.Barrier(self.HILOS)
+
+        def trabajo(hilo):
+            barrera.wait()
+            resultados = []
+            for i in range(self.COMENTARIOS_POR_HILO):
+                resultados.append(service.agregar_comentario(id_cliente, f"hilo {hilo} comentario {i}"))
+                if con_preferencias:
+                    resultados.append(service.actualizar_preferencias(id_cliente, {"idioma": "EN"}))
+            return resultados
+
+        with ThreadPoolExecutor(max_workers=self.HILOS) as executor:
+            resultados = list(executor.map(trabajo, range(self.HILOS)))
+        self.assertTrue(all(all(r) for r in resultados))
+
+    def _comprobar(self, service, id_cliente):
+        self.assertEqual(service.collection.count_documents({"id_cliente": id_cliente}), 1)
+        textos = [c["texto"] for c in service.obtener_comentarios(id_cliente)]
+        esperados = {
+            f"hilo {hilo} comentario {i}"
+            for hilo in range(self.HILOS)
+            for i in range(self.COMENTARIOS_POR_HILO)
+        }
+        self.assertEqual(len(textos), len(esperados))
+        self.assertEqual(set(textos), esperados)
+
+    def test_comentarios_concurrentes_modo_embebido(self):
+        service = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_EMBEBIDO)
+        self._escribir_en_paralelo(service, 1)
+        self._comprobar(service, 1)
+
+    def test_comentarios_concurrentes_modo_buckets(self):
+        service = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_BUCKETS)
+        self._escribir_en_paralelo(service, 2)
+        self._comprobar(service, 2)
+
+    def test_comentarios_y_preferencias_concurrentes(self):
+        service = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_EMBEBIDO)
+        self._escribir_en_paralelo(service, 3, con_preferencias=True)
+        self._comprobar(service, 3)
+        self.assertEqual(service.obtener_preferencias(3)["idioma"], "EN")
+
+    def test_primer_comentario_crea_documento_con_valores_por_defecto(self):
+        self.assertTrue(self.service.agregar_comentario(4, "primero"))
+        documento = self.service.obtener_info_completa(4)
+        self.assertEqual(documento["preferencias"], PREFERENCIAS_POR_DEFECTO)
+        self.assertEqual([c["texto"] for c in documento["comentarios"]], ["primero"])
+
+    def test_primeras_preferencias_no_se_pierden(self):
+        self.assertTrue(self.service.actualizar_preferencias(5, {"metodo_pago": "PayPal"}))
+        documento = self.service.obtener_info_completa(5)
+        self.assertEqual(documento["preferencias"]["metodo_pago"], "PayPal")
+        self.assertEqual(documento["comentarios"], [])
+
+
+class MigracionBucketsTests(MongoTestCase):
+    """La migración a buckets se puede repetir y no oculta los comentarios aún embebidos"""
+
+    @override_settings(MONGO_COMENTARIOS_POR_BUCKET=2)
+    def test_reintento_sin_duplicados_y_lectura_combinada(self):
+        embebido = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_EMBEBIDO)
+        buckets = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_BUCKETS)
+        for i in range(3):
+            embebido.agregar_comentario(1, f"antiguo {i}")
+        buckets.agregar_comentario(1, "nuevo")
+        esperados = ["antiguo 0", "antiguo 1", "antiguo 2", "nuevo"]
+
+        # Sin migrar: el modo buckets lee también el arreglo embebido
+        self.assertEqual([c["texto"] for c in buckets.obtener_comentarios(1)], esperados)
+        self.assertEqual([c["texto"] for c in buckets.obtener_comentarios(1, limit=2)], esperados[-2:])
+
+        # Una ejecución que se cortó antes del $pullAll y su reintento
+        comentarios = embebido.obtener_comentarios(1)
+        buckets.buckets.agregar_historicos(1, comentarios)
+        self.assertEqual([c["texto"] for c in buckets.obtener_comentarios(1)], esperados)
+        buckets.buckets.agregar_historicos(1, comentarios)
+        self.assertEqual(buckets.buckets.collection.count_documents({"id_cliente": 1}), 3)
+        buckets.collection.update_one({"id_cliente": 1}, {"$pullAll": {"comentarios": comentarios}})
+
+        self.assertEqual([c["texto"] for c in buckets.obtener_comentarios(1)], esperados)
+        self.assertEqual([c["texto"] for c in buckets.obtener_info_completa(1)["comentarios"]], esperados)
+
+
+class IngestaComentariosTests(MongoTestCase):
+    """Ingesta por lotes con bulk_write"""
+
+    def _ingestar(self, modo):
+        service = ClienteInfoServicePruebas(modo_comentarios=modo)
+        ingesta = IngestaComentarios(service=service, tamano_lote=100, intervalo=0.1)
+        for i in range(1000):
+            self.assertTrue(ingesta.encolar(i % 10, f"comentario {i}"))
+        self.assertTrue(ingesta.detener())
+
+        estadisticas = ingesta.estadisticas()
+        self.assertEqual(estadisticas["escritos"], 1000)
+        self.assertEqual(estadisticas["profundidad"], 0)
+        self.assertEqual(service.collection.count_documents({}), 10)
+        for id_cliente in range(10):
+            textos = [c["texto"] for c in service.obtener_comentarios(id_cliente)]
+            self.assertEqual(textos, [f"comentario {i}" for i in range(id_cliente, 1000, 10)])
+
+    def test_ingesta_modo_embebido(self):
+        self._ingestar(MODO_COMENTARIOS_EMBEBIDO)
+
+    def test_ingesta_modo_buckets(self):
+        self._ingestar(MODO_COMENTARIOS_BUCKETS)
+
+    def test_cola_llena_rechaza_sin_bloquear(self):
+        ingesta = IngestaComentarios(service=self.service, capacidad=1, intervalo=60, tamano_lote=1000)
+        ingesta._asegurar_hilo = lambda: None  # sin hilo de vaciado, la cola no se libera
+        self.assertTrue(ingesta.encolar(1, "uno", bloquear=False))
+        self.assertFalse(ingesta.encolar(1, "dos", bloquear=False))
+        self.assertEqual(ingesta.estadisticas()["rechazados"], 1)
+
+
+class ContadorComentariosTests(MongoTestCase):
+    """Contador num_comentarios mantenido con $inc"""
+
+    def test_contador_en_ambos_modos_y_estadisticas(self):
+        embebido = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_EMBEBIDO)
+        buckets = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_BUCKETS)
+        for i in range(3):
+            embebido.agregar_comentario(1, f"embebido {i}")
+        for i in range(4):
+            buckets.agregar_comentario(2, f"bucket {i}")
+        embebido.actualizar_preferencias(3, {"idioma": "EN"})
+
+        self.assertEqual(embebido.obtener_info_completa(1)["num_comentarios"], 3)
+        self.assertEqual(embebido.obtener_info_completa(2)["num_comentarios"], 4)
+        self.assertEqual(embebido.obtener_info_completa(3)["num_comentarios"], 0)
+        self.assertEqual(
+            embebido.obtener_estadisticas(),
+            {"total_clientes": 3, "total_comentarios": 7, "promedio_comentarios": 7 / 3}
+        )
+
+    def test_recalcular_contadores(self):
+        buckets = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_BUCKETS)
+        for i in range(5):
+            buckets.agregar_comentario(1, f"bucket {i}")
+        self.service.collection.update_one(
+            {"id_cliente": 1},
+            {"$unset": {"num_comentarios": ""}, "$push": {"comentarios": {"texto": "antiguo"}}}
+        )
+        self.service.recalcular_contadores()
+        self.assertEqual(self.service.obtener_info_completa(1, fields=["num_comentarios"])["num_comentarios"], 6)
+
+
+class MongoDBConnectionTests(SimpleTestCase):
+    """El MongoClient se crea en el primer uso y de nuevo en cada proceso"""
+
+    def test_importar_no_conecta(self):
+        # En un intérprete nuevo: el módulo ya está importado en este
+        codigo = (
+            "from unittest import mock\n"
+            "with mock.patch('pymongo.MongoClient') as cliente, mock.patch('pymongo.AsyncMongoClient') as asincrono:\n"
+            "    import client_sync.mongodb\n"
+            "print(cliente.call_count + asincrono.call_count)\n"
+        )
+        salida = subprocess.run(
+            [sys.executable, "-c", codigo], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(salida.stdout.strip(), "0")
+
+    def test_cliente_por_proceso(self):
+        conexion = MongoDBConnection()
+        with mock.patch('client_sync.mongodb.MongoClient', side_effect=lambda *a, **k: mock.MagicMock()) as cliente, \
+                mock.patch('os.getpid', return_value=1000):
+            padre = conexion.client
+            self.assertIs(conexion.client, padre)
+            with mock.patch('os.getpid', return_value=1001):
+                hijo = conexion.client
+        self.assertIsNot(hijo, padre)
+        self.assertEqual(cliente.call_count, 2)
+        # Los sockets heredados siguen siendo del padre: no se cierran
+        padre.close.assert_not_called()
+
+
+class AsyncMongoDBConnectionTests(SimpleTestCase):
+    """Un AsyncMongoClient por event loop; el de un loop terminado se cierra"""
+
+    def _en_loop_nuevo(self, conexion):
+        async def usar():
+            cliente = conexion.client
+            self.assertIs(conexion.client, cliente)
+            # Deja correr el cierre de los clientes de loops terminados
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            return cliente
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop, loop.run_until_complete(usar())
+        finally:
+            loop.close()
+
+    def test_cliente_por_loop(self):
+        conexion = AsyncMongoDBConnection()
+        # El loop se conserva: sin referencias, su entrada desaparecería antes de cerrarse
+        primer_loop, primero = self._en_loop_nuevo(conexion)
+        primero.close = mock.AsyncMock()
+
+        segundo_loop, segundo = self._en_loop_nuevo(conexion)
+        self.assertIsNot(primero, segundo)
+        primero.close.assert_awaited_once()
+        self.assertEqual(list(conexion._clients.keys()), [segundo_loop])
+
+
+class ObtenerInfoBulkTests(MongoTestCase):
+    """obtener_info_bulk devuelve un documento por cliente existente, en bloques $in"""
+
+    def _comprobar(self, modo):
+        service = ClienteInfoServicePruebas(modo_comentarios=modo)
+        service.bulk_chunk_size = 2
+        for id_cliente in (1, 2, 3):
+            self.assertTrue(service.agregar_comentario(id_cliente, f"comentario {id_cliente}"))
+
+        documentos = service.obtener_info_bulk([3, 99, 1, 3, 1, 2, 98])
+        self.assertEqual(set(documentos), {1, 2, 3})
+        self.assertEqual([c["texto"] for c in documentos[2]["comentarios"]], ["comentario 2"])
+        proyectados = service.obtener_info_bulk([2, 2, 97], fields=["preferencias"])
+        self.assertEqual(list(proyectados), [2])
+        self.assertNotIn("comentarios", proyectados[2])
+        self.assertEqual(service.obtener_info_bulk([]), {})
+        self.assertEqual(service.obtener_info_bulk([97, 98]), {})
+
+    def test_modo_embebido(self):
+        self._comprobar(MODO_COMENTARIOS_EMBEBIDO)
+
+    def test_modo_buckets(self):
+        self._comprobar(MODO_COMENTARIOS_BUCKETS)
+
+
+class ChequeoIndicesMongoTests(SimpleTestCase):
+    """El chequeo de índices solo actúa en modo estricto y falla si falta alguno"""
+
+    def test_modo_no_estricto(self):
+        with override_settings(MONGO_STRICT_INDEXES=False), \
+                mock.patch('ecommerce.checks._indices_faltantes') as faltantes:
+            self.assertEqual(check_indices_mongo(None), [])
+        faltantes.assert_not_called()
+
+    @override_settings(MONGO_STRICT_INDEXES=True)
+    def test_falta_un_indice(self):
+        with mock.patch('ecommerce.checks._indices_faltantes', return_value=['clientes_info.id_cliente_unico']):
+            errores = check_indices_mongo(None)
+        self.assertEqual([error.id for error in errores], ['ecommerce.E002'])
+        self.assertIn('clientes_info.id_cliente_unico', errores[0].msg)
+
+    @override_settings(MONGO_STRICT_INDEXES=True)
+    def test_mongodb_no_responde(self):
+        error = ServerSelectionTimeoutError("sin servidor")
+        with mock.patch('ecommerce.checks._indices_faltantes', side_effect=error):
+            self.assertEqual([error.id for error in check_indices_mongo(None)], ['ecommerce.E001'])
+
+
+@override_settings(MONGO_STRICT_INDEXES=True)
+class IndicesMongoTests(MongoTestCase):
+    """ensure_mongo_indexes crea los índices que exige el chequeo estricto y puede repetirse"""
+
+    def setUp(self):
+        self.service = ClienteInfoServicePruebas()
+        self._limpiar()
+        # Los índices de producción, sobre las colecciones de prueba
+        indices = IndicesMongoService.indices_requeridos
+        patcher = mock.patch.object(indices_mongo_service, 'indices_requeridos', {
+            self.service.collection_name: indices[ClienteInfoService.collection_name],
+            self.service.buckets.collection_name: indices[ComentariosBucketService.collection_name],
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ensure_mongo_indexes(self):
+        call_command('ensure_mongo_indexes', stdout=io.StringIO())
+        return sorted(self.service.collection.index_information()), sorted(
+            self.service.buckets.collection.index_information()
+        )
+
+    def test_falta_un_indice(self):
+        self._ensure_mongo_indexes()
+        self.service.buckets.collection.drop_index('id_cliente_fecha_fin')
+
+        errores = check_indices_mongo(None)
+        self.assertEqual([error.id for error in errores], ['ecommerce.E002'])
+        self.assertIn(f'{self.service.buckets.collection_name}.id_cliente_fecha_fin', errores[0].msg)
+
+    def test_todos_los_indices(self):
+        self._ensure_mongo_indexes()
+        self.assertEqual(check_indices_mongo(None), [])
+
+    def test_comando_idempotente(self):
+        primera = self._ensure_mongo_indexes()
+        self.assertEqual(self._ensure_mongo_indexes(), primera)
+        self.assertEqual(check_indices_mongo(None), [])
+
+
+class AsyncClienteInfoServiceTests(MongoTestCase):
+    """El servicio async escribe y lee los mismos documentos que el síncrono"""
+
+    async def _escribir_y_leer(self, modo):
+        service = AsyncClienteInfoServicePruebas(modo_comentarios=modo)
+        for i in range(7):
+            self.assertTrue(await service.agregar_comentario(1, f"comentario {i}"))
+        self.assertTrue(await service.actualizar_preferencias(1, {"idioma": "EN"}))
+
+        ultimos = await service.obtener_comentarios(1, limit=3)
+        self.assertEqual([c["texto"] for c in ultimos], ["comentario 4", "comentario 5", "comentario 6"])
+        self.assertEqual((await service.obtener_preferencias(1))["idioma"], "EN")
+        self.assertEqual((await service.obtener_estadisticas())["total_comentarios"], 7)
+        self.assertEqual(set(await service.obtener_info_bulk([1, 2])), {1})
+
+        sincrono = ClienteInfoServicePruebas(modo_comentarios=modo)
+        self.assertEqual(
+            [c["texto"] for c in sincrono.obtener_comentarios(1)],
+            [f"comentario {i}" for i in range(7)]
+        )
+
+    async def test_modo_embebido(self):
+        await self._escribir_y_leer(MODO_COMENTARIOS_EMBEBIDO)
+
+    async def test_modo_buckets(self):
+        await self._escribir_y_leer(MODO_COMENTARIOS_BUCKETS)
+
+
+class IterarClientesCompletosTests(TestCase):
+    """El recorrido por bloques hace una consulta SQL y una lectura MongoDB por bloque"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            cliente = Cliente.objects.create(nombre=f"Cliente {i}", email=f"c{i}@prueba.com", telefono="1")
+            for _ in range(i % 3):
+                Pedido.objects.create(
+                    id_cliente=cliente, total=Decimal('10.50'), direccion_envio="-", metodo_pago="efectivo"
+                )
+
+    def test_viajes_por_bloque_y_totales(self):
+        with mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_bulk', return_value={}
+        ) as obtener_info_bulk:
+            # 7 clientes en bloques de 3: consultas de 3, 3 y 1 fila
+            with self.assertNumQueries(3):
+                clientes = list(ClienteIntegrationService.iterar_clientes_completos(tamano_bloque=3))
+
+        self.assertEqual(obtener_info_bulk.call_count, 3)
+        self.assertEqual([c["nombre"] for c in clientes], [f"Cliente {i}" for i in range(7)])
+        self.assertEqual([c["total_pedidos"] for c in clientes], [i % 3 for i in range(7)])
+        self.assertEqual([c["total_gastado"] for c in clientes], [10.5 * (i % 3) for i in range(7)])
+
+
+class ExportacionStreamingTests(TestCase):
+    """Las exportaciones se emiten por bloques y con un número fijo de consultas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        producto = Producto.objects.create(nombre="Producto", precio=Decimal('2.00'), stock=100)
+        for i in range(5):
+            cliente = Cliente.objects.create(nombre=f"Cliente {i}", email=f"e{i}@prueba.com", telefono="1")
+            pedido = Pedido.objects.create(id_cliente=cliente, direccion_envio="-", metodo_pago="efectivo")
+            DetallePedido.objects.create(id_pedido=pedido, id_producto=producto, cantidad=i + 1)
+
+    def setUp(self):
+        patcher = mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_bulk',
+            return_value={}
+        )
+        self.obtener_info_bulk = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _contenido(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_un_cursor_y_una_lectura_mongo_por_bloque(self):
+        response = respuesta_exportacion(
+            bloques_clientes(Cliente.objects.all(), tamano_bloque=2), 'clientes', FORMATO_NDJSON, comprimir=False
+        )
+        with self.assertNumQueries(1):
+            lineas = self._contenido(response).decode().splitlines()
+
+        self.assertEqual(self.obtener_info_bulk.call_count, 3)
+        self.assertEqual([json.loads(linea)["nombre"] for linea in lineas], [f"Cliente {i}" for i in range(5)])
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+    def test_json_es_un_arreglo_valido(self):
+        response = respuesta_exportacion(
+            bloques_clientes(Cliente.objects.all(), tamano_bloque=2), 'clientes', FORMATO_JSON, comprimir=False
+        )
+        self.assertEqual(len(json.loads(self._contenido(response))), 5)
+
+        vacio = respuesta_exportacion(
+            bloques_clientes(Cliente.objects.none()), 'clientes', FORMATO_JSON, comprimir=False
+        )
+        self.assertEqual(json.loads(self._contenido(vacio)), [])
+
+    def test_csv_comprimido(self):
+        response = respuesta_exportacion(
+            bloques_clientes(Cliente.objects.all(), tamano_bloque=2), 'clientes', FORMATO_CSV,
+            columnas=COLUMNAS_CLIENTES, comprimir=True
+        )
+        self.assertTrue(response['Content-Disposition'].endswith('.csv.gz"'))
+        filas = list(csv.DictReader(io.StringIO(gzip.decompress(self._contenido(response)).decode())))
+        self.assertEqual(len(filas), 5)
+        self.assertEqual(filas[0]["total_pedidos"], "1")
+        self.assertEqual(json.loads(filas[0]["preferencias"]), {})
+
+    def test_pedidos_consultas_por_bloque(self):
+        response = respuesta_exportacion(
+            bloques_pedidos(Pedido.objects.all(), tamano_bloque=2), 'pedidos', FORMATO_NDJSON, comprimir=False
+        )
+        # Cursor de pedidos + detalles y productos precargados en cada uno de los 3 bloques
+        with self.assertNumQueries(1 + 2 * 3):
+            pedidos = [json.loads(linea) for linea in self._contenido(response).decode().splitlines()]
+
+        self.assertEqual([p["detalles"][0]["cantidad"] for p in pedidos], [1, 2, 3, 4, 5])
+        self.assertEqual(self.obtener_info_bulk.call_count, 3)
+
+
+class PedidosClienteTests(TestCase):
+    """obtener_pedidos_cliente no depende del número de pedidos en sus viajes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        productos = [
+            Producto.objects.create(nombre=f"Producto {i}", precio=Decimal('3.00'), stock=100) for i in range(3)
+        ]
+        cls.cliente = Cliente.objects.create(nombre="Cliente", email="pedidos@prueba.com", telefono="1")
+        for i in range(20):
+            pedido = Pedido.objects.create(id_cliente=cls.cliente, direccion_envio="-", metodo_pago="efectivo")
+            for producto in productos[:i % 3 + 1]:
+                DetallePedido.objects.create(id_pedido=pedido, id_producto=producto, cantidad=2)
+
+    def test_viajes_fijos(self):
+        with mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_completa',
+            return_value={"preferencias": {"idioma": "ES"}}
+        ) as obtener_info_completa:
+            # Pedidos con su cliente, detalles y productos, y pedidos archivados
+            with self.assertNumQueries(4):
+                pedidos = PedidoIntegrationService.obtener_pedidos_cliente(self.cliente.id_cliente)
+
+        self.assertEqual(obtener_info_completa.call_count, 1)
+        self.assertEqual(len(pedidos), 20)
+        self.assertEqual(sum(len(p["detalles"]) for p in pedidos), 39)
+        self.assertTrue(all(p["cliente"]["preferencias"] == {"idioma": "ES"} for p in pedidos))
+        self.assertEqual(
+            [p["id_pedido"] for p in pedidos],
+            list(Pedido.objects.filter(id_cliente=self.cliente).order_by('-fecha_pedido').values_list('id_pedido', flat=True))
+        )
+
+    def test_cliente_sin_pedidos(self):
+        otro = Cliente.objects.create(nombre="Otro", email="otro@prueba.com", telefono="1")
+        with mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_completa'
+        ) as obtener_info_completa:
+            self.assertEqual(PedidoIntegrationService.obtener_pedidos_cliente(otro.id_cliente), [])
+        obtener_info_completa.assert_not_called()
+
+
+class CrearPedidoTests(TestCase):
+    """crear_pedido da el mismo resultado que guardar detalle a detalle, con consultas fijas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre="Cliente", email="crear@prueba.com", telefono="1")
+        cls.productos = [
+            Producto.objects.create(nombre=f"Producto {i}", precio=Decimal('1.25') * (i + 1), stock=100)
+            for i in range(30)
+        ]
+
+    def _lineas(self):
+        return [{"id_producto": p.id_producto, "cantidad": i % 4 + 1} for i, p in enumerate(self.productos)]
+
+    def test_mismo_resultado_que_detalle_a_detalle(self):
+        referencia = Pedido.objects.create(id_cliente=self.cliente, direccion_envio="-", metodo_pago="efectivo")
+        for linea in self._lineas():
+            DetallePedido.objects.create(
+                id_pedido=referencia, id_producto_id=linea["id_producto"], cantidad=linea["cantidad"]
+            )
+        referencia.refresh_from_db()
+
+        # Productos, pedido, totales del cliente y detalles, más un UPDATE de stock por producto
+        with self.assertNumQueries(4 + len(self.productos)):
+            pedido = PedidoIntegrationService.crear_pedido(self.cliente.id_cliente, self._lineas(), "-", "efectivo")
+        pedido.refresh_from_db()
+
+        self.assertEqual(pedido.total, referencia.total)
+        self.assertEqual(pedido.total, pedido.calcular_total())
+        campos = ('id_producto_id', 'cantidad', 'precio_unitario', 'subtotal')
+        self.assertEqual(
+            list(pedido.detalles.order_by('id_producto').values_list(*campos)),
+            list(referencia.detalles.order_by('id_producto').values_list(*campos))
+        )
+
+    def test_producto_inexistente_no_crea_nada(self):
+        lineas = self._lineas() + [{"id_producto": 999999, "cantidad": 1}]
+        with mock.patch('ecommerce.integration_service.cliente_info_service.actualizar_preferencias'):
+            resultado = PedidoIntegrationService.crear_pedido_completo(self.cliente.id_cliente, lineas, "-", "efectivo")
+        self.assertIsNone(resultado)
+        self.assertFalse(Pedido.objects.filter(id_cliente=self.cliente).exists())
+
+
+class TotalesClienteTests(TestCase):
+    """num_pedidos y total_gastado siguen a los pedidos sin recalcularse en cada lectura"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre="Cliente", email="totales@prueba.com", telefono="1")
+        cls.otro = Cliente.objects.create(nombre="Otro", email="totales.otro@prueba.com", telefono="1")
+        cls.producto = Producto.objects.create(nombre="Producto", precio=Decimal('4.00'), stock=100)
+
+    def _pedido(self, cliente, total):
+        return Pedido.objects.create(
+            id_cliente=cliente, total=Decimal(total), direccion_envio="-", metodo_pago="efectivo"
+        )
+
+    def _totales(self, cliente):
+        cliente.refresh_from_db()
+        return cliente.num_pedidos, cliente.total_gastado
+
+    def test_diferencias_al_crear_modificar_mover_y_borrar(self):
+        pedido = self._pedido(self.cliente, '10.00')
+        self._pedido(self.cliente, '5.50')
+        self.assertEqual(self._totales(self.cliente), (2, Decimal('15.50')))
+
+        # La línea suma su subtotal al total del pedido (10.00 + 3 x 4.00)
+        DetallePedido.objects.create(id_pedido=pedido, id_producto=self.producto, cantidad=3)
+        self.assertEqual(self._totales(self.cliente), (2, Decimal('27.50')))
+
+        pedido.estado = 'enviado'
+        with self.assertNumQueries(1):
+            pedido.save(update_fields=['estado'])
+
+        pedido.id_cliente = self.otro
+        pedido.save()
+        self.assertEqual(self._totales(self.cliente), (1, Decimal('5.50')))
+        self.assertEqual(self._totales(self.otro), (1, Decimal('22.00')))
+
+        pedido.delete()
+        Pedido.objects.filter(id_cliente=self.cliente).delete()
+        self.assertEqual(self._totales(self.cliente), (0, Decimal('0.00')))
+        self.assertEqual(self._totales(self.otro), (0, Decimal('0.00')))
+
+    def test_lectura_sin_consultas_de_pedidos(self):
+        self._pedido(self.cliente, '7.25')
+        with mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_completa', return_value=None
+        ):
+            with self.assertNumQueries(1):
+                completo = ClienteIntegrationService.obtener_cliente_completo(self.cliente.id_cliente)
+        self.assertEqual((completo["total_pedidos"], completo["total_gastado"]), (1, 7.25))
+
+    def test_carga_masiva_suma_totales(self):
+        with mock.patch('ecommerce.ingesta_pedidos.escrituras_mongo.service'):
+            PedidoIntegrationService.crear_pedidos_bulk([
+                {"id_cliente": cliente.id_cliente, "direccion_envio": "-", "metodo_pago": "efectivo",
+                 "productos": [{"id_producto": self.producto.id_producto, "cantidad": 2}]}
+                for cliente in (self.cliente, self.cliente, self.otro)
+            ])
+        self.assertEqual(self._totales(self.cliente), (2, Decimal('16.00')))
+        self.assertEqual(self._totales(self.otro), (1, Decimal('8.00')))
+
+    def test_recalcular_corrige_desvios(self):
+        self._pedido(self.cliente, '3.00')
+        self._pedido(self.otro, '4.00')
+        Cliente.objects.filter(id_cliente=self.cliente.id_cliente).update(num_pedidos=9, total_gastado=0)
+
+        verificacion = ClienteIntegrationService.recalcular_totales(reparar=False)
+        self.assertEqual(verificacion["desviados"], [self.cliente.id_cliente])
+        self.assertEqual(verificacion["reparados"], 0)
+
+        self.assertEqual(ClienteIntegrationService.recalcular_totales()["reparados"], 1)
+        self.assertEqual(self._totales(self.cliente), (1, Decimal('3.00')))
+        self.assertEqual(ClienteIntegrationService.recalcular_totales(reparar=False)["desviados"], [])
+
+
+class TotalesPedidoTests(TestCase):
+    """Las líneas suman su diferencia al total del pedido sin volver a sumar las demás"""
+
+    LINEAS = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre="Cliente", email="totales.pedido@prueba.com", telefono="1")
+        cls.productos = [
+            Producto.objects.create(nombre=f"Producto {i}", precio=Decimal('2.50'), stock=1000)
+            for i in range(cls.LINEAS)
+        ]
+
+    def _pedido(self):
+        return Pedido.objects.create(id_cliente=self.cliente, direccion_envio="-", metodo_pago="efectivo")
+
+    def _comprobar(self, *pedidos):
+        for pedido in pedidos:
+            guardado = Pedido.objects.get(pk=pedido.pk)
+            self.assertEqual(guardado.total, sum((d.subtotal for d in guardado.detalles.all()), Decimal('0.00')))
+        self.cliente.refresh_from_db()
+        self.assertEqual(
+            self.cliente.total_gastado, sum(p.total for p in Pedido.objects.filter(id_cliente=self.cliente))
+        )
+
+    def test_crear_modificar_mover_y_borrar_lineas(self):
+        pedido, otro = self._pedido(), self._pedido()
+        detalle = DetallePedido.objects.create(id_pedido=pedido, id_producto=self.productos[0], cantidad=2)
+        DetallePedido.objects.create(id_pedido=pedido, id_producto=self.productos[1], cantidad=1)
+        self.assertEqual(pedido.total, Decimal('7.50'))
+        self._comprobar(pedido, otro)
+
+        detalle.cantidad = 4
+        detalle.save()
+        self._comprobar(pedido, otro)
+
+        detalle.id_pedido = otro
+        detalle.save()
+        self.assertEqual(otro.total, Decimal('10.00'))
+        self._comprobar(pedido, otro)
+
+        detalle.delete()
+        DetallePedido.objects.filter(id_pedido=pedido).delete()
+        self._comprobar(pedido, otro)
+        self.assertEqual(Pedido.objects.get(pk=pedido.pk).total, Decimal('0.00'))
+
+    def test_editar_pedido_grande_coste_lineal(self):
+        pedido = self._pedido()
+        detalles = [
+            DetallePedido.objects.create(id_pedido=pedido, id_producto=producto, cantidad=1)
+            for producto in self.productos
+        ]
+
+        # Por línea: bloqueo de la línea, UPDATE de la línea, del producto, del pedido y del cliente
+        with CaptureQueriesContext(connection) as consultas:
+            for detalle in detalles:
+                detalle.cantidad = 2
+                detalle.save()
+        self.assertEqual(len(consultas), 5 * self.LINEAS)
+        self.assertFalse(any('SUM(' in consulta['sql'] for consulta in consultas.captured_queries))
+        self._comprobar(pedido)
+        self.assertEqual(Pedido.objects.get(pk=pedido.pk).total, Decimal('500.00'))
+
+    def test_recalcular_corrige_desvios(self):
+        pedido, otro = self._pedido(), self._pedido()
+        DetallePedido.objects.create(id_pedido=pedido, id_producto=self.productos[0], cantidad=2)
+        DetallePedido.objects.create(id_pedido=otro, id_producto=self.productos[0], cantidad=1)
+        # Desvío de las escrituras que no pasan por save (p. ej. update de QuerySet)
+        DetallePedido.objects.filter(id_pedido=pedido).update(subtotal=Decimal('9.00'))
+
+        verificacion = PedidoIntegrationService.recalcular_totales(reparar=False)
+        self.assertEqual(verificacion["desviados"], [pedido.id_pedido])
+        self.assertEqual(verificacion["reparados"], 0)
+
+        self.assertEqual(PedidoIntegrationService.recalcular_totales()["reparados"], 1)
+        self.assertEqual(Pedido.objects.get(pk=pedido.pk).total, Decimal('9.00'))
+        self._comprobar(pedido, otro)
+        self.assertEqual(PedidoIntegrationService.recalcular_totales(reparar=False)["desviados"], [])
+
+
+class CacheClientesTests(TestCase):
+    """obtener_cliente_completo sale de la caché hasta que una escritura cambia la versión del cliente"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes = [
+            Cliente.objects.create(nombre=f"Cliente {i}", email=f"cache{i}@prueba.com", telefono="1")
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        cache_clientes.limpiar_lru()
+        patcher = mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_completa',
+            return_value={"preferencias": {"idioma": "ES"}, "comentarios": []}
+        )
+        self.obtener_info_completa = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _leer(self, cliente=None):
+        return ClienteIntegrationService.obtener_cliente_completo((cliente or self.clientes[0]).id_cliente)
+
+    def _diferencia(self, antes, contador):
+        return cache_clientes.estadisticas()[contador] - antes[contador]
+
+    def test_aciertos_lru_y_compartida(self):
+        antes = cache_clientes.estadisticas()
+        primero = self._leer()
+        with self.assertNumQueries(0):
+            segundo = self._leer()
+            cache_clientes.limpiar_lru()
+            tercero = self._leer()
+
+        self.assertEqual(primero, segundo)
+        self.assertEqual(primero, tercero)
+        self.assertEqual(self.obtener_info_completa.call_count, 1)
+        self.assertEqual(self._diferencia(antes, "fallos"), 1)
+        self.assertEqual(self._diferencia(antes, "aciertos_lru"), 1)
+        self.assertEqual(self._diferencia(antes, "aciertos_compartida"), 1)
+
+        # Modificar lo devuelto no altera la caché
+        segundo["preferencias"]["idioma"] = "EN"
+        self.assertEqual(self._leer()["preferencias"], {"idioma": "ES"})
+
+    def test_lectura_async_comparte_la_cache(self):
+        primero = self._leer()
+        with mock.patch(
+            'ecommerce.async_services.async_cliente_info_service.obtener_info_completa', new_callable=mock.AsyncMock
+        ) as obtener_async, self.assertNumQueries(0):
+            cache_clientes.limpiar_lru()
+            segundo = async_to_sync(AsyncClienteIntegrationService.obtener_cliente_completo)(
+                self.clientes[0].id_cliente
+            )
+        self.assertEqual(primero, segundo)
+        obtener_async.assert_not_called()
+
+        # Lo que carga la lectura async lo aprovecha la síncrona
+        with mock.patch(
+            'ecommerce.async_services.async_cliente_info_service.obtener_info_completa', new_callable=mock.AsyncMock,
+            return_value={"preferencias": {"idioma": "EN"}, "comentarios": []}
+        ):
+            async_to_sync(AsyncClienteIntegrationService.obtener_cliente_completo)(self.clientes[1].id_cliente)
+        self.assertEqual(self._leer(self.clientes[1])["preferencias"], {"idioma": "EN"})
+        self.assertEqual(self.obtener_info_completa.call_count, 1)
+
+    def test_mongodb_caido_no_queda_en_cache(self):
+        antes = cache_clientes.estadisticas()
+        self.obtener_info_completa.side_effect = lambda id_cliente, fields=None, en_error=None: en_error
+        self.assertEqual(self._leer()["preferencias"], {})
+        with mock.patch(
+            'ecommerce.async_services.async_cliente_info_service.obtener_info_completa', new_callable=mock.AsyncMock,
+            side_effect=lambda id_cliente, fields=None, en_error=None: en_error
+        ):
+            async_to_sync(AsyncClienteIntegrationService.obtener_cliente_completo)(self.clientes[0].id_cliente)
+        self.assertEqual(self._diferencia(antes, "degradados"), 2)
+
+        # En cuanto MongoDB responde, la vista se carga completa y se guarda
+        self.obtener_info_completa.side_effect = None
+        self.assertEqual(self._leer()["preferencias"], {"idioma": "ES"})
+        self._leer()
+        self.assertEqual(self.obtener_info_completa.call_count, 2)
+
+    def test_escrituras_invalidan_solo_a_su_cliente(self):
+        self._leer()
+        self._leer(self.clientes[1])
+
+        ClienteIntegrationService.actualizar_cliente_completo(
+            self.clientes[0].id_cliente, datos_postgres={"nombre": "Renombrado"}
+        )
+        self.assertEqual(self._leer()["nombre"], "Renombrado")
+        self.assertEqual(self.obtener_info_completa.call_count, 3)
+
+        with mock.patch.object(cliente_info_service, '_upsert'):
+            cliente_info_service.actualizar_preferencias(self.clientes[0].id_cliente, {"idioma": "EN"})
+        self._leer()
+        self.assertEqual(self.obtener_info_completa.call_count, 4)
+
+        Pedido.objects.create(
+            id_cliente=self.clientes[0], total=Decimal('8.00'), direccion_envio="-", metodo_pago="efectivo"
+        )
+        self.assertEqual(self._leer()["total_pedidos"], 1)
+
+        # El otro cliente sigue en caché
+        self._leer(self.clientes[1])
+        self.assertEqual(self.obtener_info_completa.call_count, 5)
+
+    def test_lectura_concurrente_con_escritura_no_queda_en_cache(self):
+        def cargar_e_invalidar():
+            resultado = ClienteIntegrationService._cargar_cliente_completo(self.clientes[0].id_cliente)
+            cache_clientes.invalidar([self.clientes[0].id_cliente])
+            return resultado
+
+        cache_clientes.obtener(self.clientes[0].id_cliente, cargar_e_invalidar)
+        self._leer()
+        self.assertEqual(self.obtener_info_completa.call_count, 2)
+
+    @override_settings(CACHE_CLIENTES_LRU_TAMANO=2)
+    def test_lru_acotado(self):
+        antes = cache_clientes.estadisticas()
+        for cliente in self.clientes:
+            self._leer(cliente)
+        self.assertEqual(self._diferencia(antes, "desalojos"), 1)
+        self.assertEqual(cache_clientes.estadisticas()["tamano_lru"], 2)
+
+        # El desalojado se sirve desde la caché compartida
+        self._leer(self.clientes[0])
+        self.assertEqual(self._diferencia(antes, "aciertos_compartida"), 1)
+
+    @override_settings(CACHE_CLIENTES_TTL=0)
+    def test_desactivada(self):
+        self._leer()
+        self._leer()
+        self.assertEqual(self.obtener_info_completa.call_count, 2)
+
+
+class EstadisticasSnapshotTests(TestCase):
+    """El panel lee un snapshot calculado desde los contadores mantenidos al escribir"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes = [
+            Cliente.objects.create(nombre=f"Cliente {i}", email=f"stats{i}@prueba.com", telefono="1") for i in range(3)
+        ]
+        cls.productos = [
+            Producto.objects.create(nombre=f"Producto {i}", precio=Decimal('2.00'), stock=100) for i in range(4)
+        ]
+        for i, cliente in enumerate(cls.clientes):
+            PedidoIntegrationService.crear_pedido(
+                cliente.id_cliente,
+                [{"id_producto": p.id_producto, "cantidad": i + 1} for p in cls.productos[:i + 1]],
+                "-", "efectivo"
+            )
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            snapshot_estadisticas, '_estadisticas_mongo',
+            return_value={"total_clientes": 3, "total_comentarios": 6, "promedio_comentarios": 2.0}
+        )
+        self.estadisticas_mongo = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _unidades_reales(self):
+        return {
+            p.id_producto: sum(d.cantidad for d in DetallePedido.objects.filter(id_producto=p))
+            for p in Producto.objects.all()
+        }
+
+    def test_unidades_vendidas_siguen_a_las_lineas(self):
+        pedido = Pedido.objects.filter(id_cliente=self.clientes[0]).get()
+        detalle = DetallePedido.objects.create(id_pedido=pedido, id_producto=self.productos[3], cantidad=4)
+        detalle.cantidad = 1
+        detalle.save()
+        Pedido.objects.filter(id_cliente=self.clientes[1]).delete()
+        self.assertEqual(
+            dict(Producto.objects.values_list('id_producto', 'unidades_vendidas')), self._unidades_reales()
+        )
+        self.assertEqual(snapshot_estadisticas.recalcular_unidades_vendidas(), 0)
+
+        Producto.objects.filter(id_producto=self.productos[0].id_producto).update(unidades_vendidas=99)
+        self.assertEqual(snapshot_estadisticas.recalcular_unidades_vendidas(), 1)
+        self.assertEqual(
+            dict(Producto.objects.values_list('id_producto', 'unidades_vendidas')), self._unidades_reales()
+        )
+
+    def test_snapshot_vigente_una_consulta(self):
+        snapshot_estadisticas.refrescar()
+        with self.assertNumQueries(1):
+            estadisticas = EstadisticasService.obtener_estadisticas_generales()
+
+        self.assertEqual(estadisticas["postgresql"]["total_pedidos"], 3)
+        self.assertEqual(estadisticas["postgresql"]["total_ventas"], 2.0 * (1 + 2 * 2 + 3 * 3))
+        self.assertEqual(estadisticas["integracion"]["porcentaje_cobertura"], 100)
+        self.assertIsNotNone(estadisticas["fecha_calculo"])
+
+        datos = EstadisticasSnapshot.objects.get().datos
+        self.assertEqual(datos["pedidos_hoy"], 3)
+        self.assertEqual(
+            [(p["id_producto"], p["unidades_vendidas"]) for p in datos["productos_mas_vendidos"]],
+            [(self.productos[0].id_producto, 6), (self.productos[1].id_producto, 5), (self.productos[2].id_producto, 3)]
+        )
+        self.assertEqual(datos["clientes_mas_activos"][0]["num_pedidos"], 1)
+
+    def test_limite_de_antiguedad(self):
+        anterior = snapshot_estadisticas.refrescar()
+        PedidoIntegrationService.crear_pedido(
+            self.clientes[0].id_cliente, [{"id_producto": self.productos[3].id_producto, "cantidad": 1}], "-", "efectivo"
+        )
+        self.assertEqual(EstadisticasService.obtener_estadisticas_generales()["postgresql"]["total_pedidos"], 3)
+
+        estadisticas = EstadisticasService.obtener_estadisticas_generales(max_antiguedad=0)
+        self.assertEqual(estadisticas["postgresql"]["total_pedidos"], 4)
+        self.assertGreater(estadisticas["fecha_calculo"], anterior.fecha_calculo)
+
+    def test_mongo_caido_conserva_lo_anterior(self):
+        anterior = snapshot_estadisticas.refrescar()
+        self.estadisticas_mongo.side_effect = RuntimeError("sin conexión")
+        snapshot = snapshot_estadisticas.refrescar()
+
+        self.assertGreater(snapshot.fecha_calculo, anterior.fecha_calculo)
+        self.assertEqual(snapshot.fecha_mongo, anterior.fecha_mongo)
+        self.assertEqual(snapshot.datos["mongodb"]["total_comentarios"], 6)
+
+    def test_panel(self):
+        request = RequestFactory().get('/admin/')
+        request.user = User.objects.create_superuser("admin", "admin@prueba.com", "clave")
+        response = custom_admin_site.index(request)
+        self.assertEqual(response.context_data["productos_mas_vendidos"][0]["nombre"], self.productos[0].nombre)
+        self.assertIsNotNone(response.context_data["estadisticas_fecha"])
+
+
+@override_settings(LECTURAS_PARALELAS=True, CACHE_CLIENTES_TTL=0)
+class LecturasParalelasTests(TestCase):
+    """Con LECTURAS_PARALELAS, MongoDB se lee en el pool mientras el ORM consulta PostgreSQL"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre="Cliente", email="paralelas@prueba.com", telefono="1")
+        producto = Producto.objects.create(nombre="Producto", precio=Decimal('3.00'), stock=100)
+        cls.pedido = Pedido.objects.create(id_cliente=cls.cliente, direccion_envio="-", metodo_pago="efectivo")
+        DetallePedido.objects.create(id_pedido=cls.pedido, id_producto=producto, cantidad=2)
+
+    def setUp(self):
+        self.hilos = []
+        self.campos = []
+        self.liberar = threading.Event()
+        self.addCleanup(self.liberar.set)
+
+        def obtener_info_completa(id_cliente, fields=None, en_error=None):
+            self.hilos.append(threading.current_thread().name)
+            self.campos.append(fields)
+            if self.bloquear:
+                self.liberar.wait(5)
+            return {"preferencias": {"idioma": "ES"}, "comentarios": []}
+
+        self.bloquear = False
+        patcher = mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_completa',
+            side_effect=obtener_info_completa
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pedido_en_paralelo(self):
+        # Pedido con su cliente, detalles y productos
+        with self.assertNumQueries(3):
+            pedido = PedidoIntegrationService.obtener_pedido_completo(self.pedido.id_pedido)
+
+        self.assertEqual(pedido["cliente"]["preferencias"], {"idioma": "ES"})
+        self.assertEqual(len(pedido["detalles"]), 1)
+        self.assertTrue(self.hilos[0].startswith('lecturas_mongo'))
+        # Del documento del cliente solo se usan las preferencias
+        self.assertEqual(self.campos, [["preferencias"]])
+
+    def test_cliente_en_paralelo(self):
+        cliente = ClienteIntegrationService.obtener_cliente_completo(self.cliente.id_cliente)
+        self.assertEqual(cliente["preferencias"], {"idioma": "ES"})
+        self.assertTrue(self.hilos[0].startswith('lecturas_mongo'))
+        self.assertIsNone(ClienteIntegrationService.obtener_cliente_completo(0))
+
+    @override_settings(LECTURAS_PARALELAS_TIMEOUT=0.05, CACHE_CLIENTES_TTL=300)
+    def test_timeout_responde_sin_mongo(self):
+        cache.clear()
+        cache_clientes.limpiar_lru()
+        self.bloquear = True
+        antes = lecturas_paralelas.estadisticas()["timeouts"]
+        cliente = ClienteIntegrationService.obtener_cliente_completo(self.cliente.id_cliente)
+
+        self.assertEqual(cliente["nombre"], "Cliente")
+        self.assertEqual(cliente["preferencias"], {})
+        self.assertEqual(lecturas_paralelas.estadisticas()["timeouts"], antes + 1)
+
+        # La vista sin MongoDB no se guardó en la caché
+        self.liberar.set()
+        self.bloquear = False
+        cliente = ClienteIntegrationService.obtener_cliente_completo(self.cliente.id_cliente)
+        self.assertEqual(cliente["preferencias"], {"idioma": "ES"})
+
+    @override_settings(LECTURAS_PARALELAS=False)
+    def test_desactivado_en_el_hilo_actual(self):
+        PedidoIntegrationService.obtener_pedido_completo(self.pedido.id_pedido)
+        self.assertEqual(self.hilos, [threading.current_thread().name])
+
+
+class ReplicaLecturasTests(SimpleTestCase):
+    """Las lecturas de informes van a la réplica salvo en transacción, tras escribir o con retraso"""
+
+    def setUp(self):
+        self.replica = ReplicaLecturas()
+        self.retraso = mock.patch.object(self.replica, 'retraso', return_value=0.5).start()
+        mock.patch.object(
+            ReplicaLecturas, 'configurada', new_callable=mock.PropertyMock, return_value=True
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+        replica_lecturas.reiniciar()
+        self.addCleanup(replica_lecturas.reiniciar)
+
+    def test_sin_replica_configurada(self):
+        with mock.patch.object(ReplicaLecturas, 'configurada', new_callable=mock.PropertyMock, return_value=False):
+            self.assertEqual(self.replica.alias(), ALIAS_PRINCIPAL)
+        self.retraso.assert_not_called()
+
+    def test_replica_al_dia(self):
+        self.assertEqual(self.replica.alias(), ALIAS_REPLICA)
+        self.assertEqual(self.replica.estadisticas()["replica"], 1)
+
+    @override_settings(REPLICA_MAX_RETRASO=0.1)
+    def test_retrasada_lee_del_principal(self):
+        self.assertEqual(self.replica.alias(), ALIAS_PRINCIPAL)
+        self.assertEqual(self.replica.estadisticas()["retrasada"], 1)
+
+    def test_no_disponible_lee_del_principal(self):
+        self.retraso.side_effect = OperationalError("connection refused")
+        self.assertEqual(self.replica.alias(), ALIAS_PRINCIPAL)
+        self.assertEqual(self.replica.estadisticas()["no_disponible"], 1)
+
+    @override_settings(REPLICA_COMPROBACION_INTERVALO=60)
+    def test_comprobacion_reutilizada(self):
+        self.replica.alias()
+        self.replica.alias()
+        self.assertEqual(self.retraso.call_count, 1)
+
+    def test_transaccion_lee_del_principal(self):
+        with mock.patch.object(connections[ALIAS_PRINCIPAL], 'in_atomic_block', True):
+            self.assertEqual(self.replica.alias(), ALIAS_PRINCIPAL)
+        self.retraso.assert_not_called()
+
+    def test_escritura_fija_el_principal(self):
+        self.assertEqual(router.db_for_write(Cliente), ALIAS_PRINCIPAL)
+        self.assertEqual(self.replica.alias(), ALIAS_PRINCIPAL)
+        with override_settings(REPLICA_FIJAR_TRAS_ESCRITURA=0):
+            self.assertEqual(self.replica.alias(), ALIAS_REPLICA)
+
+    def test_router(self):
+        self.assertEqual(router.db_for_read(Cliente), ALIAS_PRINCIPAL)
+        with self.replica.lecturas(ALIAS_REPLICA):
+            self.assertEqual(Cliente.objects.all().db, ALIAS_REPLICA)
+            self.assertEqual(Cliente.objects.select_for_update().db, ALIAS_PRINCIPAL)
+        self.assertEqual(Cliente.objects.all().db, ALIAS_PRINCIPAL)
+        self.assertTrue(router.allow_migrate(ALIAS_PRINCIPAL, 'ecommerce'))
+        self.assertFalse(router.allow_migrate(ALIAS_REPLICA, 'ecommerce'))
+
+
+class RetrasoReplicaTests(TestCase):
+    """SQL_RETRASO solo da por al día una réplica que recibe WAL en streaming"""
+
+    def _retraso(self, receptor, ultima_transaccion="now() - interval '30 seconds'"):
+        # Sustituye en un esquema propio, por delante de pg_catalog, las
+        # funciones de recuperación y la vista del receptor de una réplica
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE SCHEMA replica_simulada")
+            cursor.execute(
+                "CREATE FUNCTION replica_simulada.pg_is_in_recovery() RETURNS boolean AS 'SELECT true' LANGUAGE sql"
+            )
+            for funcion in ("pg_last_wal_receive_lsn", "pg_last_wal_replay_lsn"):
+                cursor.execute(
+                    f"CREATE FUNCTION replica_simulada.{funcion}() RETURNS pg_lsn "
+                    "AS $$SELECT '0/10'::pg_lsn$$ LANGUAGE sql"
+                )
+            cursor.execute(
+                "CREATE FUNCTION replica_simulada.pg_last_xact_replay_timestamp() RETURNS timestamptz "
+                f"AS $$SELECT {ultima_transaccion}$$ LANGUAGE sql"
+            )
+            cursor.execute(
+                "CREATE VIEW replica_simulada.pg_stat_wal_receiver AS SELECT %s::text AS status WHERE %s",
+                [receptor, receptor is not None]
+            )
+            cursor.execute("SET LOCAL search_path = replica_simulada, pg_catalog, public")
+        with mock.patch('ecommerce.replica.ALIAS_REPLICA', ALIAS_PRINCIPAL):
+            return ReplicaLecturas().retraso()
+
+    def test_al_dia_en_streaming(self):
+        self.assertEqual(self._retraso('streaming'), 0)
+
+    def test_receptor_desconectado(self):
+        self.assertAlmostEqual(self._retraso(None), 30, delta=1)
+
+    def test_receptor_esperando(self):
+        self.assertAlmostEqual(self._retraso('waiting'), 30, delta=1)
+
+    def test_desconectada_sin_transacciones_aplicadas(self):
+        self.assertEqual(self._retraso(None, ultima_transaccion="NULL::timestamptz"), float('inf'))
+
+
+@unittest.skipUnless(ALIAS_REPLICA in settings.DATABASES, "Sin réplica configurada (POSTGRES_REPLICA_HOST)")
+@override_settings(REPLICA_FIJAR_TRAS_ESCRITURA=0)
+class ReplicaRealTests(TransactionTestCase):
+    """Con una réplica en streaming, estadísticas y exportaciones la leen y el resto usa el principal"""
+
+    databases = '__all__'
+
+    def setUp(self):
+        producto = Producto.objects.create(nombre="Producto", precio=Decimal('2.00'), stock=100)
+        for i in range(3):
+            cliente = Cliente.objects.create(nombre=f"Cliente {i}", email=f"r{i}@prueba.com", telefono="1")
+            PedidoIntegrationService.crear_pedido(
+                cliente.id_cliente, [{"id_producto": producto.id_producto, "cantidad": 1}], "-", "efectivo"
+            )
+        # La replicación es asíncrona: esperar a que la réplica vea los datos
+        for _ in range(50):
+            if Pedido.objects.using(ALIAS_REPLICA).count() == 3:
+                break
+            time.sleep(0.1)
+        replica_lecturas.reiniciar()
+        self.addCleanup(replica_lecturas.reiniciar)
+        patcher = mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_bulk', return_value={}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _consultas(self, leer):
+        with CaptureQueriesContext(connection) as principal, \
+                CaptureQueriesContext(connections[ALIAS_REPLICA]) as replica:
+            resultado = leer()
+        return resultado, [q["sql"] for q in principal], [q["sql"] for q in replica]
+
+    def test_exportaciones_en_la_replica(self):
+        pedidos, principal, replica = self._consultas(lambda: [
+            pedido for bloque in bloques_pedidos(Pedido.objects.all(), tamano_bloque=2) for pedido in bloque
+        ])
+        self.assertEqual(len(pedidos), 3)
+        self.assertEqual(pedidos[0]["detalles"][0]["cantidad"], 1)
+        self.assertTrue(any('detalle_pedido' in sql for sql in replica))
+        self.assertFalse(any('pedidos' in sql for sql in principal))
+
+        clientes, principal, replica = self._consultas(
+            lambda: list(ClienteIntegrationService.iterar_clientes_completos(tamano_bloque=2))
+        )
+        self.assertEqual([c["total_pedidos"] for c in clientes], [1, 1, 1])
+        self.assertFalse(any('clientes' in sql for sql in principal))
+
+    def test_estadisticas_calculadas_en_la_replica(self):
+        with mock.patch.object(snapshot_estadisticas, '_estadisticas_mongo', side_effect=Exception("sin MongoDB")):
+            snapshot, principal, replica = self._consultas(snapshot_estadisticas.refrescar)
+
+        self.assertEqual(snapshot.datos["postgresql"]["total_pedidos"], 3)
+        self.assertTrue(any('"clientes"' in sql for sql in replica))
+        self.assertFalse(any('"clientes"' in sql for sql in principal))
+        # El snapshot se guarda en el principal
+        self.assertTrue(any('estadisticas_snapshot' in sql for sql in principal))
+        self.assertFalse(any('estadisticas_snapshot' in sql for sql in replica))
+
+    @override_settings(REPLICA_MAX_RETRASO=-1)
+    def test_retrasada_lee_del_principal(self):
+        clientes, principal, replica = self._consultas(
+            lambda: list(ClienteIntegrationService.iterar_clientes_completos())
+        )
+        self.assertEqual(len(clientes), 3)
+        self.assertTrue(any('clientes' in sql for sql in principal))
+        self.assertFalse(any('clientes' in sql for sql in replica))
+
+
+class IndicesPostgresTests(TestCase):
+    """Con volumen y estadísticas reales, cada consulta frecuente usa su índice"""
+
+    CLIENTES = 200
+    PRODUCTOS = 5000
+    PEDIDOS = 50000
+
+    @classmethod
+    def setUpTestData(cls):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO clientes (nombre, email, telefono, fecha_registro, activo, num_pedidos, total_gastado) "
+                "SELECT 'Cliente ' || i, 'indices' || i || '@prueba.com', '1', now(), true, 0, 0 "
+                "FROM generate_series(1, %s) i", [cls.CLIENTES]
+            )
+            # Solo un 1% de los productos se ha vendido
+            cursor.execute(
+                "INSERT INTO productos (nombre, precio, descripcion, stock, activo, fecha_creacion, unidades_vendidas) "
+                "SELECT 'Producto ' || i, 1, '', 100, true, now(), CASE WHEN i %% 100 = 0 THEN i ELSE 0 END "
+                "FROM generate_series(1, %s) i", [cls.PRODUCTOS]
+            )
+            # Pedidos repartidos en un año; un 1% sin entregar
+            cursor.execute(
+                "INSERT INTO pedidos (id_cliente_id, fecha_pedido, total, estado, direccion_envio, metodo_pago) "
+                "SELECT (SELECT min(id_cliente) FROM clientes) + i %% %s, "
+                "now() - (i %% 365) * interval '1 day' - (i %% 3600) * interval '1 second', 1, "
+                "CASE WHEN i %% 100 = 0 THEN 'pendiente' ELSE 'entregado' END, '-', 'efectivo' "
+                "FROM generate_series(1, %s) i", [cls.CLIENTES, cls.PEDIDOS]
+            )
+            cursor.execute(
+                "INSERT INTO detalle_pedido "
+                "(id_pedido_id, id_producto_id, cantidad, subtotal, precio_unitario, fecha_pedido) "
+                "SELECT id_pedido, (SELECT min(id_producto) FROM productos) + id_pedido %% %s, 1, 1, 1, fecha_pedido "
+                "FROM pedidos", [cls.PRODUCTOS]
+            )
+            cursor.execute("ANALYZE clientes, productos, pedidos, detalle_pedido")
+        cls.cliente = Cliente.objects.order_by('id_cliente').first()
+        cls.producto = Producto.objects.order_by('id_producto').first()
+
+    def assertUsaIndice(self, queryset, indice):
+        plan = queryset.explain()
+        self.assertIn(indice, plan, plan)
+
+    def test_pedidos_de_un_cliente(self):
+        self.assertUsaIndice(
+            Pedido.objects.filter(id_cliente_id=self.cliente.id_cliente).order_by('-fecha_pedido'),
+            'pedidos_cliente_fecha_idx'
+        )
+
+    def test_pedidos_de_hoy(self):
+        self.assertUsaIndice(snapshot_estadisticas.pedidos_hoy(), 'pedidos_fecha_idx')
+
+    def test_filtro_por_estado_del_admin(self):
+        self.assertUsaIndice(Pedido.objects.filter(estado='pendiente').order_by('id_pedido')[:100], 'pedidos_estado_idx')
+
+    def test_unidades_vendidas_de_un_producto(self):
+        self.assertUsaIndice(
+            DetallePedido.objects.filter(id_producto=self.producto).values('id_producto').annotate(u=Sum('cantidad')),
+            'detalle_producto_cantidad_idx'
+        )
+
+    def test_productos_mas_vendidos(self):
+        self.assertUsaIndice(
+            Producto.objects.filter(unidades_vendidas__gt=0).order_by('-unidades_vendidas', 'id_producto')[:5],
+            'productos_mas_vendidos_idx'
+        )
+
+
+class ParticionesPedidosTests(TestCase):
+    """Pedidos y líneas particionados por mes detrás de los mismos modelos"""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nombre="Cliente", email="particiones@prueba.com", telefono="1")
+        self.producto = Producto.objects.create(nombre="Producto", precio=Decimal('2.50'), stock=100)
+        self.mes_antiguo = sumar_meses(mes_actual(), -14)
+        self.antiguo = Pedido.objects.create(id_cliente=self.cliente, direccion_envio="-", metodo_pago="efectivo")
+        Pedido.objects.filter(pk=self.antiguo.pk).update(
+            fecha_pedido=datetime(self.mes_antiguo.year, self.mes_antiguo.month, 10, 12, tzinfo=dt_timezone.utc)
+        )
+        self.antiguo.refresh_from_db()
+        DetallePedido.objects.create(id_pedido=self.antiguo, id_producto=self.producto, cantidad=2)
+        self.resultado = ParticionesPedidos.convertir(meses_adelante=2)
+
+    def particion_de(self, tabla, columna, valor):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {tabla} WHERE {columna} = %s", [valor])
+            return cursor.fetchone()[0]
+
+    def test_conversion_conserva_las_filas(self):
+        self.assertTrue(es_particionada('pedidos'))
+        self.assertTrue(es_particionada('detalle_pedido'))
+        self.assertEqual(self.resultado["pedidos"], 1)
+        self.assertEqual(self.resultado["detalles"], 1)
+        particiones = ParticionesPedidos.particiones('pedidos')
+        self.assertEqual(len(particiones), 14 + 3)
+        self.assertEqual(particiones[0][1], self.mes_antiguo)
+        self.assertEqual(particiones[-1][1], sumar_meses(mes_actual(), 2))
+
+        self.assertEqual(Pedido.objects.get(pk=self.antiguo.pk).total, Decimal('5.00'))
+        self.assertEqual(self.antiguo.detalles.get().cantidad, 2)
+
+    def test_lineas_en_la_particion_de_su_pedido(self):
+        pedido = Pedido.objects.create(id_cliente=self.cliente, direccion_envio="-", metodo_pago="efectivo")
+        detalle = DetallePedido.objects.create(id_pedido=pedido, id_producto=self.producto, cantidad=1)
+
+        # La secuencia sigue donde la dejó la columna identity
+        self.assertGreater(pedido.id_pedido, self.antiguo.id_pedido)
+        actual = mes_actual()
+        self.assertEqual(
+            self.particion_de('pedidos', 'id_pedido', pedido.id_pedido),
+            ParticionesPedidos.nombre_particion('pedidos', actual)
+        )
+        self.assertEqual(
+            self.particion_de('detalle_pedido', 'id_detalle', detalle.id_detalle),
+            ParticionesPedidos.nombre_particion('detalle_pedido', actual)
+        )
+        self.assertEqual(
+            self.particion_de('detalle_pedido', 'id_pedido_id', self.antiguo.id_pedido),
+            ParticionesPedidos.nombre_particion('detalle_pedido', self.mes_antiguo)
+        )
+
+        detalle.cantidad = 3
+        detalle.save()
+        self.assertEqual(Pedido.objects.get(pk=pedido.pk).total, Decimal('7.50'))
+        pedido.delete()
+        self.assertFalse(DetallePedido.objects.filter(pk=detalle.pk).exists())
+
+    def test_pedidos_de_hoy_solo_recorre_su_particion(self):
+        plan = snapshot_estadisticas.pedidos_hoy().explain()
+        self.assertIn(ParticionesPedidos.nombre_particion('pedidos', mes_actual()), plan)
+        self.assertNotIn(ParticionesPedidos.nombre_particion('pedidos', self.mes_antiguo), plan)
+
+    def test_mantenimiento_crea_y_desconecta(self):
+        creadas = ParticionesPedidos.crear_particiones_futuras(4)
+        self.assertEqual(len(creadas), 2 * 2)
+        self.assertEqual(ParticionesPedidos.crear_particiones_futuras(4), [])
+
+        desconectadas = ParticionesPedidos.desconectar_anteriores(12)
+        self.assertEqual(len(desconectadas), 2 * 3)
+        self.assertEqual(ParticionesPedidos.particiones('pedidos')[0][1], sumar_meses(mes_actual(), -11))
+        self.assertFalse(Pedido.objects.filter(pk=self.antiguo.pk).exists())
+        self.assertFalse(DetallePedido.objects.filter(id_pedido_id=self.antiguo.pk).exists())
+
+        # La partición desconectada conserva sus filas
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {ParticionesPedidos.nombre_particion('pedidos', self.mes_antiguo)}")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class ArchivoPedidosTests(TestCase):
+    """Los pedidos archivados salen de las tablas de pedidos sin dejar de leerse ni de contar"""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nombre="Cliente", email="archivo@prueba.com", telefono="1")
+        self.productos = [
+            Producto.objects.create(nombre=f"Producto {i}", precio=Decimal('2.50') * (i + 1), stock=100)
+            for i in range(2)
+        ]
+        hace_dos_anos = timezone.now() - timedelta(days=730)
+        self.antiguo = self.crear_pedido('entregado', hace_dos_anos)
+        self.pendiente = self.crear_pedido('pendiente', hace_dos_anos - timedelta(days=1))
+        self.reciente = self.crear_pedido('entregado', timezone.now())
+        self.cliente.refresh_from_db()
+        self.mongo = mock.patch(
+            'ecommerce.integration_service.cliente_info_service.obtener_info_completa',
+            return_value={"preferencias": {"idioma": "ES"}}
+        )
+        self.mongo.start()
+        self.addCleanup(self.mongo.stop)
+
+    def crear_pedido(self, estado, fecha):
+        pedido = Pedido.objects.create(id_cliente=self.cliente, direccion_envio="Calle 1", metodo_pago="efectivo")
+        Pedido.objects.filter(pk=pedido.pk).update(estado=estado, fecha_pedido=fecha)
+        pedido.refresh_from_db()
+        for i, producto in enumerate(self.productos):
+            DetallePedido.objects.create(id_pedido=pedido, id_producto=producto, cantidad=i + 1)
+        pedido.refresh_from_db()
+        return pedido
+
+    def test_archiva_solo_pedidos_cerrados_antiguos(self):
+        unidades = list(Producto.objects.order_by('pk').values_list('unidades_vendidas', flat=True))
+        self.assertEqual(ArchivoPedidos.archivar(meses=12, tamano_lote=1), 1)
+
+        self.assertFalse(Pedido.objects.filter(pk=self.antiguo.pk).exists())
+        self.assertFalse(DetallePedido.objects.filter(id_pedido_id=self.antiguo.pk).exists())
+        self.assertEqual(Pedido.objects.filter(pk__in=[self.pendiente.pk, self.reciente.pk]).count(), 2)
+        archivado = PedidoArchivado.objects.get(pk=self.antiguo.pk)
+        self.assertEqual(archivado.total, self.antiguo.total)
+        self.assertEqual(archivado.unidades(), {self.productos[0].pk: 1, self.productos[1].pk: 2})
+
+        # Sin señales de borrado: los contadores no cambian
+        cliente = Cliente.objects.get(pk=self.cliente.pk)
+        self.assertEqual((cliente.num_pedidos, cliente.total_gastado), (3, self.cliente.total_gastado))
+        self.assertEqual(list(Producto.objects.order_by('pk').values_list('unidades_vendidas', flat=True)), unidades)
+        self.assertEqual(ArchivoPedidos.archivar(meses=12), 0)
+
+    def test_lectura_transparente(self):
+        antes = PedidoIntegrationService.obtener_pedido_completo(self.antiguo.pk)
+        ArchivoPedidos.archivar(meses=12)
+        despues = PedidoIntegrationService.obtener_pedido_completo(self.antiguo.pk)
+
+        self.assertTrue(despues.pop("archivado"))
+        self.assertFalse(antes.pop("archivado"))
+        self.assertEqual(despues, antes)
+        self.assertIsNone(PedidoIntegrationService.obtener_pedido_completo(999999))
+
+        pedidos = PedidoIntegrationService.obtener_pedidos_cliente(self.cliente.pk)
+        self.assertEqual(
+            [p["id_pedido"] for p in pedidos], [self.reciente.pk, self.antiguo.pk, self.pendiente.pk]
+        )
+
+    def test_recalculos_cuentan_el_archivo(self):
+        ArchivoPedidos.archivar(meses=12)
+        self.assertEqual(ClienteIntegrationService.recalcular_totales(reparar=False)["desviados"], [])
+        self.assertEqual(snapshot_estadisticas.recalcular_unidades_vendidas(), 0)
+        self.assertEqual(UnidadesArchivadas.objects.get(pk=self.productos[1].pk).unidades, 2)
+
+        # Eliminar un pedido archivado lo resta como uno de 'pedidos'
+        PedidoArchivado.objects.get(pk=self.antiguo.pk).delete()
+        self.assertEqual(ClienteIntegrationService.recalcular_totales(reparar=False)["desviados"], [])
+        self.assertEqual(snapshot_estadisticas.recalcular_unidades_vendidas(), 0)
+
+    def test_archiva_y_elimina_particiones_desconectadas(self):
+        ParticionesPedidos.convertir(meses_adelante=1)
+        desconectadas = ParticionesPedidos.desconectar_anteriores(12)
+        self.assertFalse(Pedido.objects.filter(pk=self.pendiente.pk).exists())
+
+        self.assertEqual(sorted(ArchivoPedidos.archivar_desconectadas()), sorted(desconectadas))
+        self.assertEqual(ParticionesPedidos.desconectadas('pedidos'), [])
+        # Las particiones desconectadas se archivan enteras, también los pedidos sin cerrar
+        self.assertEqual(
+            set(PedidoArchivado.objects.values_list('pk', flat=True)), {self.antiguo.pk, self.pendiente.pk}
+        )
+        self.assertEqual(ClienteIntegrationService.recalcular_totales(reparar=False)["desviados"], [])
+
+
+class ReservaStockTests(TestCase):
+    """Los pedidos descuentan stock todo o nada y la cancelación lo devuelve"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(nombre="Cliente", email="stock@prueba.com", telefono="1")
+        cls.a = Producto.objects.create(nombre="A", precio=Decimal('5.00'), stock=10)
+        cls.b = Producto.objects.create(nombre="B", precio=Decimal('7.00'), stock=3)
+
+    def setUp(self):
+        for objetivo in ('ecommerce.integration_service.cliente_info_service',
+                         'ecommerce.integration_service.escrituras_mongo'):
+            patcher = mock.patch(objetivo)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _stock(self):
+        return list(Producto.objects.order_by('id_producto').values_list('stock', flat=True))
+
+    def _crear(self, lineas):
+        return PedidoIntegrationService.crear_pedido_completo(self.cliente.id_cliente, lineas, "-", "efectivo")
+
+    def test_reserva_y_cancelacion(self):
+        pedido = self._crear([
+            {"id_producto": self.a.id_producto, "cantidad": 4},
+            {"id_producto": self.b.id_producto, "cantidad": 3},
+        ])
+        self.assertIsNotNone(pedido)
+        self.assertEqual(self._stock(), [6, 0])
+
+        self.assertTrue(PedidoIntegrationService.cancelar_pedido(pedido["id_pedido"]))
+        self.assertEqual(self._stock(), [10, 3])
+        self.assertEqual(Pedido.objects.get(id_pedido=pedido["id_pedido"]).estado, 'cancelado')
+
+        # Cancelar de nuevo no devuelve el stock dos veces
+        self.assertFalse(PedidoIntegrationService.cancelar_pedido(pedido["id_pedido"]))
+        self.assertEqual(self._stock(), [10, 3])
+
+    def test_cancelacion_devuelve_solo_lo_reservado(self):
+        pedido = self._crear([{"id_producto": self.a.id_producto, "cantidad": 4}])
+        # Línea agregada desde el admin y pedido anterior a la reserva: no descontaron stock
+        DetallePedido.objects.create(id_pedido_id=pedido["id_pedido"], id_producto=self.b, cantidad=2)
+        antiguo = Pedido.objects.create(id_cliente=self.cliente, direccion_envio="-", metodo_pago="efectivo")
+        DetallePedido.objects.create(id_pedido=antiguo, id_producto=self.a, cantidad=5)
+        self.assertEqual(self._stock(), [6, 3])
+
+        self.assertTrue(PedidoIntegrationService.cancelar_pedido(pedido["id_pedido"]))
+        self.assertEqual(self._stock(), [10, 3])
+        self.assertTrue(PedidoIntegrationService.cancelar_pedido(antiguo.id_pedido))
+        self.assertEqual(self._stock(), [10, 3])
+        self.assertFalse(DetallePedido.objects.filter(cantidad_reservada__gt=0).exists())
+
+    def test_linea_sin_stock_rechaza_todo_el_pedido(self):
+        self.assertIsNone(self._crear([
+            {"id_producto": self.a.id_producto, "cantidad": 4},
+            {"id_producto": self.b.id_producto, "cantidad": 4},
+        ]))
+        self.assertEqual(self._stock(), [10, 3])
+        self.assertFalse(Pedido.objects.exists())
+
+
+class ColumnasPosterioresTests(TestCase):
+    """migrate agrega a las tablas existentes las columnas posteriores a su creación"""
+
+    def _eliminar_columnas(self, *campos, modelo=DetallePedido):
+        with connection.schema_editor() as schema_editor:
+            for campo in campos:
+                schema_editor.remove_field(modelo, modelo._meta.get_field(campo))
+
+    def test_columnas_con_valor_por_defecto(self):
+        self._eliminar_columnas('cantidad_reservada')
+        self.assertEqual(crear_columnas_posteriores(), ['detalle_pedido.cantidad_reservada'])
+        self.assertEqual(crear_columnas_posteriores(), [])
+
+    def test_fecha_de_las_lineas_rellenada(self):
+        cliente = Cliente.objects.create(nombre="Cliente", email="columnas@prueba.com", telefono="1")
+        producto = Producto.objects.create(nombre="Producto", precio=Decimal('1.00'), stock=10)
+        pedido = Pedido.objects.create(id_cliente=cliente, direccion_envio="-", metodo_pago="efectivo")
+        DetallePedido.objects.create(id_pedido=pedido, id_producto=producto, cantidad=1)
+        with connection.cursor() as cursor:
+            # Sin comprobaciones diferidas pendientes, que impedirían el ALTER TABLE
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        self._eliminar_columnas('fecha_pedido', 'cantidad_reservada')
+
+        agregar_columnas_posteriores(sender=apps.get_app_config('ecommerce'), using='default')
+
+        self.assertEqual(columnas_faltantes(DetallePedido, ['fecha_pedido', 'cantidad_reservada']), [])
+        self.assertEqual(DetallePedido.objects.get().fecha_pedido, pedido.fecha_pedido)
+
+    def test_totales_de_los_clientes_calculados(self):
+        cliente = Cliente.objects.create(nombre="Cliente", email="totales@prueba.com", telefono="1")
+        Pedido.objects.create(
+            id_cliente=cliente, direccion_envio="-", metodo_pago="efectivo", total=Decimal('7.50')
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        self._eliminar_columnas('num_pedidos', 'total_gastado', modelo=Cliente)
+
+        agregar_columnas_posteriores(sender=apps.get_app_config('ecommerce'), using='default')
+
+        cliente.refresh_from_db()
+        self.assertEqual((cliente.num_pedidos, cliente.total_gastado), (1, Decimal('7.50')))
+
+    def test_unidades_vendidas_calculadas(self):
+        cliente = Cliente.objects.create(nombre="Cliente", email="unidades@prueba.com", telefono="1")
+        producto = Producto.objects.create(nombre="Producto", precio=Decimal('1.00'), stock=10)
+        pedido = Pedido.objects.create(id_cliente=cliente, direccion_envio="-", metodo_pago="efectivo")
+        DetallePedido.objects.create(id_pedido=pedido, id_producto=producto, cantidad=3)
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        self._eliminar_columnas('unidades_vendidas', modelo=Producto)
+
+        agregar_columnas_posteriores(sender=apps.get_app_config('ecommerce'), using='default')
+
+        producto.refresh_from_db()
+        self.assertEqual(producto.unidades_vendidas, 3)
+
+
+class ReservaStockConcurrenteTests(TransactionTestCase):
+    """Pedidos simultáneos del mismo producto nunca venden más stock del que hay"""
+
+    def test_no_sobreventa(self):
+        cliente = Cliente.objects.create(nombre="Cliente", email="concurrente@prueba.com", telefono="1")
+        producto = Producto.objects.create(nombre="Oferta", precio=Decimal('1.00'), stock=10)
+
+        def comprar(_):
+            try:
+                with transaction.atomic():
+                    PedidoIntegrationService.crear_pedido(
+                        cliente.id_cliente, [{"id_producto": producto.id_producto, "cantidad": 1}], "-", "efectivo"
+                    )
+                return True
+            except StockInsuficienteError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            resultados = list(executor.map(comprar, range(30)))
+
+        self.assertEqual(sum(resultados), 10)
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock, 0)
+        self.assertEqual(Pedido.objects.count(), 10)
+
+
+class CrearPedidosBulkTests(TestCase):
+    """La carga con COPY crea lo mismo que crear_pedido y rechaza los pedidos inválidos"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.clientes = [
+            Cliente.objects.create(nombre=f"Cliente {i}", email=f"bulk{i}@prueba.com", telefono="1") for i in range(3)
+        ]
+        cls.productos = [
+            Producto.objects.create(nombre=f"Producto {i}", precio=Decimal('2.50') * (i + 1), stock=1000)
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        patcher = mock.patch('ecommerce.ingesta_pedidos.escrituras_mongo.service')
+        self.mongo = patcher.start()
+        self.mongo.actualizar_preferencias_bulk.return_value = 3
+        self.addCleanup(patcher.stop)
+
+    def _pedido(self, i, **cambios):
+        pedido = {
+            "id_cliente": self.clientes[i % 3].id_cliente,
+            "productos": [
+                {"id_producto": p.id_producto, "cantidad": i % 3 + 1} for p in self.productos[:i % 4 + 1]
+            ],
+            "direccion_envio": f"Calle {i}, \"portal\" B",
+            "metodo_pago": "tarjeta" if i % 2 else "efectivo",
+        }
+        pedido.update(cambios)
+        return pedido
+
+    def test_carga_y_rechazos(self):
+        producto = self.productos[0]
+        pedidos = [self._pedido(i) for i in range(50)]
+        pedidos[3] = self._pedido(3, id_cliente=999999)
+        pedidos[7] = self._pedido(7, productos=[{"id_producto": 999999, "cantidad": 1}])
+        pedidos[9] = self._pedido(9, productos=[{"id_producto": producto.id_producto, "cantidad": 0}])
+        pedidos[11] = self._pedido(11, productos=[
+            {"id_producto": producto.id_producto, "cantidad": 1, "precio_unitario": "0.01"}
+        ])
+        pedidos[13] = self._pedido(13, productos=[])
+
+        resultado = PedidoIntegrationService.crear_pedidos_bulk(iter(pedidos))
+
+        self.assertEqual(resultado["recibidos"], 50)
+        self.assertEqual(resultado["creados"], 46)
+        self.assertEqual(
+            [(r["indice"], r["motivo"]) for r in resultado["rechazados"]],
+            [(3, "cliente inexistente"), (7, "producto inexistente"),
+             (9, "cantidad inválida"), (11, "precio distinto del catálogo")]
+        )
+        self.assertGreater(resultado["pedidos_por_segundo"], 0)
+
+        creados = list(Pedido.objects.order_by('id_pedido'))
+        self.assertEqual(len(creados), 46)
+        for pedido in creados:
+            self.assertEqual(pedido.total, pedido.calcular_total())
+        self.assertEqual(creados[0].direccion_envio, 'Calle 0, "portal" B')
+        self.assertEqual(Pedido.objects.filter(detalles__isnull=True).count(), 1)
+
+        vendidos = sum(
+            d.cantidad for d in DetallePedido.objects.filter(id_producto=producto)
+        )
+        producto.refresh_from_db()
+        self.assertEqual(producto.stock, 1000 - vendidos)
+        self.assertFalse(DetallePedido.objects.exclude(cantidad_reservada=F('cantidad')).exists())
+
+        preferencias = self.mongo.actualizar_preferencias_bulk.call_args.args[0]
+        self.assertEqual(
+            preferencias[self.clientes[1].id_cliente],
+            {"metodo_pago": pedidos[49]["metodo_pago"]}
+        )
+
+        # Las tablas temporales no impiden otra carga en la misma transacción
+        self.assertEqual(PedidoIntegrationService.crear_pedidos_bulk([self._pedido(0)])["creados"], 1)
+
+    def test_sin_stock_rechaza_solo_los_pedidos_afectados(self):
+        escaso, otro = self.productos[0], self.productos[1]
+        pedidos = [self._pedido(i, productos=[
+            {"id_producto": escaso.id_producto, "cantidad": 300}, {"id_producto": otro.id_producto, "cantidad": 1}
+        ]) for i in range(4)]
+        pedidos.append(self._pedido(4, productos=[{"id_producto": otro.id_producto, "cantidad": 5}]))
+
+        resultado = PedidoIntegrationService.crear_pedidos_bulk(pedidos)
+
+        self.assertEqual(resultado["creados"], 4)
+        self.assertEqual(resultado["rechazados"], [{"indice": 3, "motivo": "stock insuficiente"}])
+        escaso.refresh_from_db()
+        otro.refresh_from_db()
+        # La línea del pedido rechazado no descuenta stock del otro producto
+        self.assertEqual((escaso.stock, otro.stock), (100, 992))
+        self.assertEqual(escaso.unidades_vendidas, 900)
+
+    def test_pedido_que_no_cabe_no_consume_stock(self):
+        producto = Producto.objects.create(nombre="Escaso", precio=Decimal('1.00'), stock=5)
+        otro = Producto.objects.create(nombre="Otro escaso", precio=Decimal('1.00'), stock=3)
+        pedidos = [
+            self._pedido(0, productos=[
+                {"id_producto": producto.id_producto, "cantidad": 6}, {"id_producto": otro.id_producto, "cantidad": 3}
+            ]),
+            self._pedido(1, productos=[{"id_producto": producto.id_producto, "cantidad": 5}]),
+            self._pedido(2, productos=[{"id_producto": otro.id_producto, "cantidad": 3}]),
+        ]
+
+        resultado = PedidoIntegrationService.crear_pedidos_bulk(pedidos)
+
+        self.assertEqual(resultado["creados"], 2)
+        self.assertEqual(resultado["rechazados"], [{"indice": 0, "motivo": "stock insuficiente"}])
+        producto.refresh_from_db()
+        otro.refresh_from_db()
+        self.assertEqual((producto.stock, otro.stock), (0, 0))
+
+    @override_settings(MONGO_OUTBOX=True)
+    def test_preferencias_en_el_outbox(self):
+        resultado = PedidoIntegrationService.crear_pedidos_bulk([self._pedido(i) for i in range(5)])
+
+        self.assertEqual(resultado["preferencias_actualizadas"], 3)
+        self.mongo.actualizar_preferencias_bulk.assert_not_called()
+        self.assertEqual(
+            dict(EventoOutbox.objects.filter(tipo=TIPO_PREFERENCIAS).values_list('id_cliente', 'datos')),
+            {self.clientes[i % 3].id_cliente: {"preferencias": {"metodo_pago": self._pedido(i)["metodo_pago"]}}
+             for i in (2, 3, 4)}
+        )
+
+
+@override_settings(MONGO_OUTBOX=True)
+class OutboxTests(TestCase):
+    """Con el outbox activo las escrituras en MongoDB se registran en la transacción de PostgreSQL"""
+
+    def setUp(self):
+        patcher = mock.patch('ecommerce.integration_service.escrituras_mongo.service')
+        self.service = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('ecommerce.integration_service.cliente_info_service')
+        patcher.start().obtener_info_completa.return_value = None
+        self.addCleanup(patcher.stop)
+
+    def _eventos(self):
+        return list(EventoOutbox.objects.values_list('id_cliente', 'tipo'))
+
+    def test_escrituras_registradas_sin_llamar_a_mongodb(self):
+        cliente = ClienteIntegrationService.crear_cliente_completo("Ana", "ana@prueba.com", "1")
+        otro = ClienteIntegrationService.crear_cliente_completo("Luis", "luis@prueba.com", "1", {"idioma": "EN"})
+        self.assertTrue(ClienteIntegrationService.actualizar_cliente_completo(
+            cliente["id_cliente"], comentario="Hola", preferencias={"tema": "oscuro"}
+        ))
+
+        self.assertEqual(self._eventos(), [
+            (cliente["id_cliente"], TIPO_CREAR_DOCUMENTO),
+            (otro["id_cliente"], TIPO_PREFERENCIAS),
+            (cliente["id_cliente"], TIPO_COMENTARIO),
+            (cliente["id_cliente"], TIPO_PREFERENCIAS),
+        ])
+        self.assertEqual(EventoOutbox.objects.get(tipo=TIPO_COMENTARIO).datos["texto"], "Hola")
+        self.assertEqual(self.service.method_calls, [])
+
+    def test_rollback_descarta_los_eventos(self):
+        producto = Producto.objects.create(nombre="P", precio=Decimal('1.00'), stock=1)
+        cliente = Cliente.objects.create(nombre="Eva", email="eva@prueba.com", telefono="1")
+
+        self.assertIsNone(PedidoIntegrationService.crear_pedido_completo(
+            cliente.id_cliente, [{"id_producto": producto.id_producto, "cantidad": 2}], "-", "efectivo"
+        ))
+        self.assertFalse(ClienteIntegrationService.actualizar_cliente_completo(
+            cliente.id_cliente, datos_postgres={"email": None}, comentario="No debe quedar"
+        ))
+        self.assertEqual(self._eventos(), [])
+
+    def test_eliminar_cliente_descarta_sus_eventos(self):
+        cliente = ClienteIntegrationService.crear_cliente_completo("Ana", "ana@prueba.com", "1", {"idioma": "ES"})
+        otro = ClienteIntegrationService.crear_cliente_completo("Luis", "luis@prueba.com", "1")
+
+        self.assertTrue(ClienteIntegrationService.eliminar_cliente_completo(cliente["id_cliente"]))
+
+        self.assertEqual(self._eventos(), [(otro["id_cliente"], TIPO_CREAR_DOCUMENTO)])
+        self.service.eliminar_cliente.assert_called_once_with(cliente["id_cliente"])
+
+
+@override_settings(MONGO_OUTBOX_MAX_INTENTOS=2, MONGO_OUTBOX_ESPERA_REINTENTO=60)
+class RelayOutboxReintentosTests(TestCase):
+    """Los eventos que fallan esperan su reintento y no bloquean a los demás clientes"""
+
+    def setUp(self):
+        self.relay = RelayOutbox(service=mock.Mock(), tamano_lote=10)
+        patcher = mock.patch.object(RelayOutbox, '_aplicar', return_value={1})
+        self.aplicar = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _vencer_esperas(self):
+        EventoOutbox.objects.update(proximo_intento=timezone.now() - timedelta(seconds=1))
+
+    def test_espera_y_descarte(self):
+        for id_cliente in (1, 2, 1):
+            EventoOutbox.objects.create(id_cliente=id_cliente, tipo=TIPO_CREAR_DOCUMENTO)
+
+        self.assertEqual(self.relay.procesar_lote(), {"eventos": 3, "aplicados": 1, "fallidos": 2, "descartados": 0})
+        self.assertEqual(list(EventoOutbox.objects.values_list('id_cliente', 'intentos')), [(1, 1), (1, 1)])
+
+        # Un evento nuevo del cliente espera detrás de los suyos; el de otro cliente no
+        EventoOutbox.objects.create(id_cliente=1, tipo=TIPO_COMENTARIO, datos={"texto": "t", "fecha": "2024-01-01"})
+        EventoOutbox.objects.create(id_cliente=3, tipo=TIPO_CREAR_DOCUMENTO)
+        self.assertEqual(self.relay.procesar_lote(), {"eventos": 1, "aplicados": 1, "fallidos": 0, "descartados": 0})
+
+        self._vencer_esperas()
+        self.assertEqual(self.relay.procesar_lote(), {"eventos": 3, "aplicados": 0, "fallidos": 3, "descartados": 2})
+        self._vencer_esperas()
+        # Los descartados siguen reteniendo el evento posterior de su cliente
+        self.assertEqual(self.relay.procesar_lote()["eventos"], 0)
+        self.assertEqual(self.relay.descartados().count(), 2)
+
+        self.assertEqual(self.relay.reintentar_descartados(), 2)
+        self.aplicar.return_value = set()
+        self.assertEqual(self.relay.procesar_lote(), {"eventos": 3, "aplicados": 3, "fallidos": 0, "descartados": 0})
+        self.assertFalse(EventoOutbox.objects.exists())
+
+    def test_una_vez_termina_con_eventos_fallidos(self):
+        for id_cliente in (1, 2):
+            EventoOutbox.objects.create(id_cliente=id_cliente, tipo=TIPO_CREAR_DOCUMENTO)
+        salida = io.StringIO()
+        with mock.patch('ecommerce.management.commands.relay_outbox_mongo.time.sleep') as sleep:
+            call_command('relay_outbox_mongo', una_vez=True, lote=1, stdout=salida)
+        self.assertIn('Eventos aplicados: 1, fallidos: 1.', salida.getvalue())
+        sleep.assert_called_once()
+        self.assertEqual(list(EventoOutbox.objects.values_list('id_cliente', flat=True)), [1])
+
+
+@unittest.skipUnless(mongodb_disponible(), "MongoDB no disponible")
+class RelayOutboxTests(TestCase):
+    """El relay aplica los eventos agrupados por cliente y reintentar no los duplica"""
+
+    def setUp(self):
+        self.service = ClienteInfoServicePruebas()
+        self.service.collection.drop()
+        self.service.buckets.collection.drop()
+        self.addCleanup(self.service.collection.drop)
+        self.addCleanup(self.service.buckets.collection.drop)
+
+    def _registrar_eventos(self):
+        EventoOutbox.objects.create(id_cliente=1, tipo=TIPO_CREAR_DOCUMENTO)
+        for i in range(3):
+            EventoOutbox.objects.create(
+                id_cliente=1, tipo=TIPO_COMENTARIO, datos={"texto": f"c{i}", "fecha": f"2024-01-0{i + 1}T10:00:00"}
+            )
+        EventoOutbox.objects.create(id_cliente=2, tipo=TIPO_PREFERENCIAS, datos={"preferencias": {"idioma": "EN"}})
+        EventoOutbox.objects.create(id_cliente=2, tipo=TIPO_PREFERENCIAS, datos={"preferencias": {"idioma": "FR"}})
+
+    def _comprobar(self, service):
+        self.assertEqual([c["texto"] for c in service.obtener_comentarios(1)], ["c0", "c1", "c2"])
+        self.assertEqual(service.obtener_info_completa(1, fields=["num_comentarios"])["num_comentarios"], 3)
+        self.assertEqual(service.obtener_preferencias(2)["idioma"], "FR")
+
+    def test_relay_idempotente(self):
+        for modo in (MODO_COMENTARIOS_EMBEBIDO, MODO_COMENTARIOS_BUCKETS):
+            with self.subTest(modo=modo):
+                self.setUp()
+                EventoOutbox.objects.all().delete()
+                self._registrar_eventos()
+                service = ClienteInfoServicePruebas(modo_comentarios=modo)
+                relay = RelayOutbox(service=service, tamano_lote=100)
+
+                # Una caída tras escribir en MongoDB y antes de borrar los eventos
+                por_cliente = {}
+                for evento in EventoOutbox.objects.all():
+                    por_cliente.setdefault(evento.id_cliente, []).append(evento)
+                self.assertEqual(relay._aplicar(por_cliente), set())
+
+                self.assertEqual(relay.procesar_lote(), {"eventos": 6, "aplicados": 6, "fallidos": 0, "descartados": 0})
+                self.assertFalse(EventoOutbox.objects.exists())
+                self._comprobar(service)
+
+    def test_fallo_del_documento_principal_no_duplica_buckets(self):
+        self._registrar_eventos()
+        service = ClienteInfoServicePruebas(modo_comentarios=MODO_COMENTARIOS_BUCKETS)
+        relay = RelayOutbox(service=service, tamano_lote=100)
+        escribir = bulk_write_con_reintento
+        llamadas = []
+
+        def principal_falla_una_vez(collection, operaciones):
+            llamadas.append(collection.name)
+            if collection.name == service.collection_name and llamadas.count(service.collection_name) == 1:
+                raise AutoReconnect("conexión perdida")
+            return escribir(collection, operaciones)
+
+        with mock.patch('ecommerce.outbox.bulk_write_con_reintento', side_effect=principal_falla_una_vez):
+            self.assertEqual(relay.procesar_lote()["fallidos"], 6)
+            EventoOutbox.objects.update(proximo_intento=None)
+            self.assertEqual(relay.procesar_lote()["aplicados"], 6)
+
+        self._comprobar(service)
+        textos = [c["texto"] for b in service.buckets.collection.find({"id_cliente": 1}) for c in b["comentarios"]]
+        self.assertEqual(sorted(textos), ["c0", "c1", "c2"])
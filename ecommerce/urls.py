@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'ecommerce'
+
+urlpatterns = [
+    path('clientes/<int:id_cliente>/', views.cliente_completo, name='cliente_completo'),
+    path('clientes/<int:id_cliente>/sync/', views.cliente_completo_sync, name='cliente_completo_sync'),
+]
@@ -1,3 +1,23 @@
-from django.shortcuts import render
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, JsonResponse
 
-# Create your views here.
+from .async_services import AsyncClienteIntegrationService
+from .integration_service import ClienteIntegrationService
+
+
+@staff_member_required
+async def cliente_completo(request, id_cliente):
+    """Vista async: información completa del cliente (PostgreSQL y MongoDB a la vez)"""
+    datos = await AsyncClienteIntegrationService.obtener_cliente_completo(id_cliente)
+    if datos is None:
+        raise Http404("Cliente no encontrado")
+    return JsonResponse(datos)
+
+
+@staff_member_required
+def cliente_completo_sync(request, id_cliente):
+    """Vista síncrona equivalente, para comparar con la vista async"""
+    datos = ClienteIntegrationService.obtener_cliente_completo(id_cliente)
+    if datos is None:
+        raise Http404("Cliente no encontrado")
+    return JsonResponse(datos)